@@ -295,6 +295,147 @@ async def get_memory_usage():
         logger.error(f"❌ Memory usage error: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi lấy memory usage: {str(e)}")
 
+@router.get("/inference-executor",
+            summary="Inference Executor Stats",
+            description="Thống kê các thread pool encode/search/generate")
+async def get_inference_executor_stats():
+    """
+    **Inference Executor Stats**
+    
+    Số worker, số tác vụ đang chạy, đã hoàn thành và lỗi
+    cho từng stage (encode, search, generate)
+    """
+    try:
+        from app.services.inference_executor import get_inference_executor
+        
+        return {
+            "stages": get_inference_executor().get_stats()
+        }
+        
+    except Exception as e:
+        logger.error(f"❌ Inference executor stats error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê executor: {str(e)}")
+
+@router.get("/embedding-batcher",
+            summary="Embedding Micro-batcher Stats",
+            description="Histogram batch size / thời gian chờ / forward pass của query embeddings")
+async def get_embedding_batcher_stats():
+    """
+    **Embedding Micro-batcher Stats**
+
+    Phân bố kích thước batch, thời gian request chờ trong hàng đợi
+    và thời gian forward pass của embedding model
+    """
+    try:
+        from app.services.rag_service_unified import get_rag_service_unified
+
+        rag_service = await get_rag_service_unified()
+        if rag_service.embedding_batcher is None:
+            return {"enabled": False}
+
+        return {
+            "enabled": True,
+            **rag_service.embedding_batcher.get_stats()
+        }
+
+    except Exception as e:
+        logger.error(f"❌ Embedding batcher stats error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê embedding batcher: {str(e)}")
+
+@router.get("/generation-scheduler",
+            summary="Generation Scheduler Stats",
+            description="Throughput (tokens/s), queue wait và batch size của continuous batching")
+async def get_generation_scheduler_stats():
+    """
+    **Generation Scheduler Stats**
+
+    Số sequence đang decode, hàng đợi, tokens/s và phân bố thời gian chờ
+    """
+    try:
+        from app.services.rag_service_unified import _rag_service_unified
+
+        llm_service = _rag_service_unified.llm_service if _rag_service_unified else None
+        if llm_service is None or llm_service.scheduler is None:
+            return {"enabled": False}
+
+        return {
+            "enabled": True,
+            **llm_service.scheduler.get_stats()
+        }
+
+    except Exception as e:
+        logger.error(f"❌ Generation scheduler stats error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê generation scheduler: {str(e)}")
+
+@router.get("/prefix-cache",
+            summary="Prefix KV Cache Stats",
+            description="Thống kê cache KV của system prompt trong LLMService")
+async def get_prefix_cache_stats():
+    """
+    **Prefix KV Cache Stats**
+
+    Số system prompt đang cache, hit/miss và tổng thời gian prefill tiết kiệm được
+    """
+    try:
+        from app.core.config import settings
+        from app.services.rag_service_unified import _rag_service_unified
+
+        llm_service = _rag_service_unified.llm_service if _rag_service_unified else None
+        if llm_service is None or llm_service.prefix_cache is None:
+            return {"enabled": settings.PREFIX_CACHE_ENABLED, "entries": 0}
+
+        return {
+            "enabled": settings.PREFIX_CACHE_ENABLED,
+            **llm_service.prefix_cache.get_stats()
+        }
+
+    except Exception as e:
+        logger.error(f"❌ Prefix cache stats error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê prefix cache: {str(e)}")
+
+@router.get("/answer-cache",
+            summary="Answer Cache Stats",
+            description="Thống kê answer cache (exact + semantic) của RAG query")
+async def get_answer_cache_stats():
+    """
+    **Answer Cache Stats**
+
+    Số entries, hit/miss theo từng tầng, evictions và version index hiện tại
+    """
+    try:
+        from app.services.rag_service_unified import get_rag_service_unified
+
+        rag_service = await get_rag_service_unified()
+        if rag_service.answer_cache is None:
+            return {"enabled": False}
+
+        return {
+            "enabled": True,
+            **rag_service.answer_cache.get_stats()
+        }
+
+    except Exception as e:
+        logger.error(f"❌ Answer cache stats error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi lấy thống kê answer cache: {str(e)}")
+
+@router.post("/answer-cache/clear",
+             summary="Clear Answer Cache",
+             description="Xóa toàn bộ answer cache")
+async def clear_answer_cache():
+    """Xóa toàn bộ answer cache (cả tầng exact và semantic)"""
+    try:
+        from app.services.rag_service_unified import get_rag_service_unified
+
+        rag_service = await get_rag_service_unified()
+        if rag_service.answer_cache is not None:
+            rag_service.answer_cache.clear()
+
+        return {"success": True, "message": "Đã xóa answer cache"}
+
+    except Exception as e:
+        logger.error(f"❌ Clear answer cache error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi xóa answer cache: {str(e)}")
+
 @router.get("/config",
             summary="System Configuration",
             description="Lấy cấu hình hiện tại của hệ thống")
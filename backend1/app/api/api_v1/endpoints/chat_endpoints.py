@@ -3,14 +3,17 @@
 Chat Endpoints - Quản lý chat và lịch sử trò chuyện
 """
 
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 import logging
+import threading
 from sqlalchemy.orm import Session
 
 from app.services.chat_service_unified import get_chat_service_unified
 from app.core.database import get_db
+from app.services.token_streamer import format_sse
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -145,6 +148,71 @@ async def send_message(request: ChatRequest, db: Session = Depends(get_db)):
         logger.error(f"❌ Chat error: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi chat: {str(e)}")
 
+@router.post("/send/stream",
+             summary="Gửi tin nhắn chat (streaming)",
+             description="Giống /send nhưng stream câu trả lời bằng Server-Sent Events")
+async def send_message_stream(request: ChatRequest, http_request: Request, db: Session = Depends(get_db)):
+    """
+    **Gửi tin nhắn chat với streaming**
+    
+    Events: `start` (chat_id) → `sources` → `token`... → `end` (confidence, ttft_ms,
+    stage_timings, message_id của tin nhắn AI đã lưu). Client ngắt kết nối sẽ dừng generation.
+    """
+    try:
+        chat_service = get_chat_service_unified(db)
+        
+        # Xác định hoặc tạo chat
+        if request.chat_id:
+            chat_context = chat_service.get_chat_with_context(request.chat_id)
+            if not chat_context:
+                raise HTTPException(status_code=404, detail=f"Chat {request.chat_id} không tồn tại")
+        else:
+            title = request.message[:50] + "..." if len(request.message) > 50 else request.message
+            chat = chat_service.create_chat_with_rag_context(
+                title=title,
+                user_id=request.user_id,
+                category_filter=request.filter_category,
+                session_id=request.session_id,
+                rag_settings=request.rag_settings
+            )
+            request.chat_id = chat.id
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Chat stream error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi chat: {str(e)}")
+    
+    stop_event = threading.Event()
+    
+    async def event_generator():
+        events = chat_service.stream_message_with_rag(
+            chat_id=request.chat_id,
+            user_message=request.message,
+            user_id=request.user_id,
+            override_settings=request.rag_settings,
+            stop_event=stop_event
+        )
+        try:
+            async for event in events:
+                if await http_request.is_disconnected():
+                    logger.info("🔌 Client ngắt kết nối, dừng generation")
+                    break
+                yield format_sse(event)
+        except Exception as e:
+            logger.error(f"❌ Chat stream error: {e}")
+            db.rollback()
+            yield format_sse({"type": "error", "message": f"Lỗi chat: {str(e)}"})
+        finally:
+            stop_event.set()
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/history", response_model=ChatHistoryResponse,
             summary="Lấy lịch sử chat",
             description="Lấy danh sách các cuộc trò chuyện với thống kê")
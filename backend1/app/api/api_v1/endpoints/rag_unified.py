@@ -3,12 +3,15 @@
 RAG Unified API Endpoint - Core RAG functionality only
 """
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 import logging
+import threading
 
 from app.services.rag_service_unified import get_rag_service_unified
+from app.services.token_streamer import format_sse
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +26,9 @@ class UnifiedQueryRequest(BaseModel):
     include_sources: Optional[bool] = Field(default=True, description="Có bao gồm thông tin nguồn tài liệu không")
     similarity_threshold: Optional[float] = Field(default=None, description="Ngưỡng độ tương đồng tối thiểu", ge=0.0, le=1.0)
     use_enhancement: Optional[bool] = Field(default=True, description="Sử dụng LLM enhancement để nâng cao chất lượng response")
+    pipeline_mode: Optional[str] = Field(default=None, description="Pipeline sinh câu trả lời: 'two_stage', 'single_pass', 'adaptive' (mặc định theo cấu hình)",
+                                         pattern="^(two_stage|single_pass|adaptive)$")
+    debug: Optional[bool] = Field(default=False, description="Trả về thời gian chi tiết từng stage (stage_breakdown)")
 
 class SourceInfo(BaseModel):
     """Thông tin nguồn tài liệu"""
@@ -47,6 +53,12 @@ class UnifiedQueryResponse(BaseModel):
     service_version: str
     enhancement_applied: Optional[bool] = Field(default=False, description="Có áp dụng LLM enhancement không")
     original_response: Optional[str] = Field(default=None, description="Response gốc trước khi enhancement")
+    cache_hit: Optional[str] = Field(default=None, description="Tầng answer cache trả kết quả: 'exact', 'semantic' hoặc null")
+    pipeline_mode: Optional[str] = Field(default=None, description="Pipeline mode đã dùng")
+    pipeline_path: Optional[str] = Field(default=None, description="Nhánh pipeline thực tế đã chạy (two_stage, single_pass, adaptive_skip_enhancement, adaptive_enhanced, rag_only)")
+    stage_timings: Optional[Dict[str, int]] = Field(default=None, description="Thời gian từng stage (ms)")
+    prompt_tokens: Optional[Dict[str, int]] = Field(default=None, description="Số token prompt gửi vào LLM theo từng stage và tổng")
+    stage_breakdown: Optional[Dict[str, int]] = Field(default=None, description="Thời gian chi tiết (ms): cache lookup, encode, search, từng stage generation, tổng - chỉ khi debug=true")
 
 class ServiceStats(BaseModel):
     """Thống kê service"""
@@ -99,7 +111,9 @@ async def unified_query(request: UnifiedQueryRequest):
             filter_category=request.filter_category,
             include_sources=request.include_sources,
             similarity_threshold=request.similarity_threshold,
-            use_enhancement=request.use_enhancement
+            use_enhancement=request.use_enhancement,
+            pipeline_mode=request.pipeline_mode,
+            debug=request.debug
         )
         
         # Convert to response model
@@ -117,7 +131,13 @@ async def unified_query(request: UnifiedQueryRequest):
             timestamp=result.get('timestamp', ''),
             service_version=result.get('service_version', '2.0.0'),
             enhancement_applied=result.get('enhancement_applied', False),
-            original_response=result.get('original_response', None)
+            original_response=result.get('original_response', None),
+            cache_hit=result.get('cache_hit', None),
+            pipeline_mode=result.get('pipeline_mode', None),
+            pipeline_path=result.get('pipeline_path', None),
+            stage_timings=result.get('stage_timings', None),
+            prompt_tokens=result.get('prompt_tokens', None),
+            stage_breakdown=result.get('stage_breakdown', None)
         )
         
         logger.info(f"✅ Query processed: {response.total_sources} sources, {response.processing_time_ms}ms")
@@ -130,6 +150,51 @@ async def unified_query(request: UnifiedQueryRequest):
         logger.error(f"❌ Unified query error: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi xử lý câu hỏi: {str(e)}")
 
+@router.post("/query/stream",
+             summary="Query RAG Unified (streaming)",
+             description="Giống /query nhưng trả về Server-Sent Events: sources → token → end")
+async def unified_query_stream(request: UnifiedQueryRequest, http_request: Request):
+    """
+    **Streaming Query (Server-Sent Events)**
+    
+    Mỗi event có dạng `data: {"type": ...}`:
+    - `start`: bắt đầu xử lý
+    - `sources`: nguồn tài liệu tìm được (gửi trước khi sinh câu trả lời)
+    - `token`: một đoạn text mới của câu trả lời (`content`)
+    - `end`: confidence, `ttft_ms`, `stage_timings`, `prompt_tokens`, `processing_time_ms`
+    - `error`: lỗi xử lý
+    
+    Client ngắt kết nối sẽ dừng generation ngay lập tức.
+    """
+    logger.info(f"📡 Streaming query: {request.question[:100]}...")
+    rag_service = await get_rag_service_unified()
+    stop_event = threading.Event()
+    
+    async def event_generator():
+        events = rag_service.query_stream(
+            question=request.question,
+            top_k=request.top_k,
+            filter_category=request.filter_category,
+            include_sources=request.include_sources,
+            similarity_threshold=request.similarity_threshold,
+            stop_event=stop_event
+        )
+        try:
+            async for event in events:
+                if await http_request.is_disconnected():
+                    logger.info("🔌 Client ngắt kết nối, dừng generation")
+                    break
+                yield format_sse(event)
+        finally:
+            stop_event.set()
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/stats", response_model=ServiceStats,
             summary="Service Statistics",
             description="Lấy thống kê chi tiết về RAG service")
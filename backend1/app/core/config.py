@@ -6,7 +6,7 @@ from pydantic_settings import BaseSettings
 from typing import List
 import os
 from .paths import (
-    EMBEDDING_MODEL, LLM_MODEL, DOCUMENTS_ROOT, DOCS_LUAT, 
+    EMBEDDING_MODEL, LLM_MODEL, RERANKER_MODEL, DOCUMENTS_ROOT, DOCS_LUAT, 
     DOCS_ENGLISH, DOCS_VIETNAMESE, DOCUMENTS_UPLOAD, DATA_DIR, 
     FAISS_INDEX, EMBEDDINGS_PKL, TESSERACT_PATH
 )
@@ -41,6 +41,7 @@ class Settings(BaseSettings):
     # Model paths - sử dụng paths.py
     EMBEDDING_MODEL_PATH: str = str(EMBEDDING_MODEL)
     LLM_MODEL_PATH: str = str(LLM_MODEL)
+    RERANKER_MODEL_PATH: str = str(RERANKER_MODEL)
     
     # Document paths - sử dụng paths.py
     DOCUMENTS_PATH: str = str(DOCUMENTS_ROOT)
@@ -67,6 +68,15 @@ class Settings(BaseSettings):
     OCR_LANGUAGES: str = "vie+eng"  # Vietnamese + English
     OCR_PSM: int = 6  # Page segmentation mode
     USE_OCR: bool = True  # Enable/disable OCR
+
+    # Chọn text layer / OCR theo từng trang PDF, cache kết quả OCR theo hash nội dung trang (OCR_CACHE_PATH)
+    OCR_MIN_PAGE_CHARS: int = 50  # Text layer ít ký tự hơn -> OCR trang
+    OCR_MIN_TEXT_COVERAGE: float = 0.05  # Trang ảnh phủ > 50% mà vùng chữ phủ ít hơn ngưỡng này -> trang scan, OCR
+    OCR_MAX_INVALID_CHAR_RATIO: float = 0.1  # Text layer lỗi font (ký tự thay thế / điều khiển) vượt ngưỡng -> OCR
+    OCR_WORKERS: int = 4  # Process OCR song song các trang của một tài liệu
+    OCR_CACHE_ENABLED: bool = True
+    OCR_CACHE_PATH: str = str(DATA_DIR / "ocr_cache")  # Dùng chung cho upload API và tool ingestion
+    OCR_SECONDS_PER_PAGE_ESTIMATE: float = 2.0  # Ước tính thời gian tiết kiệm khi tài liệu không có trang nào phải OCR
     
     # Model settings
     USE_QUANTIZATION: bool = False  # Tắt quantization vì gặp lỗi device_map  # Enable quantization để tiết kiệm memory
@@ -91,7 +101,105 @@ class Settings(BaseSettings):
     LLM_TOP_P: float = 0.95
     EMBEDDING_TOP_K: int = 5
     EMBEDDING_MAX_TOKENS_PER_CHUNK: int = 4096
-    
+
+    # Inference executor - số worker cho từng stage chạy ngoài event loop
+    INFERENCE_ENCODE_WORKERS: int = 2
+    INFERENCE_SEARCH_WORKERS: int = 2
+    INFERENCE_GENERATE_WORKERS: int = 1  # Mỗi request có GenerationConfig riêng, có thể tăng an toàn
+
+    # Continuous batching cho LLM generation
+    GENERATION_SCHEDULER_ENABLED: bool = True
+    GENERATION_BATCH_MAX_SIZE: int = 8  # Số sequence tối đa decode cùng lúc
+
+    # Cache KV của system prompt (prefix) dùng chung giữa các prompt
+    PREFIX_CACHE_ENABLED: bool = True
+    PREFIX_CACHE_MAX_ENTRIES: int = 8
+    PREFIX_CACHE_MAX_TOKENS: int = 2048  # Tổng số token prefix giữ trong cache
+    PREFIX_CACHE_MIN_TOKENS: int = 32  # Prefix ngắn hơn không đáng cache
+
+    # Search lọc category trong index (sub-index theo category) thay vì search toàn bộ rồi lọc
+    CATEGORY_PARTITIONED_SEARCH: bool = True
+
+    # Query router: chọn category cần search khi không có filter_category (luật từ khóa + centroid embedding)
+    QUERY_ROUTER_ENABLED: bool = True
+    QUERY_ROUTER_MIN_CONFIDENCE: float = 0.8  # Tổng xác suất tối thiểu của các category được chọn, thấp hơn -> search toàn corpus
+    QUERY_ROUTER_MAX_CATEGORIES: int = 2
+    QUERY_ROUTER_RULE_WEIGHT: float = 0.5  # Trọng số luật từ khóa so với classifier
+    QUERY_ROUTER_TEMPERATURE: float = 0.02  # Nhiệt độ softmax trên cosine (cosine e5 nằm trong khoảng hẹp)
+    QUERY_ROUTER_CENTROID_SAMPLE: int = 2000  # Số chunk mỗi category dùng để tính centroid
+
+    # Loại FAISS index khi build: flat | ivf_flat | ivf_pq | hnsw | sq8 | ivf_sq8 | pq (ghi vào <index>.manifest.json)
+    FAISS_INDEX_TYPE: str = "flat"
+    FAISS_INDEX_METRIC: str = "l2"  # l2 | ip
+    FAISS_IVF_NLIST: int = 1024  # Tự giảm nếu không đủ vector để train
+    FAISS_IVF_NPROBE: int = 16
+    FAISS_PQ_M: int = 64  # Số sub-quantizer (phải chia hết dimension)
+    FAISS_PQ_NBITS: int = 8
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 200
+    FAISS_HNSW_EF_SEARCH: int = 64
+    FAISS_RERANK_FACTOR: int = 4  # Index nén (sq8/pq): re-rank top_k * factor ứng viên bằng vector float (0 = tắt)
+    FAISS_MMAP: bool = True  # RAG service mở index read-only bằng mmap (chỉ inverted lists IVF được mmap thật)
+
+    # Ingestion append-only: mỗi batch tài liệu ghi một segment bất biến trong data/segments/
+    SEGMENT_BATCH_DOCUMENTS: int = 16  # Số tài liệu gom vào một segment khi ingest hàng loạt
+    SEGMENT_MERGE_MIN_CHUNKS: int = 4096  # Segment nhỏ hơn được gộp nền với các segment nhỏ liền kề
+    SEGMENT_MERGE_FACTOR: int = 8  # Số segment nhỏ liền kề tối thiểu để gộp
+    SEGMENT_INDEX_MIN_FRACTION: float = 0.1  # Upload từng file: chỉ ghi lại index chung khi phần chưa index >= tỉ lệ này
+    SEGMENT_EXPORT_PICKLE: bool = False  # Xuất all_embeddings.pkl sau khi ingest hàng loạt cho code cũ (rag_utils...)
+
+    # Pipeline ingestion nhiều stage: extract/OCR -> chunk -> embed -> ghi segment, queue giới hạn giữa các stage
+    INGEST_PIPELINE_ENABLED: bool = True  # process_all_documents dùng pipeline thay vì xử lý tuần tự từng file
+    INGEST_EXTRACT_WORKERS: int = 4  # Process trích xuất text / OCR
+    INGEST_CHUNK_WORKERS: int = 2  # Process tách câu + chia chunk
+    INGEST_QUEUE_SIZE: int = 8  # Số tài liệu tối đa chờ giữa hai stage (giới hạn RAM)
+    INGEST_EMBED_BATCH_CHUNKS: int = 256  # Gom chunk của nhiều tài liệu tới ngưỡng này rồi mới encode
+
+    # Hybrid retrieval: dense (FAISS) + BM25 (underthesea), fuse bằng reciprocal rank fusion
+    HYBRID_SEARCH_ENABLED: bool = True
+    HYBRID_RRF_K: int = 60
+    BM25_K1: float = 1.5
+    BM25_B: float = 0.75
+
+    # Tra cứu trích dẫn pháp luật (số hiệu văn bản + Điều / Khoản) -> chunk, không qua vector search
+    CITATION_LOOKUP_ENABLED: bool = True
+    CITATION_SKIP_VECTOR_SEARCH: bool = True  # False: ghép chunk trích dẫn lên đầu kết quả dense/hybrid
+
+    # Rerank bằng cross-encoder (score cặp câu hỏi - chunk trong một forward pass)
+    CROSS_ENCODER_RERANK_ENABLED: bool = False
+    CROSS_ENCODER_MAX_CANDIDATES: int = 20  # Số ứng viên đầu (theo thứ tự dense/RRF) được rerank
+    CROSS_ENCODER_MAX_LENGTH: int = 512  # Token tối đa của một cặp (câu hỏi, chunk)
+    CROSS_ENCODER_TIMEOUT_MS: float = 300  # Quá thời gian -> giữ thứ tự dense
+    CROSS_ENCODER_CACHE_SIZE: int = 10000  # Số score (câu hỏi, chunk id) giữ trong LRU
+
+    # Ngân sách token cho context tài liệu trong prompt (đếm bằng tokenizer của LLM)
+    CONTEXT_TOKEN_BUDGET: int = 768  # Prompt trả lời RAG / single-pass
+    CONTEXT_TOKEN_BUDGET_ENHANCEMENT: int = 384  # Prompt enhancement (đã có draft trả lời)
+    CONTEXT_TOKEN_BUDGET_CHAT: int = 384  # Chat có lịch sử hội thoại
+
+    # Ghép chunk kề (cùng tài liệu) vào hit trước khi đóng gói context
+    CONTEXT_EXPANSION_ENABLED: bool = True
+    CONTEXT_EXPANSION_WINDOW: int = 1  # Số chunk mỗi phía
+    CONTEXT_EXPANSION_TOKEN_BUDGET: int = 512  # Tổng token thêm vào cho mọi hit
+
+    # Micro-batching cho query embeddings
+    EMBEDDING_MICRO_BATCHING: bool = True
+    EMBEDDING_BATCH_MAX_SIZE: int = 16
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5.0  # Cửa sổ gom batch (ms)
+
+    # Pipeline sinh câu trả lời: two_stage | single_pass | adaptive
+    RAG_PIPELINE_MODE: str = "two_stage"
+    ADAPTIVE_SKIP_CONFIDENCE: float = 0.75  # adaptive: bỏ enhancement khi confidence retrieval >= ngưỡng
+    ADAPTIVE_MIN_DRAFT_LENGTH: int = 200  # adaptive: độ dài tối thiểu để coi draft là hoàn chỉnh
+
+    # Answer cache cho RAG query (exact + semantic)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_TTL_SECONDS: float = 3600
+    ANSWER_CACHE_SEMANTIC_ENABLED: bool = True
+    ANSWER_CACHE_SEMANTIC_THRESHOLD: float = 0.97  # Cosine similarity tối thiểu giữa 2 câu hỏi
+    ANSWER_CACHE_SEMANTIC_MAX_ENTRIES: int = 1000
+
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -0,0 +1,228 @@
+# app/core/metrics.py
+# Metrics nội bộ đơn giản (histogram, counter) để theo dõi hiệu năng các stage
+# Không phụ thuộc thư viện ngoài, an toàn khi dùng từ nhiều thread
+# Xuất ra định dạng text của Prometheus qua endpoint /metrics
+
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Buckets mặc định
+DEFAULT_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+DEFAULT_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+class Histogram:
+    """Histogram với buckets cố định (giống Prometheus: mỗi bucket đếm giá trị <= upper bound)"""
+
+    def __init__(self, name: str, description: str = "", buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS_MS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # bucket cuối là +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Ghi nhận một giá trị"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Ước lượng quantile từ buckets (nội suy tuyến tính trong bucket)"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if total == 0:
+            return None
+
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i >= len(self.buckets):
+                    return float(self.buckets[-1])
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return float(self.buckets[-1])
+
+    def snapshot(self) -> Dict:
+        """Lấy trạng thái hiện tại của histogram"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_sum = self._sum
+
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+
+        return {
+            "count": total,
+            "sum": total_sum,
+            "mean": total_sum / total if total else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets
+        }
+
+    def reset(self):
+        """Xóa toàn bộ dữ liệu"""
+        with self._lock:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._sum = 0.0
+            self._count = 0
+
+    @contextmanager
+    def time_ms(self):
+        """Đo thời gian (ms) của khối lệnh và ghi vào histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - start) * 1000)
+
+    def render_prometheus(self) -> List[str]:
+        """Các dòng text format Prometheus cho histogram này"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_sum = self._sum
+
+        name = _prometheus_name(self.name)
+        lines = [f"# HELP {name} {_escape_help(self.description)}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum {total_sum}")
+        lines.append(f"{name}_count {total}")
+        return lines
+
+class Counter:
+    """Counter chỉ tăng, hỗ trợ label (vd: tier='exact')"""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        """Tăng counter (theo bộ label nếu có)"""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def snapshot(self) -> Dict:
+        """Giá trị theo từng bộ label và tổng"""
+        with self._lock:
+            values = dict(self._values)
+        return {
+            "total": sum(values.values()),
+            "values": {
+                ",".join(f"{k}={v}" for k, v in key) or "_": value
+                for key, value in values.items()
+            }
+        }
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def render_prometheus(self) -> List[str]:
+        """Các dòng text format Prometheus cho counter này"""
+        with self._lock:
+            values = dict(self._values)
+
+        name = _prometheus_name(self.name)
+        lines = [f"# HELP {name} {_escape_help(self.description)}", f"# TYPE {name} counter"]
+        if not values:
+            lines.append(f"{name} 0")
+        for key, value in sorted(values.items()):
+            if key:
+                label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in key)
+                lines.append(f"{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+        return lines
+
+def _prometheus_name(name: str) -> str:
+    """Tên metric hợp lệ theo Prometheus ([a-zA-Z_:][a-zA-Z0-9_:]*)"""
+    name = re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+    return name if re.match(r"[a-zA-Z_:]", name) else f"_{name}"
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class MetricsRegistry:
+    """Registry chứa tất cả metrics của ứng dụng"""
+
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, description: str = "",
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS_MS) -> Histogram:
+        """Lấy histogram theo tên, tạo mới nếu chưa có"""
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, description, buckets)
+            return self._histograms[name]
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        """Lấy counter theo tên, tạo mới nếu chưa có"""
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = Counter(name, description)
+            return self._counters[name]
+
+    def histograms(self) -> List[Histogram]:
+        """Danh sách tất cả histograms"""
+        with self._lock:
+            return list(self._histograms.values())
+
+    def counters(self) -> List[Counter]:
+        """Danh sách tất cả counters"""
+        with self._lock:
+            return list(self._counters.values())
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Snapshot tất cả metrics"""
+        snapshot = {h.name: h.snapshot() for h in self.histograms()}
+        snapshot.update({c.name: c.snapshot() for c in self.counters()})
+        return snapshot
+
+    def render_prometheus(self) -> str:
+        """Toàn bộ metrics theo text exposition format của Prometheus"""
+        lines = []
+        for metric in sorted(self.counters() + self.histograms(), key=lambda m: m.name):
+            lines.extend(metric.render_prometheus())
+        return "\n".join(lines) + "\n"
+
+# Global registry
+metrics_registry = MetricsRegistry()
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Lấy metrics registry global"""
+    return metrics_registry
@@ -20,6 +20,7 @@ BACKEND_ROOT = BACKEND_ROOT
 MODELS_DIR = BACKEND_ROOT / "models"
 EMBEDDING_MODEL = MODELS_DIR / "multilingual_e5_large"
 LLM_MODEL = MODELS_DIR / "vinallama-2.7b-chat"
+RERANKER_MODEL = MODELS_DIR / "bge_reranker_v2_m3"  # Cross-encoder đa ngôn ngữ (tùy chọn)
 
 # ==================== DOCUMENTS ====================
 DOCUMENTS_ROOT = PROJECT_ROOT / "documents"
@@ -0,0 +1,236 @@
+# app/services/answer_cache.py
+# Cache câu trả lời 2 tầng cho RAGServiceUnified.query
+# - Tầng exact: key = câu hỏi đã chuẩn hóa + tham số query
+# - Tầng semantic: FAISS index nhỏ chứa embedding các câu hỏi đã trả lời (cosine similarity)
+#   chỉ khớp câu hỏi có cùng số hiệu văn bản / số Điều, Khoản: "Điều 5 Luật 86/2015" và "Điều 6 Luật 86/2015"
+#   gần như trùng embedding nhưng là hai câu hỏi khác nhau
+
+import copy
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+from app.services.citation_index import parse_citations
+
+logger = logging.getLogger(__name__)
+
+def normalize_question(question: str) -> str:
+    """Chuẩn hóa câu hỏi: NFC, lowercase, gộp khoảng trắng, bỏ dấu câu cuối"""
+    text = unicodedata.normalize("NFC", question).lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip(" ?.!")
+
+def question_signature(question: str) -> Tuple:
+    """Số hiệu văn bản (key cụ thể nhất) + các số trong câu hỏi - hai câu hỏi khác số không dùng chung câu trả lời"""
+    citations = tuple(citation.document_keys[0] for citation in parse_citations(question) if citation.document_keys)
+    numbers = tuple(str(int(number)) for number in re.findall(r"\d+", normalize_question(question)))
+    return citations, numbers
+
+class AnswerCache:
+    """Cache LRU + TTL cho response của RAG query, tự xóa khi index tài liệu thay đổi"""
+
+    def __init__(self,
+                 max_entries: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None,
+                 semantic_enabled: Optional[bool] = None,
+                 semantic_threshold: Optional[float] = None,
+                 semantic_max_entries: Optional[int] = None):
+        self.max_entries = max_entries or settings.ANSWER_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or settings.ANSWER_CACHE_TTL_SECONDS
+        self.semantic_enabled = settings.ANSWER_CACHE_SEMANTIC_ENABLED if semantic_enabled is None else semantic_enabled
+        self.semantic_threshold = semantic_threshold or settings.ANSWER_CACHE_SEMANTIC_THRESHOLD
+        self.semantic_max_entries = semantic_max_entries or settings.ANSWER_CACHE_SEMANTIC_MAX_ENTRIES
+
+        self.index_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+        # Tầng exact: key -> (response, expires_at)
+        self._exact: "OrderedDict[Tuple, Tuple[Dict[str, Any], float]]" = OrderedDict()
+
+        # Tầng semantic: id -> ((params_key, question_signature), response, expires_at), thứ tự LRU
+        self._semantic: "OrderedDict[int, Tuple[Tuple, Dict[str, Any], float]]" = OrderedDict()
+        self._semantic_index = None
+        self._next_id = 0
+
+        self._stats = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0
+        }
+
+    # ------------------------------------------------------------------
+    # Keys / version
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def make_params_key(top_k: int,
+                        filter_category: Optional[str],
+                        similarity_threshold: float,
+                        use_enhancement: bool,
+                        pipeline_mode: str = "two_stage") -> Tuple:
+        """Key cho các tham số ảnh hưởng tới câu trả lời (không gồm câu hỏi)"""
+        return (int(top_k), filter_category or "all", round(float(similarity_threshold), 4),
+                bool(use_enhancement), pipeline_mode)
+
+    def set_index_version(self, version: str):
+        """Cập nhật version của index tài liệu - xóa toàn bộ cache nếu version thay đổi"""
+        with self._lock:
+            if self.index_version is not None and version != self.index_version:
+                self._clear_locked()
+                self._stats["invalidations"] += 1
+                logger.info(f"🧹 Index tài liệu thay đổi ({self.index_version} -> {version}), đã xóa answer cache")
+            self.index_version = version
+
+    # ------------------------------------------------------------------
+    # Exact tier
+    # ------------------------------------------------------------------
+
+    def get_exact(self, question: str, params_key: Tuple) -> Optional[Dict[str, Any]]:
+        """Tìm trong tầng exact"""
+        key = (normalize_question(question), params_key)
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if expires_at < time.time():
+                del self._exact[key]
+                self._stats["expirations"] += 1
+                return None
+            self._exact.move_to_end(key)
+            self._stats["exact_hits"] += 1
+            return copy.deepcopy(response)
+
+    # ------------------------------------------------------------------
+    # Semantic tier
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _normalize_embedding(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype='float32').reshape(1, -1).copy()
+        faiss.normalize_L2(vector)
+        return vector
+
+    def get_semantic(self, question: str, embedding: np.ndarray, params_key: Tuple) -> Optional[Dict[str, Any]]:
+        """Tìm câu hỏi tương tự (cosine >= semantic_threshold) với cùng tham số query và cùng số hiệu / số Điều"""
+        if not self.semantic_enabled:
+            return None
+
+        semantic_key = (params_key, question_signature(question))
+        vector = self._normalize_embedding(embedding)
+        with self._lock:
+            if self._semantic_index is None or self._semantic_index.ntotal == 0:
+                return None
+
+            k = min(8, self._semantic_index.ntotal)
+            scores, ids = self._semantic_index.search(vector, k)
+            now = time.time()
+
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or score < self.semantic_threshold:
+                    break
+                entry = self._semantic.get(int(entry_id))
+                if entry is None:
+                    continue
+                entry_params, response, expires_at = entry
+                if expires_at < now:
+                    self._remove_semantic_locked(int(entry_id))
+                    self._stats["expirations"] += 1
+                    continue
+                if entry_params != semantic_key:
+                    continue
+
+                self._semantic.move_to_end(int(entry_id))
+                self._stats["semantic_hits"] += 1
+                result = copy.deepcopy(response)
+                result['cache_similarity'] = float(score)
+                return result
+
+        return None
+
+    def _remove_semantic_locked(self, entry_id: int):
+        self._semantic.pop(entry_id, None)
+        self._semantic_index.remove_ids(np.array([entry_id], dtype='int64'))
+
+    # ------------------------------------------------------------------
+    # Put / clear / stats
+    # ------------------------------------------------------------------
+
+    def record_miss(self):
+        """Ghi nhận một lần miss (cả 2 tầng)"""
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def put(self,
+            question: str,
+            params_key: Tuple,
+            response: Dict[str, Any],
+            embedding: Optional[np.ndarray] = None):
+        """Lưu response vào cả 2 tầng"""
+        expires_at = time.time() + self.ttl_seconds
+        stored = copy.deepcopy(response)
+        key = (normalize_question(question), params_key)
+
+        with self._lock:
+            self._exact[key] = (stored, expires_at)
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+                self._stats["evictions"] += 1
+
+            if not self.semantic_enabled or embedding is None:
+                return
+
+            vector = self._normalize_embedding(embedding)
+            if self._semantic_index is None:
+                self._semantic_index = faiss.IndexIDMap(faiss.IndexFlatIP(vector.shape[1]))
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._semantic_index.add_with_ids(vector, np.array([entry_id], dtype='int64'))
+            self._semantic[entry_id] = ((params_key, question_signature(question)), stored, expires_at)
+
+            while len(self._semantic) > self.semantic_max_entries:
+                oldest_id = next(iter(self._semantic))
+                self._remove_semantic_locked(oldest_id)
+                self._stats["evictions"] += 1
+
+    def _clear_locked(self):
+        self._exact.clear()
+        self._semantic.clear()
+        self._semantic_index = None
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._clear_locked()
+        logger.info("🧹 Đã xóa answer cache")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê cache"""
+        with self._lock:
+            hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                "index_version": self.index_version,
+                "exact_entries": len(self._exact),
+                "semantic_entries": len(self._semantic),
+                "max_entries": self.max_entries,
+                "semantic_max_entries": self.semantic_max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "semantic_enabled": self.semantic_enabled,
+                "semantic_threshold": self.semantic_threshold,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                **self._stats
+            }
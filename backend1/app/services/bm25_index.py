@@ -0,0 +1,168 @@
+# app/services/bm25_index.py
+# BM25 inverted index cho chunk tiếng Việt (tokenize bằng underthesea), lưu cạnh FAISS index
+# Bổ sung cho dense search ở các truy vấn phụ thuộc định danh chính xác: "Nghị định 53/2022", "Điều 5 Luật 86/2015"
+#
+# File (cùng thư mục với index):
+#   all_bm25.vocab.json   {term: term_id}
+#   all_bm25.npz          postings dạng CSR: indptr[V + 1], doc_ids, tfs + doc_len
+
+import json
+import logging
+import os
+import re
+import unicodedata
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from underthesea import word_tokenize
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "all_bm25"
+
+# Số hiệu văn bản / tiêu chuẩn: 53/2022/NĐ-CP, 86/2015/QH13, 27001:2022, 10541
+_IDENTIFIER = re.compile(r"\d+(?:[/.:-]\w+)*", re.UNICODE)
+_IDENTIFIER_SEPARATOR = re.compile(r"(?<=\d)[/:]")
+# Điều / khoản / chương + số (sau khi bỏ dấu): "Điều 5" -> "dieu_5"
+_ARTICLE = re.compile(r"\b(dieu|khoan|chuong|muc)\s+(\d+)\b")
+_SYLLABLE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+def fold_accents(text: str) -> str:
+    """Bỏ dấu tiếng Việt (đ -> d) - câu hỏi thường gõ không dấu"""
+    text = unicodedata.normalize("NFD", text.replace("đ", "d").replace("Đ", "D"))
+    return "".join(c for c in text if unicodedata.category(c) != "Mn")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Term BM25 của một đoạn văn:
+    - âm tiết đã bỏ dấu (khớp cả câu hỏi không dấu)
+    - từ ghép nhiều âm tiết của underthesea, giữ dấu ("an_toàn", "thông_tin")
+    - số hiệu văn bản + các tiền tố ("53/2022/nd-cp", "53/2022", "53"), "dieu_5"
+    """
+    text = unicodedata.normalize("NFC", text or "").lower()
+    folded = fold_accents(text)
+
+    terms = _SYLLABLE.findall(folded)
+    terms.extend(word.replace(" ", "_") for word in word_tokenize(text) if " " in word)
+    for identifier in _IDENTIFIER.findall(folded):
+        terms.extend(identifier[:m.start()] for m in _IDENTIFIER_SEPARATOR.finditer(identifier))
+        terms.append(identifier)
+    terms.extend(f"{word}_{number}" for word, number in _ARTICLE.findall(folded))
+    return terms
+
+class BM25Index:
+    """Inverted index BM25 (Okapi) với postings CSR trên numpy"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, texts: Iterable[str]):
+        """Thêm chunk (id tiếp nối các chunk đã có) và gộp postings"""
+        new_terms, new_docs, new_tfs, new_lens = [], [], [], []
+        for offset, text in enumerate(texts):
+            doc_id = self.n_docs + offset
+            counts = {}
+            terms = tokenize(text)
+            for term in terms:
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            new_terms.extend(counts)
+            new_docs.extend([doc_id] * len(counts))
+            new_tfs.extend(counts.values())
+            new_lens.append(len(terms))
+
+        # Postings cũ (term, doc, tf) + postings mới -> sắp theo term (stable giữ doc tăng dần)
+        old_terms = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        all_terms = np.concatenate([old_terms, np.asarray(new_terms, dtype=np.int64)])
+        order = np.argsort(all_terms, kind='stable')
+        self.doc_ids = np.concatenate([self.doc_ids, np.asarray(new_docs, dtype=np.int32)])[order]
+        self.tfs = np.concatenate([self.tfs, np.asarray(new_tfs, dtype=np.float32)])[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(all_terms, minlength=len(self.vocab)))]).astype(np.int64)
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(new_lens, dtype=np.int32)])
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k chunk theo điểm BM25 (chỉ các chunk có điểm > 0)
+
+        allowed: mask bool theo chunk id (lọc category)
+        """
+        if not self.n_docs:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        avg_len = max(float(self.doc_len.mean()), 1.0)
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs, tfs = self.doc_ids[start:end], self.tfs[start:end]
+            df = end - start
+            idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[docs] / avg_len)
+            scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+        if allowed is not None:
+            scores[~allowed[:self.n_docs]] = 0.0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return scores[candidates], candidates.astype(np.int64)
+
+    def save(self, index_dir: str):
+        """Ghi ra file tạm rồi os.replace"""
+        base = os.path.join(index_dir, INDEX_NAME)
+        np.savez(base + ".tmp.npz", indptr=self.indptr, doc_ids=self.doc_ids, tfs=self.tfs,
+                 doc_len=self.doc_len, params=np.asarray([self.k1, self.b], dtype=np.float64))
+        with open(base + ".vocab.json.tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        os.replace(base + ".tmp.npz", base + ".npz")
+        os.replace(base + ".vocab.json.tmp", base + ".vocab.json")
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["BM25Index"]:
+        """Đọc index (None nếu chưa có)"""
+        base = os.path.join(index_dir, INDEX_NAME)
+        if not (os.path.exists(base + ".npz") and os.path.exists(base + ".vocab.json")):
+            return None
+        data = np.load(base + ".npz")
+        index = cls(k1=float(data["params"][0]), b=float(data["params"][1]))
+        index.indptr, index.doc_ids, index.tfs, index.doc_len = (
+            data["indptr"], data["doc_ids"], data["tfs"], data["doc_len"]
+        )
+        with open(base + ".vocab.json", 'r', encoding='utf-8') as f:
+            index.vocab = json.load(f)
+        return index
+
+def update_bm25_index(index_dir: str,
+                      new_texts: List[str],
+                      existing_texts: Iterable[str],
+                      n_existing: int,
+                      k1: float = 1.5,
+                      b: float = 0.75) -> BM25Index:
+    """
+    Thêm chunk mới vào BM25 index lúc ingestion
+
+    Index chưa có / lệch số chunk với index chung (n_existing) -> build lại từ existing_texts
+    """
+    index = BM25Index.load(index_dir)
+    if index is None or index.n_docs != n_existing:
+        if index is not None:
+            logger.warning(f"⚠️ BM25 index có {index.n_docs} chunks, index chung có {n_existing} - build lại")
+        index = BM25Index(k1=k1, b=b)
+        index.add(existing_texts)
+    index.add(new_texts)
+    index.save(index_dir)
+    logger.info(f"✅ BM25 index: {index.n_docs} chunks, {len(index.vocab)} terms")
+    return index
@@ -0,0 +1,145 @@
+# app/services/category_index.py
+# FAISS search lọc theo category ngay trong index
+# Mỗi category có sub-index riêng (IndexIDMap giữ id gốc của chunk), chi phí search tỉ lệ với kích thước category
+# thay vì search toàn corpus rồi lọc (có thể trả về ít hơn top_k kết quả)
+
+import logging
+import time
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import faiss
+import numpy as np
+
+from app.services.quantized_index import RefinedIndex, unwrap_index
+
+logger = logging.getLogger(__name__)
+
+class CategoryPartitionedIndex:
+    """
+    Các sub-index theo category dựng từ index FAISS chính
+
+    - Vector được reconstruct từ index chính, sub-index dùng cùng metric (IndexFlat) + IndexIDMap
+    - Nếu index chính không hỗ trợ reconstruct, dùng IDSelectorBatch trên index chính cho category đó
+    - Index nén (RefinedIndex) / index mmap (use_selectors=True) dùng ID selector:
+      sub-index float sẽ chép lại toàn bộ vector vào RAM của từng process
+    """
+
+    def __init__(self,
+                 base_index,
+                 categories: Union[Sequence[str], Mapping[str, np.ndarray]],
+                 batch_size: int = 4096,
+                 use_selectors: Optional[bool] = None):
+        """categories: category của từng chunk theo id, hoặc {category: các id} (ChunkTable.ids_by_category)"""
+        self.base_index = base_index
+        self.dimension = base_index.d
+        self._sub_indexes: Dict[str, "faiss.Index"] = {}
+        self._selectors: Dict[str, "faiss.SearchParameters"] = {}
+        self._sizes: Dict[str, int] = {}
+        self.build_time = 0.0
+
+        start = time.time()
+        if isinstance(categories, Mapping):
+            ids_by_category = {
+                category: ids[ids < base_index.ntotal] for category, ids in categories.items()
+            }
+        else:
+            ids_by_category: Dict[str, List[int]] = {}
+            for chunk_id, category in enumerate(categories[:base_index.ntotal]):
+                ids_by_category.setdefault(category, []).append(chunk_id)
+
+        if use_selectors is None:
+            use_selectors = isinstance(base_index, RefinedIndex)
+        for category, ids in ids_by_category.items():
+            ids = np.asarray(ids, dtype='int64')
+            self._sizes[category] = len(ids)
+            if use_selectors:
+                self._selectors[category] = self._selector_params(ids)
+                continue
+            try:
+                self._sub_indexes[category] = self._build_sub_index(ids, batch_size)
+            except RuntimeError as e:
+                # Index không hỗ trợ reconstruct (vd: IVF chưa có direct map) -> lọc bằng ID selector
+                logger.warning(f"⚠️ Không tạo được sub-index cho '{category}' ({e}), dùng ID selector")
+                self._selectors[category] = self._selector_params(ids)
+
+        self.build_time = time.time() - start
+        logger.info(f"✅ Category index: {self._sizes} ({self.build_time:.2f}s)")
+
+    def _build_sub_index(self, ids: np.ndarray, batch_size: int):
+        """IndexIDMap(IndexFlat) chứa vector của các chunk thuộc category"""
+        sub_index = faiss.IndexIDMap(faiss.IndexFlat(self.dimension, self.base_index.metric_type))
+        for start in range(0, len(ids), batch_size):
+            batch_ids = ids[start:start + batch_size]
+            vectors = np.asarray(self.base_index.reconstruct_batch(batch_ids), dtype='float32')
+            sub_index.add_with_ids(vectors, batch_ids)
+        return sub_index
+
+    def _selector_params(self, ids: np.ndarray):
+        """SearchParameters có ID selector, giữ nprobe / efSearch hiện tại của index chính"""
+        selector = faiss.IDSelectorBatch(ids)
+        index = unwrap_index(self.base_index)
+        try:
+            ivf = faiss.extract_index_ivf(index)
+            return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+        except RuntimeError:
+            pass
+        hnsw_index = faiss.downcast_index(index)
+        if hasattr(hnsw_index, "hnsw"):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw_index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+
+    @property
+    def categories(self) -> List[str]:
+        return list(self._sizes)
+
+    def search(self,
+               query: np.ndarray,
+               k: int,
+               category: Optional[Union[str, Sequence[str]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search top-k trong category (id trả về là id gốc trong index chính)
+
+        category None / 'all' -> search toàn bộ index chính;
+        danh sách category (query router) -> search từng partition rồi gộp top-k theo metric
+        """
+        query = np.asarray(query, dtype='float32').reshape(1, -1)
+        if not category or category == 'all':
+            return self.base_index.search(query, k)
+        if not isinstance(category, str):
+            if len(category) == 1:
+                return self._search_partition(query, k, category[0])
+            return self._merge([self._search_partition(query, k, name) for name in category], k)
+        return self._search_partition(query, k, category)
+
+    def _search_partition(self, query: np.ndarray, k: int, category: str) -> Tuple[np.ndarray, np.ndarray]:
+        if category in self._sub_indexes:
+            return self._sub_indexes[category].search(query, k)
+        if category in self._selectors:
+            return self.base_index.search(query, k, params=self._selectors[category])
+
+        # Category không có chunk nào
+        return np.full((1, k), -np.inf, dtype='float32'), np.full((1, k), -1, dtype='int64')
+
+    def _merge(self, partials: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Gộp kết quả các partition: L2 lấy khoảng cách nhỏ nhất, inner product lấy score lớn nhất"""
+        scores = np.concatenate([partial[0] for partial in partials], axis=1)
+        ids = np.concatenate([partial[1] for partial in partials], axis=1)
+        ascending = self.base_index.metric_type != faiss.METRIC_INNER_PRODUCT
+        keys = np.where(ids >= 0, scores if ascending else -scores, np.inf)
+        order = np.argsort(keys, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def partition_size(self, category: Optional[Union[str, Sequence[str]]] = None) -> int:
+        """Số vector phải search cho category (toàn index nếu không lọc)"""
+        if not category or category == 'all':
+            return int(self.base_index.ntotal)
+        names = [category] if isinstance(category, str) else category
+        return sum(self._sizes.get(name, 0) for name in names)
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            "categories": dict(self._sizes),
+            "sub_indexes": sorted(self._sub_indexes),
+            "id_selectors": sorted(self._selectors),
+            "build_time_s": round(self.build_time, 3)
+        }
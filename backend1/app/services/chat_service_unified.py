@@ -6,8 +6,10 @@ Quản lý lịch sử trò chuyện với RAG system
 
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, and_, or_, func
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import logging
+import threading
+import time
 from datetime import datetime, timedelta
 import uuid
 import json
@@ -20,9 +22,25 @@ from app.schemas.chat import (
     ChatSessionCreate, ChatSessionResponse
 )
 from app.services.rag_service_unified import get_rag_service_unified
+from app.core.metrics import get_metrics_registry
 
 logger = logging.getLogger(__name__)
 
+# Histograms cho từng stage của luồng chat (DB đọc/ghi, RAG, tổng)
+_metrics = get_metrics_registry()
+chat_context_load_histogram = _metrics.histogram(
+    "chat_context_load_ms", "Thời gian đọc chat context và lịch sử tin nhắn từ DB (ms)"
+)
+chat_db_write_histogram = _metrics.histogram(
+    "chat_db_write_ms", "Thời gian ghi tin nhắn / cập nhật chat vào DB (ms)"
+)
+chat_rag_histogram = _metrics.histogram(
+    "chat_rag_ms", "Thời gian gọi RAG query trong send_message_with_rag (ms)"
+)
+chat_send_total_histogram = _metrics.histogram(
+    "chat_send_total_ms", "Tổng thời gian send_message_with_rag (ms)"
+)
+
 class ChatServiceUnified:
     """Chat Service tích hợp với RAG Unified"""
     
@@ -188,8 +206,11 @@ class ChatServiceUnified:
                                   user_id: Optional[int] = None,
                                   override_settings: Optional[Dict] = None) -> Dict[str, Any]:
         """Gửi tin nhắn và nhận phản hồi từ RAG"""
+        start_time = time.perf_counter()
+        chat_timings = {}
         try:
             # Lấy chat context
+            stage_start = time.perf_counter()
             chat_context = self.get_chat_with_context(chat_id)
             if not chat_context:
                 raise ValueError(f"Chat {chat_id} không tồn tại")
@@ -203,8 +224,10 @@ class ChatServiceUnified:
             
             # Lấy lịch sử chat gần nhất
             recent_messages = self.get_recent_messages_formatted(chat_id, limit=10)
+            chat_timings["context_load_ms"] = self._observe_ms(chat_context_load_histogram, stage_start)
             
             # Lưu tin nhắn user
+            stage_start = time.perf_counter()
             user_msg = self.create_message_enhanced(
                 chat_id=chat_id,
                 role="user",
@@ -215,8 +238,10 @@ class ChatServiceUnified:
                     "timestamp": datetime.utcnow().isoformat()
                 }
             )
+            chat_timings["user_message_write_ms"] = int((time.perf_counter() - stage_start) * 1000)
             
             # Gọi RAG service
+            stage_start = time.perf_counter()
             rag_service = await self.get_rag_service()
             
             rag_response = await rag_service.query(
@@ -227,6 +252,7 @@ class ChatServiceUnified:
                 similarity_threshold=rag_settings.get("similarity_threshold", 0.3),
                 use_enhancement=True  # Luôn sử dụng LLM Enhancement
             )
+            chat_timings["rag_ms"] = self._observe_ms(chat_rag_histogram, stage_start)
             
             # Lưu tin nhắn AI với metadata đầy đủ
             ai_metadata = {
@@ -239,11 +265,13 @@ class ChatServiceUnified:
                 },
                 "processing_info": {
                     "processing_time_ms": rag_response.get("processing_time_ms", 0),
+                    "stage_timings": rag_response.get("stage_timings", {}),
                     "timestamp": rag_response.get("timestamp", ""),
                     "service_version": rag_response.get("service_version", "1.0.0")
                 }
             }
             
+            stage_start = time.perf_counter()
             ai_msg = self.create_message_enhanced(
                 chat_id=chat_id,
                 role="assistant",
@@ -255,13 +283,16 @@ class ChatServiceUnified:
             
             # Cập nhật chat timestamp
             chat.updated_at = datetime.utcnow()
-            self.db.commit()
+            self._timed_commit()
+            chat_timings["ai_message_write_ms"] = int((time.perf_counter() - stage_start) * 1000)
+            chat_timings["total_ms"] = self._observe_ms(chat_send_total_histogram, start_time)
             
             return {
                 "user_message": user_msg,
                 "ai_message": ai_msg,
                 "rag_response": rag_response,
-                "chat_context": chat_context
+                "chat_context": chat_context,
+                "chat_timings": chat_timings
             }
             
         except Exception as e:
@@ -269,6 +300,96 @@ class ChatServiceUnified:
             self.db.rollback()
             raise
     
+    @staticmethod
+    def _observe_ms(histogram, stage_start: float) -> int:
+        """Ghi thời gian từ stage_start vào histogram, trả về số ms"""
+        elapsed_ms = (time.perf_counter() - stage_start) * 1000
+        histogram.observe(elapsed_ms)
+        return int(elapsed_ms)
+    
+    def _timed_commit(self):
+        """db.commit() có đo thời gian ghi DB"""
+        with chat_db_write_histogram.time_ms():
+            self.db.commit()
+    
+    async def stream_message_with_rag(self, chat_id: int, user_message: str,
+                                      user_id: Optional[int] = None,
+                                      override_settings: Optional[Dict] = None,
+                                      stop_event: Optional[threading.Event] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Giống send_message_with_rag nhưng stream từng token, lưu tin nhắn AI khi kết thúc"""
+        chat_context = self.get_chat_with_context(chat_id)
+        if not chat_context:
+            raise ValueError(f"Chat {chat_id} không tồn tại")
+        
+        chat = chat_context["chat"]
+        rag_settings = chat_context["rag_settings"]
+        if override_settings:
+            rag_settings.update(override_settings)
+        
+        # Lưu tin nhắn user
+        user_msg = self.create_message_enhanced(
+            chat_id=chat_id,
+            role="user",
+            content=user_message,
+            message_type="user_query",
+            metadata={
+                "user_id": user_id,
+                "timestamp": datetime.utcnow().isoformat()
+            }
+        )
+        
+        rag_service = await self.get_rag_service()
+        sources = []
+        
+        events = rag_service.query_stream(
+            question=user_message,
+            top_k=rag_settings.get("top_k", 5),
+            filter_category=chat.category_filter,
+            include_sources=rag_settings.get("include_sources", True),
+            similarity_threshold=rag_settings.get("similarity_threshold", 0.3),
+            stop_event=stop_event
+        )
+        try:
+            async for event in events:
+                if event["type"] == "start":
+                    event["chat_id"] = chat_id
+                    event["user_message_id"] = user_msg.id
+                elif event["type"] == "sources":
+                    sources = event["sources"]
+                elif event["type"] == "end":
+                    # Lưu tin nhắn AI với metadata đầy đủ rồi trả message id trong event kết thúc
+                    ai_msg = self.create_message_enhanced(
+                        chat_id=chat_id,
+                        role="assistant",
+                        content=event["answer"] or "Xin lỗi, không thể trả lời lúc này.",
+                        message_type="rag_response",
+                        metadata={
+                            "rag_response": {
+                                "sources": sources,
+                                "total_sources": len(sources),
+                                "confidence": event.get("confidence", 0.0),
+                                "method": event.get("method", "unified"),
+                                "filter_category": event.get("filter_category", "all")
+                            },
+                            "processing_info": {
+                                "processing_time_ms": event.get("processing_time_ms", 0),
+                                "ttft_ms": event.get("ttft_ms"),
+                                "stage_timings": event.get("stage_timings", {}),
+                                "prompt_tokens": event.get("prompt_tokens", {}),
+                                "timestamp": event.get("timestamp", ""),
+                                "service_version": "2.0.0"
+                            }
+                        },
+                        processing_time=event.get("processing_time_ms", 0)
+                    )
+                    chat.updated_at = datetime.utcnow()
+                    self._timed_commit()
+                    event["chat_id"] = chat_id
+                    event["message_id"] = ai_msg.id
+                yield event
+        finally:
+            await events.aclose()
+    
     def create_message_enhanced(self, chat_id: int, role: str, content: str, 
                               message_type: str = "text", metadata: Optional[Dict] = None,
                               processing_time: Optional[int] = None) -> ChatMessage:
@@ -283,9 +404,10 @@ class ChatServiceUnified:
                 processing_time=processing_time
             )
             
-            self.db.add(message)
-            self.db.commit()
-            self.db.refresh(message)
+            with chat_db_write_histogram.time_ms():
+                self.db.add(message)
+                self.db.commit()
+                self.db.refresh(message)
             
             logger.info(f"Tạo tin nhắn enhanced: {message.id} ({message_type})")
             return message
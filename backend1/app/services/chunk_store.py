@@ -0,0 +1,248 @@
+# app/services/chunk_store.py
+# Chunk store trên đĩa, đọc qua mmap - thay cho pickle.load toàn bộ all_embeddings.pkl lúc khởi động
+#
+# Định dạng (cùng thư mục với index):
+#   all_chunks.json                header: thư mục dữ liệu hiện tại, tên tài liệu, category (từng tài liệu), nguồn (kiểm tra stale)
+#   all_chunks.<build>/text.bin    text UTF-8 của các chunk nối liền
+#   all_chunks.<build>/offsets.npy int64[n + 1], chunk i = bin[offsets[i]:offsets[i + 1]]
+#   all_chunks.<build>/meta.npy    structured array (doc_idx, chunk_idx, category_id, content_length)
+#
+# Mỗi lần build ghi một thư mục mới rồi đổi header bằng một os.replace -> reader luôn thấy bộ file cùng một lần build
+# Build chạy dưới lockfile all_chunks.lock: nhiều worker cùng thấy store cũ lúc khởi động chỉ build một lần
+#
+# Các worker uvicorn mở cùng file -> dùng chung page cache, text chỉ được decode cho các hit trả về
+
+import json
+import logging
+import mmap
+import os
+import pickle
+import shutil
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+STORE_NAME = "all_chunks"
+_KEEP_BUILDS = 2  # Giữ lại bản build trước cho worker vừa đọc header cũ
+
+META_DTYPE = np.dtype([
+    ('doc_idx', '<i4'),
+    ('chunk_idx', '<i4'),
+    ('category_id', '<i2'),
+    ('content_length', '<i4')
+])
+
+def _header_path(store_dir: str) -> str:
+    return os.path.join(store_dir, STORE_NAME + ".json")
+
+def _lock_path(store_dir: str) -> str:
+    return os.path.join(store_dir, STORE_NAME + ".lock")
+
+def _data_paths(data_dir: str) -> Dict[str, str]:
+    return {
+        "text": os.path.join(data_dir, "text.bin"),
+        "offsets": os.path.join(data_dir, "offsets.npy"),
+        "meta": os.path.join(data_dir, "meta.npy")
+    }
+
+def _source_signature(source_path: str) -> Dict[str, Any]:
+    stat = os.stat(source_path)
+    return {"path": os.path.basename(source_path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+def _remove_old_builds(store_dir: str, current: str):
+    """Xóa các bản build cũ (giữ _KEEP_BUILDS bản mới nhất) và file của định dạng cũ (một bộ file chung)"""
+    prefix = STORE_NAME + "."
+    builds = [
+        name for name in os.listdir(store_dir)
+        if name.startswith(prefix) and os.path.isdir(os.path.join(store_dir, name))
+    ]
+    builds.sort(key=lambda name: os.path.getmtime(os.path.join(store_dir, name)), reverse=True)
+    keep = {current, *builds[:_KEEP_BUILDS]}
+    for name in builds:
+        if name not in keep:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+    for suffix in (".bin", ".offsets.npy", ".meta.npy"):
+        legacy = os.path.join(store_dir, STORE_NAME + suffix)
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+class ChunkStore:
+    """Truy cập chunk theo id (thứ tự giống FAISS index) mà không nạp toàn bộ text vào Python"""
+
+    def __init__(self, store_dir: str):
+        with open(_header_path(store_dir), 'r', encoding='utf-8') as f:
+            self.header = json.load(f)
+        if self.header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Chunk store version {self.header.get('version')} không hỗ trợ")
+
+        paths = _data_paths(os.path.join(store_dir, self.header["data_dir"]))
+        self.store_dir = store_dir
+        self.documents: List[str] = self.header["documents"]
+        self.categories: List[str] = self.header["categories"]
+        self.offsets = np.load(paths["offsets"], mmap_mode='r')
+        self.meta = np.load(paths["meta"], mmap_mode='r')
+
+        self._text_file = open(paths["text"], 'rb')
+        text_size = os.fstat(self._text_file.fileno()).st_size
+        self._text = mmap.mmap(self._text_file.fileno(), 0, access=mmap.ACCESS_READ) if text_size else b""
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    @property
+    def n_documents(self) -> int:
+        return len(self.documents)
+
+    def text(self, chunk_id: int) -> str:
+        """Decode text của một chunk"""
+        start, end = int(self.offsets[chunk_id]), int(self.offsets[chunk_id + 1])
+        return self._text[start:end].decode('utf-8')
+
+    def metadata(self, chunk_id: int) -> Dict[str, Any]:
+        """Metadata của chunk (không decode text)"""
+        row = self.meta[chunk_id]
+        doc_idx = int(row['doc_idx'])
+        return {
+            'doc_idx': doc_idx,
+            'chunk_idx': int(row['chunk_idx']),
+            'pdf_name': self.documents[doc_idx],
+            'category': self.categories[int(row['category_id'])],
+            'content_length': int(row['content_length'])
+        }
+
+    def get(self, chunk_id: int) -> Dict[str, Any]:
+        """Metadata + text của một chunk"""
+        chunk = self.metadata(chunk_id)
+        chunk['content'] = self.text(chunk_id)
+        return chunk
+
+    def categories_changed(self, categorize: Callable[[str], str]) -> bool:
+        """Luật phân category đã đổi so với lúc build (store cũ không ghi category từng tài liệu -> coi như đổi)"""
+        stored = self.header.get("document_categories")
+        return stored is None or stored != [categorize(pdf_name) for pdf_name in self.documents]
+
+    def is_stale(self, source_path: str) -> bool:
+        """Pickle nguồn đã thay đổi sau khi build store"""
+        try:
+            return self.header.get("source") != _source_signature(source_path)
+        except OSError:
+            return False  # Không còn pickle nguồn -> store là bản duy nhất
+
+    def close(self):
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
+        self._text_file.close()
+
+    @staticmethod
+    def exists(store_dir: str) -> bool:
+        return os.path.exists(_header_path(store_dir))
+
+    @staticmethod
+    def build(documents_data: Iterable[Dict[str, Any]],
+              store_dir: str,
+              categorize: Callable[[str], str],
+              source_path: Optional[str] = None) -> "ChunkStore":
+        """
+        Ghi chunk store từ documents_data (format all_embeddings.pkl)
+
+        Dữ liệu ghi vào thư mục build mới, header (trỏ tới thư mục) ghi ra file tạm rồi os.replace -
+        worker khác đang đọc vẫn dùng bản cũ cho tới khi mở lại. Gọi trong file_lock(_lock_path(store_dir))
+        """
+        build_name = f"{STORE_NAME}.{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{os.getpid()}"
+        data_dir = os.path.join(store_dir, build_name)
+        os.makedirs(data_dir)
+        paths = _data_paths(data_dir)
+        documents, categories, document_categories = [], [], []
+        category_ids: Dict[str, int] = {}
+        offsets = [0]
+        meta_rows = []
+
+        with open(paths["text"], 'wb') as f:
+            for doc_idx, doc in enumerate(documents_data):
+                pdf_name = doc.get('pdf_name', 'Unknown')
+                documents.append(pdf_name)
+                category = categorize(pdf_name)
+                document_categories.append(category)
+                if category not in category_ids:
+                    category_ids[category] = len(categories)
+                    categories.append(category)
+
+                for chunk_idx, chunk in enumerate(doc.get('chunks', [])):
+                    encoded = chunk.encode('utf-8')
+                    f.write(encoded)
+                    offsets.append(offsets[-1] + len(encoded))
+                    meta_rows.append((doc_idx, chunk_idx, category_ids[category], len(chunk)))
+
+        np.save(paths["offsets"], np.asarray(offsets, dtype='<i8'))
+        np.save(paths["meta"], np.asarray(meta_rows, dtype=META_DTYPE))
+
+        header = {
+            "version": FORMAT_VERSION,
+            "data_dir": build_name,
+            "n_chunks": len(meta_rows),
+            "documents": documents,
+            "categories": categories,
+            "document_categories": document_categories,
+            "source": _source_signature(source_path) if source_path else None,
+            "built_at": datetime.now().isoformat()
+        }
+        header_path = _header_path(store_dir)
+        tmp_header = f"{header_path}.{os.getpid()}.tmp"
+        with open(tmp_header, 'w', encoding='utf-8') as f:
+            json.dump(header, f, ensure_ascii=False)
+        os.replace(tmp_header, header_path)  # Đổi sang bản build mới trong một bước
+
+        _remove_old_builds(store_dir, build_name)
+        logger.info(f"✅ Đã build chunk store: {len(meta_rows)} chunks, {len(documents)} tài liệu")
+        return ChunkStore(store_dir)
+
+def _open_current(store_dir: str, source_path: str, categorize: Callable[[str], str]) -> Optional[ChunkStore]:
+    """Chunk store hiện có nếu còn khớp nguồn và luật phân category, không thì None"""
+    if not ChunkStore.exists(store_dir):
+        return None
+    try:
+        store = ChunkStore(store_dir)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"⚠️ Không mở được chunk store ({e}), build lại")
+        return None
+    if store.is_stale(source_path):
+        store.close()
+        return None
+    if store.categories_changed(categorize):
+        logger.info("🔄 Luật phân category đã thay đổi, build lại chunk store")
+        store.close()
+        return None
+    return store
+
+def open_chunk_store(store_dir: str,
+                     source_path: str,
+                     categorize: Callable[[str], str],
+                     load_documents: Optional[Callable[[], Iterable[Dict[str, Any]]]] = None) -> ChunkStore:
+    """
+    Mở chunk store, build lại từ nguồn nếu chưa có hoặc đã cũ
+
+    Nguồn mặc định là pickle source_path; load_documents (nếu có) trả về tài liệu theo thứ tự chunk id,
+    source_path khi đó chỉ dùng để phát hiện thay đổi (manifest của segment store)
+    """
+    store = _open_current(store_dir, source_path, categorize)
+    if store is not None:
+        return store
+
+    with file_lock(_lock_path(store_dir)):
+        # Worker khác có thể vừa build xong trong lúc chờ khóa
+        store = _open_current(store_dir, source_path, categorize)
+        if store is not None:
+            return store
+        logger.info("🔄 Chưa có chunk store hoặc nguồn đã thay đổi, build từ nguồn...")
+
+        if load_documents is not None:
+            return ChunkStore.build(load_documents(), store_dir, categorize, source_path=source_path)
+        with open(source_path, 'rb') as f:
+            documents_data = pickle.load(f)
+        return ChunkStore.build(documents_data, store_dir, categorize, source_path=source_path)
@@ -0,0 +1,135 @@
+# app/services/chunk_table.py
+# Bảng metadata chunk dạng cột (thay cho list dict chunks_metadata)
+# Mỗi trường là một numpy array, pdf_name / category được intern thành id,
+# thống kê theo category tính sẵn một lần -> /rag/stats, /rag/health, /rag/categories là O(1)
+
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ChunkTable:
+    """
+    Metadata của toàn bộ chunk theo id (cùng thứ tự với FAISS index)
+
+    - doc_idx / chunk_idx / category_id / content_length: numpy array
+    - documents[doc_idx], categories[category_id]: bảng tên đã intern
+    - prev_id / next_id: chunk liền kề trong cùng tài liệu (mở rộng context)
+    """
+
+    def __init__(self,
+                 doc_idx: np.ndarray,
+                 chunk_idx: np.ndarray,
+                 category_id: np.ndarray,
+                 content_length: np.ndarray,
+                 documents: List[str],
+                 categories: List[str]):
+        self.doc_idx = np.ascontiguousarray(doc_idx, dtype=np.int32)
+        self.chunk_idx = np.ascontiguousarray(chunk_idx, dtype=np.int32)
+        self.category_id = np.ascontiguousarray(category_id, dtype=np.int16)
+        self.content_length = np.ascontiguousarray(content_length, dtype=np.int32)
+        self.documents = list(documents)
+        self.categories = list(categories)
+        self._category_codes = {name: code for code, name in enumerate(self.categories)}
+
+        # Mảng kề: id chunk liền trước / liền sau trong cùng tài liệu (-1 nếu không có)
+        order = np.lexsort((self.chunk_idx, self.doc_idx))
+        adjacent = ((self.doc_idx[order[1:]] == self.doc_idx[order[:-1]]) &
+                    (self.chunk_idx[order[1:]] == self.chunk_idx[order[:-1]] + 1))
+        self.prev_id = np.full(len(self.doc_idx), -1, dtype=np.int32)
+        self.next_id = np.full(len(self.doc_idx), -1, dtype=np.int32)
+        self.prev_id[order[1:][adjacent]] = order[:-1][adjacent]
+        self.next_id[order[:-1][adjacent]] = order[1:][adjacent]
+
+        # Thống kê theo category (tính một lần)
+        n_categories = len(self.categories)
+        chunk_counts = np.bincount(self.category_id, minlength=n_categories)
+        total_lengths = np.bincount(self.category_id, weights=self.content_length, minlength=n_categories)
+        self._category_stats = {
+            name: {'chunks': int(chunk_counts[code]), 'total_length': int(total_lengths[code])}
+            for code, name in enumerate(self.categories)
+        }
+
+    @classmethod
+    def from_store(cls, store) -> "ChunkTable":
+        """Chép các cột metadata từ ChunkStore (mmap) vào RAM - ~22 bytes / chunk (gồm mảng kề)"""
+        meta = store.meta
+        return cls(
+            doc_idx=meta['doc_idx'],
+            chunk_idx=meta['chunk_idx'],
+            category_id=meta['category_id'],
+            content_length=meta['content_length'],
+            documents=store.documents,
+            categories=store.categories
+        )
+
+    def __len__(self) -> int:
+        return len(self.doc_idx)
+
+    @property
+    def n_documents(self) -> int:
+        return len(self.documents)
+
+    def category_code(self, category: str) -> Optional[int]:
+        return self._category_codes.get(category)
+
+    def category_stats(self) -> Dict[str, Dict[str, int]]:
+        """{category: {'chunks', 'total_length'}}"""
+        return {name: dict(stats) for name, stats in self._category_stats.items()}
+
+    def ids_by_category(self) -> Dict[str, np.ndarray]:
+        """Id các chunk của từng category (tăng dần)"""
+        order = np.argsort(self.category_id, kind='stable')
+        bounds = np.searchsorted(self.category_id[order], np.arange(len(self.categories) + 1))
+        return {
+            name: order[bounds[code]:bounds[code + 1]].astype(np.int64)
+            for code, name in enumerate(self.categories)
+            if bounds[code + 1] > bounds[code]
+        }
+
+    def category_codes(self, category: Optional[Union[str, Sequence[str]]]) -> Optional[List[int]]:
+        """Mã các category cần lọc (None = không lọc; một category hoặc danh sách category do router chọn)"""
+        if not category or category == 'all':
+            return None
+        names = [category] if isinstance(category, str) else list(category)
+        return [code for code in (self.category_code(name) for name in names) if code is not None]
+
+    def category_mask(self, category: Optional[Union[str, Sequence[str]]]) -> Optional[np.ndarray]:
+        """Mask bool theo chunk id cho category (None = không lọc)"""
+        codes = self.category_codes(category)
+        if codes is None:
+            return None
+        return np.isin(self.category_id, codes)
+
+    def select(self,
+               ids: np.ndarray,
+               scores: np.ndarray,
+               category: Optional[Union[str, Sequence[str]]] = None,
+               min_score: Optional[float] = None) -> np.ndarray:
+        """Mask các hit hợp lệ: id trong bảng, đúng category, score >= min_score"""
+        ids = np.asarray(ids, dtype=np.int64)
+        mask = (ids >= 0) & (ids < len(self))
+        if min_score is not None:
+            mask &= np.asarray(scores) >= min_score
+        codes = self.category_codes(category)
+        if codes is not None:
+            mask[mask] = np.isin(self.category_id[ids[mask]], codes)
+        return mask
+
+    def rows(self, ids: np.ndarray) -> List[Dict[str, Any]]:
+        """Metadata của các chunk (tra cứu theo cột, không loop trên toàn bảng)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        doc_idx = self.doc_idx[ids]
+        category_id = self.category_id[ids]
+        return [
+            {
+                'doc_idx': int(d),
+                'chunk_idx': int(c),
+                'pdf_name': self.documents[d],
+                'category': self.categories[k],
+                'content_length': int(n)
+            }
+            for d, c, k, n in zip(doc_idx, self.chunk_idx[ids], category_id, self.content_length[ids])
+        ]
@@ -0,0 +1,268 @@
+# app/services/citation_index.py
+# Index tra cứu trích dẫn pháp luật: số hiệu văn bản + Điều / Khoản -> chunk id (dict, O(1))
+# "Điều 9 Nghị định 13/2023/NĐ-CP" -> lấy thẳng các chunk của Điều 9 trong văn bản 13/2023/NĐ-CP
+#
+# File (cùng thư mục với index): all_citations.json
+#   documents  {key số hiệu: [pdf_name]}     key: "13/2023/nd-cp", "nd:13/2023", "13/2023", "nd:13"
+#   chunks     {pdf_name: [chunk id]}
+#   units      {pdf_name: {"9": [chunk id], "9.2": [chunk id]}}   Điều 9 / Khoản 2 Điều 9
+
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from app.services.bm25_index import fold_accents
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "all_citations"
+
+# Loại văn bản (sau khi bỏ dấu) -> mã loại dùng trong key
+DOC_TYPES = {
+    "luat": "luat",
+    "nghi dinh": "nd",
+    "thong tu lien tich": "ttlt",
+    "thong tu": "tt",
+    "quyet dinh": "qd"
+}
+# Ký hiệu văn bản -> mã loại: QH13 = luật, NĐ-CP = nghị định, ...
+_CODE_TYPES = (("ttlt", "ttlt"), ("tt", "tt"), ("nd", "nd"), ("qd", "qd"), ("qh", "luat"))
+
+_CODE = r"(?:ttlt|tt|nd|qd|qh)[a-z0-9]*(?:-[a-z]+)*"
+# Tên file: Luat-86-2015-QH13, 13_2023_ND-CP_465185, Quyet_dinh-1118-QD-BTTTT
+_FILENAME_NUMBER = re.compile(rf"(?:^|-)(\d+)-(?:(\d{{4}})-)?({_CODE})(?=-|$)")
+# Câu hỏi: "nghị định 13/2023/nđ-cp", "thông tư số 12/2022", "quyết định 1118/qđ-btttt", "luật 86"
+_TYPED_NUMBER = re.compile(
+    rf"\b({'|'.join(sorted(DOC_TYPES, key=len, reverse=True))})\s+(?:so\s+)?(\d+)"
+    rf"(?:\s*/\s*(\d{{4}}))?(?:\s*/\s*({_CODE}))?"
+)
+_BARE_NUMBER = re.compile(rf"\b(\d+)/(?:(\d{{4}})(?:/({_CODE}))?|({_CODE}))\b")
+_ARTICLE_QUERY = re.compile(r"\bdieu\s+(\d+)")
+_CLAUSE_QUERY = re.compile(r"\bkhoan\s+(\d+)")
+
+# Ranh giới trong văn bản: tiêu đề "Điều 9. Tên điều" và khoản "2. Nội dung" ở đầu dòng / sau dấu câu
+_ARTICLE_HEADING = re.compile(r"(?:^|(?<=[\n.;:]))\s*Dieu\s+(\d+)\s*[.:]\s*(?=[A-Z])")
+_CLAUSE_HEADING = re.compile(r"(?:^|(?<=[\n.;:]))\s*(\d{1,3})\.\s+(?=[A-Z])")
+
+@dataclass(frozen=True)
+class Citation:
+    """Trích dẫn trong câu hỏi: key số hiệu (cụ thể nhất trước) + Điều / Khoản"""
+    document_keys: Tuple[str, ...]
+    article: Optional[int] = None
+    clause: Optional[int] = None
+
+    @property
+    def unit(self) -> Optional[str]:
+        if self.article is None:
+            return None
+        return f"{self.article}.{self.clause}" if self.clause is not None else str(self.article)
+
+@dataclass
+class CitationMatch:
+    """Kết quả tra cứu: chunk id của Điều/Khoản (unit) hoặc của cả văn bản (unit = None)"""
+    chunk_ids: List[int]
+    documents: List[str]
+    unit: Optional[str]
+
+def _code_type(code: Optional[str]) -> Optional[str]:
+    if not code:
+        return None
+    for prefix, doc_type in _CODE_TYPES:
+        if code.startswith(prefix):
+            return doc_type
+    return None
+
+def _number_keys(number: str, year: Optional[str], code: Optional[str], doc_type: Optional[str]) -> List[str]:
+    """Các key của một số hiệu, cụ thể nhất trước: 13/2023/nd-cp, nd:13/2023, 13/2023, nd:13"""
+    number = str(int(number))  # "03" -> "3"
+    base = f"{number}/{year}" if year else number
+    doc_type = doc_type or _code_type(code)
+    keys = []
+    if code:
+        keys.append(f"{base}/{code}")
+    if doc_type and year:
+        keys.append(f"{doc_type}:{base}")
+    if year:
+        keys.append(base)
+    if doc_type:
+        keys.append(f"{doc_type}:{number}")
+    return keys
+
+def document_keys(pdf_name: str) -> List[str]:
+    """Key số hiệu của văn bản theo tên file (rỗng nếu tên file không theo mẫu số hiệu)"""
+    name = re.sub(r"[\s_]+", "-", fold_accents(os.path.splitext(pdf_name)[0]).lower())
+    match = _FILENAME_NUMBER.search(name)
+    if not match:
+        return []
+    return _number_keys(*match.groups(), doc_type=None)
+
+def parse_citations(text: str) -> List[Citation]:
+    """Trích dẫn văn bản trong câu hỏi; Điều / Khoản gắn với trích dẫn đầu tiên"""
+    folded = fold_accents(text or "").lower()
+    citations, spans = [], []
+    for match in _TYPED_NUMBER.finditer(folded):
+        doc_type, number, year, code = match.groups()
+        citations.append(_number_keys(number, year, code, DOC_TYPES[doc_type]))
+        spans.append(match.span())
+    for match in _BARE_NUMBER.finditer(folded):
+        if any(start <= match.start() < end for start, end in spans):
+            continue
+        number, year, code, code_without_year = match.groups()
+        citations.append(_number_keys(number, year, code or code_without_year, None))
+
+    article = _ARTICLE_QUERY.search(folded)
+    clause = _CLAUSE_QUERY.search(folded)
+    article = int(article.group(1)) if article else None
+    clause = int(clause.group(1)) if clause and article is not None else None
+    if not citations:
+        return [Citation((), article, clause)] if article is not None else []
+    return [
+        Citation(tuple(keys), article, clause) if i == 0 else Citation(tuple(keys))
+        for i, keys in enumerate(citations)
+    ]
+
+def legal_units(chunks: Sequence[str]) -> List[Set[str]]:
+    """
+    Điều / Khoản mà từng chunk (theo thứ tự trong văn bản) thuộc về
+
+    Điều / khoản đang mở được mang sang chunk sau; khoản chỉ nhận khi đánh số liên tiếp (1, 2, 3...)
+    để không nhầm với danh sách đánh số khác
+    """
+    article, clause = None, None
+    units = []
+    for chunk in chunks:
+        folded = fold_accents(chunk)
+        chunk_units = set()
+        if article is not None:
+            chunk_units.add(str(article))
+            if clause is not None:
+                chunk_units.add(f"{article}.{clause}")
+
+        headings = sorted(
+            [(m.start(), 'article', int(m.group(1))) for m in _ARTICLE_HEADING.finditer(folded)] +
+            [(m.start(), 'clause', int(m.group(1))) for m in _CLAUSE_HEADING.finditer(folded)]
+        )
+        for _, kind, number in headings:
+            if kind == 'article':
+                article, clause = number, None
+                chunk_units.add(str(article))
+            elif article is not None and (number == 1 or (clause is not None and number == clause + 1)):
+                clause = number
+                chunk_units.add(f"{article}.{clause}")
+        units.append(chunk_units)
+    return units
+
+class CitationIndex:
+    """Dict số hiệu / Điều / Khoản -> chunk id"""
+
+    def __init__(self):
+        self.documents: Dict[str, List[str]] = {}
+        self.chunks: Dict[str, List[int]] = {}
+        self.units: Dict[str, Dict[str, List[int]]] = {}
+        self.n_chunks = 0
+
+    def add_document(self, pdf_name: str, chunk_ids: Sequence[int], texts: Sequence[str]):
+        """Thêm các chunk (theo thứ tự trong văn bản) của một văn bản"""
+        self.n_chunks += len(chunk_ids)
+        keys = document_keys(pdf_name)
+        if not keys:
+            return
+        for key in keys:
+            names = self.documents.setdefault(key, [])
+            if pdf_name not in names:
+                names.append(pdf_name)
+        self.chunks.setdefault(pdf_name, []).extend(int(c) for c in chunk_ids)
+        doc_units = self.units.setdefault(pdf_name, {})
+        for chunk_id, chunk_units in zip(chunk_ids, legal_units(texts)):
+            for unit in chunk_units:
+                doc_units.setdefault(unit, []).append(int(chunk_id))
+
+    def lookup(self, citation: Citation) -> Optional[CitationMatch]:
+        """Chunk của văn bản được trích dẫn (Điều/Khoản nếu có) - None nếu không có văn bản nào khớp"""
+        documents = next((self.documents[key] for key in citation.document_keys if key in self.documents), None)
+        if not documents:
+            return None
+
+        # Khoản không tách được -> cả Điều; Điều không có -> cả văn bản
+        for unit in (citation.unit, str(citation.article) if citation.article is not None else None):
+            if unit is None:
+                continue
+            chunk_ids = sorted({c for name in documents for c in self.units.get(name, {}).get(unit, [])})
+            if chunk_ids:
+                return CitationMatch(chunk_ids, list(documents), unit)
+        chunk_ids = [c for name in documents for c in self.chunks.get(name, [])]
+        return CitationMatch(chunk_ids, list(documents), None)
+
+    def lookup_question(self, question: str) -> Optional[CitationMatch]:
+        """Tra trích dẫn đầu tiên trong câu hỏi khớp với một văn bản trong index"""
+        for citation in parse_citations(question):
+            match = self.lookup(citation)
+            if match is not None:
+                return match
+        return None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "documents": len(self.chunks),
+            "keys": len(self.documents),
+            "units": sum(len(units) for units in self.units.values()),
+            "chunks": self.n_chunks
+        }
+
+    def save(self, index_dir: str):
+        """Ghi ra file tạm rồi os.replace"""
+        path = os.path.join(index_dir, INDEX_NAME + ".json")
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({
+                "n_chunks": self.n_chunks,
+                "documents": self.documents,
+                "chunks": self.chunks,
+                "units": self.units
+            }, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["CitationIndex"]:
+        """Đọc index (None nếu chưa có)"""
+        path = os.path.join(index_dir, INDEX_NAME + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls()
+        index.n_chunks = data["n_chunks"]
+        index.documents = data["documents"]
+        index.chunks = data["chunks"]
+        index.units = data["units"]
+        return index
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[str, Sequence[str]]]) -> "CitationIndex":
+        """Build từ (pdf_name, chunks) theo thứ tự chunk id của index chung"""
+        index = cls()
+        for pdf_name, chunks in documents:
+            index.add_document(pdf_name, range(index.n_chunks, index.n_chunks + len(chunks)), chunks)
+        return index
+
+def update_citation_index(index_dir: str,
+                          new_documents: Sequence[Tuple[str, Sequence[str]]],
+                          existing_documents: Iterable[Tuple[str, Sequence[str]]],
+                          n_existing: int) -> CitationIndex:
+    """
+    Thêm các văn bản mới (pdf_name, chunks - theo thứ tự chunk id từ n_existing) vào citation index lúc ingestion
+
+    Index chưa có / lệch số chunk với index chung (n_existing) -> build lại từ existing_documents
+    """
+    index = CitationIndex.load(index_dir)
+    if index is None or index.n_chunks != n_existing:
+        if index is not None:
+            logger.warning(f"⚠️ Citation index có {index.n_chunks} chunks, index chung có {n_existing} - build lại")
+        index = CitationIndex.build(existing_documents)
+    for pdf_name, chunks in new_documents:
+        index.add_document(pdf_name, range(index.n_chunks, index.n_chunks + len(chunks)), chunks)
+    index.save(index_dir)
+    logger.info(f"✅ Citation index: {len(index.chunks)} văn bản, {len(index.documents)} key số hiệu")
+    return index
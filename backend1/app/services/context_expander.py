@@ -0,0 +1,88 @@
+# app/services/context_expander.py
+# Mở rộng context của hit bằng chunk liền trước / liền sau trong cùng tài liệu
+# Chunk chỉ overlap 50 token nên một điều khoản hay bị cắt đôi - ghép hàng xóm thay vì tăng top_k
+# Tra hàng xóm qua mảng kề prev_id / next_id của ChunkTable (không search thêm), phần overlap chỉ giữ một lần
+
+import logging
+from typing import Callable, Dict, List, Sequence
+
+from app.services.context_packer import split_sentences
+
+logger = logging.getLogger(__name__)
+
+def overlap_length(left: Sequence[str], right: Sequence[str]) -> int:
+    """Số câu cuối của left trùng với các câu đầu của right (overlap khi chia chunk)"""
+    for k in range(min(len(left), len(right)), 0, -1):
+        if list(left[-k:]) == list(right[:k]):
+            return k
+    return 0
+
+class ContextExpander:
+    """
+    Ghép mỗi hit với các chunk kề trong ngân sách token
+
+    - Mở rộng theo vòng: khoảng cách 1 cho mọi hit (theo thứ hạng) rồi mới tới khoảng cách 2...
+    - Chunk đã là hit hoặc đã được ghép vào hit khác thì bỏ qua (không lặp text trong prompt)
+    - Câu overlap giữa hai chunk kề chỉ giữ một lần
+    """
+
+    def __init__(self, chunk_table, text_of: Callable[[int], str], count_tokens: Callable[[str], int]):
+        self.chunk_table = chunk_table
+        self.text_of = text_of
+        self.count_tokens = count_tokens
+
+    def expand(self, results: List[Dict], token_budget: int, window: int = 1) -> List[Dict]:
+        """Trả về bản sao results, hit được mở rộng có content đã ghép và 'chunk_ids' (thứ tự trong tài liệu)"""
+        if not results or token_budget <= 0 or window <= 0:
+            return results
+
+        claimed = {r['chunk_id'] for r in results}
+        spans = [[r['chunk_id']] for r in results]
+        sentences = [split_sentences(r['content']) for r in results]
+        before = [[] for _ in results]
+        after = [[] for _ in results]
+        used = 0
+
+        for _ in range(window):
+            for i, span in enumerate(spans):
+                for side in ('prev', 'next'):
+                    if side == 'prev':
+                        neighbour = int(self.chunk_table.prev_id[span[0]])
+                    else:
+                        neighbour = int(self.chunk_table.next_id[span[-1]])
+                    if neighbour < 0 or neighbour in claimed:
+                        continue
+
+                    neighbour_sentences = split_sentences(self.text_of(neighbour))
+                    if side == 'prev':
+                        k = overlap_length(neighbour_sentences, sentences[i])
+                        added = neighbour_sentences[:len(neighbour_sentences) - k]
+                    else:
+                        k = overlap_length(sentences[i], neighbour_sentences)
+                        added = neighbour_sentences[k:]
+
+                    tokens = self.count_tokens(" ".join(added)) if added else 0
+                    if used + tokens > token_budget:
+                        continue
+                    used += tokens
+                    claimed.add(neighbour)
+                    if side == 'prev':
+                        span.insert(0, neighbour)
+                        before[i] = added + before[i]
+                        sentences[i] = added + sentences[i]
+                    else:
+                        span.append(neighbour)
+                        after[i] = after[i] + added
+                        sentences[i] = sentences[i] + added
+
+        expanded = []
+        for result, span, head, tail in zip(results, spans, before, after):
+            if len(span) == 1:
+                expanded.append(result)
+                continue
+            content = "\n".join(part for part in (" ".join(head), result['content'], " ".join(tail)) if part)
+            expanded.append({**result, 'content': content, 'content_length': len(content), 'chunk_ids': list(span)})
+
+        if used:
+            logger.debug(f"Context expansion: +{len(claimed) - len(results)} chunks, {used}/{token_budget} tokens")
+        return expanded
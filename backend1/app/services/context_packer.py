@@ -0,0 +1,129 @@
+# app/services/context_packer.py
+# Đóng gói context cho prompt theo ngân sách token (dùng tokenizer của LLM)
+# Thay cho cắt cứng theo số ký tự: chọn các câu liên quan nhất trong các chunk, không cắt giữa câu
+
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Ranh giới câu: sau dấu kết thúc câu (. ! ? …) + khoảng trắng, hoặc xuống dòng
+# Không tách ở ";" / ":" - tiêu đề "Điều N:" và các khoản liệt kê "a) ...; b) ..." giữ nguyên trong một câu
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n+")
+# Nhãn đánh số đứng trước nội dung ("Điều 5.", "Chương II.", "1.", "1.2.") - ghép với phần sau, không tách thành câu
+_HEADING_LABEL = re.compile(r"^(?:(?:Điều|Khoản|Mục|Chương|Phần)\s+[\dIVXLC]+[a-z]?|\d+(?:\.\d+)*)\.$", re.IGNORECASE)
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# Âm tiết chức năng tiếng Việt - không mang nội dung khi so khớp câu hỏi
+_STOPWORDS = {
+    "là", "gì", "của", "và", "các", "những", "có", "được", "cho", "trong", "như", "thế", "nào",
+    "với", "một", "này", "để", "khi", "thì", "mà", "từ", "về", "ra", "bị", "sao", "hãy", "không",
+    "the", "is", "what", "of", "and", "a", "an", "to", "in", "how"
+}
+
+def split_sentences(text: str) -> List[str]:
+    """Tách đoạn văn thành các câu (giữ nguyên nội dung từng câu)"""
+    sentences = []
+    label = ""
+    for part in _SENTENCE_BOUNDARY.split(text or ""):
+        part = part.strip() if part else ""
+        if not part:
+            continue
+        if _HEADING_LABEL.match(part):
+            label = f"{label} {part}" if label else part
+            continue
+        sentences.append(f"{label} {part}" if label else part)
+        label = ""
+    if label:
+        sentences.append(label)
+    return sentences
+
+def _terms(text: str) -> set:
+    """Âm tiết + cặp âm tiết liền kề (từ ghép tiếng Việt) sau khi bỏ stopword"""
+    words = _WORD.findall(unicodedata.normalize("NFC", text).lower())
+    unigrams = {w for w in words if w not in _STOPWORDS and len(w) > 1}
+    bigrams = {f"{a} {b}" for a, b in zip(words, words[1:])}
+    return unigrams | bigrams
+
+@dataclass
+class PackedContext:
+    """Kết quả đóng gói: passages[i] là nội dung đã chọn của tài liệu i (có thể rỗng)"""
+    passages: List[str]
+    token_count: int
+    token_budget: int
+    selected_sentences: int = 0
+    dropped_sentences: int = 0
+
+class ContextPacker:
+    """
+    Chọn câu từ các chunk đã retrieve sao cho tổng số token <= token_budget
+
+    - Điểm mỗi câu: mức độ trùng khớp với câu hỏi + ưu tiên theo thứ hạng retrieval của chunk
+    - Chọn tham lam theo điểm, câu không vừa ngân sách thì bỏ (không bao giờ cắt giữa câu)
+    - Các câu được chọn trả về theo thứ tự gốc trong chunk để giữ mạch văn
+    """
+
+    RANK_WEIGHT = 0.3  # Trọng số thứ hạng chunk so với độ trùng khớp câu hỏi
+    LEAD_BONUS = 0.05  # Câu đầu chunk thường là câu chủ đề
+
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer
+
+    def count_tokens(self, text: str) -> int:
+        """Số token của text theo tokenizer LLM (ước lượng theo số từ nếu chưa có tokenizer)"""
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return int(len(text.split()) * 1.5) + 1
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def pack(self,
+             question: str,
+             passages: Sequence[str],
+             token_budget: int,
+             separator: str = " ") -> PackedContext:
+        """Đóng gói passages (đã xếp theo độ liên quan giảm dần) vào token_budget"""
+        question_terms = _terms(question)
+
+        candidates = []  # (score, doc_index, sentence_index, sentence)
+        for doc_index, passage in enumerate(passages):
+            rank_score = self.RANK_WEIGHT / (doc_index + 1)
+            for sentence_index, sentence in enumerate(split_sentences(passage)):
+                sentence_terms = _terms(sentence)
+                overlap = len(question_terms & sentence_terms) / len(question_terms) if question_terms else 0.0
+                score = overlap + rank_score + (self.LEAD_BONUS if sentence_index == 0 else 0.0)
+                candidates.append((score, doc_index, sentence_index, sentence))
+
+        # Ưu tiên điểm cao; cùng điểm thì giữ thứ tự tài liệu / câu
+        candidates.sort(key=lambda c: (-c[0], c[1], c[2]))
+
+        separator_tokens = self.count_tokens(separator.strip()) if separator.strip() else 0
+        selected = {}
+        used = 0
+        dropped = 0
+        for score, doc_index, sentence_index, sentence in candidates:
+            tokens = self.count_tokens(sentence) + separator_tokens
+            if used + tokens > token_budget:
+                dropped += 1
+                continue
+            selected[(doc_index, sentence_index)] = sentence
+            used += tokens
+
+        packed_passages = []
+        for doc_index in range(len(passages)):
+            sentences = [selected[key] for key in sorted(k for k in selected if k[0] == doc_index)]
+            packed_passages.append(separator.join(sentences))
+
+        if dropped:
+            logger.debug(f"Context packer: giữ {len(selected)} câu ({used}/{token_budget} tokens), bỏ {dropped} câu")
+
+        return PackedContext(
+            passages=packed_passages,
+            token_count=used,
+            token_budget=token_budget,
+            selected_sentences=len(selected),
+            dropped_sentences=dropped
+        )
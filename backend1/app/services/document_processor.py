@@ -16,6 +16,7 @@ import docx  # python-docx
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from app.core.config import settings
+from app.services.pdf_text import OcrCache, extract_pdf_text
 
 logger = logging.getLogger(__name__)
 
@@ -36,23 +37,28 @@ class DocumentProcessor:
         self.use_ocr = settings.USE_OCR
         if self.use_ocr:
             self._setup_ocr()
+        self.ocr_cache = (
+            OcrCache(settings.OCR_CACHE_PATH) if settings.OCR_CACHE_ENABLED else None
+        )
     
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """Trích xuất text từ file PDF với hỗ trợ OCR"""
         try:
             text = ""
             
-            # Thử với PyMuPDF trước (nhanh hơn)
+            # Thử với PyMuPDF trước (nhanh hơn): text layer từng trang, chỉ OCR trang ảnh (có cache theo trang)
             try:
-                doc = fitz.open(pdf_path)
-                for page in doc:
-                    page_text = page.get_text()
-                    if page_text.strip():
-                        text += page_text
-                doc.close()
+                text, _ = extract_pdf_text(
+                    pdf_path,
+                    cache=self.ocr_cache,
+                    ocr=self.use_ocr,
+                    zoom=2.0,
+                    ocr_config=f'--psm {settings.OCR_PSM} -l {settings.OCR_LANGUAGES}'
+                )
                 if text.strip():
                     logger.info(f"Đã trích xuất text từ {pdf_path} bằng PyMuPDF")
                     return text
+                text = ""
             except Exception as e:
                 logger.warning(f"PyMuPDF failed for {pdf_path}: {e}")
             
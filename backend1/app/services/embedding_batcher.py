@@ -0,0 +1,126 @@
+# app/services/embedding_batcher.py
+# Micro-batcher cho query embeddings
+# Gom các câu hỏi đến đồng thời trong một cửa sổ thời gian ngắn rồi encode trong một forward pass
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import get_metrics_registry, DEFAULT_LATENCY_BUCKETS_MS, DEFAULT_SIZE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingMicroBatcher:
+    """
+    Gom các request encode đồng thời thành batch
+
+    - Request đầu tiên mở một cửa sổ max_wait_ms
+    - Batch được gửi đi khi đủ max_batch_size hoặc hết cửa sổ
+    - encode_batch_fn(texts) -> np.ndarray [len(texts), dim] chạy trong thread pool 'encode'
+    """
+
+    def __init__(self,
+                 encode_batch_fn: Callable[[List[str]], np.ndarray],
+                 inference_executor,
+                 max_batch_size: Optional[int] = None,
+                 max_wait_ms: Optional[float] = None):
+        self.encode_batch_fn = encode_batch_fn
+        self.inference_executor = inference_executor
+        self.max_batch_size = max_batch_size or settings.EMBEDDING_BATCH_MAX_SIZE
+        self.max_wait_ms = max_wait_ms if max_wait_ms is not None else settings.EMBEDDING_BATCH_MAX_WAIT_MS
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        registry = get_metrics_registry()
+        self.batch_size_histogram = registry.histogram(
+            "embedding_batch_size", "Số câu hỏi trong mỗi batch embedding", DEFAULT_SIZE_BUCKETS
+        )
+        self.wait_time_histogram = registry.histogram(
+            "embedding_batch_wait_ms", "Thời gian request chờ trong hàng đợi trước khi batch được gửi (ms)",
+            DEFAULT_LATENCY_BUCKETS_MS
+        )
+        self.forward_time_histogram = registry.histogram(
+            "embedding_batch_forward_ms", "Thời gian forward pass của một batch embedding (ms)",
+            DEFAULT_LATENCY_BUCKETS_MS
+        )
+
+    def _ensure_worker(self):
+        """Tạo queue và worker task trên event loop hiện tại"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Encode một câu hỏi, trả về embedding shape [1, dim] (giống encode_text)"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future, time.perf_counter()))
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[str, asyncio.Future, float]]:
+        """Lấy một batch từ queue theo max_batch_size / max_wait_ms"""
+        first = await self._queue.get()
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+
+        # Lấy thêm những request đã nằm sẵn trong queue (không cần chờ)
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+        return batch
+
+    async def _run(self):
+        """Worker loop: gom batch -> forward -> trả kết quả cho từng caller"""
+        while True:
+            batch = await self._collect_batch()
+            dispatch_time = time.perf_counter()
+
+            # Bỏ các request đã bị hủy (client disconnect)
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            texts = [text for text, _, _ in batch]
+            self.batch_size_histogram.observe(len(texts))
+            for _, _, enqueued_at in batch:
+                self.wait_time_histogram.observe((dispatch_time - enqueued_at) * 1000)
+
+            try:
+                embeddings = await self.inference_executor.run_encode(self.encode_batch_fn, texts)
+                self.forward_time_histogram.observe((time.perf_counter() - dispatch_time) * 1000)
+
+                for i, (_, future, _) in enumerate(batch):
+                    if not future.done():
+                        future.set_result(embeddings[i:i + 1])
+
+            except Exception as e:
+                logger.error(f"❌ Lỗi encode batch ({len(texts)} câu hỏi): {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê micro-batcher (histograms batch size, wait time, forward time)"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "batch_size": self.batch_size_histogram.snapshot(),
+            "wait_time_ms": self.wait_time_histogram.snapshot(),
+            "forward_time_ms": self.forward_time_histogram.snapshot()
+        }
@@ -4,21 +4,31 @@
 import os
 import logging
 import numpy as np
-import fitz  # PyMuPDF
-import pytesseract
-from PIL import Image, ImageEnhance, ImageFilter
-import io
+from PIL import Image
 from datetime import datetime
 import pickle
 import re
+from dataclasses import asdict
 from typing import List, Union, Optional, Dict, Any
 from sentence_transformers import SentenceTransformer
 from transformers import AutoTokenizer
 from underthesea import sent_tokenize
 import torch
-import faiss
 from langchain.schema import Document
 
+from app.core.config import settings
+from app.services.bm25_index import update_bm25_index
+from app.services.citation_index import update_citation_index
+from app.services.index_factory import (
+    IndexSpec, build_index, load_index, read_index_manifest, save_index, spec_from_manifest
+)
+from app.services.ingestion_manifest import (
+    MANIFEST_NAME as INGESTION_MANIFEST_NAME, STATUS_ERROR, STATUS_PENDING, STATUS_PROCESSING, IngestionManifest
+)
+from app.services.pdf_text import OcrCache, PdfExtractionStats, extract_pdf_text, preprocess_image
+from app.services.segment_store import SegmentStore
+from app.services.text_chunker import chunk_sentences, count_tokens
+
 logger = logging.getLogger(__name__)
 
 class EmbeddingService:
@@ -37,9 +47,34 @@ class EmbeddingService:
         # Đường dẫn FAISS và pickle chung
         self.all_faiss_path = os.path.join(self.output_dir, "all_faiss.index")
         self.all_pickle_path = os.path.join(self.output_dir, "all_embeddings.pkl")
+
+        # Segment store append-only (nguồn dữ liệu chính, mở khi ghi), pickle chung chỉ là bản xuất cho code cũ
+        self.segments_dir = os.path.join(self.output_dir, "segments")
+        self._segment_store: Optional[SegmentStore] = None
+        self.pending_documents: List[Dict[str, Any]] = []
+
+        # OCR theo trang: cache kết quả theo hash nội dung trang
+        self.ocr_workers = settings.OCR_WORKERS
+        self.ocr_cache = OcrCache(settings.OCR_CACHE_PATH) if settings.OCR_CACHE_ENABLED else None
+        self.last_pdf_stats: Optional[PdfExtractionStats] = None
+
+        # Manifest ingestion: trạng thái từng file theo đường dẫn + hash nội dung
+        self.embedding_model = os.path.basename(os.path.normpath(model_path))
+        self.ingestion_manifest = IngestionManifest(os.path.join(self.output_dir, INGESTION_MANIFEST_NAME))
+        self._legacy_document_names: Optional[set] = None
         
         logger.info(f"Sử dụng device: {self.device}")
         
+    @property
+    def segment_store(self) -> SegmentStore:
+        """Mở segment store để ghi (lần đầu: import all_embeddings.pkl có sẵn, ghi manifest ingestion)"""
+        if self._segment_store is None:
+            self._segment_store = SegmentStore(self.segments_dir, on_merge=self.ingestion_manifest.rename_segments)
+            if self._segment_store.is_empty() and os.path.exists(self.all_pickle_path):
+                self._segment_store.import_pickle(self.all_pickle_path)
+            self.ingestion_manifest.import_segments(self._segment_store, self.embedding_model)
+        return self._segment_store
+
     def load_model(self):
         """Load model embedding và tokenizer"""
         try:
@@ -57,35 +92,19 @@ class EmbeddingService:
 
     def preprocess_image(self, img: Image.Image) -> Image.Image:
         """Tiền xử lý ảnh để cải thiện OCR"""
-        if img.mode != 'L':
-            img = img.convert('L')
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.5)
-        img = img.filter(ImageFilter.SHARPEN)
-        return img
+        return preprocess_image(img)
 
     def extract_text_from_pdf(self, pdf_path: str) -> Optional[str]:
-        """OCR file PDF thành text"""
+        """
+        Trích xuất text PDF theo từng trang: text layer nếu trang có đủ chữ, OCR trang ảnh (có cache theo trang)
+
+        Thống kê OCR của file gần nhất ở self.last_pdf_stats
+        """
         try:
-            logger.info(f"Đang OCR file: {pdf_path}")
-            doc = fitz.open(pdf_path)
-            total_pages = len(doc)
-            full_text = ""
-            ocr_config = r'--oem 3 --psm 6 -l vie'
-            
-            for page_num in range(total_pages):
-                logger.info(f"Xử lý trang {page_num + 1}/{total_pages}...")
-                page = doc.load_page(page_num)
-                matrix = fitz.Matrix(2.5, 2.5)
-                pix = page.get_pixmap(matrix=matrix)
-                img_data = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
-                img = self.preprocess_image(img)
-                page_text = pytesseract.image_to_string(img, config=ocr_config)
-                full_text += page_text.strip() + "\n"
-                
-            doc.close()
-            logger.info(f"Hoàn thành OCR {total_pages} trang")
+            logger.info(f"Đang trích xuất text: {pdf_path}")
+            full_text, self.last_pdf_stats = extract_pdf_text(
+                pdf_path, cache=self.ocr_cache, workers=self.ocr_workers
+            )
             return full_text
             
         except Exception as e:
@@ -184,35 +203,9 @@ class EmbeddingService:
         
         for section in sections:
             sentences = sent_tokenize(section)
-            current_chunk = []
-            current_tokens = 0
-            
-            for sentence in sentences:
-                num_tokens = len(self.tokenizer.tokenize(sentence))
-                
-                if current_tokens + num_tokens > chunk_size:
-                    if current_chunk:
-                        chunk_text = '\n'.join(current_chunk).strip()
-                        all_chunks.append(chunk_text)
-                    
-                    # Tạo overlap
-                    overlap_chunk = []
-                    total = 0
-                    for s in reversed(current_chunk):
-                        toks = len(self.tokenizer.tokenize(s))
-                        if total + toks > overlap:
-                            break
-                        overlap_chunk.insert(0, s)
-                        total += toks
-                    
-                    current_chunk = overlap_chunk + [sentence]
-                    current_tokens = total + num_tokens
-                else:
-                    current_chunk.append(sentence)
-                    current_tokens += num_tokens
-            
-            if current_chunk:
-                all_chunks.append(' '.join(current_chunk).strip())
+            # Một lần gọi tokenizer cho cả section, số token dùng lại khi tính overlap
+            token_counts = count_tokens(self.tokenizer, sentences)
+            all_chunks.extend(chunk_sentences(sentences, token_counts, chunk_size, overlap))
         
         return all_chunks
 
@@ -248,13 +241,15 @@ class EmbeddingService:
             return None
 
     def save_embeddings_to_faiss(self, chunks: List[str], embeddings: np.ndarray, 
-                                doc_path: str) -> Dict[str, str]:
-        """Lưu embeddings vào FAISS index và pickle"""
-        doc_name = os.path.splitext(os.path.basename(doc_path))[0]
-        doc_folder = os.path.join(self.output_dir, doc_name)
-        os.makedirs(doc_folder, exist_ok=True)
+                                doc_path: str, commit: bool = True) -> Dict[str, str]:
+        """
+        Lưu embeddings của một tài liệu
 
-        # Tạo data structure
+        Tài liệu được gom vào batch, mỗi batch ghi một segment mới (không đọc/ghi lại dữ liệu cũ,
+        không ghi pickle / FAISS index riêng cho từng tài liệu).
+        commit=False: chưa cập nhật index chung - gọi commit() sau khi ingest xong cả loạt
+        """
+        doc_name = os.path.splitext(os.path.basename(doc_path))[0]
         data = {
             'pdf_name': doc_name,
             'doc_path': doc_path,
@@ -263,55 +258,128 @@ class EmbeddingService:
             'created_at': datetime.now().isoformat()
         }
 
-        # Lưu embeddings pickle riêng
-        pickle_path = os.path.join(doc_folder, f"{doc_name}_embeddings.pkl")
-        with open(pickle_path, 'wb') as f:
-            pickle.dump(data, f)
-
-        # Lưu FAISS index riêng
-        index_path = os.path.join(doc_folder, f"{doc_name}_faiss.index")
-        dim = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dim)
-        index.add(embeddings.astype(np.float32))
-        faiss.write_index(index, index_path)
+        self.pending_documents.append(data)
+        self.ingestion_manifest.record(
+            doc_path, STATUS_PENDING, chunk_count=len(chunks), embedding_model=self.embedding_model
+        )
+        if commit:
+            self.commit()
+        elif len(self.pending_documents) >= settings.SEGMENT_BATCH_DOCUMENTS:
+            self.flush_segment()
 
-        # Cập nhật FAISS chung
-        if os.path.exists(self.all_faiss_path):
-            index_all = faiss.read_index(self.all_faiss_path)
-        else:
-            index_all = faiss.IndexFlatL2(dim)
-        index_all.add(embeddings.astype(np.float32))
-        faiss.write_index(index_all, self.all_faiss_path)
-
-        # Cập nhật pickle chung
-        if os.path.exists(self.all_pickle_path):
-            with open(self.all_pickle_path, 'rb') as f:
-                all_data = pickle.load(f)
-        else:
-            all_data = []
-        all_data.append(data)
-        with open(self.all_pickle_path, 'wb') as f:
-            pickle.dump(all_data, f)
-
-        logger.info(f"Đã lưu embeddings: {pickle_path}")
-        logger.info(f"Đã lưu FAISS index: {index_path}")
+        logger.info(f"Đã lưu embeddings {doc_name}: {len(chunks)} chunks")
 
         return {
-            "pickle_path": pickle_path,
-            "faiss_path": index_path,
+            "segments_dir": self.segments_dir,
             "all_faiss_path": self.all_faiss_path,
             "all_pickle_path": self.all_pickle_path
         }
 
+    def flush_segment(self) -> Optional[str]:
+        """Ghi các tài liệu đang chờ thành một segment"""
+        if not self.pending_documents:
+            return None
+        name = self.segment_store.append(self.pending_documents)
+        if name is not None:
+            self.ingestion_manifest.mark_segment([doc['doc_path'] for doc in self.pending_documents], name)
+        self.pending_documents = []
+        return name
+
+    def commit(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Đưa các segment mới vào index chung
+
+        Chỉ đọc phần đuôi chưa được index (FAISS / BM25 / citation cùng bắt đầu từ ntotal của FAISS),
+        build lại toàn bộ khi chưa có index hoặc index lệch với segment store.
+
+        Index chung được ghi lại nguyên file -> force=False (upload từng file) chỉ ghi khi phần chưa index
+        >= SEGMENT_INDEX_MIN_FRACTION index hiện có: chi phí O(N) chia đều cho nhiều lần upload, phần đuôi
+        chưa index được RAG service thêm vào index trong RAM lúc load. Ingest hàng loạt dùng force=True
+        """
+        self.flush_segment()
+        store = self.segment_store
+        with store.merges_paused(), store.snapshot():
+            result = self._update_shared_index(store, force)
+
+        store.merge_in_background()
+        store.remove_orphans()
+        return result
+
+    def _update_shared_index(self, store: SegmentStore, force: bool) -> Dict[str, Any]:
+        """commit(): cập nhật FAISS / BM25 / citation (trong snapshot của segment store)"""
+        n_total = store.n_chunks
+        if not n_total:
+            return {"chunks": 0, "added": 0}
+
+        manifest = read_index_manifest(self.all_faiss_path) if os.path.exists(self.all_faiss_path) else None
+        if manifest and not force:
+            n_deferred = n_total - manifest["ntotal"]
+            if 0 <= n_deferred < settings.SEGMENT_INDEX_MIN_FRACTION * manifest["ntotal"]:
+                logger.info(f"📥 Commit: {n_deferred} chunks chưa vào index chung (RAG service thêm khi load)")
+                return {"chunks": n_total, "added": 0, "deferred": n_deferred}
+
+        index_all, spec, n_indexed = None, None, 0
+        if os.path.exists(self.all_faiss_path):
+            index_all, manifest = load_index(self.all_faiss_path)
+            spec = spec_from_manifest(manifest)
+            n_indexed = index_all.ntotal
+        new_documents = list(store.iter_documents(n_indexed))
+        if index_all is not None and (n_indexed > n_total or (new_documents and new_documents[0][0] != n_indexed)):
+            logger.warning(f"⚠️ Index chung có {n_indexed} vectors, segment store có {n_total} chunks - build lại")
+            index_all, n_indexed = None, 0
+            new_documents = list(store.iter_documents())
+
+        new_embeddings = store.read_embeddings(n_indexed)
+        if index_all is None:
+            # Build từ toàn bộ dữ liệu -> index cần train (IVF/PQ) cũng build được đúng loại
+            index_all, spec = build_index(new_embeddings, spec or IndexSpec.from_settings())
+            save_index(index_all, self.all_faiss_path, spec, vectors=new_embeddings)
+        elif len(new_embeddings):
+            index_all.add(new_embeddings)
+            save_index(index_all, self.all_faiss_path, spec)
+
+        # BM25 / citation: chỉ tokenize / phân tích chunk mới, đọc dữ liệu cũ khi phải build lại
+        def existing():
+            for offset, doc in store.iter_documents():
+                if offset >= n_indexed:
+                    return
+                yield doc
+
+        update_bm25_index(
+            self.output_dir, [chunk for _, doc in new_documents for chunk in doc['chunks']],
+            (chunk for doc in existing() for chunk in doc['chunks']), n_indexed,
+            k1=settings.BM25_K1, b=settings.BM25_B
+        )
+        update_citation_index(
+            self.output_dir, [(doc['pdf_name'], doc['chunks']) for _, doc in new_documents],
+            ((doc['pdf_name'], doc['chunks']) for doc in existing()), n_indexed
+        )
+
+        logger.info(f"✅ Commit: +{n_total - n_indexed} chunks, index chung {index_all.ntotal} vectors")
+        return {"chunks": n_total, "added": n_total - n_indexed}
+
+    def export_pickle(self):
+        """Xuất all_embeddings.pkl (toàn bộ dữ liệu) cho code cũ - chỉ sau khi ingest hàng loạt"""
+        store = self.segment_store
+        with store.snapshot():
+            tmp_path = f"{self.all_pickle_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(store.to_documents_data(), f)
+            os.replace(tmp_path, self.all_pickle_path)
+        logger.info(f"✅ Đã xuất {self.all_pickle_path}")
+
     def process_document(self, doc_path: str, chunk_size: int = 512, 
-                        overlap: int = 50) -> Optional[Dict[str, Any]]:
-        """Xử lý toàn bộ một document: extract -> clean -> chunk -> embed -> save"""
+                        overlap: int = 50, commit: bool = True) -> Optional[Dict[str, Any]]:
+        """Xử lý toàn bộ một document: extract -> clean -> chunk -> embed -> save (commit=False: chờ commit())"""
         try:
             logger.info(f"Bắt đầu xử lý document: {doc_path}")
+            self.ingestion_manifest.record(doc_path, STATUS_PROCESSING, embedding_model=self.embedding_model)
+            self.last_pdf_stats = None
             
             # 1. Trích xuất text
             raw_text = self.extract_text_from_document(doc_path)
             if not raw_text:
+                self.ingestion_manifest.record(doc_path, STATUS_ERROR, error="Không trích xuất được text")
                 return None
             
             # 2. Làm sạch text
@@ -324,21 +392,27 @@ class EmbeddingService:
             # 4. Tạo embeddings
             embeddings = self.create_embeddings(chunks)
             if embeddings is None:
+                self.ingestion_manifest.record(doc_path, STATUS_ERROR, error="Không tạo được embeddings")
                 return None
             
             # 5. Lưu vào FAISS
-            paths = self.save_embeddings_to_faiss(chunks, embeddings, doc_path)
+            paths = self.save_embeddings_to_faiss(chunks, embeddings, doc_path, commit=commit)
             
             return {
                 "doc_path": doc_path,
                 "num_chunks": len(chunks),
                 "embedding_shape": embeddings.shape,
+                "ocr": asdict(self.last_pdf_stats) if self.last_pdf_stats else None,
                 "paths": paths,
                 "status": "success"
             }
             
         except Exception as e:
             logger.error(f"Lỗi xử lý document {doc_path}: {e}")
+            try:
+                self.ingestion_manifest.record(doc_path, STATUS_ERROR, error=str(e))
+            except OSError:
+                pass
             return {
                 "doc_path": doc_path,
                 "status": "error",
@@ -346,21 +420,42 @@ class EmbeddingService:
             }
 
     def is_document_embedded(self, doc_path: str) -> bool:
-        """Kiểm tra xem file tài liệu đã được embedding hay chưa"""
-        if not os.path.exists(self.all_pickle_path):
-            return False
-        
+        """
+        Kiểm tra xem file tài liệu đã được embedding hay chưa (một lookup trong manifest ingestion)
+
+        File đổi tên nhưng nội dung không đổi vẫn tính là đã embedding (tra theo hash)
+        """
         doc_name = os.path.splitext(os.path.basename(doc_path))[0]
         
         try:
-            with open(self.all_pickle_path, 'rb') as f:
-                all_data = pickle.load(f)
-            existing_doc_names = {entry['pdf_name'] for entry in all_data}
-            return doc_name in existing_doc_names
+            if any(entry['pdf_name'] == doc_name for entry in self.pending_documents):
+                return True
+            if self.ingestion_manifest.is_embedded(doc_path, self.embedding_model):
+                return True
+            if self.ingestion_manifest.has_record(doc_path):
+                return False
+            # Tài liệu ingest trước khi có manifest: so tên trong manifest segment / pickle cũ (chỉ đọc)
+            return doc_name in self.legacy_document_names()
         except Exception as e:
             logger.error(f"Lỗi kiểm tra document embedded: {e}")
             return False
 
+    def legacy_document_names(self) -> set:
+        """
+        Tên tài liệu đã embedding theo segment store / all_embeddings.pkl (chưa import), đọc một lần
+
+        Chỉ đọc - endpoint liệt kê file không kích hoạt import pickle vào segment store
+        """
+        if self._legacy_document_names is None:
+            if SegmentStore.exists(self.segments_dir):
+                self._legacy_document_names = SegmentStore(self.segments_dir, writable=False).document_names()
+            elif os.path.exists(self.all_pickle_path):
+                with open(self.all_pickle_path, 'rb') as f:
+                    self._legacy_document_names = {doc.get('pdf_name') for doc in pickle.load(f)}
+            else:
+                self._legacy_document_names = set()
+        return self._legacy_document_names
+
     def get_all_document_files(self, root_folder: str) -> List[str]:
         """Quét đệ quy tất cả thư mục con để tìm các file tài liệu"""
         supported_extensions = ['.pdf', '.doc', '.docx', '.txt']
@@ -375,8 +470,13 @@ class EmbeddingService:
         return document_files
 
     def process_all_documents(self, input_folders: List[str], 
-                             force_rebuild: bool = False) -> Dict[str, Any]:
-        """Xử lý tất cả documents trong các folders"""
+                             force_rebuild: bool = False,
+                             use_pipeline: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Xử lý tất cả documents trong các folders
+
+        use_pipeline (mặc định INGEST_PIPELINE_ENABLED): extract / chunk / embed / ghi chạy song song theo stage
+        """
         try:
             all_document_files = []
             
@@ -391,25 +491,41 @@ class EmbeddingService:
             
             logger.info(f"Tổng cộng {len(all_document_files)} files để xử lý")
             
-            # Xử lý từng file
+            # Chọn file cần xử lý (bỏ qua file đã embedding / trùng tên trong lần chạy này)
             results = []
             processed_count = 0
             skipped_count = 0
             error_count = 0
+            to_process, seen_names = [], set()
             
             for doc_path in all_document_files:
-                if not force_rebuild and self.is_document_embedded(doc_path):
+                doc_name = os.path.splitext(os.path.basename(doc_path))[0]
+                if doc_name in seen_names or (not force_rebuild and self.is_document_embedded(doc_path)):
                     logger.info(f"File đã được embedding, bỏ qua: {os.path.basename(doc_path)}")
                     skipped_count += 1
                     continue
-                
-                result = self.process_document(doc_path)
-                if result:
-                    if result.get("status") == "success":
-                        processed_count += 1
-                    else:
-                        error_count += 1
-                    results.append(result)
+                seen_names.add(doc_name)
+                to_process.append(doc_path)
+
+            pipeline_summary = None
+            use_pipeline = settings.INGEST_PIPELINE_ENABLED if use_pipeline is None else use_pipeline
+            if use_pipeline and len(to_process) > 1:
+                from app.services.ingestion_pipeline import IngestionPipeline
+
+                pipeline_result = IngestionPipeline(self).run(to_process)
+                results = pipeline_result["results"]
+                pipeline_summary = pipeline_result["summary"]
+            else:
+                # Gom thành segment theo batch, cập nhật index chung một lần ở cuối
+                for doc_path in to_process:
+                    result = self.process_document(doc_path, commit=False)
+                    if result:
+                        results.append(result)
+                self.commit(force=True)
+            if settings.SEGMENT_EXPORT_PICKLE:
+                self.export_pickle()
+            processed_count = sum(1 for r in results if r.get("status") == "success")
+            error_count = len(results) - processed_count
             
             return {
                 "total_files": len(all_document_files),
@@ -417,6 +533,7 @@ class EmbeddingService:
                 "skipped": skipped_count,
                 "errors": error_count,
                 "results": results,
+                "pipeline": pipeline_summary,
                 "all_faiss_path": self.all_faiss_path,
                 "all_pickle_path": self.all_pickle_path
             }
@@ -0,0 +1,133 @@
+# app/services/generation_profiles.py
+# Registry các profile generation (basic / enhancement / chat)
+# Mỗi request dùng một GenerationProfile bất biến -> GenerationConfig riêng,
+# không bao giờ sửa model.generation_config dùng chung
+
+import copy
+from dataclasses import dataclass, fields, replace
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Union
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """Tham số generation bất biến cho một request"""
+    name: str = "default"
+    max_new_tokens: int = 256
+    do_sample: bool = True
+    temperature: float = 0.5
+    top_p: float = 0.8
+    top_k: int = 40
+    repetition_penalty: float = 1.2
+    no_repeat_ngram_size: int = 3
+    num_beams: int = 1
+    early_stopping: bool = False
+    num_return_sequences: int = 1
+
+    def __post_init__(self):
+        if not 1 <= self.max_new_tokens <= 2048:
+            raise ValueError(f"[{self.name}] max_new_tokens phải trong khoảng 1-2048: {self.max_new_tokens}")
+        if self.do_sample and self.temperature <= 0:
+            raise ValueError(f"[{self.name}] temperature phải > 0 khi do_sample=True: {self.temperature}")
+        if not 0 < self.top_p <= 1:
+            raise ValueError(f"[{self.name}] top_p phải trong khoảng (0, 1]: {self.top_p}")
+        if self.top_k < 0:
+            raise ValueError(f"[{self.name}] top_k không được âm: {self.top_k}")
+        if self.repetition_penalty <= 0:
+            raise ValueError(f"[{self.name}] repetition_penalty phải > 0: {self.repetition_penalty}")
+        if self.no_repeat_ngram_size < 0:
+            raise ValueError(f"[{self.name}] no_repeat_ngram_size không được âm: {self.no_repeat_ngram_size}")
+        if self.num_beams < 1:
+            raise ValueError(f"[{self.name}] num_beams phải >= 1: {self.num_beams}")
+        if self.early_stopping and self.num_beams == 1:
+            raise ValueError(f"[{self.name}] early_stopping chỉ dùng được với num_beams > 1")
+        if self.num_return_sequences != 1:
+            raise ValueError(f"[{self.name}] chỉ hỗ trợ num_return_sequences = 1")
+
+    @property
+    def uses_beam_search(self) -> bool:
+        return self.num_beams > 1
+
+    def with_overrides(self, **overrides) -> "GenerationProfile":
+        """Tạo profile mới với một số tham số thay đổi (được validate lại)"""
+        unknown = set(overrides) - PROFILE_FIELDS - {"name"}
+        if unknown:
+            raise ValueError(f"Tham số generation không hợp lệ: {sorted(unknown)}")
+        return replace(self, **overrides)
+
+    def generation_kwargs(self) -> Dict[str, Any]:
+        """Tham số truyền vào GenerationConfig"""
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.name != "name"}
+
+    def to_generation_config(self, base_config):
+        """Tạo GenerationConfig mới từ config gốc của model (không sửa base_config)"""
+        config = copy.deepcopy(base_config)
+        config.update(**self.generation_kwargs())
+        return config
+
+PROFILE_FIELDS = {f.name for f in fields(GenerationProfile)} - {"name"}
+
+# Registry - giá trị giữ nguyên như các cấu hình trước đây trong LLMService / RAGServiceUnified
+GENERATION_PROFILES: Mapping[str, GenerationProfile] = MappingProxyType({
+    # Mặc định của LLMService - tối ưu cho tiếng Việt
+    "default": GenerationProfile(name="default"),
+    # Stage 1: câu trả lời cơ bản từ RAG
+    "basic": GenerationProfile(
+        name="basic",
+        max_new_tokens=200,
+        temperature=0.6,
+        top_p=0.9,
+        top_k=50,
+        repetition_penalty=1.1
+    ),
+    # Stage 2 / single-pass: tập trung vào chất lượng, giảm lỗi chính tả và lặp từ
+    "enhancement": GenerationProfile(
+        name="enhancement",
+        max_new_tokens=300,
+        temperature=0.4,
+        top_p=0.75,
+        top_k=30,
+        repetition_penalty=1.25,
+        no_repeat_ngram_size=4
+    ),
+    # Chat có lịch sử: beam search, không sampling
+    "chat": GenerationProfile(
+        name="chat",
+        max_new_tokens=512,
+        do_sample=False,
+        num_beams=3,
+        early_stopping=True,
+        repetition_penalty=1.2,
+        no_repeat_ngram_size=3
+    ),
+})
+
+def get_generation_profile(name: str, **overrides) -> GenerationProfile:
+    """Lấy profile theo tên (có thể override một số tham số)"""
+    if name not in GENERATION_PROFILES:
+        raise ValueError(f"Generation profile không tồn tại: {name} (có: {sorted(GENERATION_PROFILES)})")
+    profile = GENERATION_PROFILES[name]
+    return profile.with_overrides(**overrides) if overrides else profile
+
+def resolve_generation_profile(generation_config: Union[None, str, Dict, GenerationProfile] = None,
+                               max_new_tokens: Optional[int] = None) -> GenerationProfile:
+    """
+    Chuẩn hóa tham số generation của caller thành GenerationProfile
+
+    - None: profile 'default' với max_new_tokens của caller
+    - str: tên profile trong registry
+    - dict: override trên profile 'default' (tương thích với API dict cũ)
+    - GenerationProfile: dùng nguyên
+    """
+    if isinstance(generation_config, GenerationProfile):
+        return generation_config
+    if isinstance(generation_config, str):
+        return get_generation_profile(generation_config)
+
+    base = get_generation_profile("default")
+    if max_new_tokens is not None:
+        base = base.with_overrides(max_new_tokens=max_new_tokens)
+    if generation_config:
+        overrides = dict(generation_config)
+        overrides.setdefault("name", "custom")
+        base = base.with_overrides(**overrides)
+    return base
@@ -0,0 +1,490 @@
+# app/services/generation_scheduler.py
+# Continuous batching cho LLMService
+# Gom các request generate đồng thời vào một vòng decode chung:
+# sequence mới được prefill rồi nhập batch tại ranh giới token, sequence xong được tách ra ngay
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+from app.core.config import settings
+from app.core.metrics import get_metrics_registry, DEFAULT_LATENCY_BUCKETS_MS, DEFAULT_SIZE_BUCKETS
+from app.services.generation_profiles import GenerationProfile
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class _Sequence:
+    """Trạng thái của một request trong scheduler"""
+    prompt_ids: List[int]
+    params: GenerationProfile
+    future: Future
+    streamer: Any = None
+    stop_event: Optional[threading.Event] = None
+    prefix: Any = None  # PrefixEntry: KV cache của system prompt đã prefill sẵn
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    generated_ids: List[int] = field(default_factory=list)
+
+    @property
+    def all_ids(self) -> List[int]:
+        return self.prompt_ids + self.generated_ids
+
+class GenerationScheduler:
+    """
+    Scheduler continuous batching chạy trên một thread riêng
+
+    - submit() đưa request vào queue, trả về concurrent.futures.Future
+    - Mỗi vòng lặp: nhận request mới (tối đa max_batch_size), prefill và ghép KV cache vào batch
+      (left padding), decode 1 token cho toàn batch, tách các sequence đã xong
+    """
+
+    def __init__(self, llm_service, max_batch_size: Optional[int] = None):
+        self.llm_service = llm_service
+        self.max_batch_size = max_batch_size or settings.GENERATION_BATCH_MAX_SIZE
+
+        self._queue: "queue.Queue[_Sequence]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._running = False
+
+        # Trạng thái batch (chỉ truy cập từ thread scheduler)
+        self._active: List[_Sequence] = []
+        self._past_key_values = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._stop_ids: Optional[set] = None
+
+        # Thống kê
+        self._total_requests = 0
+        self._total_generated_tokens = 0
+        self._busy_seconds = 0.0
+        self._recent_tokens: deque = deque()  # (timestamp, số token) trong cửa sổ 30s
+
+        registry = get_metrics_registry()
+        self.queue_wait_histogram = registry.histogram(
+            "generation_queue_wait_ms", "Thời gian request chờ trước khi vào batch generate (ms)",
+            DEFAULT_LATENCY_BUCKETS_MS
+        )
+        self.batch_size_histogram = registry.histogram(
+            "generation_batch_size", "Số sequence trong mỗi bước decode", DEFAULT_SIZE_BUCKETS
+        )
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def submit(self,
+               prompt: str,
+               profile: GenerationProfile,
+               streamer=None,
+               stop_event: Optional[threading.Event] = None,
+               prefix=None) -> Future:
+        """
+        Đưa một prompt vào hàng đợi, Future trả về text đã sinh (chưa làm sạch)
+
+        prefix (PrefixEntry): KV cache của system prompt - chỉ prefill phần còn lại của prompt
+        """
+        if profile.uses_beam_search:
+            raise ValueError(f"Scheduler không hỗ trợ beam search (profile '{profile.name}')")
+        self._ensure_running()
+
+        tokenizer = self.llm_service.tokenizer
+        prompt_ids = list(tokenizer(prompt, truncation=True, max_length=2048)['input_ids'])
+        if prefix is not None and not (len(prompt_ids) > prefix.length and prompt_ids[:prefix.length] == prefix.prefix_ids):
+            prefix = None
+        sequence = _Sequence(
+            prompt_ids=prompt_ids,
+            params=profile,
+            future=Future(),
+            streamer=streamer,
+            stop_event=stop_event,
+            prefix=prefix
+        )
+        self._queue.put(sequence)
+        return sequence.future
+
+    def generate(self, prompt: str, profile: GenerationProfile,
+                 streamer=None, stop_event: Optional[threading.Event] = None, prefix=None) -> str:
+        """Blocking: submit và chờ kết quả (gọi từ thread pool 'generate')"""
+        return self.submit(prompt, profile, streamer, stop_event, prefix).result()
+
+    def shutdown(self):
+        """Dừng thread scheduler"""
+        with self._lock:
+            self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        logger.info("🛑 Đã dừng generation scheduler")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê throughput và queue"""
+        now = time.time()
+        recent = [(t, n) for t, n in list(self._recent_tokens) if now - t <= 30]
+        recent_tokens = sum(n for _, n in recent)
+        return {
+            "max_batch_size": self.max_batch_size,
+            "running": self._running,
+            "active_sequences": len(self._active),
+            "queue_size": self._queue.qsize(),
+            "total_requests": self._total_requests,
+            "total_generated_tokens": self._total_generated_tokens,
+            "busy_seconds": round(self._busy_seconds, 3),
+            "tokens_per_second": self._total_generated_tokens / self._busy_seconds if self._busy_seconds else 0.0,
+            "tokens_per_second_30s": recent_tokens / 30.0,
+            "queue_wait_ms": self.queue_wait_histogram.snapshot(),
+            "batch_size": self.batch_size_histogram.snapshot()
+        }
+
+    # ------------------------------------------------------------------
+    # Scheduler loop
+    # ------------------------------------------------------------------
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._running and self._thread is not None and self._thread.is_alive():
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._loop, name="generation-scheduler", daemon=True)
+            self._thread.start()
+            logger.info(f"🚀 Generation scheduler started (max batch size {self.max_batch_size})")
+
+    def _loop(self):
+        while self._running:
+            try:
+                self._admit_new_sequences()
+                if not self._active:
+                    continue
+
+                step_start = time.perf_counter()
+                with torch.no_grad():
+                    self._decode_step()
+                self._busy_seconds += time.perf_counter() - step_start
+
+            except Exception as e:
+                logger.error(f"❌ Lỗi trong generation scheduler: {e}")
+                self._fail_all(e)
+
+    def _admit_new_sequences(self):
+        """Nhận request mới vào batch (block khi batch rỗng)"""
+        new_sequences = []
+        slots = self.max_batch_size - len(self._active)
+
+        if not self._active:
+            try:
+                new_sequences.append(self._queue.get(timeout=0.5))
+                slots -= 1
+            except queue.Empty:
+                return
+
+        while slots > 0:
+            try:
+                new_sequences.append(self._queue.get_nowait())
+                slots -= 1
+            except queue.Empty:
+                break
+
+        # Bỏ các request đã bị hủy trong lúc chờ (client ngắt kết nối)
+        for sequence in [s for s in new_sequences if s.stop_event is not None and s.stop_event.is_set()]:
+            new_sequences.remove(sequence)
+            self._finish(sequence)
+
+        if not new_sequences:
+            return
+
+        now = time.perf_counter()
+        for sequence in new_sequences:
+            self.queue_wait_histogram.observe((now - sequence.enqueued_at) * 1000)
+            if sequence.streamer is not None:
+                # TextStreamer(skip_prompt=True) bỏ qua lần put đầu tiên là prompt
+                sequence.streamer.put(torch.tensor([sequence.prompt_ids]))
+        self._total_requests += len(new_sequences)
+
+        step_start = time.perf_counter()
+        try:
+            with torch.no_grad():
+                self._prefill(new_sequences)
+        except Exception as e:
+            # Prefill lỗi: chỉ báo lỗi cho các sequence mới, batch đang chạy không bị ảnh hưởng
+            logger.error(f"❌ Lỗi prefill {len(new_sequences)} sequence: {e}")
+            for sequence in new_sequences:
+                if sequence in self._active:
+                    continue
+                if sequence.streamer is not None:
+                    sequence.streamer.end()
+                if not sequence.future.done():
+                    sequence.future.set_exception(e)
+        self._busy_seconds += time.perf_counter() - step_start
+
+    def _device(self):
+        return self.llm_service._model_device()
+
+    def _prefill(self, sequences: List[_Sequence]):
+        """Prefill các sequence mới rồi ghép KV cache vào batch đang chạy"""
+        uncached = [s for s in sequences if s.prefix is None]
+        if uncached:
+            past, attention_mask, logits = self._prefill_batch(uncached)
+            self._join_batch(uncached, past, attention_mask, logits)
+
+        # Sequence có prefix cache: chỉ forward phần sau system prompt
+        for sequence in sequences:
+            if sequence.prefix is not None:
+                past, attention_mask, logits = self._prefill_from_prefix(sequence)
+                self._join_batch([sequence], past, attention_mask, logits)
+
+    def _prefill_batch(self, sequences: List[_Sequence]):
+        """Prefill toàn bộ prompt của nhiều sequence (left padding)"""
+        device = self._device()
+        pad_id = self.llm_service.tokenizer.pad_token_id or self.llm_service.tokenizer.eos_token_id
+        max_len = max(len(s.prompt_ids) for s in sequences)
+
+        input_ids = torch.full((len(sequences), max_len), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(sequences), max_len), dtype=torch.long)
+        for i, sequence in enumerate(sequences):
+            length = len(sequence.prompt_ids)
+            input_ids[i, max_len - length:] = torch.tensor(sequence.prompt_ids, dtype=torch.long)
+            attention_mask[i, max_len - length:] = 1
+        input_ids = input_ids.to(device)
+        attention_mask = attention_mask.to(device)
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        outputs = self.llm_service.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=True
+        )
+        return self._to_legacy_cache(outputs.past_key_values), attention_mask, outputs.logits[:, -1, :]
+
+    def _prefill_from_prefix(self, sequence: _Sequence):
+        """Prefill phần prompt sau system prompt, dùng past_key_values đã cache của prefix"""
+        device = self._device()
+        prefix_len = sequence.prefix.length
+        total_len = len(sequence.prompt_ids)
+
+        input_ids = torch.tensor([sequence.prompt_ids[prefix_len:]], dtype=torch.long, device=device)
+        attention_mask = torch.ones((1, total_len), dtype=torch.long, device=device)
+        position_ids = torch.arange(prefix_len, total_len, dtype=torch.long, device=device).unsqueeze(0)
+
+        # Forward tạo tensor KV mới (torch.cat), past của prefix cache không bị sửa
+        outputs = self.llm_service.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=sequence.prefix.past_key_values,
+            use_cache=True
+        )
+        return self._to_legacy_cache(outputs.past_key_values), attention_mask, outputs.logits[:, -1, :]
+
+    def _join_batch(self, sequences: List[_Sequence], past, attention_mask: torch.Tensor, logits: torch.Tensor):
+        """Ghép KV cache vừa prefill vào batch hiện tại và lấy token đầu tiên từ logits prefill"""
+        if self._active:
+            self._past_key_values, self._attention_mask = self._merge_batches(
+                self._past_key_values, self._attention_mask, past, attention_mask
+            )
+        else:
+            self._past_key_values, self._attention_mask = past, attention_mask
+        self._active.extend(sequences)
+
+        offset = len(self._active) - len(sequences)
+        finished = []
+        for i, sequence in enumerate(sequences):
+            token_id = self._sample(logits[i], sequence)
+            if self._append_token(sequence, token_id):
+                finished.append(offset + i)
+        self._remove_finished(finished)
+
+    def _decode_step(self):
+        """Decode 1 token cho toàn bộ batch"""
+        device = self._device()
+        self.batch_size_histogram.observe(len(self._active))
+
+        input_ids = torch.tensor([[s.generated_ids[-1]] for s in self._active], dtype=torch.long, device=device)
+        position_ids = self._attention_mask.sum(dim=-1, keepdim=True)
+        self._attention_mask = torch.cat(
+            [self._attention_mask, torch.ones((len(self._active), 1), dtype=self._attention_mask.dtype, device=device)],
+            dim=-1
+        )
+
+        outputs = self.llm_service.model(
+            input_ids=input_ids,
+            attention_mask=self._attention_mask,
+            position_ids=position_ids,
+            past_key_values=self._past_key_values,
+            use_cache=True
+        )
+        self._past_key_values = self._to_legacy_cache(outputs.past_key_values)
+        logits = outputs.logits[:, -1, :]
+
+        finished = []
+        for i, sequence in enumerate(self._active):
+            token_id = self._sample(logits[i], sequence)
+            if self._append_token(sequence, token_id):
+                finished.append(i)
+        self._remove_finished(finished)
+
+    # ------------------------------------------------------------------
+    # KV cache helpers
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _to_legacy_cache(past_key_values) -> Tuple:
+        if hasattr(past_key_values, 'to_legacy_cache'):
+            return past_key_values.to_legacy_cache()
+        return past_key_values
+
+    @staticmethod
+    def _left_pad(tensor: torch.Tensor, target_len: int, dim: int) -> torch.Tensor:
+        pad_len = target_len - tensor.shape[dim]
+        if pad_len <= 0:
+            return tensor
+        pad_shape = list(tensor.shape)
+        pad_shape[dim] = pad_len
+        return torch.cat([tensor.new_zeros(pad_shape), tensor], dim=dim)
+
+    def _merge_batches(self, past_a, mask_a, past_b, mask_b):
+        """Ghép 2 batch KV cache có độ dài khác nhau (left padding theo chiều seq)"""
+        target_len = max(mask_a.shape[1], mask_b.shape[1])
+        merged_past = tuple(
+            (
+                torch.cat([self._left_pad(k_a, target_len, 2), self._left_pad(k_b, target_len, 2)], dim=0),
+                torch.cat([self._left_pad(v_a, target_len, 2), self._left_pad(v_b, target_len, 2)], dim=0)
+            )
+            for (k_a, v_a), (k_b, v_b) in zip(past_a, past_b)
+        )
+        merged_mask = torch.cat([self._left_pad(mask_a, target_len, 1), self._left_pad(mask_b, target_len, 1)], dim=0)
+        return merged_past, merged_mask
+
+    def _remove_finished(self, finished: List[int]):
+        """Tách các sequence đã xong ra khỏi batch và cắt bớt padding thừa bên trái"""
+        if not finished:
+            return
+
+        for i in finished:
+            self._finish(self._active[i])
+
+        finished_set = set(finished)
+        keep = [i for i in range(len(self._active)) if i not in finished_set]
+        self._active = [self._active[i] for i in keep]
+        if not self._active:
+            self._past_key_values = None
+            self._attention_mask = None
+            return
+
+        index = torch.tensor(keep, dtype=torch.long, device=self._attention_mask.device)
+        mask = self._attention_mask.index_select(0, index)
+
+        # Cột đầu tiên còn token thật của ít nhất một sequence
+        start = int((mask.sum(dim=0) > 0).nonzero()[0])
+        self._attention_mask = mask[:, start:]
+        self._past_key_values = tuple(
+            (k.index_select(0, index.to(k.device))[:, :, start:, :],
+             v.index_select(0, index.to(v.device))[:, :, start:, :])
+            for k, v in self._past_key_values
+        )
+
+    # ------------------------------------------------------------------
+    # Sampling / stop conditions
+    # ------------------------------------------------------------------
+
+    def _sample(self, logits: torch.Tensor, sequence: _Sequence) -> int:
+        """Chọn token tiếp theo với tham số sampling của sequence"""
+        params = sequence.params
+        logits = logits.float().clone()
+        history = sequence.all_ids
+
+        # Repetition penalty
+        if params.repetition_penalty and params.repetition_penalty != 1.0:
+            seen = torch.tensor(sorted(set(history)), dtype=torch.long, device=logits.device)
+            scores = logits.index_select(0, seen)
+            scores = torch.where(scores < 0, scores * params.repetition_penalty, scores / params.repetition_penalty)
+            logits.index_copy_(0, seen, scores)
+
+        # No repeat n-gram
+        n = params.no_repeat_ngram_size
+        if n and len(history) >= n:
+            prefix = tuple(history[-(n - 1):]) if n > 1 else tuple()
+            banned = [
+                history[i + n - 1]
+                for i in range(len(history) - n + 1)
+                if tuple(history[i:i + n - 1]) == prefix
+            ]
+            if banned:
+                logits[banned] = -float('inf')
+
+        if not params.do_sample:
+            return int(torch.argmax(logits))
+
+        logits = logits / max(params.temperature, 1e-5)
+
+        if params.top_k and params.top_k > 0:
+            top_k = min(params.top_k, logits.shape[-1])
+            threshold = torch.topk(logits, top_k).values[-1]
+            logits[logits < threshold] = -float('inf')
+
+        if params.top_p and params.top_p < 1.0:
+            sorted_logits, sorted_indices = torch.sort(logits, descending=True)
+            cumulative = torch.softmax(sorted_logits, dim=-1).cumsum(dim=-1)
+            remove = cumulative > params.top_p
+            remove[1:] = remove[:-1].clone()
+            remove[0] = False
+            logits[sorted_indices[remove]] = -float('inf')
+
+        probs = torch.softmax(logits, dim=-1)
+        return int(torch.multinomial(probs, num_samples=1))
+
+    def _stop_token_ids(self) -> set:
+        """EOS và token kết thúc lượt ChatML (<|im_end|>) nếu có trong vocab"""
+        if self._stop_ids is None:
+            tokenizer = self.llm_service.tokenizer
+            stop_ids = {tokenizer.eos_token_id}
+            im_end_id = tokenizer.convert_tokens_to_ids("<|im_end|>")
+            if im_end_id is not None and im_end_id != tokenizer.unk_token_id:
+                stop_ids.add(im_end_id)
+            self._stop_ids = stop_ids
+        return self._stop_ids
+
+    def _append_token(self, sequence: _Sequence, token_id: int) -> bool:
+        """Thêm token vào sequence, trả về True nếu sequence đã xong"""
+        if token_id in self._stop_token_ids():
+            return True
+
+        sequence.generated_ids.append(token_id)
+        self._total_generated_tokens += 1
+        self._recent_tokens.append((time.time(), 1))
+        while self._recent_tokens and time.time() - self._recent_tokens[0][0] > 30:
+            self._recent_tokens.popleft()
+
+        if sequence.streamer is not None:
+            sequence.streamer.put(torch.tensor([token_id]))
+
+        if len(sequence.generated_ids) >= sequence.params.max_new_tokens:
+            return True
+        if sequence.stop_event is not None and sequence.stop_event.is_set():
+            return True
+        return False
+
+    def _finish(self, sequence: _Sequence):
+        """Trả kết quả cho caller"""
+        if sequence.streamer is not None:
+            sequence.streamer.end()
+        if not sequence.future.done():
+            text = self.llm_service.tokenizer.decode(sequence.generated_ids, skip_special_tokens=True)
+            sequence.future.set_result(text)
+
+    def _fail_all(self, error: Exception):
+        """Báo lỗi cho toàn bộ sequence đang chạy và reset batch"""
+        for sequence in self._active:
+            if sequence.streamer is not None:
+                sequence.streamer.end()
+            if not sequence.future.done():
+                sequence.future.set_exception(error)
+        self._active = []
+        self._past_key_values = None
+        self._attention_mask = None
@@ -0,0 +1,270 @@
+# app/services/index_factory.py
+# Factory cho FAISS index: Flat, IVF-Flat, IVF-PQ, HNSW, SQ8 / IVF-SQ8 / PQ (nén, có re-rank float)
+# Loại index chọn lúc build (settings FAISS_INDEX_*) và được ghi vào manifest cạnh file index,
+# lúc load tham số search (nprobe / efSearch) được áp dụng lại từ manifest
+
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+from app.services.quantized_index import (
+    RefinedIndex, open_float_vectors, save_float_vectors, unwrap_index, vectors_path
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "ivf_sq8", "pq")
+COMPRESSED_TYPES = ("ivf_pq", "sq8", "ivf_sq8", "pq")
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+
+# FAISS cần khoảng 39 vector / centroid để train k-means ổn định
+MIN_POINTS_PER_CENTROID = 39
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """Cấu hình một FAISS index"""
+    index_type: str = "flat"
+    metric: str = "l2"
+    nlist: int = 1024
+    nprobe: int = 16
+    pq_m: int = 64
+    pq_nbits: int = 8
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    rerank_factor: int = 4  # Index nén: số ứng viên = top_k * rerank_factor (0 = không re-rank)
+
+    def __post_init__(self):
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Loại index không hợp lệ: {self.index_type} (có: {INDEX_TYPES})")
+        if self.metric not in METRICS:
+            raise ValueError(f"Metric không hợp lệ: {self.metric} (có: {sorted(METRICS)})")
+
+    @classmethod
+    def from_settings(cls, **overrides) -> "IndexSpec":
+        """IndexSpec theo cấu hình FAISS_INDEX_* (có thể override từng tham số)"""
+        spec = cls(
+            index_type=settings.FAISS_INDEX_TYPE,
+            metric=settings.FAISS_INDEX_METRIC,
+            nlist=settings.FAISS_IVF_NLIST,
+            nprobe=settings.FAISS_IVF_NPROBE,
+            pq_m=settings.FAISS_PQ_M,
+            pq_nbits=settings.FAISS_PQ_NBITS,
+            hnsw_m=settings.FAISS_HNSW_M,
+            ef_construction=settings.FAISS_HNSW_EF_CONSTRUCTION,
+            ef_search=settings.FAISS_HNSW_EF_SEARCH,
+            rerank_factor=settings.FAISS_RERANK_FACTOR
+        )
+        return replace(spec, **overrides) if overrides else spec
+
+    @property
+    def is_ivf(self) -> bool:
+        return self.index_type.startswith("ivf")
+
+    @property
+    def is_compressed(self) -> bool:
+        return self.index_type in COMPRESSED_TYPES
+
+    @property
+    def requires_training(self) -> bool:
+        return self.index_type not in ("flat", "hnsw")
+
+    @property
+    def metric_type(self) -> int:
+        return METRICS[self.metric]
+
+    def factory_string(self, nlist: Optional[int] = None) -> str:
+        """Chuỗi cho faiss.index_factory"""
+        nlist = nlist or self.nlist
+        if self.index_type == "ivf_flat":
+            return f"IVF{nlist},Flat"
+        if self.index_type == "ivf_pq":
+            return f"IVF{nlist},PQ{self.pq_m}x{self.pq_nbits}"
+        if self.index_type == "ivf_sq8":
+            return f"IVF{nlist},SQ8"
+        if self.index_type == "hnsw":
+            return f"HNSW{self.hnsw_m},Flat"
+        if self.index_type == "sq8":
+            return "SQ8"
+        if self.index_type == "pq":
+            return f"PQ{self.pq_m}x{self.pq_nbits}"
+        return "Flat"
+
+    def search_params(self) -> Dict[str, int]:
+        """Tham số search áp dụng sau khi load"""
+        if self.is_ivf:
+            return {"nprobe": self.nprobe}
+        if self.index_type == "hnsw":
+            return {"efSearch": self.ef_search}
+        return {}
+
+def effective_nlist(spec: IndexSpec, n_vectors: int) -> int:
+    """Giảm nlist khi không đủ vector để train (tối thiểu 1)"""
+    return max(1, min(spec.nlist, n_vectors // MIN_POINTS_PER_CENTROID))
+
+def create_empty_index(dimension: int, spec: Optional[IndexSpec] = None) -> Tuple[Any, IndexSpec]:
+    """
+    Index rỗng để add dần (VectorStore / EmbeddingService)
+
+    IVF / SQ / PQ cần train trước khi add -> chưa có dữ liệu thì dùng Flat, build lại bằng faiss_index_tool.py build
+    """
+    spec = spec or IndexSpec.from_settings()
+    if spec.requires_training:
+        logger.warning(f"⚠️ {spec.index_type} cần dữ liệu để train, tạo Flat trước - build lại bằng faiss_index_tool.py")
+        spec = replace(spec, index_type="flat")
+    index = faiss.index_factory(dimension, spec.factory_string(), spec.metric_type)
+    if spec.index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = spec.ef_construction
+    apply_search_params(index, spec.search_params())
+    return index, spec
+
+def build_index(embeddings: np.ndarray, spec: Optional[IndexSpec] = None) -> Tuple[Any, IndexSpec]:
+    """Build index từ toàn bộ embeddings (train nếu cần), trả về (index, spec thực tế)"""
+    spec = spec or IndexSpec.from_settings()
+    vectors = np.ascontiguousarray(embeddings, dtype='float32')
+    n_vectors, dimension = vectors.shape
+
+    if spec.is_ivf:
+        nlist = effective_nlist(spec, n_vectors)
+        if nlist != spec.nlist:
+            logger.warning(f"⚠️ Chỉ có {n_vectors} vectors, giảm nlist {spec.nlist} -> {nlist}")
+        spec = replace(spec, nlist=nlist, nprobe=min(spec.nprobe, nlist))
+
+    index = faiss.index_factory(dimension, spec.factory_string(), spec.metric_type)
+    if spec.index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = spec.ef_construction
+    if not index.is_trained:
+        logger.info(f"🔄 Training {spec.factory_string()} trên {n_vectors} vectors...")
+        index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index, spec.search_params())
+
+    logger.info(f"✅ Đã build index {spec.factory_string()} ({index.ntotal} vectors)")
+    return index, spec
+
+def apply_search_params(index, params: Dict[str, int]):
+    """Đặt nprobe / efSearch cho index (bỏ qua tham số không áp dụng được)"""
+    parameter_space = faiss.ParameterSpace()
+    for name, value in params.items():
+        try:
+            parameter_space.set_index_parameter(unwrap_index(index), name, value)
+        except RuntimeError as e:
+            logger.warning(f"⚠️ Không đặt được {name}={value}: {e}")
+
+# ----------------------------------------------------------------------
+# Manifest
+# ----------------------------------------------------------------------
+
+def manifest_path(index_path: str) -> str:
+    return os.path.splitext(index_path)[0] + ".manifest.json"
+
+def write_index_manifest(index_path: str, index, spec: IndexSpec, extra: Optional[Dict[str, Any]] = None):
+    """Ghi loại index và tham số build/search cạnh file index"""
+    manifest = {
+        "index_type": spec.index_type,
+        "factory_string": spec.factory_string(),
+        "metric": spec.metric,
+        "dimension": index.d,
+        "ntotal": index.ntotal,
+        "spec": asdict(spec),
+        "search_params": spec.search_params(),
+        "faiss_version": getattr(faiss, "__version__", "unknown"),
+        "built_at": datetime.now().isoformat(),
+        **(extra or {})
+    }
+    if isinstance(index, RefinedIndex) and index.path:
+        manifest["rerank_vectors"] = os.path.basename(index.path)
+    with open(manifest_path(index_path), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+def read_index_manifest(index_path: str) -> Optional[Dict[str, Any]]:
+    """Đọc manifest (None nếu index cũ chưa có manifest)"""
+    path = manifest_path(index_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def spec_from_manifest(manifest: Optional[Dict[str, Any]]) -> IndexSpec:
+    """IndexSpec đã dùng để build index (index cũ không có manifest là IndexFlatL2)"""
+    if not manifest:
+        return IndexSpec.from_settings(index_type="flat", metric="l2")
+    return IndexSpec(**manifest["spec"])
+
+def save_index(index,
+               index_path: str,
+               spec: IndexSpec,
+               extra: Optional[Dict[str, Any]] = None,
+               vectors: Optional[np.ndarray] = None):
+    """
+    Ghi index + manifest
+
+    Index nén có re-rank: vectors (float32) được ghi ra <index>.vectors.npy lần đầu build,
+    RefinedIndex đã load thì tự ghi nối vào file đuôi khi add
+    """
+    extra = dict(extra or {})
+    if vectors is not None and spec.is_compressed and spec.rerank_factor > 0:
+        save_float_vectors(vectors_path(index_path), vectors)
+        extra["rerank_vectors"] = os.path.basename(vectors_path(index_path))
+
+    faiss.write_index(unwrap_index(index), index_path)
+    write_index_manifest(index_path, index, spec, extra)
+
+def read_index_mmap(index_path: str):
+    """
+    Đọc index bằng mmap (read-only) - các worker dùng chung page cache thay vì mỗi worker một bản trong RAM
+
+    FAISS hỗ trợ mmap cho inverted lists của IVF, và cho IndexFlatCodes (Flat / SQ / PQ) từ bản có IO_FLAG_MMAP_IFC
+    """
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    try:
+        return faiss.read_index(index_path, flags)
+    except RuntimeError as e:
+        logger.warning(f"⚠️ Không mmap được {index_path} ({e}), đọc toàn bộ vào RAM")
+        return faiss.read_index(index_path)
+
+def is_mmapped_ivf(index) -> bool:
+    """Index IVF có inverted lists thật sự đọc qua mmap (OnDiskInvertedLists) - search chỉ chạm nprobe list"""
+    try:
+        ivf = faiss.extract_index_ivf(unwrap_index(index))
+    except RuntimeError:
+        return False  # Flat / HNSW: IO_FLAG_MMAP không có tác dụng (trừ IO_FLAG_MMAP_IFC), index đọc vào RAM
+    return isinstance(faiss.downcast_InvertedLists(ivf.invlists), faiss.OnDiskInvertedLists)
+
+def load_index(index_path: str, mmap: bool = False) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """
+    Đọc index và áp dụng tham số search từ manifest
+
+    - mmap=True: index chỉ đọc, dùng chung page cache giữa các process (không add được)
+    - Index IVF được bật direct map để reconstruct được vector (category sub-index, tuning)
+    - Index nén có file vector float -> bọc trong RefinedIndex (re-rank chính xác, vector đọc qua mmap)
+    """
+    index = read_index_mmap(index_path) if mmap else faiss.read_index(index_path)
+    manifest = read_index_manifest(index_path)
+
+    if manifest:
+        apply_search_params(index, manifest.get("search_params", {}))
+        logger.info(f"📋 Index manifest: {manifest['factory_string']} ({manifest['ntotal']} vectors, {manifest.get('search_params')})")
+
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        ivf.make_direct_map()
+    except RuntimeError:
+        pass  # Không phải IVF
+
+    if manifest and manifest.get("rerank_vectors"):
+        spec = spec_from_manifest(manifest)
+        path = os.path.join(os.path.dirname(index_path), manifest["rerank_vectors"])
+        if spec.rerank_factor > 0 and os.path.exists(path):
+            index = RefinedIndex(index, open_float_vectors(path, index.ntotal), spec.rerank_factor, path=path)
+        else:
+            logger.warning(f"⚠️ Không re-rank được (thiếu {path} hoặc rerank_factor=0), dùng khoảng cách trên mã nén")
+
+    return index, manifest
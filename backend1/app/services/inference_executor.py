@@ -0,0 +1,124 @@
+# app/services/inference_executor.py
+# Executor quản lý các thread pool riêng cho encode / search / generate
+# Giúp chạy các tác vụ nặng của model ngoài event loop của uvicorn
+
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class InferenceExecutor:
+    """Quản lý thread pool cho từng stage inference và trả về awaitable"""
+
+    STAGES = ("encode", "search", "generate")
+
+    def __init__(self,
+                 encode_workers: Optional[int] = None,
+                 search_workers: Optional[int] = None,
+                 generate_workers: Optional[int] = None):
+        self.workers = {
+            "encode": encode_workers or settings.INFERENCE_ENCODE_WORKERS,
+            "search": search_workers or settings.INFERENCE_SEARCH_WORKERS,
+            "generate": generate_workers or settings.INFERENCE_GENERATE_WORKERS,
+        }
+        # Với generation scheduler, thread 'generate' chỉ chờ kết quả - cần đủ thread để lấp đầy batch
+        if settings.GENERATION_SCHEDULER_ENABLED and not generate_workers:
+            self.workers["generate"] = max(self.workers["generate"], settings.GENERATION_BATCH_MAX_SIZE)
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        self._lock = threading.Lock()
+
+        # Thống kê đơn giản - chỉ được cập nhật trên event loop
+        self._inflight = {stage: 0 for stage in self.STAGES}
+        self._completed = {stage: 0 for stage in self.STAGES}
+        self._failed = {stage: 0 for stage in self.STAGES}
+
+    def _get_pool(self, stage: str) -> ThreadPoolExecutor:
+        """Lấy (hoặc tạo lazy) thread pool cho một stage"""
+        if stage not in self.STAGES:
+            raise ValueError(f"Stage không hợp lệ: {stage}")
+
+        pool = self._pools.get(stage)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(stage)
+                if pool is None:
+                    pool = ThreadPoolExecutor(
+                        max_workers=self.workers[stage],
+                        thread_name_prefix=f"inference-{stage}"
+                    )
+                    self._pools[stage] = pool
+                    logger.info(f"🧵 Tạo thread pool '{stage}' với {self.workers[stage]} workers")
+        return pool
+
+    async def run(self, stage: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Chạy func trong thread pool của stage và await kết quả"""
+        pool = self._get_pool(stage)
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+
+        self._inflight[stage] += 1
+        try:
+            result = await loop.run_in_executor(pool, call)
+            self._completed[stage] += 1
+            return result
+        except Exception:
+            self._failed[stage] += 1
+            raise
+        finally:
+            self._inflight[stage] -= 1
+
+    async def run_encode(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Chạy tác vụ encode (embedding model)"""
+        return await self.run("encode", func, *args, **kwargs)
+
+    async def run_search(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Chạy tác vụ search (FAISS)"""
+        return await self.run("search", func, *args, **kwargs)
+
+    async def run_generate(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Chạy tác vụ generate (LLM)"""
+        return await self.run("generate", func, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True):
+        """Dừng tất cả thread pool"""
+        with self._lock:
+            for stage, pool in self._pools.items():
+                pool.shutdown(wait=wait)
+                logger.info(f"🛑 Đã dừng thread pool '{stage}'")
+            self._pools = {}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lấy thống kê của executor"""
+        return {
+            stage: {
+                "workers": self.workers[stage],
+                "started": stage in self._pools,
+                "inflight": self._inflight[stage],
+                "completed": self._completed[stage],
+                "failed": self._failed[stage]
+            }
+            for stage in self.STAGES
+        }
+
+# Global instance
+_inference_executor = None
+
+def get_inference_executor() -> InferenceExecutor:
+    """Get InferenceExecutor instance"""
+    global _inference_executor
+    if _inference_executor is None:
+        _inference_executor = InferenceExecutor()
+    return _inference_executor
+
+def shutdown_inference_executor(wait: bool = True):
+    """Dừng InferenceExecutor global (gọi khi app shutdown)"""
+    global _inference_executor
+    if _inference_executor is not None:
+        _inference_executor.shutdown(wait=wait)
+        _inference_executor = None
@@ -0,0 +1,234 @@
+# app/services/ingestion_manifest.py
+# Manifest ingestion (SQLite, data/ingestion.sqlite3): trạng thái từng file tài liệu theo đường dẫn + hash nội dung
+# "File đã embedding chưa?" = một lookup có index, không unpickle all_embeddings.pkl
+#
+# Bảng documents (khóa: đường dẫn tuyệt đối, index: content_hash)
+#   content_hash     sha256 nội dung file - file đổi tên / di chuyển vẫn nhận ra là đã embedding
+#   size, mtime_ns   stat lúc hash - stat không đổi thì dùng lại hash, không đọc lại file
+#   doc_name, chunk_count, segment, embedding_model
+#   status           processing | pending (chờ ghi segment) | embedded | error
+#
+# Bảng file_hashes: (path, size, mtime_ns) -> content_hash của mọi file đã hash (kể cả file chưa embedding),
+# lookup lặp lại (endpoint liệt kê file) không đọc lại file có stat không đổi
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "ingestion.sqlite3"
+
+STATUS_PROCESSING = "processing"
+STATUS_PENDING = "pending"
+STATUS_EMBEDDED = "embedded"
+STATUS_ERROR = "error"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    doc_name TEXT NOT NULL,
+    chunk_count INTEGER,
+    segment TEXT,
+    embedding_model TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents (content_hash, status);
+CREATE INDEX IF NOT EXISTS idx_documents_name ON documents (doc_name);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """sha256 nội dung file (đọc theo block)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def document_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+class IngestionManifest:
+    """Trạng thái ingestion của file tài liệu, lookup theo đường dẫn rồi theo hash nội dung"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")  # Đọc (list files) không chặn ghi (ingestion)
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Lookup
+    # ------------------------------------------------------------------
+
+    def content_hash(self, path: str) -> str:
+        """Hash nội dung, dùng lại hash đã lưu nếu size + mtime của file không đổi"""
+        path = os.path.abspath(path)
+        with self._connect() as conn:
+            return self._cached_hash(conn, path, os.stat(path))
+
+    @staticmethod
+    def _cached_hash(conn: sqlite3.Connection, path: str, stat: os.stat_result) -> str:
+        """Hash từ documents / file_hashes nếu stat khớp, không thì đọc file và lưu vào file_hashes"""
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        row = conn.execute(
+            "SELECT content_hash FROM documents WHERE path = ? AND size = ? AND mtime_ns = ?", key
+        ).fetchone() or conn.execute(
+            "SELECT content_hash FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?", key
+        ).fetchone()
+        if row:
+            return row["content_hash"]
+        content_hash = file_hash(path)
+        conn.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)", (*key, content_hash))
+        return content_hash
+
+    def lookup(self, path: str, embedding_model: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Bản ghi embedded của file: theo đường dẫn (stat khớp), không có thì theo hash nội dung
+
+        embedding_model: chỉ nhận bản ghi embedding bằng model đó. File không tồn tại -> chỉ tra theo đường dẫn
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM documents WHERE path = ?", (path,)).fetchone()
+            if row is not None and (stat is None or (row["size"], row["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns)):
+                return self._accept(row, embedding_model)
+            if stat is None:
+                return None
+
+            content_hash = self._cached_hash(conn, path, stat)
+            query = "SELECT * FROM documents WHERE content_hash = ? AND status = ?"
+            params = [content_hash, STATUS_EMBEDDED]
+            if embedding_model:
+                query += " AND embedding_model = ?"
+                params.append(embedding_model)
+            match = conn.execute(query + " LIMIT 1", params).fetchone()
+            if match is None:
+                return None
+            # Ghi bản ghi cho đường dẫn mới (file đổi tên / copy) -> lần sau lookup theo đường dẫn
+            conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, content_hash, stat.st_size, stat.st_mtime_ns, match["doc_name"], match["chunk_count"],
+                 match["segment"], match["embedding_model"], STATUS_EMBEDDED, None, datetime.now().isoformat())
+            )
+            return dict(match)
+
+    @staticmethod
+    def _accept(row: sqlite3.Row, embedding_model: Optional[str]) -> Optional[Dict[str, Any]]:
+        if row["status"] != STATUS_EMBEDDED:
+            return None
+        if embedding_model and row["embedding_model"] != embedding_model:
+            return None
+        return dict(row)
+
+    def is_embedded(self, path: str, embedding_model: Optional[str] = None) -> bool:
+        return self.lookup(path, embedding_model) is not None
+
+    def has_record(self, path: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT 1 FROM documents WHERE path = ?", (os.path.abspath(path),)
+            ).fetchone() is not None
+
+    # ------------------------------------------------------------------
+    # Ghi
+    # ------------------------------------------------------------------
+
+    def record(self,
+               path: str,
+               status: str,
+               content_hash: Optional[str] = None,
+               chunk_count: Optional[int] = None,
+               segment: Optional[str] = None,
+               embedding_model: Optional[str] = None,
+               error: Optional[str] = None):
+        """Ghi / cập nhật trạng thái file (hash + stat lấy tại thời điểm gọi)"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        content_hash = content_hash or self.content_hash(path)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, content_hash, stat.st_size, stat.st_mtime_ns, document_name(path), chunk_count,
+                 segment, embedding_model, status, error, datetime.now().isoformat())
+            )
+
+    def mark_segment(self, paths: Iterable[str], segment: str):
+        """Các file đã được ghi vào segment -> embedded"""
+        rows = [(segment, STATUS_EMBEDDED, datetime.now().isoformat(), os.path.abspath(p)) for p in paths]
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "UPDATE documents SET segment = ?, status = ?, error = NULL, updated_at = ? WHERE path = ?", rows
+            )
+
+    def rename_segments(self, old_names: Iterable[str], new_name: str):
+        """Segment đã được gộp (SegmentStore.on_merge)"""
+        old_names = list(old_names)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"UPDATE documents SET segment = ? WHERE segment IN ({','.join('?' * len(old_names))})",
+                [new_name, *old_names]
+            )
+
+    def import_segments(self, segment_store, embedding_model: Optional[str] = None) -> int:
+        """
+        Ghi bản ghi cho tài liệu đã có trong segment store trước khi có manifest (chạy một lần)
+
+        Chỉ các tài liệu mà file gốc ('doc_path') còn tồn tại mới hash được
+        """
+        with self._connect() as conn:
+            if conn.execute("SELECT value FROM meta WHERE key = 'imported_segments'").fetchone():
+                return 0
+        imported = 0
+        with segment_store.snapshot():
+            for segment in segment_store.segments:
+                for doc in segment_store.load_documents(segment["name"]):
+                    doc_path = doc.get('doc_path')
+                    if not doc_path or not os.path.isfile(doc_path) or self.has_record(doc_path):
+                        continue
+                    self.record(doc_path, STATUS_EMBEDDED, chunk_count=len(doc['chunks']),
+                                segment=segment["name"], embedding_model=embedding_model)
+                    imported += 1
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('imported_segments', ?)", (datetime.now().isoformat(),))
+        if imported:
+            logger.info(f"✅ Ingestion manifest: import {imported} tài liệu từ segment store")
+        return imported
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM documents GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
@@ -0,0 +1,398 @@
+# app/services/ingestion_pipeline.py
+# Pipeline ingestion nhiều stage cho EmbeddingService.process_all_documents
+#
+#   extract (process pool: đọc PDF/Word/TXT, OCR, clean)
+#     -> chunk (process pool: tách câu underthesea + chia chunk theo tokenizer)
+#     -> embed (một thread: gom chunk của nhiều tài liệu thành batch đầy rồi encode)
+#     -> write (một thread: ghi segment, commit index chung một lần ở cuối)
+#
+# Giữa các stage là queue giới hạn (INGEST_QUEUE_SIZE) - stage sau chậm thì stage trước dừng lại, không dồn RAM
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.ingestion_manifest import STATUS_ERROR, STATUS_PROCESSING
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("extract", "chunk", "embed", "write")
+_DONE = object()  # Hết input của stage
+
+@dataclass
+class StageStats:
+    """Tiến độ một stage: số tài liệu / trang / chunk đã xong, thời gian bận (tổng các worker)"""
+    documents: int = 0
+    pages: int = 0
+    chunks: int = 0
+    errors: int = 0
+    busy_seconds: float = 0.0
+
+@dataclass
+class PipelineDocument:
+    """Tài liệu đi qua các stage"""
+    doc_path: str
+    pages: int = 0
+    text: Optional[str] = None
+    chunks: List[str] = field(default_factory=list)
+    embeddings: Optional[np.ndarray] = None
+    error: Optional[str] = None
+    seconds: float = 0.0  # Thời gian xử lý ở stage vừa xong (trong worker)
+    ocr: Optional[Dict[str, Any]] = None  # PdfExtractionStats (PDF)
+
+# ----------------------------------------------------------------------
+# Worker process (extract / chunk) - EmbeddingService không load model, chunk chỉ cần tokenizer
+# ----------------------------------------------------------------------
+
+_worker_service = None
+
+def _init_worker(model_path: str, output_dir: str, load_tokenizer: bool):
+    global _worker_service
+    from app.services.embedding_service import EmbeddingService
+
+    logging.basicConfig(level=logging.WARNING)
+    _worker_service = EmbeddingService(model_path, output_dir=output_dir)
+    _worker_service.ocr_workers = 1  # Đã song song theo tài liệu, không mở thêm pool OCR trong worker
+    if load_tokenizer:
+        from transformers import AutoTokenizer
+        _worker_service.tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+def page_count(doc_path: str) -> int:
+    """Số trang (PDF), file khác tính 1 trang"""
+    if os.path.splitext(doc_path)[1].lower() != '.pdf':
+        return 1
+    import fitz
+    with fitz.open(doc_path) as doc:
+        return len(doc)
+
+def _extract(doc: PipelineDocument) -> PipelineDocument:
+    start = time.perf_counter()
+    try:
+        doc.pages = page_count(doc.doc_path)
+        _worker_service.last_pdf_stats = None
+        raw_text = _worker_service.extract_text_from_document(doc.doc_path)
+        if _worker_service.last_pdf_stats is not None:
+            doc.ocr = asdict(_worker_service.last_pdf_stats)
+        if raw_text:
+            doc.text = _worker_service.clean_text(raw_text)
+        else:
+            doc.error = "Không trích xuất được text"
+    except Exception as e:
+        doc.error = str(e)
+    doc.seconds = time.perf_counter() - start
+    return doc
+
+def _chunk(doc: PipelineDocument, chunk_size: int, overlap: int) -> PipelineDocument:
+    start = time.perf_counter()
+    try:
+        doc.chunks = _worker_service.split_text_to_chunks_vi(doc.text, chunk_size, overlap)
+        doc.text = None  # Không gửi lại text qua pipe
+        if not doc.chunks:
+            doc.error = "Không có chunk nào"
+    except Exception as e:
+        doc.error = str(e)
+    doc.seconds = time.perf_counter() - start
+    return doc
+
+class _ChunkTask:
+    """Callable picklable cho pool chunk (giữ chunk_size / overlap)"""
+
+    def __init__(self, chunk_size: int, overlap: int):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    def __call__(self, doc: PipelineDocument) -> PipelineDocument:
+        return _chunk(doc, self.chunk_size, self.overlap)
+
+# ----------------------------------------------------------------------
+# Pipeline
+# ----------------------------------------------------------------------
+
+class IngestionPipeline:
+    """Ingest nhiều tài liệu song song theo stage, ghi qua EmbeddingService (segment + commit)"""
+
+    def __init__(self,
+                 embedding_service,
+                 extract_workers: Optional[int] = None,
+                 chunk_workers: Optional[int] = None,
+                 queue_size: Optional[int] = None,
+                 embed_batch_chunks: Optional[int] = None,
+                 encode_batch_size: int = 32,
+                 chunk_size: int = 512,
+                 overlap: int = 50,
+                 progress: Optional[Callable[[Dict[str, StageStats]], None]] = None):
+        self.service = embedding_service
+        self.extract_workers = extract_workers or settings.INGEST_EXTRACT_WORKERS
+        self.chunk_workers = chunk_workers or settings.INGEST_CHUNK_WORKERS
+        self.queue_size = queue_size or settings.INGEST_QUEUE_SIZE
+        self.embed_batch_chunks = embed_batch_chunks or settings.INGEST_EMBED_BATCH_CHUNKS
+        self.encode_batch_size = encode_batch_size
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.progress = progress
+
+        self.stats = {stage: StageStats() for stage in STAGES}
+        self._stats_lock = threading.Lock()
+        self._results: List[Dict[str, Any]] = []
+        self._failures: List[Tuple[str, BaseException]] = []  # Lỗi làm dừng stage (thread), run() raise lại
+        self._total = 0
+
+    def run(self, doc_paths: List[str]) -> Dict[str, Any]:
+        """Chạy pipeline trên danh sách file, trả về kết quả từng file + thống kê stage + pages/s"""
+        self._total = len(doc_paths)
+        if self.service.model is None:
+            self.service.load_model()
+        start = time.perf_counter()
+
+        # spawn: worker không kế thừa CUDA context / model của process chính
+        context = multiprocessing.get_context("spawn")
+        extract_pool = ProcessPoolExecutor(
+            self.extract_workers, mp_context=context, initializer=_init_worker,
+            initargs=(self.service.model_path, self.service.output_dir, False)
+        )
+        chunk_pool = ProcessPoolExecutor(
+            self.chunk_workers, mp_context=context, initializer=_init_worker,
+            initargs=(self.service.model_path, self.service.output_dir, True)
+        )
+        inbox = queue.Queue()
+        extracted = queue.Queue(maxsize=self.queue_size)
+        chunked = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+
+        for doc_path in doc_paths:
+            inbox.put(PipelineDocument(doc_path))
+        inbox.put(_DONE)
+
+        stages = [
+            ("extract", self._pool_stage,
+             ("extract", extract_pool, _extract, inbox, extracted, self.extract_workers * 2)),
+            ("chunk", self._pool_stage,
+             ("chunk", chunk_pool, _ChunkTask(self.chunk_size, self.overlap), extracted, chunked, self.chunk_workers * 2)),
+            ("embed", self._embed_stage, (chunked, embedded)),
+            ("write", self._write_stage, (embedded,))
+        ]
+        threads = [
+            threading.Thread(target=self._run_stage, name=f"ingest-{stage}", args=(stage, target, args))
+            for stage, target, args in stages
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            extract_pool.shutdown()
+            chunk_pool.shutdown()
+
+        if self._failures:
+            # Vd: commit index chung lỗi - không báo tài liệu là đã embedding
+            stage, error = self._failures[0]
+            logger.error(f"❌ Pipeline ingestion dừng ở stage {stage}: {error}")
+            raise error
+
+        elapsed = time.perf_counter() - start
+        pages = self.stats["write"].pages
+        summary = {
+            "elapsed_seconds": round(elapsed, 2),
+            "pages": pages,
+            "pages_per_second": round(pages / elapsed, 2) if elapsed else 0.0,
+            "stages": {stage: vars(stats).copy() for stage, stats in self.stats.items()},
+            "ocr": self._ocr_summary()
+        }
+        logger.info(f"✅ Pipeline ingestion: {self.stats['write'].documents}/{self._total} tài liệu, "
+                    f"{pages} trang trong {elapsed:.1f}s ({summary['pages_per_second']} trang/s)")
+        for stage, stats in self.stats.items():
+            logger.info(f"   {stage:<8} {stats.documents} tài liệu, {stats.chunks} chunks, "
+                        f"{stats.errors} lỗi, bận {stats.busy_seconds:.1f}s")
+        ocr = summary["ocr"]
+        if ocr:
+            logger.info(f"   OCR {int(ocr['ocr_pages'])}/{int(ocr['pages'])} trang PDF "
+                        f"({int(ocr['cached_pages'])} từ cache), tiết kiệm ~{ocr['saved_seconds']:.0f}s")
+        return {"results": self._results, "summary": summary}
+
+    def _ocr_summary(self) -> Dict[str, float]:
+        """Tổng thống kê OCR theo trang của các PDF đã ghi"""
+        totals: Dict[str, float] = {}
+        for result in self._results:
+            for key, value in (result.get("ocr") or {}).items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    # ------------------------------------------------------------------
+    # Stage
+    # ------------------------------------------------------------------
+
+    def _run_stage(self, stage: str, target: Callable, args: tuple):
+        """Chạy stage trong thread, giữ lại exception để run() raise (exception trong thread tự nó bị mất)"""
+        try:
+            target(*args)
+        except BaseException as e:
+            with self._stats_lock:
+                self._failures.append((stage, e))
+
+    def _pool_stage(self, stage: str, pool, task, inbox: queue.Queue, outbox: queue.Queue, max_in_flight: int):
+        """
+        Lấy tài liệu từ inbox, chạy task trong process pool (tối đa max_in_flight), đẩy kết quả sang outbox
+
+        Lỗi (kể cả pool hỏng) được gắn vào tài liệu và chuyển tiếp - stage luôn tiêu hết inbox, không làm treo stage trước
+        """
+        in_flight: Dict[Any, PipelineDocument] = {}
+        exhausted = False
+        try:
+            while not exhausted or in_flight:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    try:
+                        doc = inbox.get(timeout=0.05 if in_flight else None)
+                    except queue.Empty:
+                        break
+                    if doc is _DONE:
+                        exhausted = True
+                    elif doc.error:
+                        outbox.put(doc)  # Lỗi ở stage trước: chuyển thẳng tới writer
+                    else:
+                        try:
+                            if stage == "extract":
+                                self.service.ingestion_manifest.record(
+                                    doc.doc_path, STATUS_PROCESSING, embedding_model=self.service.embedding_model
+                                )
+                            in_flight[pool.submit(task, doc)] = doc
+                        except Exception as e:
+                            doc.error = f"{stage}: {e}"
+                            self._record(stage, doc, 0.0)
+                            outbox.put(doc)
+                if not in_flight:
+                    continue
+                finished, _ = wait(list(in_flight), timeout=0.05, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    doc = in_flight.pop(future)
+                    try:
+                        doc = future.result()
+                    except Exception as e:
+                        doc.error = f"{stage}: {e}"
+                    self._record(stage, doc, doc.seconds)
+                    outbox.put(doc)
+        finally:
+            outbox.put(_DONE)
+
+    def _embed_stage(self, inbox: queue.Queue, outbox: queue.Queue):
+        """Gom chunk của nhiều tài liệu tới embed_batch_chunks rồi encode một lần (batch GPU đầy)"""
+        batch: List[PipelineDocument] = []
+        doc = None
+        try:
+            while True:
+                doc = inbox.get()
+                if doc is _DONE:
+                    break
+                if doc.error:
+                    outbox.put(doc)
+                    continue
+                batch.append(doc)
+                if sum(len(d.chunks) for d in batch) >= self.embed_batch_chunks:
+                    self._encode(batch, outbox)
+                    batch = []
+            if batch:
+                self._encode(batch, outbox)
+        except Exception as e:
+            logger.error(f"❌ Lỗi stage embed: {e}")
+            # Tiêu hết inbox (stage trước không bị treo khi queue đầy), tài liệu còn lại chuyển tiếp dạng lỗi
+            while doc is not _DONE:
+                doc = inbox.get()
+                if doc is not _DONE:
+                    doc.error = doc.error or f"embed: {e}"
+                    outbox.put(doc)
+            raise
+        finally:
+            outbox.put(_DONE)
+
+    def _encode(self, batch: List[PipelineDocument], outbox: queue.Queue):
+        start = time.perf_counter()
+        texts = [chunk for doc in batch for chunk in doc.chunks]
+        try:
+            embeddings = self.service.model.encode(
+                texts, convert_to_tensor=False, show_progress_bar=False, batch_size=self.encode_batch_size
+            )
+        except Exception as e:
+            logger.error(f"❌ Lỗi tạo embeddings cho {len(batch)} tài liệu: {e}")
+            for doc in batch:
+                doc.error = str(e)
+                outbox.put(doc)
+            return
+        seconds = time.perf_counter() - start
+        offset = 0
+        for doc in batch:
+            doc.embeddings = np.asarray(embeddings[offset:offset + len(doc.chunks)])
+            offset += len(doc.chunks)
+            self._record("embed", doc, seconds * len(doc.chunks) / len(texts))
+            outbox.put(doc)
+
+    def _write_stage(self, inbox: queue.Queue):
+        """Một writer duy nhất: ghi segment theo batch, commit index chung khi hết tài liệu"""
+        doc = None
+        try:
+            while True:
+                doc = inbox.get()
+                if doc is _DONE:
+                    break
+                start = time.perf_counter()
+                if doc.error:
+                    self._write_error(doc)
+                    continue
+                try:
+                    paths = self.service.save_embeddings_to_faiss(doc.chunks, doc.embeddings, doc.doc_path, commit=False)
+                except Exception as e:
+                    doc.error = str(e)
+                    self._write_error(doc)
+                    continue
+                self._results.append({
+                    "doc_path": doc.doc_path,
+                    "num_chunks": len(doc.chunks),
+                    "embedding_shape": doc.embeddings.shape,
+                    "pages": doc.pages,
+                    "ocr": doc.ocr,
+                    "paths": paths,
+                    "status": "success"
+                })
+                self._record("write", doc, time.perf_counter() - start)
+            start = time.perf_counter()
+            self.service.commit(force=True)
+            with self._stats_lock:
+                self.stats["write"].busy_seconds += time.perf_counter() - start
+        except Exception as e:
+            logger.error(f"❌ Lỗi stage write: {e}")
+            while doc is not _DONE:  # Tiêu hết inbox để stage embed không bị treo
+                doc = inbox.get()
+            raise
+
+    def _write_error(self, doc: PipelineDocument):
+        logger.error(f"❌ Lỗi xử lý document {doc.doc_path}: {doc.error}")
+        try:
+            self.service.ingestion_manifest.record(doc.doc_path, STATUS_ERROR, error=doc.error)
+        except OSError:
+            pass
+        self._results.append({"doc_path": doc.doc_path, "status": "error", "error": doc.error})
+        with self._stats_lock:
+            self.stats["write"].errors += 1
+
+    def _record(self, stage: str, doc: PipelineDocument, seconds: float):
+        with self._stats_lock:
+            stats = self.stats[stage]
+            stats.busy_seconds += seconds
+            if doc.error:
+                stats.errors += 1
+            else:
+                stats.documents += 1
+                stats.pages += doc.pages
+                stats.chunks += len(doc.chunks)
+            line = " | ".join(f"{s} {self.stats[s].documents}/{self._total}" for s in STAGES)
+        logger.info(f"📊 [{stage}] {os.path.basename(doc.doc_path)} ({seconds:.1f}s) - {line}")
+        if self.progress is not None:
+            self.progress(self.stats)
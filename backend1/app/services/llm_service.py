@@ -3,18 +3,29 @@
 
 import os
 import logging
+import threading
 import torch
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 from transformers import (
     AutoTokenizer, 
     AutoModelForCausalLM, 
     BitsAndBytesConfig,
+    StoppingCriteriaList,
     pipeline
 )
 from app.core.config import settings
+from app.services.token_streamer import StopOnEvent
+from app.services.generation_profiles import GenerationProfile, get_generation_profile, resolve_generation_profile
+from app.services.prefix_cache import PrefixKVCache, split_system_prefix
+from app.services.context_packer import ContextPacker
+from app.core.metrics import get_metrics_registry
 
 logger = logging.getLogger(__name__)
 
+generation_errors_counter = get_metrics_registry().counter(
+    "llm_generation_errors_total", "Số lần LLM generate lỗi và trả về câu xin lỗi mặc định"
+)
+
 class LLMService:
     """Service xử lý LLM sử dụng vinallama-2.7b-chat"""
     
@@ -23,6 +34,10 @@ class LLMService:
         self.tokenizer = None
         self.model = None
         self.pipeline = None
+        self.scheduler = None  # GenerationScheduler (continuous batching), tạo lazy
+        self.prefix_cache = None  # PrefixKVCache cho system prompt, tạo lazy
+        self.context_packer = None  # ContextPacker theo tokenizer, tạo lazy
+        self._generation_stats = threading.local()  # Số token prompt / ms prefill tiết kiệm trong thread hiện tại
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info(f"Sử dụng device: {self.device}")
         
@@ -96,60 +111,37 @@ class LLMService:
                          query: str, 
                          context_docs: List[Dict] = None,
                          max_new_tokens: int = 256,
-                         generation_config: Dict = None) -> str:
-        """Tạo câu trả lời từ query và context"""
+                         generation_config: Union[Dict, str, GenerationProfile] = None) -> str:
+        """Tạo câu trả lời từ query và context (generation_config: tên profile, GenerationProfile hoặc dict)"""
+        # Tạo prompt từ query và context
+        prompt = self._create_prompt(query, context_docs)
+        answer = self.generate_from_prompt(prompt, max_new_tokens, generation_config)
+        logger.info(f"Đã tạo response cho query: {query[:50]}...")
+        return answer
+    
+    def generate_from_prompt(self,
+                             prompt: str,
+                             max_new_tokens: int = 256,
+                             generation_config: Union[Dict, str, GenerationProfile] = None) -> str:
+        """Sinh text từ prompt ChatML đã dựng sẵn (không bọc thêm system prompt)"""
         if self.model is None or self.tokenizer is None:
             self.load_model()
         
         try:
-            # Tạo prompt từ query và context
-            prompt = self._create_prompt(query, context_docs)
-            
-            # Tokenize input - safe cho quantized models
-            inputs = self.tokenizer(prompt, return_tensors="pt", padding=True, truncation=True, max_length=2048)
+            profile = resolve_generation_profile(generation_config, max_new_tokens)
             
-            # Move inputs to correct device
-            device = None
-            if hasattr(self.model, 'device'):
-                device = self.model.device
-            elif hasattr(self.model, 'hf_device_map'):
-                # Model with device_map, get first device
-                device = next(iter(self.model.hf_device_map.values()))
-            elif torch.cuda.is_available():
-                device = 'cuda'
-            else:
-                device = 'cpu'
-            
-            if device:
-                inputs = {k: v.to(device) for k, v in inputs.items()}
+            # Continuous batching: decode chung với các request đồng thời khác (không hỗ trợ beam search)
+            if self._use_scheduler(profile):
+                prompt_ids = self.tokenizer(prompt, truncation=True, max_length=2048)['input_ids']
+                self._add_generation_stat('prompt_tokens', len(prompt_ids))
+                prefix = self._resolve_prefix(prompt, prompt_ids, profile)
+                answer = self.get_scheduler().generate(prompt, profile, prefix=prefix)
+                return self._clean_response(answer)
             
-            # Cấu hình generation cho responses chính xác và ổn định
-            if generation_config is None:
-                # Default generation config - tối ưu cho tiếng Việt
-                gen_config = self.model.generation_config
-                gen_config.max_new_tokens = max_new_tokens
-                gen_config.do_sample = True  # Enable sampling
-                gen_config.temperature = 0.5  # Giảm để ổn định hơn, giảm lỗi chính tả
-                gen_config.top_p = 0.8  # Giảm để tập trung hơn
-                gen_config.top_k = 40  # Giảm để ổn định hơn
-                gen_config.repetition_penalty = 1.2  # Tăng để tránh lặp từ
-                gen_config.no_repeat_ngram_size = 3  # Tăng để tránh lặp cụm từ
-                gen_config.num_return_sequences = 1
-                gen_config.num_beams = 1  # Greedy decoding
-                gen_config.early_stopping = False  # Tắt early stopping khi num_beams=1
-            else:
-                # Use custom generation config với defaults tối ưu
-                gen_config = self.model.generation_config
-                gen_config.max_new_tokens = generation_config.get('max_new_tokens', max_new_tokens)
-                gen_config.do_sample = generation_config.get('do_sample', True)
-                gen_config.temperature = generation_config.get('temperature', 0.5)  # Default tối ưu
-                gen_config.top_p = generation_config.get('top_p', 0.8)  # Default tối ưu
-                gen_config.top_k = generation_config.get('top_k', 40)  # Default tối ưu
-                gen_config.repetition_penalty = generation_config.get('repetition_penalty', 1.2)  # Default tối ưu
-                gen_config.no_repeat_ngram_size = generation_config.get('no_repeat_ngram_size', 3)  # Default tối ưu
-                gen_config.num_return_sequences = generation_config.get('num_return_sequences', 1)
-                gen_config.num_beams = generation_config.get('num_beams', 1)
-                gen_config.early_stopping = generation_config.get('early_stopping', False)  # Default tối ưu
+            inputs = self._prepare_inputs(prompt)
+            gen_config = self._build_generation_config(profile)
+            self._add_generation_stat('prompt_tokens', inputs['input_ids'].shape[1])
+            prefix = self._resolve_prefix(prompt, inputs['input_ids'][0].tolist(), profile)
             
             # Generate response
             with torch.no_grad():
@@ -158,23 +150,181 @@ class LLMService:
                     attention_mask=inputs['attention_mask'],
                     generation_config=gen_config,
                     pad_token_id=self.tokenizer.eos_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    **self._prefix_generate_kwargs(prefix)
                 )
             
-            # Decode response
-            generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            answer = generated_text[len(prompt):].strip()
+            # Decode phần token mới sinh
+            new_tokens = outputs[0][inputs['input_ids'].shape[1]:]
+            answer = self.tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
             
             # Làm sạch response
-            answer = self._clean_response(answer)
-            
-            logger.info(f"Đã tạo response cho query: {query[:50]}...")
-            return answer
+            return self._clean_response(answer)
             
         except Exception as e:
             logger.error(f"Lỗi khi tạo response: {e}")
+            generation_errors_counter.inc()
             return "Xin lỗi, tôi không thể tạo câu trả lời lúc này. Vui lòng thử lại sau."
     
+    def _prepare_inputs(self, prompt: str) -> Dict[str, torch.Tensor]:
+        """Tokenize prompt và chuyển sang device của model"""
+        # Tokenize input - safe cho quantized models
+        inputs = self.tokenizer(prompt, return_tensors="pt", padding=True, truncation=True, max_length=2048)
+        
+        # Move inputs to correct device
+        device = self._model_device()
+        if device:
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+        
+        return inputs
+    
+    def _model_device(self):
+        """Device chứa input embeddings của model"""
+        if hasattr(self.model, 'device'):
+            return self.model.device
+        elif hasattr(self.model, 'hf_device_map'):
+            # Model with device_map, get first device
+            return next(iter(self.model.hf_device_map.values()))
+        elif torch.cuda.is_available():
+            return 'cuda'
+        return 'cpu'
+    
+    def get_scheduler(self):
+        """Lấy (hoặc tạo) generation scheduler cho model này"""
+        if self.scheduler is None:
+            from app.services.generation_scheduler import GenerationScheduler
+            self.scheduler = GenerationScheduler(self)
+        return self.scheduler
+    
+    def get_prefix_cache(self) -> PrefixKVCache:
+        """Lấy (hoặc tạo) cache KV của system prompt"""
+        if self.prefix_cache is None:
+            self.prefix_cache = PrefixKVCache(self)
+        return self.prefix_cache
+    
+    def _resolve_prefix(self, prompt: str, prompt_ids: List[int], profile: GenerationProfile):
+        """
+        Tìm KV cache của system prompt cho prompt này (prefill nếu chưa có)
+        
+        Trả về None khi: tắt cache, beam search, prompt không bắt đầu bằng system prompt,
+        hoặc token hóa prompt đầy đủ không giữ nguyên các token của prefix
+        """
+        if not settings.PREFIX_CACHE_ENABLED or profile.uses_beam_search:
+            return None
+        prefix_text = split_system_prefix(prompt)
+        if prefix_text is None:
+            return None
+        
+        try:
+            cache = self.get_prefix_cache()
+            entry, hit = cache.get_or_compute(prefix_text)
+        except Exception as e:
+            logger.error(f"❌ Lỗi prefix cache: {e}")
+            return None
+        if entry is None:
+            return None
+        
+        if len(prompt_ids) <= entry.length or list(prompt_ids[:entry.length]) != entry.prefix_ids:
+            cache.record_mismatch()
+            return None
+        
+        if hit:
+            cache.record_saved(entry)
+            self._add_generation_stat('prefix_saved_ms', entry.prefill_ms)
+        return entry
+    
+    @staticmethod
+    def _prefix_generate_kwargs(prefix) -> Dict[str, Any]:
+        """model.generate tự bỏ các token đã có trong past_key_values khỏi input_ids"""
+        if prefix is None:
+            return {}
+        return {"past_key_values": prefix.past_key_values}
+    
+    def _add_generation_stat(self, key: str, value: float):
+        stats = getattr(self._generation_stats, 'values', None)
+        if stats is None:
+            stats = self._generation_stats.values = {}
+        stats[key] = stats.get(key, 0) + value
+    
+    def reset_generation_stats(self):
+        """Bắt đầu đếm số token prompt và thời gian prefill tiết kiệm được trong thread hiện tại"""
+        self._generation_stats.values = {}
+    
+    def consume_generation_stats(self) -> Dict[str, float]:
+        """Lấy và reset thống kê generation của thread hiện tại: prompt_tokens, prefix_saved_ms"""
+        stats = getattr(self._generation_stats, 'values', None) or {}
+        self._generation_stats.values = {}
+        return {
+            'prompt_tokens': int(stats.get('prompt_tokens', 0)),
+            'prefix_saved_ms': float(stats.get('prefix_saved_ms', 0.0))
+        }
+    
+    def get_context_packer(self) -> ContextPacker:
+        """ContextPacker dùng tokenizer của model để đếm token"""
+        if self.context_packer is None or self.context_packer.tokenizer is not self.tokenizer:
+            self.context_packer = ContextPacker(self.tokenizer)
+        return self.context_packer
+    
+    def _build_generation_config(self, profile: GenerationProfile):
+        """GenerationConfig riêng cho request - không sửa model.generation_config dùng chung"""
+        return profile.to_generation_config(self.model.generation_config)
+    
+    def _use_scheduler(self, profile: GenerationProfile) -> bool:
+        """Scheduler chỉ hỗ trợ greedy/sampling từng token, beam search chạy model.generate trực tiếp"""
+        return settings.GENERATION_SCHEDULER_ENABLED and not profile.uses_beam_search
+    
+    def stream_from_prompt(self,
+                           prompt: str,
+                           streamer,
+                           stop_event=None,
+                           max_new_tokens: int = 256,
+                           generation_config: Union[Dict, str, GenerationProfile] = None) -> str:
+        """
+        Sinh text từ prompt và đẩy từng đoạn token ra streamer (chạy trong thread)
+        
+        stop_event (threading.Event) được kiểm tra sau mỗi token - set() để dừng generation ngay
+        """
+        if self.model is None or self.tokenizer is None:
+            self.load_model()
+        
+        try:
+            profile = resolve_generation_profile(generation_config, max_new_tokens)
+            
+            if self._use_scheduler(profile):
+                prompt_ids = self.tokenizer(prompt, truncation=True, max_length=2048)['input_ids']
+                self._add_generation_stat('prompt_tokens', len(prompt_ids))
+                prefix = self._resolve_prefix(prompt, prompt_ids, profile)
+                answer = self.get_scheduler().generate(prompt, profile, streamer=streamer, stop_event=stop_event, prefix=prefix)
+                return self._clean_response(answer)
+            
+            inputs = self._prepare_inputs(prompt)
+            gen_config = self._build_generation_config(profile)
+            self._add_generation_stat('prompt_tokens', inputs['input_ids'].shape[1])
+            prefix = self._resolve_prefix(prompt, inputs['input_ids'][0].tolist(), profile)
+            
+            stopping_criteria = None
+            if stop_event is not None:
+                stopping_criteria = StoppingCriteriaList([StopOnEvent(stop_event)])
+            
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    input_ids=inputs['input_ids'],
+                    attention_mask=inputs['attention_mask'],
+                    generation_config=gen_config,
+                    streamer=streamer,
+                    stopping_criteria=stopping_criteria,
+                    pad_token_id=self.tokenizer.eos_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    **self._prefix_generate_kwargs(prefix)
+                )
+            
+            new_tokens = outputs[0][inputs['input_ids'].shape[1]:]
+            return self._clean_response(self.tokenizer.decode(new_tokens, skip_special_tokens=True))
+            
+        finally:
+            # Đảm bảo consumer luôn nhận được tín hiệu kết thúc (kể cả khi generate lỗi)
+            streamer.end()
+    
     def _create_prompt(self, query: str, context_docs: List[Dict] = None) -> str:
         """Tạo prompt từ query và context documents theo định dạng ChatML"""
         
@@ -192,12 +342,17 @@ Hãy tạo câu trả lời chi tiết, có cấu trúc và dễ hiểu. Không
         # Context từ RAG với metadata
         context_text = ""
         if context_docs:
+            # Chọn câu liên quan nhất trong ngân sách token thay vì cắt theo số ký tự
+            docs = context_docs[:3]
+            packed = self.get_context_packer().pack(
+                query, [doc['content'] for doc in docs], settings.CONTEXT_TOKEN_BUDGET
+            )
             context_parts = []
-            for i, doc in enumerate(context_docs[:3], 1):
+            for i, (doc, content) in enumerate(zip(docs, packed.passages), 1):
+                if not content:
+                    continue
                 filename = doc.get('metadata', {}).get('filename', f'Tài liệu {i}')
-                content = doc['content'][:800]  # Tăng độ dài để có nhiều context hơn
-                
-                context_parts.append(f"=== Nguồn {i}: {filename} ===\n{content.strip()}")
+                context_parts.append(f"=== Nguồn {i}: {filename} ===\n{content}")
             
             context_text = "\n\n".join(context_parts)
         
@@ -323,34 +478,8 @@ Yêu cầu:
             # Tạo prompt với lịch sử
             prompt = self._create_chat_prompt(query, chat_history, context_docs)
             
-            # Tokenize input
-            from app.utils.model_utils import safe_tokenize_to_device
-            encoding = safe_tokenize_to_device(self.tokenizer, prompt, self.model)
-            
-            # Cấu hình generation
-            generation_config = self.model.generation_config
-            generation_config.max_new_tokens = 512
-            generation_config.num_beams = 3  # Beam search với 3 beams
-            generation_config.early_stopping = True  # OK vì num_beams > 1
-            generation_config.do_sample = False
-            generation_config.num_return_sequences = 1
-            generation_config.repetition_penalty = 1.2
-            generation_config.no_repeat_ngram_size = 3
-            
-            # Generate response
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    input_ids=inputs['input_ids'],
-                    attention_mask=inputs['attention_mask'],
-                    generation_config=gen_config,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id
-                )
-            
-            # Decode response
-            generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            answer = generated_text[len(prompt):].strip()
-            answer = self._clean_response(answer)
+            # Generate với profile 'chat' (beam search) - GenerationConfig riêng cho request
+            answer = self.generate_from_prompt(prompt, generation_config=get_generation_profile("chat"))
             
             return {
                 "response": answer,
@@ -378,11 +507,11 @@ Yêu cầu:
         # Context từ RAG
         context_text = ""
         if context_docs:
-            context_chunks = []
-            for doc in context_docs[:2]:  # Chỉ lấy 2 docs để tiết kiệm tokens
-                chunk_content = doc['content'][:300]  # Giới hạn độ dài
-                context_chunks.append(chunk_content.strip())
-            context_text = "\n---\n".join(context_chunks)
+            # Chat giữ ngân sách context nhỏ để chừa chỗ cho lịch sử hội thoại
+            packed = self.get_context_packer().pack(
+                query, [doc['content'] for doc in context_docs[:3]], settings.CONTEXT_TOKEN_BUDGET_CHAT
+            )
+            context_text = "\n---\n".join(p for p in packed.passages if p)
         
         # Xây dựng prompt với lịch sử hội thoại
         messages = []
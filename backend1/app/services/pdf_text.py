@@ -0,0 +1,192 @@
+# app/services/pdf_text.py
+# Trích xuất text PDF theo từng trang: dùng text layer của PyMuPDF khi trang có đủ chữ, chỉ OCR trang ảnh (scan)
+# Kết quả OCR cache trên đĩa theo hash nội dung trang (settings.OCR_CACHE_PATH) - ingest lại không OCR lại trang đã OCR
+#
+# Cache: ocr_cache/<2 ký tự đầu>/<sha256>.json  {"text": ..., "seconds": thời gian OCR lúc tạo}
+# Key = nội dung trang (content stream, ảnh, form XObject, font, kích thước, xoay) + zoom + config tesseract
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from app.core.config import settings
+from app.utils.ocr_worker import ocr_page, preprocess_image  # noqa: F401 - preprocess_image dùng lại ở embedding_service
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_VERSION = 1
+DEFAULT_OCR_CONFIG = r'--oem 3 --psm 6 -l vie'
+DEFAULT_ZOOM = 2.5
+_SCANNED_IMAGE_COVERAGE = 0.5  # Ảnh phủ hơn nửa trang + ít vùng chữ -> trang scan (text layer chỉ là header/số trang)
+
+@dataclass
+class PdfExtractionStats:
+    """Thống kê trích xuất một PDF"""
+    pages: int = 0
+    text_layer_pages: int = 0
+    skipped_ocr_pages: int = 0  # Trang cần OCR nhưng ocr=False: chỉ có text layer (thiếu/lỗi), không tính tiết kiệm
+    ocr_pages: int = 0  # Trang phải OCR
+    cached_pages: int = 0  # Trong số ocr_pages: lấy từ cache
+    ocr_seconds: float = 0.0  # Thời gian OCR thật (không tính trang từ cache)
+    saved_seconds: float = 0.0  # Ước tính: trang text layer + trang từ cache không phải OCR
+
+# Process pool OCR dùng chung cả vòng đời process (tạo lúc cần, tạo lại khi đổi số worker):
+# không spawn lại worker + import PyMuPDF/Tesseract cho từng PDF
+_ocr_pool: Optional[ProcessPoolExecutor] = None
+_ocr_pool_workers = 0
+_ocr_pool_lock = threading.Lock()
+
+def _get_ocr_pool(workers: int) -> ProcessPoolExecutor:
+    global _ocr_pool, _ocr_pool_workers
+    with _ocr_pool_lock:
+        if _ocr_pool is None or _ocr_pool_workers != workers:
+            if _ocr_pool is not None:
+                _ocr_pool.shutdown(wait=False)
+            # spawn: không kế thừa model / CUDA context của process gọi
+            _ocr_pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            _ocr_pool_workers = workers
+        return _ocr_pool
+
+def shutdown_ocr_pool():
+    """Dừng process pool OCR (tự dừng khi thoát interpreter)"""
+    global _ocr_pool, _ocr_pool_workers
+    with _ocr_pool_lock:
+        if _ocr_pool is not None:
+            _ocr_pool.shutdown()
+        _ocr_pool, _ocr_pool_workers = None, 0
+
+def page_needs_ocr(page) -> Tuple[bool, str]:
+    """
+    (cần OCR?, text layer) - OCR khi text layer quá ít chữ, lỗi font, hoặc trang là ảnh scan phủ gần hết trang
+    """
+    text = page.get_text()
+    visible = [c for c in text if not c.isspace()]
+    if len(visible) < settings.OCR_MIN_PAGE_CHARS:
+        return True, text
+    invalid = sum(1 for c in visible if c == '�' or (ord(c) < 32))
+    if invalid / len(visible) > settings.OCR_MAX_INVALID_CHAR_RATIO:
+        return True, text
+
+    page_area = max(abs(page.rect), 1.0)
+    text_area, image_area = 0.0, 0.0
+    for x0, y0, x1, y1, _, _, block_type in page.get_text("blocks"):
+        area = max(x1 - x0, 0) * max(y1 - y0, 0)
+        if block_type == 0:
+            text_area += area
+        else:
+            image_area += area
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        image_area = max(image_area, max(x1 - x0, 0) * max(y1 - y0, 0))
+    if image_area / page_area > _SCANNED_IMAGE_COVERAGE and text_area / page_area < settings.OCR_MIN_TEXT_COVERAGE:
+        return True, text
+    return False, text
+
+def page_content_hash(doc, page, ocr_key: str) -> str:
+    """Hash nội dung trang (không render): trang giống hệt ở file khác / file đổi tên dùng chung kết quả OCR"""
+    digest = hashlib.sha256(f"{OCR_CACHE_VERSION}|{ocr_key}|{tuple(page.rect)}|{page.rotation}".encode())
+    digest.update(page.read_contents())
+    for xref in sorted({image[0] for image in page.get_images(full=True)}):
+        digest.update(doc.xref_stream_raw(xref) or b"")
+    for xobject in sorted({xobject[0] for xobject in page.get_xobjects()}):
+        digest.update(doc.xref_stream_raw(xobject) or b"")
+    digest.update("|".join(sorted(font[3] for font in page.get_fonts(full=True))).encode())
+    return digest.hexdigest()
+
+class OcrCache:
+    """Kết quả OCR theo hash nội dung trang, mỗi trang một file JSON (ghi file tạm rồi os.replace)"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, text: str, seconds: float):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"text": text, "seconds": round(seconds, 3)}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+def extract_pdf_text(pdf_path: str,
+                     cache: Optional[OcrCache] = None,
+                     ocr: bool = True,
+                     zoom: float = DEFAULT_ZOOM,
+                     ocr_config: str = DEFAULT_OCR_CONFIG,
+                     workers: Optional[int] = None) -> Tuple[str, PdfExtractionStats]:
+    """
+    Text của PDF (mỗi trang một đoạn, cách nhau bởi xuống dòng) và thống kê OCR
+
+    - Trang có text layer tốt: lấy thẳng text layer
+    - Trang ảnh: lấy từ cache theo hash nội dung, còn lại OCR trong process pool dùng chung (workers <= 1: OCR tuần tự)
+    - ocr=False: chỉ dùng text layer, trang cần OCR đếm vào skipped_ocr_pages
+    """
+    workers = settings.OCR_WORKERS if workers is None else workers
+    stats = PdfExtractionStats()
+    ocr_key = f"{zoom}|{ocr_config}"
+    texts: List[str] = []
+    to_ocr: Dict[int, str] = {}  # page_num -> cache key
+
+    with fitz.open(pdf_path) as doc:
+        stats.pages = len(doc)
+        for page_num in range(len(doc)):
+            page = doc.load_page(page_num)
+            needs_ocr, text = page_needs_ocr(page)
+            texts.append(text)
+            if not needs_ocr:
+                stats.text_layer_pages += 1
+                continue
+            if not ocr:
+                stats.skipped_ocr_pages += 1
+                continue
+            stats.ocr_pages += 1
+            key = page_content_hash(doc, page, ocr_key)
+            cached = cache.get(key) if cache is not None else None
+            if cached is not None:
+                texts[page_num] = cached["text"]
+                stats.cached_pages += 1
+                stats.saved_seconds += cached.get("seconds", 0.0)
+            else:
+                to_ocr[page_num] = key
+
+    if to_ocr:
+        args = [(pdf_path, page_num, zoom, ocr_config) for page_num in to_ocr]
+        if workers > 1 and len(args) > 1:
+            results = list(_get_ocr_pool(workers).map(ocr_page, *zip(*args)))
+        else:
+            results = [ocr_page(*a) for a in args]
+        for page_num, text, seconds in results:
+            texts[page_num] = text
+            stats.ocr_seconds += seconds
+            if cache is not None:
+                cache.put(to_ocr[page_num], text, seconds)
+
+    # Trang dùng text layer: tiết kiệm thời gian OCR trung bình một trang (đo trong tài liệu này nếu có)
+    measured = len(to_ocr)
+    per_page = stats.ocr_seconds / measured if measured else settings.OCR_SECONDS_PER_PAGE_ESTIMATE
+    if ocr:
+        stats.saved_seconds += stats.text_layer_pages * per_page
+
+    skipped = f", bỏ qua OCR {stats.skipped_ocr_pages}" if stats.skipped_ocr_pages else ""
+    logger.info(f"📄 {os.path.basename(pdf_path)}: {stats.pages} trang, text layer {stats.text_layer_pages}{skipped}, "
+                f"OCR {stats.ocr_pages} ({stats.cached_pages} từ cache, {stats.ocr_seconds:.1f}s), "
+                f"tiết kiệm ~{stats.saved_seconds:.1f}s")
+    return "".join(text.strip() + "\n" for text in texts), stats
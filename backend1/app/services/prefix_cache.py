@@ -0,0 +1,143 @@
+# app/services/prefix_cache.py
+# Cache KV (past_key_values) cho phần system prompt dùng chung giữa các prompt ChatML
+# Prefill system prompt một lần, các request sau chỉ cần prefill phần còn lại
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_START = "<|im_start|>system"
+TURN_END = "<|im_end|>"
+
+def split_system_prefix(prompt: str) -> Optional[str]:
+    """Lấy phần system prompt ở đầu prompt ChatML (tới hết <|im_end|> đầu tiên)"""
+    if not prompt.startswith(SYSTEM_START):
+        return None
+    end = prompt.find(TURN_END)
+    if end < 0:
+        return None
+    return prompt[:end + len(TURN_END)]
+
+@dataclass
+class PrefixEntry:
+    """KV cache của một system prompt"""
+    prefix_ids: List[int]
+    past_key_values: Tuple
+    prefill_ms: float
+    nbytes: int
+    hits: int = 0
+
+    @property
+    def length(self) -> int:
+        return len(self.prefix_ids)
+
+class PrefixKVCache:
+    """LRU cache past_key_values theo nội dung system prompt, giới hạn theo số entry và tổng số token"""
+
+    def __init__(self, llm_service,
+                 max_entries: Optional[int] = None,
+                 max_tokens: Optional[int] = None,
+                 min_prefix_tokens: Optional[int] = None):
+        self.llm_service = llm_service
+        self.max_entries = max_entries or settings.PREFIX_CACHE_MAX_ENTRIES
+        self.max_tokens = max_tokens or settings.PREFIX_CACHE_MAX_TOKENS
+        self.min_prefix_tokens = min_prefix_tokens or settings.PREFIX_CACHE_MIN_TOKENS
+
+        self._entries: "OrderedDict[str, PrefixEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "mismatches": 0,
+            "skipped_short": 0,
+            "saved_ms": 0.0
+        }
+
+    def get_or_compute(self, prefix_text: str) -> Tuple[Optional[PrefixEntry], bool]:
+        """Trả về (entry, hit). entry = None nếu prefix quá ngắn hoặc vượt giới hạn bộ nhớ"""
+        with self._lock:
+            entry = self._entries.get(prefix_text)
+            if entry is not None:
+                self._entries.move_to_end(prefix_text)
+                entry.hits += 1
+                self._stats["hits"] += 1
+                return entry, True
+
+            # Prefill dưới lock để không tính trùng cùng một prefix
+            prefix_ids = self.llm_service.tokenizer(prefix_text)['input_ids']
+            if len(prefix_ids) < self.min_prefix_tokens or len(prefix_ids) > self.max_tokens:
+                self._stats["skipped_short"] += 1
+                return None, False
+
+            entry = self._compute(prefix_ids)
+            self._entries[prefix_text] = entry
+            self._stats["misses"] += 1
+            self._evict_locked()
+            logger.info(f"🧠 Prefix cache: đã prefill system prompt {entry.length} tokens ({entry.prefill_ms:.1f}ms)")
+            return entry, False
+
+    def _compute(self, prefix_ids: List[int]) -> PrefixEntry:
+        """Chạy forward cho prefix và giữ lại past_key_values"""
+        device = self.llm_service._model_device()
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = self.llm_service.model(
+                input_ids=torch.tensor([prefix_ids], dtype=torch.long, device=device),
+                use_cache=True
+            )
+        past = outputs.past_key_values
+        if hasattr(past, 'to_legacy_cache'):
+            past = past.to_legacy_cache()
+        prefill_ms = (time.perf_counter() - start) * 1000
+
+        nbytes = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in past)
+        return PrefixEntry(prefix_ids=list(prefix_ids), past_key_values=past, prefill_ms=prefill_ms, nbytes=nbytes)
+
+    def _evict_locked(self):
+        """LRU eviction theo số entry và tổng số token"""
+        while self._entries and (len(self._entries) > self.max_entries or self._total_tokens() > self.max_tokens):
+            prefix_text, entry = self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+            logger.info(f"🧹 Prefix cache: evict system prompt {entry.length} tokens")
+
+    def _total_tokens(self) -> int:
+        return sum(entry.length for entry in self._entries.values())
+
+    def record_saved(self, entry: PrefixEntry):
+        """Ghi nhận thời gian prefill tiết kiệm được khi dùng lại entry"""
+        with self._lock:
+            self._stats["saved_ms"] += entry.prefill_ms
+
+    def record_mismatch(self):
+        """Token hóa của prompt đầy đủ không khớp với prefix đã cache"""
+        with self._lock:
+            self._stats["mismatches"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "total_tokens": self._total_tokens(),
+                "max_tokens": self.max_tokens,
+                "memory_mb": round(sum(e.nbytes for e in self._entries.values()) / 1024 ** 2, 2),
+                "prefixes": [
+                    {"tokens": e.length, "prefill_ms": round(e.prefill_ms, 2), "hits": e.hits}
+                    for e in self._entries.values()
+                ],
+                **{k: round(v, 2) if isinstance(v, float) else v for k, v in self._stats.items()}
+            }
@@ -0,0 +1,165 @@
+# app/services/quantized_index.py
+# Re-rank chính xác cho index nén (SQ8 / PQ)
+# Index nén trả về tập ứng viên k * rerank_factor, khoảng cách được tính lại bằng vector float32
+# đọc từ file .npy memory-mapped (chỉ các trang chứa ứng viên được nạp vào RAM)
+# Vector add sau lần build được ghi nối vào file đuôi <index>.vectors.tail.f32, file .npy không bị ghi lại
+
+import logging
+import os
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def vectors_path(index_path: str) -> str:
+    """File vector float32 đi kèm index nén"""
+    return os.path.splitext(index_path)[0] + ".vectors.npy"
+
+def tail_path(path: str) -> str:
+    """File đuôi (float32 thô, ghi nối) chứa vector được add sau lần build gần nhất"""
+    return os.path.splitext(path)[0] + ".tail.f32"
+
+def save_float_vectors(path: str, vectors: np.ndarray):
+    """Ghi toàn bộ vector (lúc build index): file tạm rồi os.replace, bỏ file đuôi cũ"""
+    tmp_path = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, np.ascontiguousarray(vectors, dtype='float32'))
+    os.replace(tmp_path, path)  # Process đang mmap file cũ vẫn đọc được inode cũ
+    if os.path.exists(tail_path(path)):
+        os.remove(tail_path(path))
+
+def append_float_vectors(path: str, vectors: np.ndarray, n_existing: int):
+    """
+    Ghi nối vector vào file đuôi (không ghi lại file .npy đang được mmap)
+
+    Phần đuôi vượt quá n_existing (add trước đó chưa kịp ghi index) được cắt bỏ trước khi ghi nối
+    """
+    n_base = len(np.load(path, mmap_mode='r'))
+    row_bytes = vectors.shape[1] * 4
+    with open(tail_path(path), 'ab') as f:
+        f.truncate(max(n_existing - n_base, 0) * row_bytes)
+        f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+
+class TailedVectors:
+    """Vector của file .npy + file đuôi (cả hai mmap), đánh id liên tục như một mảng"""
+
+    def __init__(self, base: np.ndarray, tail: np.ndarray):
+        self.base = base
+        self.tail = tail
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (len(self.base) + len(self.tail), self.base.shape[1])
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        return np.vstack([self.base, self.tail]).astype(dtype or 'float32', copy=False)
+
+    def __getitem__(self, ids) -> np.ndarray:
+        ids = np.asarray(ids, dtype='int64')
+        out = np.empty((len(ids), self.base.shape[1]), dtype='float32')
+        in_base = ids < len(self.base)
+        out[in_base] = self.base[ids[in_base]]
+        out[~in_base] = self.tail[ids[~in_base] - len(self.base)]
+        return out
+
+def open_float_vectors(path: str, n_total: Optional[int] = None):
+    """
+    Mở file vector ở chế độ mmap (read-only), gồm cả file đuôi nếu có
+
+    n_total: số vector của index đi kèm - bỏ phần đuôi chưa có trong index
+    """
+    base = np.load(path, mmap_mode='r')
+    tail_file = tail_path(path)
+    n_tail = os.path.getsize(tail_file) // (base.shape[1] * 4) if os.path.exists(tail_file) else 0
+    if n_total is not None:
+        base = base[:n_total]
+        n_tail = min(n_tail, max(n_total - len(base), 0))
+    if not n_tail:
+        return base
+    return TailedVectors(base, np.memmap(tail_file, dtype='float32', mode='r', shape=(n_tail, base.shape[1])))
+
+class RefinedIndex:
+    """
+    Bọc index nén: search ứng viên trên mã nén rồi xếp hạng lại bằng khoảng cách float32 chính xác
+
+    Giao diện giống faiss.Index ở những chỗ service dùng (d, ntotal, metric_type, search, add)
+    """
+
+    def __init__(self, index, vectors: np.ndarray, rerank_factor: int = 4, path: Optional[str] = None):
+        if len(vectors) != index.ntotal:
+            raise ValueError(f"Số vector float ({len(vectors)}) khác ntotal của index ({index.ntotal})")
+        self.index = index
+        self.vectors = vectors
+        self.rerank_factor = max(1, rerank_factor)
+        self.path = path
+
+    @property
+    def d(self) -> int:
+        return self.index.d
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def metric_type(self) -> int:
+        return self.index.metric_type
+
+    @property
+    def is_trained(self) -> bool:
+        return self.index.is_trained
+
+    def add(self, vectors: np.ndarray, persist: bool = True):
+        """
+        Thêm vào index nén và ghi nối vector float vào file đuôi (chỉ ghi phần mới)
+
+        persist=False: chỉ thêm trong RAM (RAG service thêm chunk chưa commit, không ghi file của ingestion)
+        """
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        if self.path and persist:
+            append_float_vectors(self.path, vectors, self.index.ntotal)
+            self.index.add(vectors)
+            self.vectors = open_float_vectors(self.path, self.index.ntotal)
+        else:
+            self.index.add(vectors)
+            self.vectors = TailedVectors(self.vectors, vectors)
+
+    def reconstruct_batch(self, ids: np.ndarray) -> np.ndarray:
+        return np.asarray(self.vectors[np.asarray(ids, dtype='int64')], dtype='float32')
+
+    def search(self, query: np.ndarray, k: int, params=None) -> Tuple[np.ndarray, np.ndarray]:
+        query = np.ascontiguousarray(query, dtype='float32').reshape(-1, self.d)
+        n_candidates = k * self.rerank_factor
+        if params is not None:
+            _, candidate_ids = self.index.search(query, n_candidates, params=params)
+        else:
+            _, candidate_ids = self.index.search(query, n_candidates)
+
+        inner_product = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        distances = np.full((len(query), k), -np.inf if inner_product else np.inf, dtype='float32')
+        ids = np.full((len(query), k), -1, dtype='int64')
+
+        for row, (q, candidates) in enumerate(zip(query, candidate_ids)):
+            # Đọc vector theo thứ tự id tăng dần -> truy cập mmap tuần tự hơn
+            candidates = np.sort(candidates[candidates >= 0])
+            if not len(candidates):
+                continue
+            candidate_vectors = np.asarray(self.vectors[candidates], dtype='float32')
+            if inner_product:
+                scores = candidate_vectors @ q
+                best = np.argsort(-scores)[:k]
+            else:
+                scores = ((candidate_vectors - q) ** 2).sum(axis=1)
+                best = np.argsort(scores)[:k]
+            distances[row, :len(best)] = scores[best]
+            ids[row, :len(best)] = candidates[best]
+
+        return distances, ids
+
+def unwrap_index(index):
+    """faiss.Index bên trong (để đặt tham số search / ghi file)"""
+    return index.index if isinstance(index, RefinedIndex) else index
@@ -0,0 +1,183 @@
+# app/services/query_router.py
+# Chọn category (partition) cần search từ câu hỏi khi client không truyền filter_category
+# - Luật từ khóa: "nghị định", "thông tư", "Điều 5" -> luat; "ISO 27001", "NIST", câu hỏi tiếng Anh -> english
+# - Classifier nhỏ trên embedding câu hỏi: cosine tới centroid của từng category (softmax theo nhiệt độ)
+# Độ tin cậy thấp -> không route, search toàn corpus
+
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.bm25_index import fold_accents
+
+logger = logging.getLogger(__name__)
+
+# Mẫu từ khóa (trên câu hỏi đã bỏ dấu, lowercase) theo category - cùng nhóm với RAGServiceUnified._determine_category
+# (mọi văn bản có số hiệu trong tên file, kể cả 13_2023_ND-CP_465185, thuộc luat)
+# Khớp nguyên từ (\b hai đầu): "iso" không khớp "isolation"; không dùng từ chung mọi câu hỏi pháp lý
+# ("quy dinh", "van ban") vì không phân biệt được category
+CATEGORY_PATTERNS = {
+    category: [re.compile(rf"\b{pattern}\b") for pattern in patterns]
+    for category, patterns in {
+        'luat': [
+            r'luat', r'nghi dinh', r'thong tu', r'quyet dinh', r'dieu \d+', r'khoan \d+',
+            r'xu phat', r'phap (?:ly|luat)', r'nd-cp', r'tt-\w+', r'qd-\w+', r'tcvn'
+        ],
+        'english': [
+            r'iso(?:/iec)?\s*\d+', r'nist', r'framework', r'cybersecurity', r'csf', r'sp ?800', r'playbook',
+            r'secure by design'
+        ]
+    }.items()
+}
+# Câu hỏi tiếng Anh: phần lớn từ không dấu + có từ chức năng tiếng Anh
+_ENGLISH_WORDS = {'what', 'how', 'which', 'why', 'when', 'the', 'is', 'are', 'does', 'of', 'for', 'and', 'to'}
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+@dataclass
+class RouteDecision:
+    """categories None = search toàn corpus"""
+    categories: Optional[List[str]]
+    confidence: float
+    probabilities: Dict[str, float] = field(default_factory=dict)
+    reason: str = 'fallback'
+
+class QueryRouter:
+    """Dự đoán category cần search: luật từ khóa + nearest-centroid trên embedding câu hỏi"""
+
+    def __init__(self,
+                 category_sizes: Mapping[str, int],
+                 centroids: Optional[Dict[str, np.ndarray]] = None,
+                 min_confidence: Optional[float] = None,
+                 max_categories: Optional[int] = None,
+                 rule_weight: Optional[float] = None,
+                 temperature: Optional[float] = None):
+        self.category_sizes = {category: int(size) for category, size in category_sizes.items() if size}
+        self.categories = sorted(self.category_sizes)
+        self.min_confidence = settings.QUERY_ROUTER_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.max_categories = max_categories or settings.QUERY_ROUTER_MAX_CATEGORIES
+        self.rule_weight = settings.QUERY_ROUTER_RULE_WEIGHT if rule_weight is None else rule_weight
+        self.temperature = temperature or settings.QUERY_ROUTER_TEMPERATURE
+
+        self._centroids = None
+        if centroids:
+            self._centroids = np.stack([centroids[category] for category in self.categories]).astype('float32')
+
+        self._lock = threading.Lock()
+        self._stats = {'routed': 0, 'fallback': 0, 'searched_vectors': 0, 'corpus_vectors': 0}
+
+    @classmethod
+    def from_index(cls,
+                   index,
+                   ids_by_category: Mapping[str, np.ndarray],
+                   sample_size: Optional[int] = None,
+                   seed: int = 0,
+                   **kwargs) -> "QueryRouter":
+        """Centroid (vector chuẩn hóa, trung bình) của tối đa sample_size chunk mỗi category, reconstruct từ index"""
+        sample_size = sample_size or settings.QUERY_ROUTER_CENTROID_SAMPLE
+        rng = np.random.default_rng(seed)
+        centroids = {}
+        try:
+            for category, ids in ids_by_category.items():
+                ids = np.asarray(ids, dtype='int64')
+                if len(ids) > sample_size:
+                    ids = np.sort(rng.choice(ids, sample_size, replace=False))
+                if not len(ids):
+                    continue
+                vectors = np.asarray(index.reconstruct_batch(ids), dtype='float32')
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+                centroid = vectors.mean(axis=0)
+                centroids[category] = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+        except RuntimeError as e:
+            logger.warning(f"⚠️ Không reconstruct được vector cho router ({e}), chỉ dùng luật từ khóa")
+            centroids = None
+        return cls({category: len(ids) for category, ids in ids_by_category.items()}, centroids, **kwargs)
+
+    def rule_scores(self, question: str) -> Dict[str, float]:
+        """Số từ khóa khớp theo category (chuẩn hóa tổng = 1, rỗng nếu không khớp)"""
+        folded = fold_accents(question or "").lower()
+        hits = {
+            category: sum(1 for pattern in patterns if pattern.search(folded))
+            for category, patterns in CATEGORY_PATTERNS.items()
+        }
+        words = _WORD.findall((question or "").lower())
+        if words and sum(w in _ENGLISH_WORDS for w in words) >= 2 and fold_accents(question) == question:
+            hits['english'] = hits.get('english', 0) + 2
+        hits = {category: n for category, n in hits.items() if n and category in self.category_sizes}
+        total = sum(hits.values())
+        return {category: n / total for category, n in hits.items()} if total else {}
+
+    def classifier_probabilities(self, question_embedding: Optional[np.ndarray]) -> Dict[str, float]:
+        """Softmax(cosine tới centroid / nhiệt độ)"""
+        if self._centroids is None or question_embedding is None:
+            return {}
+        query = np.asarray(question_embedding, dtype='float32').reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        logits = self._centroids @ query / self.temperature
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+        return dict(zip(self.categories, probabilities.tolist()))
+
+    def route(self, question: str, question_embedding: Optional[np.ndarray] = None) -> RouteDecision:
+        """
+        Chọn ít category nhất (<= max_categories) có tổng xác suất >= min_confidence
+
+        Không đạt ngưỡng / chọn đủ mọi category -> categories None (search toàn corpus)
+        """
+        rules = self.rule_scores(question)
+        probabilities = self.classifier_probabilities(question_embedding)
+        reason = 'rules+classifier' if probabilities else 'rules'
+        if rules and not probabilities:
+            # Không có classifier: prior đều, một từ khóa không đủ để route chắc chắn
+            probabilities = {category: 1.0 / len(self.categories) for category in self.categories}
+        if probabilities and rules:
+            combined = {
+                category: (1 - self.rule_weight) * probabilities[category] + self.rule_weight * rules.get(category, 0.0)
+                for category in self.categories
+            }
+        elif probabilities:
+            combined, reason = probabilities, 'classifier'
+        else:
+            combined, reason = {}, 'no_signal'
+
+        selected, confidence = [], 0.0
+        for category in sorted(combined, key=lambda c: -combined[c])[:self.max_categories]:
+            selected.append(category)
+            confidence += combined[category]
+            if confidence >= self.min_confidence:
+                break
+
+        if not combined or confidence < self.min_confidence or len(selected) >= len(self.categories):
+            decision = RouteDecision(None, confidence, combined, reason if combined else 'no_signal')
+        else:
+            decision = RouteDecision(selected, confidence, combined, reason)
+        self._record(decision)
+        return decision
+
+    def searched_vectors(self, categories: Optional[List[str]]) -> int:
+        corpus = sum(self.category_sizes.values())
+        if not categories:
+            return corpus
+        return sum(self.category_sizes.get(category, 0) for category in categories)
+
+    def _record(self, decision: RouteDecision):
+        with self._lock:
+            self._stats['routed' if decision.categories else 'fallback'] += 1
+            self._stats['searched_vectors'] += self.searched_vectors(decision.categories)
+            self._stats['corpus_vectors'] += self.searched_vectors(None)
+
+    def get_stats(self) -> Dict[str, object]:
+        with self._lock:
+            stats = dict(self._stats)
+        decisions = stats['routed'] + stats['fallback']
+        return {
+            **stats,
+            'route_rate': stats['routed'] / decisions if decisions else 0.0,
+            'searched_fraction': stats['searched_vectors'] / stats['corpus_vectors'] if stats['corpus_vectors'] else 1.0,
+            'classifier': self._centroids is not None,
+            'category_sizes': dict(self.category_sizes)
+        }
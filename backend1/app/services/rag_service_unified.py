@@ -5,30 +5,61 @@ Hợp nhất tất cả các chức năng RAG thành một service mạnh mẽ
 """
 
 import os
+import asyncio
+import functools
 import logging
-import pickle
-import faiss
+import threading
 import numpy as np
-from typing import List, Dict, Any, Optional, Union
+import faiss
+from typing import List, Dict, Any, Optional, Union, AsyncIterator
 from transformers import AutoTokenizer, AutoModel
 import torch
 import time
 from datetime import datetime
 from app.services.llm_service import LLMService
+from app.services.inference_executor import get_inference_executor
+from app.services.embedding_batcher import EmbeddingMicroBatcher
+from app.services.answer_cache import AnswerCache
+from app.services.token_streamer import AsyncTokenStreamer
+from app.services.context_packer import ContextPacker
+from app.services.context_expander import ContextExpander
+from app.services.category_index import CategoryPartitionedIndex
+from app.services.query_router import QueryRouter
+from app.services.index_factory import is_mmapped_ivf, load_index
+from app.services.quantized_index import RefinedIndex
+from app.services.chunk_store import ChunkStore, open_chunk_store
+from app.services.segment_store import SegmentStore
+from app.services.chunk_table import ChunkTable
+from app.services.bm25_index import BM25Index
+from app.services.citation_index import CitationIndex, document_keys
+from app.services.reranker import CrossEncoderReranker
+from app.services.generation_profiles import get_generation_profile
+from app.core.metrics import get_metrics_registry
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
 class RAGServiceUnified:
     """RAG Service thống nhất - xử lý tất cả query/response"""
     
+    PIPELINE_MODES = ('two_stage', 'single_pass', 'adaptive')
+    
+    
     def __init__(self):
         self.is_initialized = False
         self.tokenizer = None
         self.model = None
         self.device = None
         self.faiss_index = None
-        self.documents_data = None
-        self.chunks_metadata = []
+        self.index_manifest = None  # Loại index + tham số search (index_factory manifest)
+        self.category_index = None  # CategoryPartitionedIndex: search lọc category trong index
+        self.query_router: Optional[QueryRouter] = None  # Chọn partition cần search khi không có filter_category
+        self.chunk_store: Optional[ChunkStore] = None  # Text chunk, đọc qua mmap
+        self.chunk_table: Optional[ChunkTable] = None  # Metadata chunk dạng cột + thống kê category
+        self.bm25_index: Optional[BM25Index] = None  # Lexical retrieval, fuse với dense bằng RRF
+        self.context_expander: Optional[ContextExpander] = None  # Ghép chunk kề vào hit (mảng kề của chunk_table)
+        self.citation_index: Optional[CitationIndex] = None  # Số hiệu văn bản / Điều / Khoản -> chunk id
+        self.reranker: Optional[CrossEncoderReranker] = None  # Cross-encoder rerank top ứng viên (tùy chọn)
         self.total_chunks = 0
         self.total_documents = 0
         self.initialization_time = None
@@ -36,6 +67,64 @@ class RAGServiceUnified:
         # LLM Service cho text generation
         self.llm_service = None
         
+        # Executor chạy encode/search/generate ngoài event loop
+        self.inference_executor = get_inference_executor()
+        
+        # Gom các câu hỏi đồng thời thành batch trước khi encode
+        self.embedding_batcher = None
+        if settings.EMBEDDING_MICRO_BATCHING:
+            self.embedding_batcher = EmbeddingMicroBatcher(self.encode_texts, self.inference_executor)
+        
+        # Cache câu trả lời (exact + semantic), bị xóa khi index tài liệu thay đổi
+        self.answer_cache = AnswerCache() if settings.ANSWER_CACHE_ENABLED else None
+        self.index_version = None
+        
+        # Time-to-first-token cho các endpoint streaming
+        registry = get_metrics_registry()
+        self.ttft_histogram = registry.histogram(
+            "rag_stream_ttft_ms", "Thời gian từ lúc nhận request tới token đầu tiên (ms)"
+        )
+        
+        # Latency từng stage của query (ms)
+        self.stage_histograms = {
+            stage: registry.histogram(f"rag_{stage}_ms", description)
+            for stage, description in (
+                ('cache_lookup', "Thời gian tra answer cache, gồm encode cho tầng semantic (ms)"),
+                ('encode', "Thời gian encode câu hỏi (ms)"),
+                ('search', "Thời gian FAISS search (ms)"),
+                ('lexical', "Thời gian BM25 search (ms)"),
+                ('citation', "Thời gian tra cứu trích dẫn văn bản / Điều / Khoản (ms)"),
+                ('rerank', "Thời gian rerank cross-encoder (ms)"),
+                ('expansion', "Thời gian ghép chunk kề vào hit (ms)"),
+                ('retrieval', "Thời gian retrieval: encode + search + filter (ms)"),
+                ('stage1', "Thời gian stage 1 - RAG response (ms)"),
+                ('stage2', "Thời gian stage 2 - LLM enhancement (ms)"),
+                ('single_pass', "Thời gian generation single-pass (ms)"),
+                ('generation', "Thời gian generation của query stream (ms)"),
+                ('query_total', "Tổng thời gian xử lý query (ms)")
+            )
+        }
+        
+        # Counters
+        self.cache_hits_counter = registry.counter(
+            "rag_answer_cache_hits_total", "Số lần answer cache hit theo tầng (exact/semantic)"
+        )
+        self.cache_misses_counter = registry.counter(
+            "rag_answer_cache_misses_total", "Số lần answer cache miss"
+        )
+        self.template_fallback_counter = registry.counter(
+            "rag_template_fallback_total", "Số lần dùng câu trả lời template thay cho LLM, theo lý do"
+        )
+        self.enhancement_failures_counter = registry.counter(
+            "rag_enhancement_failures_total", "Số lần stage 2 enhancement lỗi, dùng lại response stage 1"
+        )
+        self.rerank_fallback_counter = registry.counter(
+            "rag_rerank_fallback_total", "Số lần bỏ qua rerank cross-encoder, giữ thứ tự dense, theo lý do"
+        )
+        self.queries_counter = registry.counter(
+            "rag_queries_total", "Số query đã xử lý theo nhánh pipeline"
+        )
+        
         # Cấu hình mặc định
         self.default_top_k = 5
         self.default_similarity_threshold = 0.3
@@ -81,35 +170,107 @@ class RAGServiceUnified:
             pickle_path = os.path.join(data_dir, "all_embeddings.pkl")
             
             logger.info(f"📥 Loading FAISS index: {faiss_path}")
-            self.faiss_index = faiss.read_index(faiss_path)
+            self.faiss_index, self.index_manifest = load_index(faiss_path, mmap=settings.FAISS_MMAP)
+            
+            # 3. Chunk store (text + metadata + category) mmap - chỉ build từ segment store / pickle khi chưa có / nguồn đã đổi
+            logger.info(f"📥 Opening chunk store: {data_dir}")
+            segments_dir = os.path.join(data_dir, "segments")
+            n_indexed = self.faiss_index.ntotal  # Số chunk đã commit vào index chung (FAISS / BM25 / citation)
+            if SegmentStore.exists(segments_dir):
+                segment_store = SegmentStore(segments_dir, writable=False)
+                # Snapshot: segment đang đọc không bị process ingestion xóa sau khi gộp
+                with segment_store.snapshot():
+                    self.chunk_store = open_chunk_store(
+                        data_dir, segment_store.manifest_path, self._determine_category,
+                        load_documents=lambda: (doc for _, doc in segment_store.iter_documents())
+                    )
+                    self._add_uncommitted_vectors(segment_store, n_indexed)
+            else:
+                self.chunk_store = open_chunk_store(data_dir, pickle_path, self._determine_category)
+            if len(self.chunk_store) != self.faiss_index.ntotal:
+                logger.warning(f"⚠️ Chunk store có {len(self.chunk_store)} chunks, index có {self.faiss_index.ntotal} vectors")
+            
+            self.chunk_table = ChunkTable.from_store(self.chunk_store)
+            self.total_chunks = len(self.chunk_table)
+            self.total_documents = self.chunk_table.n_documents
+            
+            # Ghép chunk kề: đếm token bằng tokenizer của LLM (ước lượng nếu không có LLM)
+            self.context_expander = None
+            if settings.CONTEXT_EXPANSION_ENABLED:
+                self.context_expander = ContextExpander(
+                    self.chunk_table, self.chunk_store.text, self._get_context_packer().count_tokens
+                )
+            
+            # Sub-index theo category để filter_category luôn trả đủ top_k
+            self.category_index = None
+            ids_by_category = self.chunk_table.ids_by_category()
+            if settings.CATEGORY_PARTITIONED_SEARCH:
+                try:
+                    # Inverted lists IVF mmap: lọc bằng ID selector (chỉ quét nprobe list), không chép vector
+                    # vào RAM của từng worker. Index đọc vào RAM (flat...): sub-index, chi phí theo kích thước category
+                    mmapped = settings.FAISS_MMAP and is_mmapped_ivf(self.faiss_index)
+                    self.category_index = CategoryPartitionedIndex(
+                        self.faiss_index, ids_by_category,
+                        use_selectors=True if mmapped else None
+                    )
+                except Exception as e:
+                    logger.warning(f"⚠️ Không tạo được category index: {e}, dùng search + lọc sau")
             
-            logger.info(f"📥 Loading documents data: {pickle_path}")
-            with open(pickle_path, 'rb') as f:
-                self.documents_data = pickle.load(f)
+            # Query router (cần category index để search riêng từng partition)
+            self.query_router = None
+            if settings.QUERY_ROUTER_ENABLED and self.category_index is not None:
+                try:
+                    self.query_router = QueryRouter.from_index(self.faiss_index, ids_by_category)
+                except Exception as e:
+                    logger.warning(f"⚠️ Không tạo được query router: {e}, search toàn corpus")
             
-            # 3. Tạo chunks metadata với category mapping
-            logger.info("🔄 Processing chunks metadata...")
-            self.chunks_metadata = []
+            # BM25 index (build lúc ingestion, build lại từ chunk store nếu thiếu / lệch số chunk)
+            self.bm25_index = None
+            if settings.HYBRID_SEARCH_ENABLED:
+                try:
+                    self.bm25_index = BM25Index.load(data_dir)
+                    if self.bm25_index is not None and self.bm25_index.n_docs == n_indexed < len(self.chunk_store):
+                        # Chunk chưa commit: thêm trong RAM, file index chỉ do ingestion ghi
+                        self.bm25_index.add(self.chunk_store.text(i) for i in range(n_indexed, len(self.chunk_store)))
+                    if self.bm25_index is None or self.bm25_index.n_docs != len(self.chunk_store):
+                        logger.info("🔄 Building BM25 index từ chunk store...")
+                        self.bm25_index = BM25Index(k1=settings.BM25_K1, b=settings.BM25_B)
+                        self.bm25_index.add(self.chunk_store.text(i) for i in range(len(self.chunk_store)))
+                        self.bm25_index.save(data_dir)
+                except Exception as e:
+                    logger.warning(f"⚠️ Không tạo được BM25 index: {e}, chỉ dùng dense search")
+                    self.bm25_index = None
             
-            for doc_idx, doc in enumerate(self.documents_data):
-                pdf_name = doc.get('pdf_name', 'Unknown')
-                chunks = doc.get('chunks', [])
-                
-                # Xác định category dựa trên pdf_name
-                category = self._determine_category(pdf_name)
-                
-                for chunk_idx, chunk in enumerate(chunks):
-                    self.chunks_metadata.append({
-                        'doc_idx': doc_idx,
-                        'chunk_idx': chunk_idx,
-                        'pdf_name': pdf_name,
-                        'content': chunk,
-                        'category': category,
-                        'content_length': len(chunk)
-                    })
-            
-            self.total_chunks = len(self.chunks_metadata)
-            self.total_documents = len(self.documents_data)
+            # Citation index (build lúc ingestion, build lại từ chunk store nếu thiếu / lệch số chunk)
+            self.citation_index = None
+            if settings.CITATION_LOOKUP_ENABLED:
+                try:
+                    self.citation_index = CitationIndex.load(data_dir)
+                    if self.citation_index is not None and self.citation_index.n_chunks == n_indexed < len(self.chunk_store):
+                        self._add_citation_documents(n_indexed)  # Chunk chưa commit, chỉ trong RAM
+                    if self.citation_index is None or self.citation_index.n_chunks != len(self.chunk_store):
+                        logger.info("🔄 Building citation index từ chunk store...")
+                        self.citation_index = CitationIndex()
+                        self._add_citation_documents()
+                        self.citation_index.save(data_dir)
+                except Exception as e:
+                    logger.warning(f"⚠️ Không tạo được citation index: {e}")
+                    self.citation_index = None
+            
+            # Cross-encoder rerank (tắt mặc định)
+            self.reranker = None
+            if settings.CROSS_ENCODER_RERANK_ENABLED:
+                try:
+                    self.reranker = CrossEncoderReranker()
+                    self.reranker.load_model()
+                except Exception as e:
+                    logger.warning(f"⚠️ Cross-encoder failed to load: {e}, giữ thứ tự dense")
+                    self.reranker = None
+            
+            # Version của index tài liệu - dùng để invalidate answer cache
+            self.index_version = self._compute_index_version(faiss_path)
+            if self.answer_cache is not None:
+                self.answer_cache.set_index_version(self.index_version)
             
             end_time = time.time()
             self.initialization_time = end_time - start_time
@@ -124,6 +285,14 @@ class RAGServiceUnified:
             logger.error(f"❌ Lỗi khởi tạo RAG Service Unified: {e}")
             raise
     
+    def _compute_index_version(self, faiss_path: str) -> str:
+        """Version của index = mtime file FAISS + số vectors"""
+        try:
+            mtime_ns = os.stat(faiss_path).st_mtime_ns
+        except OSError:
+            mtime_ns = 0
+        return f"{mtime_ns}-{self.faiss_index.ntotal}"
+    
     def _extract_main_topic(self, question_lower: str) -> str:
         """Trích xuất chủ đề chính từ câu hỏi"""
         # Mapping keywords to topics
@@ -205,7 +374,7 @@ class RAGServiceUnified:
                 basic_response = self._generate_basic_llm_response(question, search_results)
             else:
                 # Template-based response
-                basic_response = self._generate_template_response(question, search_results)
+                basic_response = self._generate_template_response(question, search_results, reason='llm_unavailable')
             
             return {
                 'raw_response': basic_response,
@@ -218,7 +387,7 @@ class RAGServiceUnified:
             logger.error(f"❌ RAG response generation error: {e}")
             # Fallback to template
             return {
-                'raw_response': self._generate_template_response(question, search_results),
+                'raw_response': self._generate_template_response(question, search_results, reason='stage1_error'),
                 'sources': search_results,
                 'confidence': 0.5,
                 'stage': 'rag_generation'
@@ -227,43 +396,21 @@ class RAGServiceUnified:
     def _generate_basic_llm_response(self, question: str, search_results: List[Dict]) -> str:
         """Tạo response cơ bản từ LLM với prompt đơn giản"""
         try:
-            # Simple prompt cho basic generation
-            context_text = ""
-            for i, result in enumerate(search_results[:3], 1):
-                context_text += f"\n=== Nguồn {i}: {result['pdf_name']} ===\n{result['content'][:400]}\n"
-            
-            basic_prompt = f"""
-            Dựa trên các tài liệu sau, hãy trả lời câu hỏi: {question}
-            
-            Tài liệu:
-            {context_text}
-            
-            Trả lời ngắn gọn và chính xác:
-            """
-            
-            # Cấu hình generation cho basic response
-            basic_generation_config = {
-                'temperature': 0.6,
-                'max_new_tokens': 200,
-                'top_p': 0.9,
-                'top_k': 50,
-                'repetition_penalty': 1.1
-            }
-            
+            # LLMService._create_prompt đóng gói context theo ngân sách token
             response = self.llm_service.generate_response(
                 query=question,
-                context_docs=search_results[:3],
-                max_new_tokens=200,
-                generation_config=basic_generation_config
+                context_docs=self._to_context_docs(search_results[:3]),
+                generation_config=get_generation_profile('basic')
             )
             return response
             
         except Exception as e:
             logger.warning(f"Basic LLM generation failed: {e}")
-            return self._generate_template_response(question, search_results)
+            return self._generate_template_response(question, search_results, reason='basic_llm_error')
     
-    def _generate_template_response(self, question: str, search_results: List[Dict]) -> str:
-        """Tạo response từ template (fallback)"""
+    def _generate_template_response(self, question: str, search_results: List[Dict], reason: str = 'llm_unavailable') -> str:
+        """Tạo response từ template (fallback), reason được đếm trong rag_template_fallback_total"""
+        self.template_fallback_counter.inc(reason=reason)
         if not search_results:
             return "Xin lỗi, tôi không tìm thấy thông tin liên quan đến câu hỏi của bạn."
         
@@ -281,14 +428,15 @@ class RAGServiceUnified:
         if not search_results:
             return 0.0
         
-        # Average similarity score
-        avg_similarity = sum(r['similarity'] for r in search_results[:3]) / min(len(search_results), 3)
+        # 'similarity' là khoảng cách L2 thô (nhỏ là gần) - dùng confidence đã chuẩn hóa
+        # (sigmoid rerank_score nếu đã rerank, ngược lại chuẩn hóa khoảng cách)
+        retrieval_confidence = self._calculate_confidence(search_results, max_sources=3)
         
         # Diversity bonus
         categories = set(r['category'] for r in search_results[:3])
         diversity_bonus = min(len(categories) * 0.1, 0.2)
         
-        return min(avg_similarity + diversity_bonus, 1.0)
+        return min(retrieval_confidence + diversity_bonus, 1.0)
     
     def _enhance_response_with_llm(self, rag_response: Dict[str, Any], question: str) -> Dict[str, Any]:
         """Stage 2: Nâng cao chất lượng response bằng LLM"""
@@ -321,6 +469,7 @@ class RAGServiceUnified:
             
         except Exception as e:
             logger.warning(f"LLM enhancement failed: {e}")
+            self.enhancement_failures_counter.inc()
             # Fallback to original response
             return {
                 'original_response': rag_response['raw_response'],
@@ -331,6 +480,119 @@ class RAGServiceUnified:
                 'stage': 'rag_generation'
             }
     
+    # ==================== PIPELINE SINGLE-PASS / ADAPTIVE ====================
+    
+    def _generate_single_pass_response(self, question: str, search_results: List[Dict]) -> Dict[str, Any]:
+        """Sinh câu trả lời hoàn chỉnh trong một lần gọi LLM (gộp stage 1 + stage 2)"""
+        try:
+            logger.info(f"⚡ Single-pass generation for: {question[:50]}...")
+            
+            prompt = self._create_single_pass_prompt(question, search_results)
+            answer = self.llm_service.generate_from_prompt(
+                prompt,
+                generation_config=get_generation_profile('enhancement')
+            )
+            
+            if len(answer.strip()) < 10:
+                logger.warning("Single-pass response too short, using template")
+                answer = self._generate_template_response(question, search_results, reason='single_pass_too_short')
+            
+            return {
+                'original_response': answer,
+                'enhanced_response': answer,
+                'sources': search_results,
+                'confidence': self._calculate_single_pass_confidence(search_results, answer),
+                'enhancement_applied': False,
+                'stage': 'single_pass'
+            }
+            
+        except Exception as e:
+            logger.warning(f"Single-pass generation failed: {e}")
+            answer = self._generate_template_response(question, search_results, reason='single_pass_error')
+            return {
+                'original_response': answer,
+                'enhanced_response': answer,
+                'sources': search_results,
+                'confidence': self._calculate_basic_confidence(search_results),
+                'enhancement_applied': False,
+                'stage': 'rag_generation'
+            }
+    
+    def _create_single_pass_prompt(self, question: str, search_results: List[Dict]) -> str:
+        """Prompt gộp: tài liệu + yêu cầu trình bày của stage enhancement"""
+        question_type = self._classify_question_type(question)
+        
+        system_prompt = f"""Bạn là chuyên gia an toàn thông tin. Chỉ trả lời dựa trên tài liệu được cung cấp.
+
+**QUY TẮC VIẾT:**
+- Tiếng Việt chuẩn, không lỗi chính tả và ngữ pháp
+- Câu hoàn chỉnh, dấu câu đúng, tránh lặp từ
+- Sử dụng thuật ngữ kỹ thuật chính xác
+- Cấu trúc rõ ràng: định nghĩa → đặc điểm → ví dụ → giải pháp
+- Tối đa 300 từ, súc tích nhưng đầy đủ
+
+**LOẠI CÂU HỎI:** {question_type}"""
+        
+        sources_context = ""
+        for i, (source, content) in enumerate(
+                self._pack_sources(question, search_results[:3], settings.CONTEXT_TOKEN_BUDGET), 1):
+            sources_context += f"\n**Nguồn {i}:** {source['pdf_name']}\n{content}\n"
+        
+        user_prompt = f"""**Nguồn tài liệu:**
+{sources_context}
+
+**Câu hỏi:** {question}
+
+**Câu trả lời:**"""
+        
+        return f"<|im_start|>system\n{system_prompt}\n<|im_end|>\n<|im_start|>user\n{user_prompt}\n<|im_end|>\n<|im_start|>assistant\n"
+    
+    def _get_context_packer(self) -> ContextPacker:
+        """ContextPacker theo tokenizer LLM (ước lượng số token nếu không có LLM)"""
+        return self.llm_service.get_context_packer() if self.llm_service else ContextPacker()
+    
+    def _pack_sources(self, question: str, sources: List[Dict], token_budget: int) -> List[tuple]:
+        """Chọn câu liên quan trong các nguồn theo ngân sách token, trả về [(source, nội dung đã chọn)]"""
+        packed = self._get_context_packer().pack(question, [source['content'] for source in sources], token_budget)
+        return [(source, content) for source, content in zip(sources, packed.passages) if content]
+    
+    @staticmethod
+    def _to_context_docs(search_results: List[Dict]) -> List[Dict]:
+        """Chuyển search results sang định dạng context_docs của LLMService"""
+        return [
+            {
+                'content': result['content'],
+                'metadata': {
+                    'filename': result['pdf_name'],
+                    'category': result['category'],
+                    'similarity': result['similarity']
+                }
+            }
+            for result in search_results
+        ]
+    
+    def _calculate_single_pass_confidence(self, search_results: List[Dict], response: str) -> float:
+        """Confidence cho single-pass: confidence retrieval + bonus chất lượng và sử dụng nguồn"""
+        confidence = (self._calculate_basic_confidence(search_results)
+                      + self._calculate_quality_bonus(response)
+                      + self._calculate_source_utilization_bonus(response, search_results))
+        return min(max(confidence, 0.0), 1.0)
+    
+    def _should_skip_enhancement(self, rag_response: Dict[str, Any]) -> bool:
+        """Adaptive: bỏ stage 2 khi retrieval đủ tin cậy hoặc draft đã hoàn chỉnh"""
+        if rag_response['confidence'] >= settings.ADAPTIVE_SKIP_CONFIDENCE:
+            return True
+        return self._is_well_formed_draft(rag_response['raw_response'])
+    
+    def _is_well_formed_draft(self, draft: str) -> bool:
+        """Draft đủ dài, kết thúc trọn câu và không có dấu hiệu lỗi/lặp từ"""
+        draft = draft.strip()
+        if len(draft) < settings.ADAPTIVE_MIN_DRAFT_LENGTH:
+            return False
+        if draft[-1] not in '.!?:)':
+            return False
+        return not self._has_quality_issues(draft)
+    
     def _prepare_enhancement_context(self, rag_response: Dict[str, Any], question: str) -> Dict[str, Any]:
         """Chuẩn bị context cho enhancement"""
         return {
@@ -394,8 +656,9 @@ class RAGServiceUnified:
 
         # Context từ sources - rút gọn để tránh quá dài
         sources_context = ""
-        for i, source in enumerate(sources[:2], 1):  # Chỉ lấy 2 sources đầu
-            sources_context += f"\n**Nguồn {i}:** {source['pdf_name']}\n{source['content'][:300]}...\n"
+        for i, (source, content) in enumerate(
+                self._pack_sources(question, sources[:3], settings.CONTEXT_TOKEN_BUDGET_ENHANCEMENT), 1):
+            sources_context += f"\n**Nguồn {i}:** {source['pdf_name']}\n{content}\n"
         
         # User prompt - đơn giản và rõ ràng
         user_prompt = f"""**Câu hỏi:** {question}
@@ -420,24 +683,12 @@ class RAGServiceUnified:
     def _call_llm_for_enhancement(self, enhancement_prompt: str) -> str:
         """Gọi LLM để enhance response"""
         try:
-            # Cấu hình tối ưu cho enhancement - tập trung vào chất lượng
-            generation_config = {
-                'temperature': 0.4,  # Giảm để ổn định hơn, giảm lỗi chính tả
-                'top_p': 0.75,  # Giảm để tập trung hơn
-                'top_k': 30,  # Giảm để ổn định hơn
-                'repetition_penalty': 1.25,  # Tăng để tránh lặp từ
-                'no_repeat_ngram_size': 4,  # Tăng để tránh lặp cụm từ
-                'max_new_tokens': 300,  # Giảm để tránh quá dài
-                'do_sample': True,
-                'early_stopping': False  # Tắt để tránh warning với num_beams=1
-            }
-            
-            # Gọi LLM với prompt enhancement
-            enhanced_response = self.llm_service.generate_response(
-                query=enhancement_prompt,
-                context_docs=None,  # Không cần context docs vì đã có trong prompt
-                max_new_tokens=generation_config['max_new_tokens'],
-                generation_config=generation_config
+            # Profile 'enhancement' - tập trung vào chất lượng, giảm lỗi chính tả và lặp từ
+            # enhancement_prompt đã là prompt ChatML hoàn chỉnh - không bọc thêm system prompt,
+            # system prompt của nó được dùng lại qua prefix KV cache
+            enhanced_response = self.llm_service.generate_from_prompt(
+                enhancement_prompt,
+                generation_config=get_generation_profile('enhancement')
             )
             
             return enhanced_response
@@ -611,19 +862,10 @@ class RAGServiceUnified:
             # Kiểm tra LLM service
             if not self.llm_service:
                 logger.warning("❌ LLM service not available, using template")
-                return self._generate_template_answer(question, search_results)
+                return self._generate_template_answer(question, search_results, reason='llm_unavailable')
             
             # Chuẩn bị context từ search results
-            context_docs = []
-            for result in search_results[:3]:  # Top 3 results
-                context_docs.append({
-                    'content': result['content'][:800],  # Giới hạn length để tránh token limit
-                    'metadata': {
-                        'filename': result['pdf_name'],
-                        'category': result['category'],
-                        'similarity': result['similarity']
-                    }
-                })
+            context_docs = self._to_context_docs(search_results[:3])  # Top 3 results, đóng gói theo token trong LLMService
             
             logger.info(f"📖 Prepared {len(context_docs)} context docs for LLM")
             
@@ -637,11 +879,11 @@ class RAGServiceUnified:
             # Kiểm tra response quality
             if not llm_response or len(llm_response.strip()) < 20:
                 logger.warning("❌ LLM response too short, using template fallback")
-                return self._generate_template_answer(question, search_results)
+                return self._generate_template_answer(question, search_results, reason='llm_too_short')
             
             if "không thể" in llm_response or "thử lại" in llm_response:
                 logger.warning("❌ LLM returned error message, using template fallback")
-                return self._generate_template_answer(question, search_results)
+                return self._generate_template_answer(question, search_results, reason='llm_error_message')
             
             # Tính confidence dựa trên search results quality
             confidence = self._calculate_confidence(search_results, max_sources=3)
@@ -659,10 +901,11 @@ class RAGServiceUnified:
             logger.error(f"❌ Lỗi LLM generation: {e}")
             logger.info("🔄 Falling back to template generation")
             # Fallback to template
-            return self._generate_template_answer(question, search_results)
+            return self._generate_template_answer(question, search_results, reason='llm_error')
     
-    def _generate_template_answer(self, question: str, search_results: List[Dict]) -> Dict[str, Any]:
+    def _generate_template_answer(self, question: str, search_results: List[Dict], reason: str = 'llm_unavailable') -> Dict[str, Any]:
         """Tạo câu trả lời bằng template (fallback)"""
+        self.template_fallback_counter.inc(reason=reason)
         try:
             # 1. Phân tích câu hỏi để xác định chủ đề và style
             question_lower = question.lower()
@@ -774,6 +1017,12 @@ class RAGServiceUnified:
             if not top_results:
                 return 0.0
             
+            # Đã rerank bằng cross-encoder: confidence = sigmoid(logit relevance) trung bình
+            if all('rerank_score' in r for r in top_results):
+                confidence = float(np.mean([1.0 / (1.0 + np.exp(-r['rerank_score'])) for r in top_results]))
+                logger.info(f"📊 Confidence calculation (rerank): confidence={confidence:.3f}")
+                return confidence
+            
             # Tính điểm trung bình
             avg_score = sum(r['score'] for r in top_results) / len(top_results)
             
@@ -793,12 +1042,16 @@ class RAGServiceUnified:
             logger.error(f"❌ Lỗi tính confidence: {e}")
             return 0.0
     
-    def _determine_category(self, pdf_name: str) -> str:
+    @staticmethod
+    def _determine_category(pdf_name: str) -> str:
         """Xác định category dựa trên tên file"""
         pdf_lower = pdf_name.lower()
         
         if any(keyword in pdf_lower for keyword in ['luat', 'nghi_dinh', 'quyet_dinh', 'thong_tu', 'tcvn']):
             return 'luat'
+        elif document_keys(pdf_name):
+            # Tên file theo số hiệu văn bản (13_2023_ND-CP_465185, 03_2017_TT-BTTTT_348836) - cùng mẫu citation index
+            return 'luat'
         elif any(keyword in pdf_lower for keyword in ['nist', 'iso', 'cybersecurity', 'framework']):
             return 'english'
         else:
@@ -806,13 +1059,20 @@ class RAGServiceUnified:
     
     def encode_text(self, text: str) -> np.ndarray:
         """Encode text thành embedding vector"""
+        return self.encode_texts([text])
+    
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Encode nhiều text trong một forward pass, trả về [len(texts), dim]"""
         try:
-            inputs = self.tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512)
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=512)
             inputs = {k: v.to(self.device) for k, v in inputs.items()}
             
             with torch.no_grad():
                 outputs = self.model(**inputs)
-                embeddings = outputs.last_hidden_state.mean(dim=1)
+                # Mean pooling chỉ trên token thật (bỏ padding) để kết quả giống encode từng câu
+                mask = inputs['attention_mask'].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+                summed = (outputs.last_hidden_state * mask).sum(dim=1)
+                embeddings = summed / mask.sum(dim=1).clamp(min=1e-9)
                 return embeddings.cpu().numpy()
                 
         except Exception as e:
@@ -837,44 +1097,382 @@ class RAGServiceUnified:
             # 1. Encode question
             question_embedding = self.encode_text(question)
             
-            # 2. FAISS search với top_k cao hơn để có nhiều lựa chọn
-            search_k = min(top_k * 3, 50)  # Tìm nhiều hơn để filter
-            scores, indices = self.faiss_index.search(question_embedding.astype('float32'), search_k)
+            # 2. Câu hỏi trích dẫn văn bản / Điều / Khoản -> lấy chunk trực tiếp từ citation index
+            stage_start = time.time()
+            citation_results = self._citation_search(question, question_embedding, top_k, filter_category)
+            self._observe_stage('citation', stage_start)
+            if citation_results and settings.CITATION_SKIP_VECTOR_SEARCH:
+                return self._expand_context(citation_results)
+            
+            # 3. FAISS search (lọc category trong index nếu có category index / router chọn) + BM25
+            search_filter = self._route(question, question_embedding, filter_category)
+            candidate_k = self._candidate_k(top_k)
+            search_k = self._search_k(candidate_k, search_filter)
+            scores, indices = self._search_index(question_embedding, search_k, search_filter)
+            lexical_ids = self._lexical_search(question, search_k, search_filter)
+            
+            # 4. Tạo kết quả và filter (fuse dense + BM25 bằng RRF)
+            results = self._build_search_results(
+                scores, indices, candidate_k, search_filter, similarity_threshold, lexical_ids, question_embedding
+            )
             
-            # 3. Tạo kết quả và filter
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if 0 <= idx < len(self.chunks_metadata):
-                    chunk_meta = self.chunks_metadata[idx]
-                    
-                    # Filter theo category nếu có
-                    if filter_category and filter_category != 'all':
-                        if chunk_meta['category'] != filter_category:
-                            continue
-                    
-                    # Filter theo similarity threshold
-                    if score < similarity_threshold:
-                        continue
-                    
-                    results.append({
-                        'score': float(score),
-                        'similarity': float(score),
-                        'pdf_name': chunk_meta['pdf_name'],
-                        'content': chunk_meta['content'],
-                        'category': chunk_meta['category'],
-                        'content_length': chunk_meta['content_length'],
-                        'doc_idx': chunk_meta['doc_idx'],
-                        'chunk_idx': chunk_meta['chunk_idx']
-                    })
-            
-            # 4. Sắp xếp theo score và lấy top_k
-            results.sort(key=lambda x: x['score'], reverse=True)
-            return results[:top_k]
+            # 5. Rerank cross-encoder (nếu bật)
+            if self.reranker is not None:
+                stage_start = time.time()
+                results = self._rerank(question, results)
+                self._observe_stage('rerank', stage_start)
+            
+            # 6. Ghép chunk kề vào hit
+            return self._expand_context(self._with_citation_results(citation_results, results, top_k))
+            
+        except Exception as e:
+            logger.error(f"❌ Lỗi search chunks: {e}")
+            return []
+    
+    async def search_relevant_chunks_async(self, 
+                                         question: str, 
+                                         top_k: int = None,
+                                         filter_category: Optional[str] = None,
+                                         similarity_threshold: float = None,
+                                         question_embedding: Optional[np.ndarray] = None,
+                                         timings: Optional[Dict[str, int]] = None) -> List[Dict]:
+        """
+        Giống search_relevant_chunks nhưng encode/search chạy trong inference executor
+        
+        timings (nếu có) được ghi thêm encode_ms / search_ms
+        """
+        try:
+            if not self.is_initialized:
+                raise RuntimeError("Service chưa được khởi tạo")
+            
+            if top_k is None:
+                top_k = self.default_top_k
+            if similarity_threshold is None:
+                similarity_threshold = self.default_similarity_threshold
+            
+            # 1. Encode question (bỏ qua nếu caller đã encode sẵn)
+            if question_embedding is None:
+                question_embedding = await self.encode_question_async(question, timings)
+            
+            # 2. Trích dẫn văn bản / Điều / Khoản -> chunk trực tiếp (bỏ qua vector search nếu có)
+            citation_results = await self._timed_stage('citation', timings, self.inference_executor.run_search(
+                self._citation_search, question, question_embedding, top_k, filter_category
+            ))
+            if citation_results and settings.CITATION_SKIP_VECTOR_SEARCH:
+                return await self.inference_executor.run_search(self._expand_context, citation_results, timings)
+            
+            # 3. FAISS search và BM25 search song song (thread pool 'search'), trong partition router chọn
+            search_filter = self._route(question, question_embedding, filter_category)
+            candidate_k = self._candidate_k(top_k)
+            search_k = self._search_k(candidate_k, search_filter)
+            (scores, indices), lexical_ids = await asyncio.gather(
+                self._timed_stage('search', timings, self.inference_executor.run_search(
+                    self._search_index, question_embedding, search_k, search_filter
+                )),
+                self._timed_stage('lexical', timings, self.inference_executor.run_search(
+                    self._lexical_search, question, search_k, search_filter
+                ))
+            )
+            
+            # 4. Filter + fuse kết quả - nhẹ, chạy trực tiếp trên event loop
+            results = self._build_search_results(
+                scores, indices, candidate_k, search_filter, similarity_threshold, lexical_ids, question_embedding
+            )
+            
+            # 5. Rerank cross-encoder trong thread pool 'encode', có giới hạn thời gian
+            if self.reranker is not None:
+                results = await self._timed_stage('rerank', timings, self._rerank_async(question, results))
+            
+            # 6. Ghép chunk kề vào hit (đọc text + đếm token trong thread pool 'search')
+            return await self.inference_executor.run_search(
+                self._expand_context, self._with_citation_results(citation_results, results, top_k), timings
+            )
             
         except Exception as e:
             logger.error(f"❌ Lỗi search chunks: {e}")
             return []
     
+    async def encode_question_async(self, question: str, timings: Optional[Dict[str, int]] = None) -> np.ndarray:
+        """Encode câu hỏi trong thread pool 'encode' (qua micro-batcher nếu bật)"""
+        stage_start = time.time()
+        if self.embedding_batcher is not None:
+            embedding = await self.embedding_batcher.encode(question)
+        else:
+            embedding = await self.inference_executor.run_encode(self.encode_text, question)
+        self._observe_stage('encode', stage_start, timings)
+        return embedding
+    
+    def _observe_stage(self, stage: str, stage_start: float, timings: Optional[Dict[str, int]] = None) -> int:
+        """Ghi thời gian stage (tính từ stage_start) vào histogram rag_<stage>_ms và timings['<stage>_ms']"""
+        elapsed_ms = (time.time() - stage_start) * 1000
+        self.stage_histograms[stage].observe(elapsed_ms)
+        if timings is not None:
+            timings[f'{stage}_ms'] = int(elapsed_ms)
+        return int(elapsed_ms)
+    
+    async def _timed_stage(self, stage: str, timings: Optional[Dict[str, int]], awaitable):
+        """Await và ghi thời gian vào histogram rag_<stage>_ms"""
+        stage_start = time.time()
+        result = await awaitable
+        self._observe_stage(stage, stage_start, timings)
+        return result
+    
+    def _lexical_search(self, question: str, search_k: int, filter_category: Optional[Union[str, List[str]]] = None) -> Optional[np.ndarray]:
+        """Id các chunk top BM25 (None nếu tắt hybrid search)"""
+        if self.bm25_index is None:
+            return None
+        _, ids = self.bm25_index.search(question, search_k, self.chunk_table.category_mask(filter_category))
+        return ids
+    
+    def _dense_scores(self, question_embedding: np.ndarray, chunk_ids: np.ndarray) -> Optional[np.ndarray]:
+        """Score FAISS (cùng metric với index) cho các chunk chỉ được BM25 tìm thấy"""
+        try:
+            vectors = np.asarray(self.faiss_index.reconstruct_batch(chunk_ids.astype('int64')), dtype='float32')
+        except RuntimeError:
+            return None
+        query = question_embedding.reshape(-1).astype('float32')
+        if self.faiss_index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return vectors @ query
+        return ((vectors - query) ** 2).sum(axis=1)
+    
+    def _citation_search(self,
+                         question: str,
+                         question_embedding: np.ndarray,
+                         top_k: int,
+                         filter_category: Optional[str] = None) -> List[Dict]:
+        """
+        Chunk của văn bản (Điều / Khoản nếu có) được trích dẫn trong câu hỏi - [] nếu không khớp văn bản nào
+        
+        Xếp hạng bằng score FAISS tính lại từ vector của các chunk đó (không search);
+        Điều / Khoản trả về theo thứ tự đọc trong văn bản
+        """
+        if self.citation_index is None:
+            return []
+        match = self.citation_index.lookup_question(question)
+        if match is None:
+            return []
+        chunk_ids = np.asarray(match.chunk_ids, dtype='int64')
+        chunk_ids = chunk_ids[self.chunk_table.select(chunk_ids, np.zeros(len(chunk_ids)), filter_category)]
+        if not len(chunk_ids):
+            return []
+        
+        scores = self._dense_scores(question_embedding, chunk_ids)
+        if scores is None:
+            scores = np.zeros(len(chunk_ids), dtype='float32')
+            order = np.arange(len(chunk_ids))
+        else:
+            order = self._dense_order(scores)
+        order = order[:top_k]
+        if match.unit is not None:
+            order = np.sort(order)
+        
+        unit = f" Điều {match.unit}" if match.unit else ""
+        logger.info(f"📌 Citation lookup: {', '.join(match.documents)}{unit} -> {len(chunk_ids)} chunks")
+        return self._make_results(chunk_ids[order], scores[order], ['citation'] * len(order))
+    
+    @staticmethod
+    def _with_citation_results(citation_results: List[Dict], results: List[Dict], top_k: int) -> List[Dict]:
+        """Chunk trích dẫn đứng đầu, sau đó là kết quả dense/hybrid chưa trùng"""
+        if not citation_results:
+            return results[:top_k]
+        seen = {r['chunk_id'] for r in citation_results}
+        return (citation_results + [r for r in results if r['chunk_id'] not in seen])[:top_k]
+    
+    def _expand_context(self, results: List[Dict], timings: Optional[Dict[str, int]] = None) -> List[Dict]:
+        """Ghép chunk kề (cùng tài liệu) vào từng hit trong CONTEXT_EXPANSION_TOKEN_BUDGET"""
+        if self.context_expander is None:
+            return results
+        stage_start = time.time()
+        try:
+            return self.context_expander.expand(
+                results, settings.CONTEXT_EXPANSION_TOKEN_BUDGET, settings.CONTEXT_EXPANSION_WINDOW
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Không ghép được chunk kề: {e}")
+            return results
+        finally:
+            self._observe_stage('expansion', stage_start, timings)
+    
+    def _route(self,
+               question: str,
+               question_embedding: np.ndarray,
+               filter_category: Optional[str]) -> Optional[Union[str, List[str]]]:
+        """filter_category của client, hoặc các category router chọn (None = toàn corpus)"""
+        if self.query_router is None or (filter_category and filter_category != 'all'):
+            return filter_category
+        decision = self.query_router.route(question, question_embedding)
+        if decision.categories:
+            logger.debug(f"🧭 Router: {decision.categories} (confidence={decision.confidence:.2f}, {decision.reason})")
+        return decision.categories
+    
+    def _candidate_k(self, top_k: int) -> int:
+        """Số kết quả lấy trước rerank: đủ ngân sách ứng viên của cross-encoder"""
+        if self.reranker is None:
+            return top_k
+        return max(top_k, self.reranker.max_candidates)
+    
+    def _rerank(self, question: str, results: List[Dict]) -> List[Dict]:
+        """Rerank bằng cross-encoder, lỗi -> giữ thứ tự dense"""
+        try:
+            return self.reranker.rerank(question, results)
+        except Exception as e:
+            logger.warning(f"⚠️ Rerank lỗi: {e}, giữ thứ tự dense")
+            self.rerank_fallback_counter.inc(reason='error')
+            return results
+    
+    async def _rerank_async(self, question: str, results: List[Dict]) -> List[Dict]:
+        """
+        Rerank trong inference executor với giới hạn CROSS_ENCODER_TIMEOUT_MS
+        
+        Quá thời gian -> trả thứ tự dense; forward pass vẫn chạy xong trong thread
+        và ghi score vào cache nên lần hỏi lại sẽ được rerank
+        """
+        # Rerank sửa trực tiếp dict kết quả - chạy trên bản sao để fallback không lẫn rerank_score
+        candidates = [dict(r) for r in results]
+        try:
+            return await asyncio.wait_for(
+                self.inference_executor.run_encode(self.reranker.rerank, question, candidates),
+                timeout=settings.CROSS_ENCODER_TIMEOUT_MS / 1000
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Rerank quá {settings.CROSS_ENCODER_TIMEOUT_MS:.0f}ms, giữ thứ tự dense")
+            self.rerank_fallback_counter.inc(reason='timeout')
+        except Exception as e:
+            logger.warning(f"⚠️ Rerank lỗi: {e}, giữ thứ tự dense")
+            self.rerank_fallback_counter.inc(reason='error')
+        return results
+    
+    def _uses_category_index(self, filter_category: Optional[Union[str, List[str]]]) -> bool:
+        return self.category_index is not None and bool(filter_category) and filter_category != 'all'
+    
+    def _search_k(self, top_k: int, filter_category: Optional[Union[str, List[str]]]) -> int:
+        """Số neighbours cần lấy từ FAISS"""
+        if self._uses_category_index(filter_category):
+            # Sub-index chỉ chứa chunk đúng category - không cần lấy dư để lọc
+            return top_k
+        return min(top_k * 3, 50)  # Tìm nhiều hơn để filter
+    
+    def _search_index(self, question_embedding: np.ndarray, search_k: int, filter_category: Optional[Union[str, List[str]]] = None):
+        """Chạy FAISS search cho embedding câu hỏi (trong sub-index của category nếu có)"""
+        if self._uses_category_index(filter_category):
+            return self.category_index.search(question_embedding, search_k, filter_category)
+        return self.faiss_index.search(question_embedding.astype('float32'), search_k)
+    
+    def _build_search_results(self,
+                              scores: np.ndarray,
+                              indices: np.ndarray,
+                              top_k: int,
+                              filter_category: Optional[Union[str, List[str]]],
+                              similarity_threshold: float,
+                              lexical_ids: Optional[np.ndarray] = None,
+                              question_embedding: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Chuyển kết quả FAISS (+ BM25 nếu có) thành danh sách chunks đã filter
+        
+        Có lexical_ids: xếp hạng bằng reciprocal rank fusion, hit chỉ có ở BM25 không áp similarity threshold
+        """
+        # Filter id hợp lệ / category / similarity threshold trên các cột metadata
+        mask = self.chunk_table.select(indices[0], scores[0], filter_category, similarity_threshold)
+        hit_ids = indices[0][mask]
+        hit_scores = scores[0][mask]
+        
+        if lexical_ids is not None and len(lexical_ids):
+            hit_ids, hit_scores, sources = self._fuse_rankings(hit_ids, hit_scores, lexical_ids, question_embedding, top_k)
+        else:
+            # Sắp xếp theo score (gần nhất trước) và lấy top_k
+            order = self._dense_order(hit_scores)[:top_k]
+            hit_ids, hit_scores = hit_ids[order], hit_scores[order]
+            sources = ['dense'] * len(hit_ids)
+        
+        return self._make_results(hit_ids, hit_scores, sources)
+    
+    def _add_uncommitted_vectors(self, segment_store: SegmentStore, n_indexed: int):
+        """
+        Thêm vào index (trong RAM) vector của các chunk đã ghi segment nhưng chưa commit vào index chung
+        (EmbeddingService.commit hoãn ghi lại index khi upload từng file)
+        """
+        n_uncommitted = len(self.chunk_store) - n_indexed
+        if n_uncommitted <= 0:
+            return
+        vectors = segment_store.read_embeddings(n_indexed)
+        if len(vectors) != n_uncommitted:
+            logger.warning(f"⚠️ Segment store có {len(vectors)} vector chưa index, chunk store có {n_uncommitted}")
+            return
+        try:
+            if isinstance(self.faiss_index, RefinedIndex):
+                self.faiss_index.add(vectors, persist=False)
+            else:
+                self.faiss_index.add(vectors)
+            logger.info(f"📥 Thêm {n_uncommitted} chunks chưa commit vào index (trong RAM)")
+        except RuntimeError as e:
+            # Index mmap read-only (IVF on-disk) không add được - chunk mới có sau lần commit tiếp theo
+            logger.warning(f"⚠️ Không thêm được {n_uncommitted} chunks chưa commit vào index: {e}")
+    
+    def _add_citation_documents(self, start_chunk: int = 0):
+        """Thêm vào citation index các chunk từ start_chunk (theo văn bản, thứ tự trong văn bản)"""
+        for doc_idx, pdf_name in enumerate(self.chunk_table.documents):
+            chunk_ids = np.flatnonzero(self.chunk_table.doc_idx == doc_idx)
+            chunk_ids = chunk_ids[chunk_ids >= start_chunk]
+            if len(chunk_ids):
+                self.citation_index.add_document(
+                    pdf_name, chunk_ids, [self.chunk_store.text(int(i)) for i in chunk_ids]
+                )
+    
+    def _dense_order(self, scores: np.ndarray) -> np.ndarray:
+        """Thứ tự hit dense, gần nhất trước: L2 distance tăng dần, inner product giảm dần"""
+        if self.faiss_index is not None and self.faiss_index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return np.argsort(-scores, kind='stable')
+        return np.argsort(scores, kind='stable')
+    
+    def _make_results(self, hit_ids: np.ndarray, hit_scores: np.ndarray, sources: List[str]) -> List[Dict]:
+        """Dict kết quả (metadata + text) - chỉ decode text cho các hit trả về"""
+        results = []
+        for chunk_id, score, source, chunk_meta in zip(hit_ids, hit_scores, sources, self.chunk_table.rows(hit_ids)):
+            results.append({
+                'score': float(score),
+                'similarity': float(score),
+                'content': self.chunk_store.text(int(chunk_id)),
+                'chunk_id': int(chunk_id),
+                'retrieval': source,
+                **chunk_meta
+            })
+        return results
+    
+    def _fuse_rankings(self,
+                       dense_ids: np.ndarray,
+                       dense_scores: np.ndarray,
+                       lexical_ids: np.ndarray,
+                       question_embedding: Optional[np.ndarray],
+                       top_k: int):
+        """Reciprocal rank fusion: rrf(d) = sum 1 / (HYBRID_RRF_K + rank)"""
+        rrf_k = settings.HYBRID_RRF_K
+        dense_order = self._dense_order(dense_scores)
+        fused: Dict[int, float] = {}
+        for rank, i in enumerate(dense_order, 1):
+            fused[int(dense_ids[i])] = 1.0 / (rrf_k + rank)
+        for rank, chunk_id in enumerate(lexical_ids, 1):
+            fused[int(chunk_id)] = fused.get(int(chunk_id), 0.0) + 1.0 / (rrf_k + rank)
+        
+        ranked = sorted(fused, key=lambda chunk_id: -fused[chunk_id])[:top_k]
+        dense_score_of = dict(zip(dense_ids.tolist(), dense_scores.tolist()))
+        dense_set = set(dense_score_of)
+        lexical_set = set(lexical_ids.tolist())
+        
+        # Score hiển thị / confidence vẫn là score FAISS - tính lại cho hit chỉ có ở BM25
+        lexical_only = np.asarray([c for c in ranked if c not in dense_score_of], dtype='int64')
+        if len(lexical_only) and question_embedding is not None:
+            recomputed = self._dense_scores(question_embedding, lexical_only)
+            if recomputed is not None:
+                dense_score_of.update(zip(lexical_only.tolist(), recomputed.tolist()))
+        
+        ids = np.asarray(ranked, dtype='int64')
+        scores = np.asarray([dense_score_of.get(c, 0.0) for c in ranked], dtype='float32')
+        sources = [
+            'hybrid' if c in lexical_set and c in dense_set else ('lexical' if c in lexical_set else 'dense')
+            for c in ranked
+        ]
+        return ids, scores, sources
+    
     def generate_comprehensive_answer(self, 
                                     question: str, 
                                     search_results: List[Dict],
@@ -892,7 +1490,7 @@ class RAGServiceUnified:
             if self.use_llm_generation and self.llm_service:
                 return self._generate_llm_answer(question, search_results)
             else:
-                return self._generate_template_answer(question, search_results)
+                return self._generate_template_answer(question, search_results, reason='llm_unavailable')
             
         except Exception as e:
             logger.error(f"❌ Lỗi generate answer: {e}")
@@ -1052,8 +1650,19 @@ class RAGServiceUnified:
                    filter_category: Optional[str] = None,
                    include_sources: bool = True,
                    similarity_threshold: Optional[float] = None,
-                   use_enhancement: bool = True) -> Dict[str, Any]:
-        """API chính để xử lý query với pipeline 2-stage: RAG → LLM Enhancement"""
+                   use_enhancement: bool = True,
+                   pipeline_mode: Optional[str] = None,
+                   debug: bool = False) -> Dict[str, Any]:
+        """
+        API chính để xử lý query
+        
+        pipeline_mode:
+        - two_stage: RAG response → LLM enhancement (2 lần gọi LLM)
+        - single_pass: một prompt gộp, sinh câu trả lời hoàn chỉnh trong 1 lần gọi
+        - adaptive: chạy stage 1, chỉ enhancement khi confidence thấp và draft chưa hoàn chỉnh
+        
+        debug=True: thêm 'stage_breakdown' (cache lookup, encode, search, từng stage generation, tổng)
+        """
         try:
             start_time = time.time()
             
@@ -1065,61 +1674,82 @@ class RAGServiceUnified:
                 raise ValueError("Question không được để trống")
             
             question = question.strip()
-            logger.info(f"🔍 Processing query with 2-stage pipeline: {question[:100]}...")
             
-            # 1. Search relevant chunks
-            search_results = self.search_relevant_chunks(
+            if top_k is None:
+                top_k = self.default_top_k
+            if similarity_threshold is None:
+                similarity_threshold = self.default_similarity_threshold
+            pipeline_mode = pipeline_mode or settings.RAG_PIPELINE_MODE
+            if pipeline_mode not in self.PIPELINE_MODES:
+                raise ValueError(f"pipeline_mode không hợp lệ: {pipeline_mode}")
+            
+            # Thời gian chi tiết (encode, search, cache lookup) - chỉ trả về khi debug
+            breakdown = {}
+            
+            # 0. Answer cache - tầng exact trước, sau đó tầng semantic
+            cache_key = None
+            question_embedding = None
+            if self.answer_cache is not None:
+                stage_start = time.time()
+                cache_key = AnswerCache.make_params_key(
+                    top_k, filter_category, similarity_threshold, use_enhancement, pipeline_mode
+                )
+                cached = self.answer_cache.get_exact(question, cache_key)
+                if cached is None:
+                    question_embedding = await self.encode_question_async(question, breakdown)
+                    cached = self.answer_cache.get_semantic(question, question_embedding, cache_key)
+                    cache_tier = 'semantic'
+                else:
+                    cache_tier = 'exact'
+                self._observe_stage('cache_lookup', stage_start, breakdown)
+                
+                if cached is not None:
+                    self.cache_hits_counter.inc(tier=cache_tier)
+                    self.queries_counter.inc(pipeline_path=f'cache_{cache_tier}')
+                    cached['question'] = question
+                    cached['cache_hit'] = cache_tier
+                    cached['stage_timings'] = {}
+                    cached['prompt_tokens'] = {}
+                    cached['processing_time_ms'] = self._observe_stage('query_total', start_time, breakdown)
+                    cached['timestamp'] = datetime.now().isoformat()
+                    if debug:
+                        cached['stage_breakdown'] = breakdown
+                    logger.info(f"⚡ Answer cache hit ({cache_tier}): {question[:100]}")
+                    return cached
+                self.cache_misses_counter.inc()
+                self.answer_cache.record_miss()
+            
+            logger.info(f"🔍 Processing query ({pipeline_mode}): {question[:100]}...")
+            stage_timings = {}
+            
+            # 1. Search relevant chunks (encode + FAISS chạy ngoài event loop)
+            stage_start = time.time()
+            search_results = await self.search_relevant_chunks_async(
                 question=question,
                 top_k=top_k,
                 filter_category=filter_category,
-                similarity_threshold=similarity_threshold
+                similarity_threshold=similarity_threshold,
+                question_embedding=question_embedding,
+                timings=breakdown
             )
+            self._observe_stage('retrieval', stage_start, stage_timings)
             
             if not search_results:
+                self.queries_counter.inc(pipeline_path='no_results')
                 return self._create_empty_response(question)
             
-            # 2. Stage 1: Generate RAG response
-            rag_response = self._generate_rag_response(question, search_results)
-            
-            # 3. Stage 2: LLM Enhancement (if enabled)
-            if use_enhancement and self.llm_service:
-                try:
-                    final_response = self._enhance_response_with_llm(rag_response, question)
-                except Exception as e:
-                    logger.warning(f"Enhancement failed: {e}, using RAG response")
-                    final_response = {
-                        'original_response': rag_response['raw_response'],
-                        'enhanced_response': rag_response['raw_response'],
-                        'sources': rag_response['sources'],
-                        'confidence': rag_response['confidence'],
-                        'enhancement_applied': False,
-                        'stage': 'rag_generation'
-                    }
-            else:
-                final_response = {
-                    'original_response': rag_response['raw_response'],
-                    'enhanced_response': rag_response['raw_response'],
-                    'sources': rag_response['sources'],
-                    'confidence': rag_response['confidence'],
-                    'enhancement_applied': False,
-                    'stage': 'rag_generation'
-                }
+            # 2-3. Generation theo pipeline mode
+            prompt_tokens = {}
+            final_response, pipeline_path = await self._run_generation_pipeline(
+                question, search_results, use_enhancement, pipeline_mode, stage_timings, prompt_tokens
+            )
             
             # 4. Prepare sources information
-            sources = []
-            if include_sources and final_response['sources']:
-                for result in final_response['sources']:
-                    sources.append({
-                        'filename': result['pdf_name'],
-                        'display_name': self._clean_filename(result['pdf_name']),
-                        'category': result['category'],
-                        'content_preview': result['content'][:300] + "..." if len(result['content']) > 300 else result['content'],
-                        'similarity_score': result['similarity'],
-                        'content_length': result['content_length']
-                    })
+            sources = self._format_sources(final_response['sources']) if include_sources else []
             
             # 5. Calculate processing time
-            processing_time = int((time.time() - start_time) * 1000)
+            processing_time = self._observe_stage('query_total', start_time, breakdown)
+            self.queries_counter.inc(pipeline_path=pipeline_path)
             
             # 6. Prepare final response
             response = {
@@ -1128,16 +1758,29 @@ class RAGServiceUnified:
                 'sources': sources,
                 'total_sources': len(sources),
                 'confidence': final_response['confidence'],
-                'method': 'rag_llm_enhancement' if final_response['enhancement_applied'] else 'rag_generation',
+                'method': self._response_method(final_response),
                 'processing_time_ms': processing_time,
                 'filter_category': filter_category or 'all',
                 'timestamp': datetime.now().isoformat(),
                 'service_version': '2.0.0',
                 'enhancement_applied': final_response['enhancement_applied'],
-                'original_response': final_response['original_response'] if final_response['enhancement_applied'] else None
+                'original_response': final_response['original_response'] if final_response['enhancement_applied'] else None,
+                'pipeline_mode': pipeline_mode,
+                'pipeline_path': pipeline_path,
+                'stage_timings': stage_timings,
+                'prompt_tokens': prompt_tokens
             }
             
             logger.info(f"✅ Query processed successfully: {len(sources)} sources, {processing_time}ms, enhancement: {final_response['enhancement_applied']}")
+            
+            # 7. Lưu vào answer cache
+            if self.answer_cache is not None:
+                self.answer_cache.put(question, cache_key, response, question_embedding)
+            
+            # Breakdown không lưu vào cache (chỉ đúng cho lần xử lý này)
+            if debug:
+                response['stage_breakdown'] = {**stage_timings, **breakdown}
+            
             return response
             
         except Exception as e:
@@ -1153,6 +1796,221 @@ class RAGServiceUnified:
                 'error': str(e)
             }
     
+    async def query_stream(self,
+                           question: str,
+                           top_k: Optional[int] = None,
+                           filter_category: Optional[str] = None,
+                           include_sources: bool = True,
+                           similarity_threshold: Optional[float] = None,
+                           stop_event: Optional[threading.Event] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming query: sources → từng token → event kết thúc
+        
+        Sinh câu trả lời bằng prompt single-pass để token đầu tiên là của câu trả lời cuối.
+        Set stop_event (hoặc đóng generator) để dừng generation ngay lập tức.
+        """
+        start_time = time.time()
+        stop_event = stop_event or threading.Event()
+        generation_task = None
+        
+        try:
+            if not self.is_initialized:
+                await self.initialize()
+            
+            if not question or not question.strip():
+                raise ValueError("Question không được để trống")
+            question = question.strip()
+            
+            yield {'type': 'start', 'message': 'Đang tìm kiếm tài liệu liên quan...', 'question': question}
+            stage_timings = {}
+            prompt_tokens = {}
+            
+            # 1. Retrieval
+            stage_start = time.time()
+            search_results = await self.search_relevant_chunks_async(
+                question=question,
+                top_k=top_k,
+                filter_category=filter_category,
+                similarity_threshold=similarity_threshold
+            )
+            self._observe_stage('retrieval', stage_start, stage_timings)
+            
+            sources = self._format_sources(search_results) if include_sources else []
+            yield {'type': 'sources', 'sources': sources, 'total_sources': len(sources)}
+            
+            # 2. Generation - stream từng token
+            stage_start = time.time()
+            ttft_ms = None
+            answer_parts = []
+            
+            if not search_results:
+                answer_parts.append(self._create_empty_response(question)['answer'])
+                yield {'type': 'token', 'content': answer_parts[0]}
+            elif self.use_llm_generation and self.llm_service:
+                prompt = self._create_single_pass_prompt(question, search_results)
+                streamer = AsyncTokenStreamer(self.llm_service.tokenizer, asyncio.get_running_loop())
+                generation_task = asyncio.ensure_future(self.inference_executor.run_generate(
+                    self._with_generation_stats,
+                    functools.partial(self.llm_service.stream_from_prompt, generation_config=get_generation_profile('enhancement')),
+                    prompt,
+                    streamer,
+                    stop_event
+                ))
+                
+                async for text in streamer:
+                    if ttft_ms is None:
+                        ttft_ms = int((time.time() - start_time) * 1000)
+                        self.ttft_histogram.observe(ttft_ms)
+                    answer_parts.append(text)
+                    yield {'type': 'token', 'content': text}
+                
+                _, generation_stats = await generation_task
+                self._record_generation_stats('generation', generation_stats, stage_timings, prompt_tokens)
+            else:
+                answer_parts.append(self._generate_template_response(question, search_results, reason='llm_unavailable'))
+                yield {'type': 'token', 'content': answer_parts[0]}
+            
+            if ttft_ms is None:
+                ttft_ms = int((time.time() - start_time) * 1000)
+            self._observe_stage('generation', stage_start, stage_timings)
+            
+            answer = ''.join(answer_parts).strip()
+            yield {
+                'type': 'end',
+                'answer': answer,
+                'response_length': len(answer),
+                'confidence': self._calculate_single_pass_confidence(search_results, answer) if search_results else 0.0,
+                'method': 'rag_single_pass_stream',
+                'ttft_ms': ttft_ms,
+                'stage_timings': stage_timings,
+                'prompt_tokens': prompt_tokens,
+                'processing_time_ms': int((time.time() - start_time) * 1000),
+                'filter_category': filter_category or 'all',
+                'timestamp': datetime.now().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"❌ Lỗi trong query stream: {e}")
+            yield {'type': 'error', 'message': f"Xin lỗi, có lỗi khi xử lý câu hỏi: {str(e)}"}
+            
+        finally:
+            # Client ngắt kết nối hoặc lỗi - dừng generation đang chạy
+            if generation_task is not None and not generation_task.done():
+                stop_event.set()
+                logger.info("🛑 Stream bị dừng, đã yêu cầu dừng generation")
+    
+    def _format_sources(self, search_results: List[Dict]) -> List[Dict[str, Any]]:
+        """Chuyển search results thành thông tin nguồn trả về cho client"""
+        sources = []
+        for result in search_results or []:
+            sources.append({
+                'filename': result['pdf_name'],
+                'display_name': self._clean_filename(result['pdf_name']),
+                'category': result['category'],
+                'content_preview': result['content'][:300] + "..." if len(result['content']) > 300 else result['content'],
+                'similarity_score': result['similarity'],
+                'content_length': result['content_length']
+            })
+        return sources
+    
+    async def _run_generation_pipeline(self,
+                                       question: str,
+                                       search_results: List[Dict],
+                                       use_enhancement: bool,
+                                       pipeline_mode: str,
+                                       stage_timings: Dict[str, int],
+                                       prompt_tokens: Dict[str, int]):
+        """
+        Chạy generation theo pipeline mode, trả về (final_response, pipeline_path)
+        
+        stage_timings / prompt_tokens được ghi thêm thời gian và số token prompt của từng stage
+        """
+        llm_available = self.use_llm_generation and self.llm_service is not None
+        
+        # Single-pass: một lần gọi LLM với prompt gộp
+        if pipeline_mode == 'single_pass' and llm_available:
+            stage_start = time.time()
+            final_response, generation_stats = await self.inference_executor.run_generate(
+                self._with_generation_stats, self._generate_single_pass_response, question, search_results
+            )
+            self._observe_stage('single_pass', stage_start, stage_timings)
+            self._record_generation_stats('single_pass', generation_stats, stage_timings, prompt_tokens)
+            return final_response, 'single_pass'
+        
+        # Stage 1: RAG response
+        stage_start = time.time()
+        rag_response, generation_stats = await self.inference_executor.run_generate(
+            self._with_generation_stats, self._generate_rag_response, question, search_results
+        )
+        self._observe_stage('stage1', stage_start, stage_timings)
+        self._record_generation_stats('stage1', generation_stats, stage_timings, prompt_tokens)
+        
+        if not use_enhancement or not self.llm_service:
+            return self._rag_only_response(rag_response), 'rag_only'
+        
+        if pipeline_mode == 'adaptive' and self._should_skip_enhancement(rag_response):
+            logger.info("⏭️ Adaptive: draft đủ tốt, bỏ qua enhancement")
+            return self._rag_only_response(rag_response), 'adaptive_skip_enhancement'
+        
+        # Stage 2: LLM Enhancement
+        stage_start = time.time()
+        try:
+            final_response, generation_stats = await self.inference_executor.run_generate(
+                self._with_generation_stats, self._enhance_response_with_llm, rag_response, question
+            )
+            self._record_generation_stats('stage2', generation_stats, stage_timings, prompt_tokens)
+        except Exception as e:
+            logger.warning(f"Enhancement failed: {e}, using RAG response")
+            self.enhancement_failures_counter.inc()
+            final_response = self._rag_only_response(rag_response)
+        self._observe_stage('stage2', stage_start, stage_timings)
+        
+        return final_response, 'adaptive_enhanced' if pipeline_mode == 'adaptive' else 'two_stage'
+    
+    def _with_generation_stats(self, func, *args):
+        """
+        Chạy func trong thread generate, trả về (kết quả, thống kê generation của LLMService)
+        
+        Thống kê gồm prompt_tokens và prefix_saved_ms (thời gian prefill tiết kiệm nhờ prefix KV cache).
+        Bộ đếm của LLMService là thread-local nên phải đọc ngay trong worker thread
+        """
+        if self.llm_service is None:
+            return func(*args), {'prompt_tokens': 0, 'prefix_saved_ms': 0.0}
+        self.llm_service.reset_generation_stats()
+        result = func(*args)
+        return result, self.llm_service.consume_generation_stats()
+    
+    @staticmethod
+    def _record_generation_stats(stage: str,
+                                 generation_stats: Dict[str, float],
+                                 stage_timings: Dict[str, int],
+                                 prompt_tokens: Dict[str, int]):
+        """Ghi số token prompt và thời gian prefill tiết kiệm của một stage (cộng dồn vào tổng)"""
+        saved_ms = int(round(generation_stats['prefix_saved_ms']))
+        stage_timings[f'{stage}_prefix_saved_ms'] = saved_ms
+        stage_timings['prefix_saved_ms'] = stage_timings.get('prefix_saved_ms', 0) + saved_ms
+        prompt_tokens[stage] = generation_stats['prompt_tokens']
+        prompt_tokens['total'] = prompt_tokens.get('total', 0) + generation_stats['prompt_tokens']
+    
+    def _rag_only_response(self, rag_response: Dict[str, Any]) -> Dict[str, Any]:
+        """Dùng response của stage 1 làm câu trả lời cuối"""
+        return {
+            'original_response': rag_response['raw_response'],
+            'enhanced_response': rag_response['raw_response'],
+            'sources': rag_response['sources'],
+            'confidence': rag_response['confidence'],
+            'enhancement_applied': False,
+            'stage': 'rag_generation'
+        }
+    
+    def _response_method(self, final_response: Dict[str, Any]) -> str:
+        """Tên phương pháp tạo câu trả lời cho field 'method'"""
+        if final_response['enhancement_applied']:
+            return 'rag_llm_enhancement'
+        if final_response['stage'] == 'single_pass':
+            return 'rag_single_pass'
+        return 'rag_generation'
+    
     def _create_empty_response(self, question: str) -> Dict[str, Any]:
         """Tạo response khi không có kết quả tìm kiếm"""
         return {
@@ -1175,14 +2033,8 @@ class RAGServiceUnified:
             if not self.is_initialized:
                 await self.initialize()
             
-            # Thống kê theo category
-            category_stats = {}
-            for chunk in self.chunks_metadata:
-                cat = chunk['category']
-                if cat not in category_stats:
-                    category_stats[cat] = {'chunks': 0, 'total_length': 0}
-                category_stats[cat]['chunks'] += 1
-                category_stats[cat]['total_length'] += chunk['content_length']
+            # Thống kê theo category (tính sẵn trong ChunkTable)
+            category_stats = self.chunk_table.category_stats() if self.chunk_table else {}
             
             return {
                 'service_name': 'RAG Service Unified',
@@ -1192,6 +2044,14 @@ class RAGServiceUnified:
                 'total_documents': self.total_documents,
                 'total_chunks': self.total_chunks,
                 'categories': category_stats,
+                'faiss_index': {
+                    'type': self.index_manifest['factory_string'] if self.index_manifest else 'Flat',
+                    'search_params': self.index_manifest.get('search_params', {}) if self.index_manifest else {}
+                },
+                'category_index': self.category_index.get_stats() if self.category_index else None,
+                'query_router': self.query_router.get_stats() if self.query_router else None,
+                'citation_index': self.citation_index.get_stats() if self.citation_index else None,
+                'reranker': self.reranker.get_stats() if self.reranker else None,
                 'device': str(self.device),
                 'model_path': 'models/multilingual_e5_large',
                 'default_settings': {
@@ -0,0 +1,124 @@
+# app/services/reranker.py
+# Rerank kết quả retrieval bằng cross-encoder đa ngôn ngữ
+# - Score các cặp (câu hỏi, chunk) của top ứng viên trong một forward pass
+# - Cache score theo (hash câu hỏi, chunk id) bằng LRU: câu hỏi lặp lại không cần chạy model
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from app.core.config import settings
+from app.services.answer_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+def question_hash(question: str) -> str:
+    """Hash của câu hỏi đã chuẩn hóa (key cache)"""
+    return hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()
+
+class CrossEncoderReranker:
+    """Cross-encoder rerank top ứng viên, score được cache LRU theo (câu hỏi, chunk id)"""
+
+    def __init__(self,
+                 model_path: Optional[str] = None,
+                 max_candidates: Optional[int] = None,
+                 max_length: Optional[int] = None,
+                 cache_size: Optional[int] = None):
+        self.model_path = model_path or settings.RERANKER_MODEL_PATH
+        self.max_candidates = max_candidates or settings.CROSS_ENCODER_MAX_CANDIDATES
+        self.max_length = max_length or settings.CROSS_ENCODER_MAX_LENGTH
+        self.cache_size = cache_size or settings.CROSS_ENCODER_CACHE_SIZE
+
+        self.tokenizer = None
+        self.model = None
+        self.device = None
+
+        self._cache: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"cache_hits": 0, "cache_misses": 0, "batches": 0}
+
+    def load_model(self):
+        """Load tokenizer + model (gọi một lần lúc khởi tạo service)"""
+        logger.info(f"📥 Loading cross-encoder: {self.model_path}")
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+        self.model = AutoModelForSequenceClassification.from_pretrained(self.model_path)
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model.to(self.device)
+        self.model.eval()
+        logger.info(f"✅ Cross-encoder loaded on {self.device}")
+
+    def score(self, question: str, chunk_ids: Sequence[int], texts: Sequence[str]) -> np.ndarray:
+        """Score relevance (logit, càng cao càng liên quan) của từng chunk - chỉ chạy model cho chunk chưa có trong cache"""
+        key = question_hash(question)
+        scores = np.zeros(len(chunk_ids), dtype=np.float32)
+        missing = []
+        with self._lock:
+            for i, chunk_id in enumerate(chunk_ids):
+                cached = self._cache.get((key, int(chunk_id)))
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end((key, int(chunk_id)))
+                    scores[i] = cached
+            self._stats["cache_hits"] += len(chunk_ids) - len(missing)
+            self._stats["cache_misses"] += len(missing)
+
+        if missing:
+            computed = self._forward(question, [texts[i] for i in missing])
+            scores[missing] = computed
+            with self._lock:
+                for i, value in zip(missing, computed.tolist()):
+                    self._cache[(key, int(chunk_ids[i]))] = value
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                self._stats["batches"] += 1
+        return scores
+
+    def _forward(self, question: str, texts: List[str]) -> np.ndarray:
+        """Một forward pass cho cả batch cặp (câu hỏi, chunk)"""
+        inputs = self.tokenizer([question] * len(texts), texts, return_tensors="pt", padding=True,
+                                truncation="only_second", max_length=self.max_length)
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        with torch.no_grad():
+            logits = self.model(**inputs).logits
+        # Model 1 label: logit relevance; nhiều label: lấy label cuối (relevant)
+        logits = logits[:, 0] if logits.shape[-1] == 1 else logits[:, -1]
+        return logits.float().cpu().numpy()
+
+    def rerank(self, question: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Sắp xếp lại max_candidates kết quả đầu theo score cross-encoder (thêm 'rerank_score')
+
+        Các kết quả ngoài ngân sách ứng viên giữ thứ tự cũ, đứng sau nhóm đã rerank
+        """
+        candidates = results[:self.max_candidates]
+        if not candidates:
+            return results
+        scores = self.score(question, [r['chunk_id'] for r in candidates], [r['content'] for r in candidates])
+        for result, value in zip(candidates, scores.tolist()):
+            result['rerank_score'] = float(value)
+        order = np.argsort(-scores, kind='stable')
+        return [candidates[i] for i in order] + results[self.max_candidates:]
+
+    def clear(self):
+        """Xóa cache score (khi chunk id thay đổi - index build lại)"""
+        with self._lock:
+            self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["cache_hits"] + self._stats["cache_misses"]
+            return {
+                "model_path": self.model_path,
+                "max_candidates": self.max_candidates,
+                "cache_entries": len(self._cache),
+                "cache_size": self.cache_size,
+                "cache_hit_rate": self._stats["cache_hits"] / lookups if lookups else 0.0,
+                **self._stats
+            }
@@ -0,0 +1,345 @@
+# app/services/segment_store.py
+# Segment store append-only cho dữ liệu embedding - thay cho việc đọc/ghi lại toàn bộ all_embeddings.pkl mỗi tài liệu
+#
+# Định dạng (data/segments/):
+#   manifest.json        danh sách segment đang dùng (theo thứ tự chunk id), ghi file tạm rồi os.replace
+#   seg_000001.npy       embeddings float32 [n_chunks, dim] của segment
+#   seg_000001.pkl       tài liệu của segment (format all_embeddings.pkl, không có 'embeddings')
+#
+# Segment không bao giờ bị sửa: mỗi batch ingestion ghi một segment mới rồi mới cập nhật manifest,
+# crash giữa chừng chỉ để lại file mồ côi (dọn khi mở store). Segment nhỏ liền kề được gộp nền.
+#
+# Nhiều process: ghi (append / merge / dọn file) giữ khóa .writer.lock và đọc lại manifest trước khi sửa;
+# đọc segment trong snapshot() giữ khóa chia sẻ .readers.lock - file không còn trong manifest (segment đã gộp)
+# chỉ bị xóa khi không còn process nào đang đọc, không thì để lần dọn sau
+
+import json
+import logging
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+WRITER_LOCK_NAME = ".writer.lock"
+READERS_LOCK_NAME = ".readers.lock"
+
+class SegmentStore:
+    """Các segment bất biến + manifest nhỏ; chunk id toàn cục = thứ tự chunk khi nối các segment"""
+
+    def __init__(self,
+                 store_dir: str,
+                 writable: bool = True,
+                 on_merge: Optional[Callable[[List[str], str], None]] = None):
+        """
+        writable=False: chỉ đọc (RAG service) - không tạo thư mục, không dọn file của process đang ghi
+        on_merge(tên segment cũ, tên segment mới): gọi sau khi gộp segment (cập nhật ingestion manifest)
+        """
+        self.store_dir = store_dir
+        self.on_merge = on_merge
+        self.manifest_path = os.path.join(store_dir, MANIFEST_NAME)
+        self.writer_lock_path = os.path.join(store_dir, WRITER_LOCK_NAME)
+        self.readers_lock_path = os.path.join(store_dir, READERS_LOCK_NAME)
+
+        self._lock = threading.Lock()  # đọc/gán manifest trong process
+        self._write_lock = threading.Lock()  # một thread ghi tại một thời điểm (khóa file chỉ loại trừ giữa process)
+        self._merge_lock = threading.Lock()  # một merge tại một thời điểm, commit chờ merge xong
+        self._merge_thread: Optional[threading.Thread] = None
+        self.manifest = self._read_manifest()
+        if writable:
+            os.makedirs(store_dir, exist_ok=True)
+            with self._writing():
+                self._remove_orphans()
+
+    @staticmethod
+    def exists(store_dir: str) -> bool:
+        return os.path.exists(os.path.join(store_dir, MANIFEST_NAME))
+
+    # ------------------------------------------------------------------
+    # Manifest
+    # ------------------------------------------------------------------
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if not os.path.exists(self.manifest_path):
+            return {"version": FORMAT_VERSION, "next_id": 1, "segments": []}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Segment manifest version {manifest.get('version')} không hỗ trợ")
+        return manifest
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest = manifest
+
+    @contextmanager
+    def _writing(self):
+        """Khóa ghi giữa các process, manifest được đọc lại (process khác có thể vừa append / gộp)"""
+        with self._write_lock, file_lock(self.writer_lock_path):
+            with self._lock:
+                self.manifest = self._read_manifest()
+            yield self.manifest
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Đọc segment theo manifest hiện tại: file của các segment trong manifest không bị xóa trong khối with
+        (segment bị gộp bởi process khác vẫn đọc được tới khi thoát)
+        """
+        if not os.path.isdir(self.store_dir):
+            yield self
+            return
+        with file_lock(self.readers_lock_path, shared=True):
+            with self._lock:
+                self.manifest = self._read_manifest()
+            yield self
+
+    def _remove_orphans(self):
+        """
+        Xóa file segment không có trong manifest (ghi dở khi crash / segment đã gộp) - gọi trong _writing()
+
+        Bỏ qua nếu có process đang đọc trong snapshot(): file sẽ được dọn lần sau
+        """
+        live = {segment["name"] for segment in self.manifest["segments"]}
+        orphans = [
+            filename for filename in os.listdir(self.store_dir)
+            if filename.startswith("seg_") and filename.split(".")[0] not in live
+        ]
+        if not orphans:
+            return
+        with file_lock(self.readers_lock_path, blocking=False) as acquired:
+            if not acquired:
+                logger.info(f"⏳ {len(orphans)} file segment cũ đang được đọc, để lần dọn sau")
+                return
+            for filename in orphans:
+                os.remove(os.path.join(self.store_dir, filename))
+                logger.info(f"🧹 Xóa segment mồ côi: {filename}")
+
+    def remove_orphans(self):
+        """Dọn file segment cũ (vd: sau commit, khi snapshot của process khác đã đóng)"""
+        with self._writing():
+            self._remove_orphans()
+
+    def _segment_paths(self, name: str) -> Tuple[str, str]:
+        base = os.path.join(self.store_dir, name)
+        return base + ".npy", base + ".pkl"
+
+    @property
+    def segments(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.manifest["segments"])
+
+    @property
+    def n_chunks(self) -> int:
+        return sum(segment["n_chunks"] for segment in self.segments)
+
+    def document_names(self) -> set:
+        return {name for segment in self.segments for name in segment["documents"]}
+
+    def is_empty(self) -> bool:
+        return not self.segments
+
+    # ------------------------------------------------------------------
+    # Ghi
+    # ------------------------------------------------------------------
+
+    def _write_segment(self, name: str, documents: List[Dict[str, Any]], embeddings: np.ndarray):
+        """Ghi file của segment (tạm rồi os.replace), chưa đưa vào manifest"""
+        vectors_path, documents_path = self._segment_paths(name)
+        np.save(vectors_path[:-4] + ".tmp.npy", np.ascontiguousarray(embeddings, dtype='float32'))
+        with open(documents_path + ".tmp", 'wb') as f:
+            pickle.dump(documents, f)
+        os.replace(vectors_path[:-4] + ".tmp.npy", vectors_path)
+        os.replace(documents_path + ".tmp", documents_path)
+
+    def append(self, documents: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        Ghi một segment cho batch tài liệu (mỗi tài liệu có 'pdf_name', 'chunks', 'embeddings')
+
+        Chi phí I/O tỉ lệ với batch, không phụ thuộc kích thước corpus
+        """
+        documents = [doc for doc in documents if len(doc['chunks'])]
+        if not documents:
+            return None
+        embeddings = np.concatenate([np.asarray(doc['embeddings'], dtype='float32') for doc in documents])
+        stored = [{k: v for k, v in doc.items() if k != 'embeddings'} for doc in documents]
+
+        with self._writing():
+            name = f"seg_{self.manifest['next_id']:06d}"
+            self._write_segment(name, stored, embeddings)
+            manifest = dict(self.manifest)
+            manifest["next_id"] += 1
+            manifest["segments"] = self.manifest["segments"] + [{
+                "name": name,
+                "n_chunks": int(len(embeddings)),
+                "documents": [doc['pdf_name'] for doc in stored],
+                "created_at": datetime.now().isoformat()
+            }]
+            self._write_manifest(manifest)
+        logger.info(f"✅ Segment {name}: {len(stored)} tài liệu, {len(embeddings)} chunks")
+        return name
+
+    def import_pickle(self, pickle_path: str) -> Optional[str]:
+        """Chuyển all_embeddings.pkl có sẵn thành segment đầu tiên (chạy một lần khi chưa có segment)"""
+        with open(pickle_path, 'rb') as f:
+            documents_data = pickle.load(f)
+        logger.info(f"🔄 Import {len(documents_data)} tài liệu từ {pickle_path} vào segment store")
+        return self.append(documents_data)
+
+    # ------------------------------------------------------------------
+    # Đọc
+    # ------------------------------------------------------------------
+
+    def load_documents(self, name: str) -> List[Dict[str, Any]]:
+        with open(self._segment_paths(name)[1], 'rb') as f:
+            return pickle.load(f)
+
+    def load_embeddings(self, name: str) -> np.ndarray:
+        return np.load(self._segment_paths(name)[0], mmap_mode='r')
+
+    def iter_documents(self, start_chunk: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """(chunk id đầu tiên, tài liệu) theo thứ tự chunk id, chỉ các tài liệu có chunk từ start_chunk trở đi"""
+        offset = 0
+        for segment in self.segments:
+            if offset + segment["n_chunks"] <= start_chunk:
+                offset += segment["n_chunks"]
+                continue
+            for doc in self.load_documents(segment["name"]):
+                if offset + len(doc['chunks']) > start_chunk:
+                    yield offset, doc
+                offset += len(doc['chunks'])
+
+    def read_embeddings(self, start_chunk: int = 0) -> np.ndarray:
+        """Embeddings của các chunk từ start_chunk tới hết (chỉ đọc các segment chứa phần đó)"""
+        parts, offset = [], 0
+        for segment in self.segments:
+            end = offset + segment["n_chunks"]
+            if end > start_chunk:
+                vectors = self.load_embeddings(segment["name"])
+                parts.append(np.asarray(vectors[max(start_chunk - offset, 0):], dtype='float32'))
+            offset = end
+        if not parts:
+            return np.zeros((0, 0), dtype='float32')
+        return np.concatenate(parts)
+
+    def to_documents_data(self) -> List[Dict[str, Any]]:
+        """Toàn bộ dữ liệu theo format all_embeddings.pkl (có 'embeddings') - để xuất pickle cũ"""
+        documents_data = []
+        for segment in self.segments:
+            vectors = self.load_embeddings(segment["name"])
+            offset = 0
+            for doc in self.load_documents(segment["name"]):
+                n = len(doc['chunks'])
+                documents_data.append({**doc, 'embeddings': np.asarray(vectors[offset:offset + n])})
+                offset += n
+        return documents_data
+
+    # ------------------------------------------------------------------
+    # Merge nền
+    # ------------------------------------------------------------------
+
+    def _merge_candidates(self, min_chunks: int, merge_factor: int) -> Optional[List[str]]:
+        """Dãy segment nhỏ liền kề dài nhất (>= merge_factor segment) - gộp liền kề giữ nguyên thứ tự chunk id"""
+        best, run = [], []
+        for segment in self.segments + [None]:
+            if segment is not None and segment["n_chunks"] < min_chunks:
+                run.append(segment["name"])
+                continue
+            if len(run) > len(best):
+                best = run
+            run = []
+        return best if len(best) >= merge_factor else None
+
+    def merge_small_segments(self,
+                             min_chunks: Optional[int] = None,
+                             merge_factor: Optional[int] = None) -> Optional[str]:
+        """
+        Gộp dãy segment nhỏ liền kề thành một segment
+
+        Segment chỉ gộp khi còn nhỏ hơn min_chunks -> mỗi chunk bị ghi lại một số lần giới hạn,
+        tổng I/O vẫn O(N)
+        """
+        min_chunks = min_chunks or settings.SEGMENT_MERGE_MIN_CHUNKS
+        merge_factor = merge_factor or settings.SEGMENT_MERGE_FACTOR
+        with self._merge_lock, self._writing():
+            # Giữ khóa ghi cả lúc gộp: segment gộp (chưa vào manifest) không bị process khác dọn như file mồ côi
+            names = self._merge_candidates(min_chunks, merge_factor)
+            if not names:
+                return None
+
+            documents, vectors = [], []
+            for name in names:
+                documents.extend(self.load_documents(name))
+                vectors.append(np.asarray(self.load_embeddings(name)))
+            embeddings = np.concatenate(vectors)
+
+            merged_name = f"seg_{self.manifest['next_id']:06d}"
+            self._write_segment(merged_name, documents, embeddings)
+
+            segments = self.manifest["segments"]
+            position = [segment["name"] for segment in segments].index(names[0])
+            merged = {
+                "name": merged_name,
+                "n_chunks": int(len(embeddings)),
+                "documents": [doc['pdf_name'] for doc in documents],
+                "created_at": datetime.now().isoformat(),
+                "merged_from": names
+            }
+            manifest = dict(self.manifest)
+            manifest["next_id"] += 1
+            manifest["segments"] = segments[:position] + [merged] + segments[position + len(names):]
+            self._write_manifest(manifest)
+
+            # Segment cũ: xóa ngay nếu không có reader, không thì để lần dọn sau
+            self._remove_orphans()
+            if self.on_merge is not None:
+                self.on_merge(names, merged_name)
+            logger.info(f"✅ Gộp {len(names)} segment -> {merged_name} ({len(embeddings)} chunks)")
+            return merged_name
+
+    def merge_in_background(self):
+        """Chạy merge_small_segments trong thread nền nếu có dãy segment nhỏ cần gộp"""
+        if self._merge_thread is not None and self._merge_thread.is_alive():
+            return
+        if not self._merge_candidates(settings.SEGMENT_MERGE_MIN_CHUNKS, settings.SEGMENT_MERGE_FACTOR):
+            return
+
+        def run():
+            try:
+                self.merge_small_segments()
+            except Exception as e:
+                logger.error(f"❌ Lỗi gộp segment: {e}")
+
+        self._merge_thread = threading.Thread(target=run, name="segment-merge", daemon=True)
+        self._merge_thread.start()
+
+    @contextmanager
+    def merges_paused(self):
+        """Chờ merge đang chạy xong và không cho merge mới bắt đầu (khi đọc toàn bộ segment)"""
+        with self._merge_lock:
+            yield self
+
+    def get_stats(self) -> Dict[str, Any]:
+        segments = self.segments
+        return {
+            "segments": len(segments),
+            "chunks": sum(segment["n_chunks"] for segment in segments),
+            "documents": sum(len(segment["documents"]) for segment in segments),
+            "smallest_segment": min((segment["n_chunks"] for segment in segments), default=0),
+            "merging": self._merge_thread is not None and self._merge_thread.is_alive()
+        }
@@ -0,0 +1,58 @@
+# app/services/text_chunker.py
+# Ghép câu thành chunk theo số token (split_text_to_chunks_vi)
+#
+# Số token của mọi câu trong một section được tính bằng một lần gọi tokenizer (batch, fast tokenizer)
+# rồi dùng lại khi ghép chunk và khi tính overlap - không tokenize lại cùng một câu
+
+from typing import List, Sequence
+
+def count_tokens(tokenizer, sentences: Sequence[str]) -> List[int]:
+    """
+    Số token của từng câu (không tính special token), bằng len(tokenizer.tokenize(câu))
+
+    Fast tokenizer: một lần gọi batch cho cả danh sách. Tokenizer chậm: tokenize từng câu
+    """
+    if not sentences:
+        return []
+    if getattr(tokenizer, "is_fast", False):
+        encoded = tokenizer(
+            list(sentences),
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+    return [len(tokenizer.tokenize(sentence)) for sentence in sentences]
+
+def chunk_sentences(sentences: Sequence[str], token_counts: Sequence[int],
+                    chunk_size: int = 512, overlap: int = 50) -> List[str]:
+    """
+    Ghép câu thành chunk không quá chunk_size token; chunk mới bắt đầu bằng các câu cuối của chunk trước
+    (tổng không quá overlap token)
+
+    Giữ nguyên ranh giới chunk của cách làm cũ: câu dài hơn chunk_size đứng riêng một chunk,
+    chunk giữa nối câu bằng '\\n', chunk cuối của section nối bằng ' '
+    """
+    chunks = []
+    current_start = 0  # Câu đầu tiên của chunk hiện tại (chunk = sentences[current_start:i])
+    current_tokens = 0
+
+    for i, num_tokens in enumerate(token_counts):
+        if current_tokens + num_tokens > chunk_size:
+            if i > current_start:
+                chunks.append('\n'.join(sentences[current_start:i]).strip())
+
+            # Overlap: lùi từ cuối chunk hiện tại, dùng số token đã tính
+            start, total = i, 0
+            while start > current_start and total + token_counts[start - 1] <= overlap:
+                start -= 1
+                total += token_counts[start]
+
+            current_start = start
+            current_tokens = total + num_tokens
+        else:
+            current_tokens += num_tokens
+
+    if len(token_counts) > current_start:
+        chunks.append(' '.join(sentences[current_start:len(token_counts)]).strip())
+    return chunks
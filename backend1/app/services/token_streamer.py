@@ -0,0 +1,59 @@
+# app/services/token_streamer.py
+# Streaming token từ model.generate (chạy trong thread) sang event loop
+# Dùng cho các endpoint Server-Sent Events
+
+import asyncio
+import json
+import threading
+from typing import Any, Dict
+
+import torch
+from transformers import StoppingCriteria, TextStreamer
+
+class AsyncTokenStreamer(TextStreamer):
+    """
+    TextStreamer đẩy từng đoạn text đã decode vào asyncio.Queue
+
+    model.generate chạy trong thread pool, consumer đọc bằng `async for text in streamer`
+    """
+
+    _END = object()
+
+    def __init__(self, tokenizer, loop: asyncio.AbstractEventLoop, skip_prompt: bool = True, **decode_kwargs):
+        decode_kwargs.setdefault("skip_special_tokens", True)
+        super().__init__(tokenizer, skip_prompt=skip_prompt, **decode_kwargs)
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._ended = False
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        """Được gọi từ thread generate mỗi khi có text mới"""
+        if self._ended:
+            return
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+        if stream_end:
+            self._ended = True
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, self._END)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        item = await self.queue.get()
+        if item is self._END:
+            raise StopAsyncIteration
+        return item
+
+class StopOnEvent(StoppingCriteria):
+    """Dừng generation khi threading.Event được set (vd: client ngắt kết nối)"""
+
+    def __init__(self, stop_event: threading.Event):
+        self.stop_event = stop_event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.stop_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Định dạng một event theo chuẩn Server-Sent Events"""
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
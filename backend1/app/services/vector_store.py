@@ -8,9 +8,10 @@ import pickle
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 import numpy as np
-import faiss
 from langchain.schema import Document
 
+from app.services.index_factory import create_empty_index, load_index, save_index, spec_from_manifest
+
 logger = logging.getLogger(__name__)
 
 class VectorStore:
@@ -20,6 +21,7 @@ class VectorStore:
         self.persist_directory = persist_directory
         self.collection_name = collection_name
         self.faiss_index = None
+        self.index_spec = None
         self.documents_data = []
         
         # Đường dẫn files
@@ -33,13 +35,14 @@ class VectorStore:
         """Khởi tạo FAISS index"""
         try:
             if os.path.exists(self.faiss_index_path):
-                # Load index hiện có
-                self.faiss_index = faiss.read_index(self.faiss_index_path)
+                # Load index hiện có (áp dụng nprobe / efSearch từ manifest)
+                self.faiss_index, manifest = load_index(self.faiss_index_path)
+                self.index_spec = spec_from_manifest(manifest)
                 logger.info(f"Đã load FAISS index từ {self.faiss_index_path}")
             else:
-                # Tạo index mới
-                self.faiss_index = faiss.IndexFlatL2(dimension)
-                logger.info(f"Đã tạo FAISS index mới với dimension {dimension}")
+                # Tạo index mới theo FAISS_INDEX_TYPE
+                self.faiss_index, self.index_spec = create_empty_index(dimension)
+                logger.info(f"Đã tạo FAISS index mới ({self.index_spec.factory_string()}) với dimension {dimension}")
                 
             # Load documents data
             if os.path.exists(self.documents_data_path):
@@ -105,7 +108,7 @@ class VectorStore:
         """Lưu FAISS index và documents data xuống đĩa"""
         try:
             # Lưu FAISS index
-            faiss.write_index(self.faiss_index, self.faiss_index_path)
+            save_index(self.faiss_index, self.faiss_index_path, self.index_spec or spec_from_manifest(None))
             
             # Lưu documents data
             with open(self.documents_data_path, 'wb') as f:
@@ -264,7 +267,8 @@ class VectorStore:
         try:
             if os.path.exists(faiss_path) and os.path.exists(pickle_path):
                 # Load FAISS index
-                self.faiss_index = faiss.read_index(faiss_path)
+                self.faiss_index, manifest = load_index(faiss_path)
+                self.index_spec = spec_from_manifest(manifest)
                 
                 # Load pickle data
                 with open(pickle_path, 'rb') as f:
@@ -0,0 +1,35 @@
+# app/utils/file_lock.py
+# Khóa liên process bằng lockfile (fcntl.flock) - các worker uvicorn / tool ingestion không ghi đè lên nhau
+# Hệ thống không có fcntl (Windows): không khóa, dữ liệu vẫn ghi ra file tạm rồi os.replace
+
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+@contextmanager
+def file_lock(lock_path: str, shared: bool = False, blocking: bool = True):
+    """
+    Giữ khóa trên lock_path trong khối with, yield True nếu lấy được khóa
+
+    shared=True: nhiều process cùng giữ (đọc), loại trừ khóa exclusive (ghi)
+    blocking=False: không chờ - yield False nếu process khác đang giữ khóa
+    """
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, 'a') as f:
+        if fcntl is None:
+            yield True
+            return
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(f.fileno(), flags if blocking else flags | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
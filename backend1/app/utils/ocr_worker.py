@@ -0,0 +1,29 @@
+# app/utils/ocr_worker.py
+# OCR một trang PDF - hàm chạy trong process pool OCR (spawn) của app.services.pdf_text
+#
+# Để ngoài package app.services: process con chỉ import module này (PyMuPDF, Tesseract, PIL),
+# không chạy app/services/__init__.py (torch, sentence-transformers, FAISS...)
+
+import io
+import time
+from typing import Tuple
+
+import fitz  # PyMuPDF
+import pytesseract
+from PIL import Image, ImageEnhance, ImageFilter
+
+def preprocess_image(img: Image.Image) -> Image.Image:
+    """Tiền xử lý ảnh để cải thiện OCR: grayscale, tăng tương phản, làm nét"""
+    if img.mode != 'L':
+        img = img.convert('L')
+    img = ImageEnhance.Contrast(img).enhance(1.5)
+    return img.filter(ImageFilter.SHARPEN)
+
+def ocr_page(pdf_path: str, page_num: int, zoom: float, ocr_config: str) -> Tuple[int, str, float]:
+    """OCR một trang: (page_num, text, giây)"""
+    start = time.perf_counter()
+    with fitz.open(pdf_path) as doc:
+        pix = doc.load_page(page_num).get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+        img = Image.open(io.BytesIO(pix.tobytes("png")))
+    text = pytesseract.image_to_string(preprocess_image(img), config=ocr_config)
+    return page_num, text, time.perf_counter() - start
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark search lọc theo category
+So sánh search toàn bộ index rồi lọc (cách cũ: search_k = min(top_k*3, 50))
+với search trong sub-index của category (CategoryPartitionedIndex)
+
+Query = vector của các chunk ngẫu nhiên + nhiễu nhỏ (không cần load model embedding)
+
+Cách dùng:
+    python benchmark_category_search.py --queries 200 --top-k 5
+"""
+
+import os
+import sys
+import time
+import pickle
+import argparse
+import statistics
+
+import faiss
+import numpy as np
+
+# Thêm backend vào Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.category_index import CategoryPartitionedIndex
+from app.services.rag_service_unified import RAGServiceUnified
+
+def load_categories(pickle_path: str):
+    """Category của từng chunk theo đúng thứ tự trong index (giống RAGServiceUnified.initialize)"""
+    with open(pickle_path, 'rb') as f:
+        documents_data = pickle.load(f)
+
+    categories = []
+    for doc in documents_data:
+        category = RAGServiceUnified._determine_category(doc.get('pdf_name', 'Unknown'))
+        categories.extend([category] * len(doc.get('chunks', [])))
+    return categories
+
+def make_queries(index, n_queries: int, noise: float, seed: int) -> np.ndarray:
+    """Query giả lập: vector chunk ngẫu nhiên + nhiễu gaussian (không chuẩn hóa, giống query của RAGServiceUnified)"""
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(index.ntotal, size=min(n_queries, index.ntotal), replace=False)
+    queries = np.asarray(index.reconstruct_batch(ids.astype('int64')), dtype='float32')
+    queries += rng.normal(scale=noise, size=queries.shape).astype('float32')
+    return queries
+
+def post_filter_search(index, categories, query, top_k: int, category: str):
+    """Cách cũ: search toàn corpus với search_k cố định rồi lọc category"""
+    search_k = min(top_k * 3, 50)
+    scores, ids = index.search(query, search_k)
+    hits = [i for i in ids[0] if 0 <= i < len(categories) and categories[i] == category]
+    return hits[:top_k]
+
+def partitioned_search(category_index, query, top_k: int, category: str):
+    """Cách mới: search trong sub-index của category"""
+    scores, ids = category_index.search(query, top_k, category)
+    return [i for i in ids[0] if i >= 0]
+
+def summarize(latencies_ms, hit_counts, top_k: int):
+    return {
+        "mean_ms": statistics.mean(latencies_ms),
+        "p95_ms": sorted(latencies_ms)[int(len(latencies_ms) * 0.95) - 1],
+        "mean_hits": statistics.mean(hit_counts),
+        "full_results": sum(1 for h in hit_counts if h >= top_k) / len(hit_counts) * 100,
+        "empty_results": sum(1 for h in hit_counts if h == 0) / len(hit_counts) * 100
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search lọc theo category")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    index = faiss.read_index(os.path.join(args.data_dir, "all_faiss.index"))
+    categories = load_categories(os.path.join(args.data_dir, "all_embeddings.pkl"))
+    print(f"📊 Index: {index.ntotal} vectors, dim {index.d}")
+
+    category_index = CategoryPartitionedIndex(index, categories)
+    print(f"⏱️ Build category index: {category_index.build_time:.2f}s")
+
+    queries = make_queries(index, args.queries, args.noise, args.seed)
+
+    for category in category_index.categories:
+        size = category_index.get_stats()["categories"][category]
+        results = {}
+        for name, search in (
+            ("post_filter", lambda q: post_filter_search(index, categories, q, args.top_k, category)),
+            ("partitioned", lambda q: partitioned_search(category_index, q, args.top_k, category))
+        ):
+            latencies, hit_counts = [], []
+            for query in queries:
+                start = time.perf_counter()
+                hits = search(query.reshape(1, -1))
+                latencies.append((time.perf_counter() - start) * 1000)
+                hit_counts.append(len(hits))
+            results[name] = summarize(latencies, hit_counts, args.top_k)
+
+        print(f"\n=== Category '{category}' ({size} chunks, {size / index.ntotal * 100:.1f}% corpus) ===")
+        print(f"{'method':<12} {'mean ms':>9} {'p95 ms':>9} {'mean hits':>10} {'đủ top_k':>9} {'rỗng':>7}")
+        for name, r in results.items():
+            print(f"{name:<12} {r['mean_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['mean_hits']:>10.2f} "
+                  f"{r['full_results']:>8.1f}% {r['empty_results']:>6.1f}%")
+
+if __name__ == "__main__":
+    main()
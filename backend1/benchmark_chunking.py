@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark chia chunk (split_text_to_chunks_vi) trên tài liệu lớn nhất trong documents/:
+tokenize từng câu (cách cũ, tokenize lại khi tính overlap) so với một lần tokenize batch mỗi section
+
+Chỉ load tokenizer (không load model embedding). Kiểm tra hai cách cho đúng cùng các chunk.
+
+Cách dùng:
+    python benchmark_chunking.py
+    python benchmark_chunking.py --file ../documents/Luat/abc.pdf --chunk-size 256 --overlap 32 --repeat 5
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BACKEND_DIR)
+
+from transformers import AutoTokenizer
+from underthesea import sent_tokenize
+
+from app.core.config import settings
+from app.services.embedding_service import EmbeddingService
+
+class CountingTokenizer:
+    """Bọc tokenizer, đếm số lần gọi và số câu đã tokenize"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.is_fast = tokenizer.is_fast
+        self.calls = 0
+        self.texts = 0
+
+    def tokenize(self, text):
+        self.calls += 1
+        self.texts += 1
+        return self.tokenizer.tokenize(text)
+
+    def __call__(self, texts, **kwargs):
+        self.calls += 1
+        self.texts += len(texts)
+        return self.tokenizer(texts, **kwargs)
+
+def legacy_split(service: EmbeddingService, text: str, chunk_size: int, overlap: int):
+    """split_text_to_chunks_vi trước đây: tokenize từng câu, tokenize lại các câu cuối khi tính overlap"""
+    all_chunks = []
+    for section in service.split_sections(text):
+        current_chunk = []
+        current_tokens = 0
+        for sentence in sent_tokenize(section):
+            num_tokens = len(service.tokenizer.tokenize(sentence))
+            if current_tokens + num_tokens > chunk_size:
+                if current_chunk:
+                    all_chunks.append('\n'.join(current_chunk).strip())
+                overlap_chunk = []
+                total = 0
+                for s in reversed(current_chunk):
+                    toks = len(service.tokenizer.tokenize(s))
+                    if total + toks > overlap:
+                        break
+                    overlap_chunk.insert(0, s)
+                    total += toks
+                current_chunk = overlap_chunk + [sentence]
+                current_tokens = total + num_tokens
+            else:
+                current_chunk.append(sentence)
+                current_tokens += num_tokens
+        if current_chunk:
+            all_chunks.append(' '.join(current_chunk).strip())
+    return all_chunks
+
+def measure(fn, service: EmbeddingService, tokenizer, repeat: int):
+    """(chunks, giây tốt nhất, số lần gọi tokenizer, số câu tokenize) của một lần chạy"""
+    best, chunks = float("inf"), None
+    for _ in range(repeat):
+        service.tokenizer = CountingTokenizer(tokenizer)
+        start = time.perf_counter()
+        chunks = fn()
+        best = min(best, time.perf_counter() - start)
+    return chunks, best, service.tokenizer.calls, service.tokenizer.texts
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chia chunk: tokenize từng câu vs batch mỗi section")
+    parser.add_argument("--documents", default=os.path.join(os.path.dirname(BACKEND_DIR), "documents"))
+    parser.add_argument("--file", help="Tài liệu cần đo (mặc định: file lớn nhất trong --documents)")
+    parser.add_argument("--model-path", default=settings.EMBEDDING_MODEL_PATH)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--overlap", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    output_dir = tempfile.mkdtemp(prefix="chunk_bench_")
+    try:
+        service = EmbeddingService(args.model_path, output_dir=output_dir)
+        path = args.file or max(service.get_all_document_files(args.documents), key=os.path.getsize)
+        start = time.perf_counter()
+        text = service.clean_text(service.extract_text_from_document(path) or "")
+        print(f"📄 {path}: {os.path.getsize(path) / 1e6:.1f} MB, {len(text):,} ký tự "
+              f"(trích xuất {time.perf_counter() - start:.1f}s)")
+
+        tokenizer = AutoTokenizer.from_pretrained(args.model_path)
+        sentences = sum(len(sent_tokenize(section)) for section in service.split_sections(text))
+        print(f"📊 {sentences:,} câu | chunk_size {args.chunk_size}, overlap {args.overlap}, "
+              f"fast tokenizer: {tokenizer.is_fast}")
+
+        results = {
+            "legacy": measure(lambda: legacy_split(service, text, args.chunk_size, args.overlap),
+                              service, tokenizer, args.repeat),
+            "batched": measure(lambda: service.split_text_to_chunks_vi(text, args.chunk_size, args.overlap),
+                               service, tokenizer, args.repeat)
+        }
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    print(f"\n{'mode':<8} {'seconds':>9} {'chunks':>7} {'calls':>8} {'sentences':>10}")
+    for mode, (chunks, seconds, calls, texts) in results.items():
+        print(f"{mode:<8} {seconds:>9.3f} {len(chunks):>7} {calls:>8} {texts:>10}")
+
+    same = results["legacy"][0] == results["batched"][0]
+    print(f"\n{'✅' if same else '❌'} Chunk {'giống hệt' if same else 'KHÁC'} cách cũ")
+    print(f"Batch nhanh hơn {results['legacy'][1] / results['batched'][1]:.2f}x")
+    if not same:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark hybrid retrieval (dense FAISS + BM25, reciprocal rank fusion) so với chỉ dense
+Dùng bộ SearchAccuracyCase trong test_accuracy.py (thư mục gốc repo)
+
+Chỉ số:
+- source recall@k: tỉ lệ câu hỏi có ít nhất một chunk thuộc tài liệu mong đợi trong top_k
+- answer term recall: tỉ lệ từ của expected_answer xuất hiện trong context đã retrieve
+- latency search (encode + FAISS + BM25 + fuse), BM25 riêng
+
+Cách dùng:
+    python benchmark_hybrid_search.py --top-k 5
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.dirname(BACKEND_DIR))  # test_accuracy.py
+
+from test_accuracy import AccuracyTester
+from app.services.bm25_index import fold_accents
+from app.services.rag_service_unified import RAGServiceUnified
+
+def normalize_name(name: str) -> str:
+    name = os.path.splitext(fold_accents(name.lower()))[0]
+    return re.sub(r"[^a-z0-9]", "", name)
+
+def source_hit(expected_sources, results) -> bool:
+    """Có chunk nào thuộc tài liệu mong đợi (so khớp tên file đã chuẩn hóa)"""
+    expected = [normalize_name(s) for s in expected_sources]
+    for result in results:
+        name = normalize_name(result['pdf_name'])
+        if any(e and (e in name or name in e) for e in expected):
+            return True
+    return False
+
+def answer_term_recall(expected_answer: str, results) -> float:
+    expected_terms = set(re.findall(r"\w+", expected_answer.lower()))
+    context_terms = set(re.findall(r"\w+", fold_accents(" ".join(r['content'] for r in results).lower())))
+    return len(expected_terms & context_terms) / len(expected_terms) if expected_terms else 1.0
+
+def run_cases(service, cases, top_k: int, repeat: int):
+    hits, term_recalls, latencies = [], [], []
+    for case in cases:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = service.search_relevant_chunks(case.question, top_k=top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        hits.append(source_hit(case.expected_sources, results))
+        term_recalls.append(answer_term_recall(case.expected_answer, results))
+    return {
+        "source_recall": sum(hits) / len(hits) * 100,
+        "term_recall": statistics.mean(term_recalls) * 100,
+        "mean_ms": statistics.mean(latencies),
+        "p95_ms": sorted(latencies)[max(int(len(latencies) * 0.95) - 1, 0)],
+        "hits": hits
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hybrid dense + BM25 retrieval")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần chạy mỗi câu hỏi để đo latency")
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    service = RAGServiceUnified()
+    service.use_llm_generation = False  # Chỉ cần retrieval
+    asyncio.run(service.initialize())
+    if service.bm25_index is None:
+        print("❌ Không có BM25 index (HYBRID_SEARCH_ENABLED=False?)")
+        return
+
+    cases = AccuracyTester().search_accuracy_cases
+    print(f"📊 {len(cases)} câu hỏi, top_k={args.top_k}, {service.total_chunks} chunks, "
+          f"BM25 {len(service.bm25_index.vocab)} terms")
+
+    bm25_latencies = []
+    for case in cases:
+        start = time.perf_counter()
+        service._lexical_search(case.question, min(args.top_k * 3, 50))
+        bm25_latencies.append((time.perf_counter() - start) * 1000)
+
+    bm25_index = service.bm25_index
+    service.bm25_index = None
+    dense = run_cases(service, cases, args.top_k, args.repeat)
+    service.bm25_index = bm25_index
+    hybrid = run_cases(service, cases, args.top_k, args.repeat)
+
+    print(f"\n{'mode':<8} {'source recall@' + str(args.top_k):>18} {'answer terms':>13} {'mean ms':>9} {'p95 ms':>9}")
+    for name, r in (("dense", dense), ("hybrid", hybrid)):
+        print(f"{name:<8} {r['source_recall']:>17.1f}% {r['term_recall']:>12.1f}% {r['mean_ms']:>9.2f} {r['p95_ms']:>9.2f}")
+    print(f"BM25 search riêng: mean {statistics.mean(bm25_latencies):.2f} ms, max {max(bm25_latencies):.2f} ms")
+
+    print("\nCâu hỏi thay đổi kết quả:")
+    for case, d, h in zip(cases, dense["hits"], hybrid["hits"]):
+        if d != h:
+            print(f"  {'✅' if h else '❌'} {case.question}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark ghi dữ liệu khi rebuild toàn bộ documents/: cách cũ (đọc + ghi lại all_embeddings.pkl và index chung
+mỗi tài liệu) so với segment store append-only (mỗi batch một segment, commit index chung một lần)
+
+OCR + chunk + embed chạy một lần (giống nhau ở hai cách, có thể cache bằng --cache), chỉ đo phần ghi:
+- thời gian ghi tổng, thời gian ghi tài liệu cuối (cách cũ tăng theo kích thước corpus)
+- số byte đọc / ghi (/proc/self/io, chỉ có trên Linux)
+
+Cách dùng:
+    python benchmark_ingestion.py --documents ../documents --cache /tmp/ingestion_cache.pkl
+    python benchmark_ingestion.py --cache /tmp/ingestion_cache.pkl --export-pickle
+"""
+
+import os
+import sys
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+
+import faiss
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BACKEND_DIR)
+
+from app.core.config import settings
+from app.services.bm25_index import update_bm25_index
+from app.services.citation_index import update_citation_index
+from app.services.embedding_service import EmbeddingService
+from app.services.index_factory import create_empty_index, load_index, save_index, spec_from_manifest
+
+def io_counters():
+    """(byte đọc, byte ghi) của process qua syscall (rchar / wchar), None nếu không có /proc"""
+    try:
+        with open("/proc/self/io", 'r') as f:
+            values = dict(line.split(": ") for line in f.read().splitlines())
+        return int(values["rchar"]), int(values["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def prepare_documents(service: EmbeddingService, documents_dir: str, chunk_size: int, overlap: int):
+    """Extract -> clean -> chunk -> embed mọi tài liệu (phần không đổi giữa hai cách ghi)"""
+    prepared = []
+    for doc_path in service.get_all_document_files(documents_dir):
+        raw_text = service.extract_text_from_document(doc_path)
+        if not raw_text:
+            continue
+        chunks = service.split_text_to_chunks_vi(service.clean_text(raw_text), chunk_size, overlap)
+        embeddings = service.create_embeddings(chunks) if chunks else None
+        if embeddings is not None:
+            prepared.append((doc_path, chunks, embeddings))
+        print(f"  📥 {os.path.basename(doc_path)}: {len(chunks)} chunks")
+    return prepared
+
+def legacy_save(output_dir: str, chunks, embeddings: np.ndarray, doc_path: str):
+    """Cách ghi cũ: load index chung + toàn bộ pickle, thêm tài liệu, ghi lại cả hai"""
+    all_faiss_path = os.path.join(output_dir, "all_faiss.index")
+    all_pickle_path = os.path.join(output_dir, "all_embeddings.pkl")
+    doc_name = os.path.splitext(os.path.basename(doc_path))[0]
+    doc_folder = os.path.join(output_dir, doc_name)
+    os.makedirs(doc_folder, exist_ok=True)
+
+    data = {
+        'pdf_name': doc_name, 'doc_path': doc_path, 'chunks': chunks,
+        'embeddings': embeddings, 'created_at': datetime.now().isoformat()
+    }
+    with open(os.path.join(doc_folder, f"{doc_name}_embeddings.pkl"), 'wb') as f:
+        pickle.dump(data, f)
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings.astype(np.float32))
+    faiss.write_index(index, os.path.join(doc_folder, f"{doc_name}_faiss.index"))
+
+    if os.path.exists(all_faiss_path):
+        index_all, manifest = load_index(all_faiss_path)
+        spec = spec_from_manifest(manifest)
+    else:
+        index_all, spec = create_empty_index(embeddings.shape[1])
+    index_all.add(embeddings.astype(np.float32))
+    save_index(index_all, all_faiss_path, spec)
+
+    all_data = []
+    if os.path.exists(all_pickle_path):
+        with open(all_pickle_path, 'rb') as f:
+            all_data = pickle.load(f)
+    n_existing = sum(len(doc['chunks']) for doc in all_data)
+    update_bm25_index(output_dir, chunks, (c for doc in all_data for c in doc['chunks']), n_existing,
+                      k1=settings.BM25_K1, b=settings.BM25_B)
+    update_citation_index(output_dir, [(doc_name, chunks)],
+                          ((doc['pdf_name'], doc['chunks']) for doc in all_data), n_existing)
+    all_data.append(data)
+    with open(all_pickle_path, 'wb') as f:
+        pickle.dump(all_data, f)
+
+def run(mode: str, prepared, model_path: str):
+    output_dir = tempfile.mkdtemp(prefix=f"ingest_{mode}_")
+    try:
+        service = EmbeddingService(model_path, output_dir=output_dir) if mode == "segments" else None
+        io_start = io_counters()
+        start = time.perf_counter()
+        last_doc_ms = 0.0
+        for doc_path, chunks, embeddings in prepared:
+            doc_start = time.perf_counter()
+            if mode == "legacy":
+                legacy_save(output_dir, chunks, embeddings, doc_path)
+            else:
+                service.save_embeddings_to_faiss(chunks, embeddings, doc_path, commit=False)
+            last_doc_ms = (time.perf_counter() - doc_start) * 1000
+        if service is not None:
+            service.commit(force=True)
+            if settings.SEGMENT_EXPORT_PICKLE:
+                service.export_pickle()
+            service.segment_store.merge_small_segments()
+        total_s = time.perf_counter() - start
+        io_end = io_counters()
+
+        index, _ = load_index(os.path.join(output_dir, "all_faiss.index"))
+        return {
+            "total_s": total_s,
+            "last_doc_ms": last_doc_ms,
+            "read_mb": (io_end[0] - io_start[0]) / 2**20 if io_start and io_end else None,
+            "write_mb": (io_end[1] - io_start[1]) / 2**20 if io_start and io_end else None,
+            "vectors": index.ntotal
+        }
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ghi dữ liệu ingestion: pickle chung vs segment store")
+    parser.add_argument("--documents", default=os.path.join(os.path.dirname(BACKEND_DIR), "documents"))
+    parser.add_argument("--model-path", default=settings.EMBEDDING_MODEL_PATH)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--overlap", type=int, default=50)
+    parser.add_argument("--cache", help="Pickle lưu kết quả chunk + embed (tạo nếu chưa có)")
+    parser.add_argument("--export-pickle", action="store_true", help="Segment store xuất thêm all_embeddings.pkl")
+    args = parser.parse_args()
+
+    if args.cache and os.path.exists(args.cache):
+        with open(args.cache, 'rb') as f:
+            prepared = pickle.load(f)
+    else:
+        print(f"🔄 Chunk + embed {args.documents} (không tính vào kết quả)...")
+        scratch_dir = tempfile.mkdtemp(prefix="ingest_prepare_")
+        try:
+            service = EmbeddingService(args.model_path, output_dir=scratch_dir)
+            prepared = prepare_documents(service, args.documents, args.chunk_size, args.overlap)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        if args.cache:
+            with open(args.cache, 'wb') as f:
+                pickle.dump(prepared, f)
+    if args.export_pickle:
+        settings.SEGMENT_EXPORT_PICKLE = True
+
+    n_chunks = sum(len(chunks) for _, chunks, _ in prepared)
+    print(f"📊 {len(prepared)} tài liệu, {n_chunks} chunks, batch {settings.SEGMENT_BATCH_DOCUMENTS} tài liệu/segment, "
+          f"xuất pickle: {'có' if settings.SEGMENT_EXPORT_PICKLE else 'không'}")
+
+    print(f"\n{'mode':<10} {'total s':>9} {'last doc ms':>12} {'read MB':>9} {'write MB':>9} {'vectors':>9}")
+    for mode in ("legacy", "segments"):
+        r = run(mode, prepared, args.model_path)
+        read_mb = f"{r['read_mb']:.1f}" if r['read_mb'] is not None else "-"
+        write_mb = f"{r['write_mb']:.1f}" if r['write_mb'] is not None else "-"
+        print(f"{mode:<10} {r['total_s']:>9.2f} {r['last_doc_ms']:>12.1f} {read_mb:>9} {write_mb:>9} {r['vectors']:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark throughput ingestion (trang/giây) trên documents/: xử lý tuần tự từng file so với pipeline nhiều stage
+(extract/OCR -> chunk -> embed -> ghi segment)
+
+Mỗi lần chạy ghi vào thư mục output tạm (không đụng data/). Pipeline in thêm thời gian bận của từng stage.
+
+Cách dùng:
+    python benchmark_ingestion_pipeline.py --limit 10
+    python benchmark_ingestion_pipeline.py --extract-workers 8 --chunk-workers 2 --embed-batch-chunks 512
+    python benchmark_ingestion_pipeline.py --mode pipeline
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BACKEND_DIR)
+
+from app.core.config import settings
+from app.services.embedding_service import EmbeddingService
+from app.services.ingestion_pipeline import page_count
+
+def link_documents(files, target_dir: str):
+    """Thư mục tạm chứa symlink tới các file được chọn (giữ tên file -> doc_name giống khi chạy thật)"""
+    for i, path in enumerate(files):
+        name = os.path.basename(path)
+        if os.path.exists(os.path.join(target_dir, name)):
+            name = f"{i}_{name}"
+        os.symlink(os.path.abspath(path), os.path.join(target_dir, name))
+
+def run(mode: str, input_dir: str, model_path: str, pages: int):
+    output_dir = tempfile.mkdtemp(prefix=f"ingest_{mode}_")
+    try:
+        service = EmbeddingService(model_path, output_dir=output_dir)
+        service.load_model()  # Không tính thời gian load model
+        start = time.perf_counter()
+        result = service.process_all_documents([input_dir], use_pipeline=(mode == "pipeline"))
+        elapsed = time.perf_counter() - start
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return {
+            "elapsed": elapsed,
+            "pages_per_second": pages / elapsed if elapsed else 0.0,
+            "processed": result["processed"],
+            "errors": result["errors"],
+            "pipeline": result.get("pipeline")
+        }
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion tuần tự vs pipeline (trang/giây)")
+    parser.add_argument("--documents", default=os.path.join(os.path.dirname(BACKEND_DIR), "documents"))
+    parser.add_argument("--model-path", default=settings.EMBEDDING_MODEL_PATH)
+    parser.add_argument("--limit", type=int, default=None, help="Chỉ lấy N file đầu tiên")
+    parser.add_argument("--mode", choices=["both", "sequential", "pipeline"], default="both")
+    parser.add_argument("--extract-workers", type=int, help="Ghi đè INGEST_EXTRACT_WORKERS")
+    parser.add_argument("--chunk-workers", type=int, help="Ghi đè INGEST_CHUNK_WORKERS")
+    parser.add_argument("--queue-size", type=int, help="Ghi đè INGEST_QUEUE_SIZE")
+    parser.add_argument("--embed-batch-chunks", type=int, help="Ghi đè INGEST_EMBED_BATCH_CHUNKS")
+    args = parser.parse_args()
+
+    for name in ("extract_workers", "chunk_workers", "queue_size", "embed_batch_chunks"):
+        value = getattr(args, name)
+        if value is not None:
+            setattr(settings, f"INGEST_{name.upper()}", value)
+
+    scan_dir = tempfile.mkdtemp(prefix="ingest_scan_")
+    try:
+        files = sorted(EmbeddingService(args.model_path, output_dir=scan_dir).get_all_document_files(args.documents))
+    finally:
+        shutil.rmtree(scan_dir, ignore_errors=True)
+    files = files[:args.limit] if args.limit else files
+    pages = sum(page_count(path) for path in files)
+    print(f"📊 {len(files)} files, {pages} trang | extract {settings.INGEST_EXTRACT_WORKERS} process, "
+          f"chunk {settings.INGEST_CHUNK_WORKERS} process, queue {settings.INGEST_QUEUE_SIZE}, "
+          f"batch embed {settings.INGEST_EMBED_BATCH_CHUNKS} chunks")
+
+    input_dir = tempfile.mkdtemp(prefix="ingest_input_")
+    try:
+        link_documents(files, input_dir)
+        modes = ["sequential", "pipeline"] if args.mode == "both" else [args.mode]
+        results = {mode: run(mode, input_dir, args.model_path, pages) for mode in modes}
+    finally:
+        shutil.rmtree(input_dir, ignore_errors=True)
+
+    print(f"\n{'mode':<11} {'seconds':>9} {'pages/s':>9} {'docs':>6} {'errors':>7}")
+    for mode, r in results.items():
+        print(f"{mode:<11} {r['elapsed']:>9.1f} {r['pages_per_second']:>9.2f} {r['processed']:>6} {r['errors']:>7}")
+
+    summary = results.get("pipeline", {}).get("pipeline")
+    if summary:
+        print(f"\nStage (thời gian bận, tổng các worker):")
+        for stage, stats in summary["stages"].items():
+            print(f"  {stage:<8} {stats['documents']:>4} docs {stats['pages']:>6} trang {stats['chunks']:>7} chunks "
+                  f"{stats['busy_seconds']:>8.1f}s {stats['errors']:>3} lỗi")
+    if len(results) == 2:
+        speedup = results["sequential"]["elapsed"] / results["pipeline"]["elapsed"]
+        print(f"\nPipeline nhanh hơn {speedup:.2f}x")
+
+if __name__ == "__main__":
+    main()
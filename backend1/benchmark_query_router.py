@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark query router (chỉ search các category router chọn) so với search toàn corpus
+Dùng bộ SearchAccuracyCase trong test_accuracy.py (thư mục gốc repo)
+
+Chỉ số:
+- số vector phải search trung bình (tỉ lệ so với toàn corpus), tỉ lệ câu hỏi được route
+- latency search (encode + route + FAISS + BM25 + fuse)
+- source recall@k: tỉ lệ câu hỏi có ít nhất một chunk thuộc tài liệu mong đợi trong top_k
+
+Cách dùng:
+    python benchmark_query_router.py --top-k 5
+    python benchmark_query_router.py --min-confidence 0.7 --max-categories 1
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.dirname(BACKEND_DIR))  # test_accuracy.py
+
+from test_accuracy import AccuracyTester
+from benchmark_hybrid_search import source_hit
+from app.services.rag_service_unified import RAGServiceUnified
+
+def run_cases(service, cases, top_k: int, repeat: int):
+    hits, latencies = [], []
+    for case in cases:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = service.search_relevant_chunks(case.question, top_k=top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        hits.append(source_hit(case.expected_sources, results))
+    return {
+        "source_recall": sum(hits) / len(hits) * 100,
+        "mean_ms": statistics.mean(latencies),
+        "p95_ms": sorted(latencies)[max(int(len(latencies) * 0.95) - 1, 0)],
+        "hits": hits
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query router vs full-corpus search")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần chạy mỗi câu hỏi để đo latency")
+    parser.add_argument("--min-confidence", type=float, default=None, help="Ghi đè QUERY_ROUTER_MIN_CONFIDENCE")
+    parser.add_argument("--max-categories", type=int, default=None, help="Ghi đè QUERY_ROUTER_MAX_CATEGORIES")
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    service = RAGServiceUnified()
+    service.use_llm_generation = False  # Chỉ cần retrieval
+    asyncio.run(service.initialize())
+    router = service.query_router
+    if router is None:
+        print("❌ Không có query router (QUERY_ROUTER_ENABLED=False hoặc không có category index?)")
+        return
+    if args.min_confidence is not None:
+        router.min_confidence = args.min_confidence
+    if args.max_categories is not None:
+        router.max_categories = args.max_categories
+
+    cases = AccuracyTester().search_accuracy_cases
+    corpus = service.category_index.partition_size()
+    print(f"📊 {len(cases)} câu hỏi, top_k={args.top_k}, {corpus} vectors, partitions {router.category_sizes}")
+    print(f"   min_confidence={router.min_confidence}, max_categories={router.max_categories}, "
+          f"classifier={'có' if router.get_stats()['classifier'] else 'không'}")
+
+    # Quyết định route + số vector phải search của từng câu hỏi
+    decisions = []
+    for case in cases:
+        decision = router.route(case.question, service.encode_text(case.question))
+        decisions.append(decision)
+    searched = [service.category_index.partition_size(d.categories) for d in decisions]
+    routed = sum(1 for d in decisions if d.categories)
+
+    service.query_router = None
+    full = run_cases(service, cases, args.top_k, args.repeat)
+    service.query_router = router
+    routed_run = run_cases(service, cases, args.top_k, args.repeat)
+
+    print(f"\nRoute: {routed}/{len(cases)} câu hỏi, vector search trung bình "
+          f"{statistics.mean(searched):.0f}/{corpus} ({statistics.mean(searched) / corpus * 100:.1f}%)")
+    print(f"\n{'mode':<8} {'source recall@' + str(args.top_k):>18} {'mean ms':>9} {'p95 ms':>9}")
+    for name, r in (("full", full), ("router", routed_run)):
+        print(f"{name:<8} {r['source_recall']:>17.1f}% {r['mean_ms']:>9.2f} {r['p95_ms']:>9.2f}")
+
+    print("\nQuyết định route:")
+    for case, decision, f, r in zip(cases, decisions, full["hits"], routed_run["hits"]):
+        marker = "  " if f == r else ("✅" if r else "❌")
+        target = ",".join(decision.categories) if decision.categories else "all"
+        print(f"  {marker} [{target:<16}] {decision.confidence:.2f} {decision.reason:<16} {case.question}")
+
+if __name__ == "__main__":
+    main()
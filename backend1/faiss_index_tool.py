@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Build, tuning và compaction FAISS index (Flat, IVF-Flat, IVF-PQ, HNSW, SQ8, IVF-SQ8, PQ)
+
+build:   build lại index chung từ data/segments (hoặc all_embeddings.pkl) theo FAISS_INDEX_* (hoặc tham số dòng lệnh), ghi kèm manifest
+         index nén (sq8 / pq) ghi thêm <index>.vectors.npy để re-rank bằng vector float
+tune:    sweep nprobe / efSearch, so với index exact (Flat) -> recall@k, QPS và kích thước index
+compact: xóa bản sao index/pickle riêng của từng tài liệu (data/<doc_name>/) khi index chung đã chứa đủ
+
+Query = vector của các chunk ngẫu nhiên + nhiễu nhỏ (không cần load model embedding)
+
+Cách dùng:
+    python faiss_index_tool.py build --type ivf_flat --nlist 256
+    python faiss_index_tool.py tune --type hnsw --top-k 10
+    python faiss_index_tool.py tune --index data/all_faiss.index --target-recall 0.95 --apply
+    python faiss_index_tool.py build --type ivf_sq8 --nlist 256
+    python faiss_index_tool.py compact          # dry-run
+    python faiss_index_tool.py compact --yes
+"""
+
+import os
+import sys
+import time
+import pickle
+import argparse
+from dataclasses import replace
+
+import faiss
+import numpy as np
+
+# Thêm backend vào Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.index_factory import (
+    INDEX_TYPES, IndexSpec, apply_search_params, build_index, load_index, read_index_manifest,
+    save_index, spec_from_manifest, write_index_manifest
+)
+from app.services.quantized_index import RefinedIndex, unwrap_index
+from app.services.segment_store import SegmentStore
+
+NPROBE_VALUES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+EF_SEARCH_VALUES = [16, 32, 64, 128, 256, 512]
+
+def load_embeddings(pickle_path: str) -> np.ndarray:
+    """Embeddings của tất cả chunks theo đúng thứ tự trong index chung (segment store cạnh pickle nếu có)"""
+    segments_dir = os.path.join(os.path.dirname(pickle_path), "segments")
+    if SegmentStore.exists(segments_dir):
+        store = SegmentStore(segments_dir, writable=False)
+        with store.snapshot():
+            return store.read_embeddings()
+    with open(pickle_path, 'rb') as f:
+        documents_data = pickle.load(f)
+    return np.vstack([np.asarray(doc['embeddings'], dtype='float32') for doc in documents_data])
+
+def make_queries(vectors: np.ndarray, n_queries: int, noise: float, seed: int) -> np.ndarray:
+    """
+    Query giả lập: vector chunk ngẫu nhiên + nhiễu gaussian
+
+    Không chuẩn hóa L2: corpus trong index và query của RAGServiceUnified (mean pooling) đều không chuẩn hóa
+    """
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    return vectors[ids] + rng.normal(scale=noise, size=(len(ids), vectors.shape[1])).astype('float32')
+
+def spec_from_args(args) -> IndexSpec:
+    overrides = {
+        "index_type": args.type, "metric": args.metric, "nlist": args.nlist,
+        "pq_m": args.pq_m, "hnsw_m": args.hnsw_m, "ef_construction": args.ef_construction,
+        "rerank_factor": args.rerank_factor
+    }
+    return IndexSpec.from_settings(**{k: v for k, v in overrides.items() if v is not None})
+
+def recall_at_k(exact_ids: np.ndarray, ids: np.ndarray, k: int) -> float:
+    hits = sum(len(set(e[:k]) & set(a[:k])) for e, a in zip(exact_ids, ids))
+    return hits / (len(exact_ids) * k)
+
+def timed_search(index, queries: np.ndarray, k: int):
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return ids, time.perf_counter() - start
+
+def index_bytes_per_vector(index) -> float:
+    """Kích thước index (mã nén + cấu trúc IVF / HNSW) chia cho số vector"""
+    return faiss.serialize_index(unwrap_index(index)).nbytes / max(index.ntotal, 1)
+
+def sweep_values(spec: IndexSpec):
+    """(tên tham số, các giá trị) cần sweep cho loại index"""
+    if spec.is_ivf:
+        return "nprobe", [v for v in NPROBE_VALUES if v <= spec.nlist]
+    if spec.index_type == "hnsw":
+        return "efSearch", EF_SEARCH_VALUES
+    return None, [None]
+
+def cmd_build(args):
+    vectors = load_embeddings(args.pickle)
+    print(f"📊 {len(vectors)} vectors, dim {vectors.shape[1]}")
+
+    start = time.time()
+    index, spec = build_index(vectors, spec_from_args(args))
+    build_time = time.time() - start
+
+    save_index(index, args.output, spec, extra={"source": args.pickle, "build_time_s": round(build_time, 2)},
+               vectors=vectors)
+    bytes_per_vector = index_bytes_per_vector(index)
+    print(f"✅ {spec.factory_string()} -> {args.output} ({build_time:.1f}s, search {spec.search_params()})")
+    print(f"💾 {bytes_per_vector:.0f} bytes/vector (~{bytes_per_vector * 1e6 / 2**30:.2f} GiB / 1M chunks)")
+
+def cmd_tune(args):
+    vectors = load_embeddings(args.pickle)
+    queries = make_queries(vectors, args.queries, args.noise, args.seed)
+    k = args.top_k
+
+    if args.index:
+        index, manifest = load_index(args.index)
+        spec = spec_from_manifest(manifest)
+        build_time = None
+    else:
+        start = time.time()
+        index, spec = build_index(vectors, spec_from_args(args))
+        build_time = time.time() - start
+        if spec.is_compressed and spec.rerank_factor > 0:
+            index = RefinedIndex(index, vectors, spec.rerank_factor)
+
+    exact = faiss.IndexFlat(vectors.shape[1], spec.metric_type)
+    exact.add(vectors)
+    exact_ids, exact_time = timed_search(exact, queries, k)
+
+    print(f"📊 {len(vectors)} vectors, {len(queries)} queries, recall@{k}")
+    print(f"🔎 Candidate: {spec.factory_string()}" + (f" (build {build_time:.1f}s)" if build_time else "")
+          + (f", re-rank x{spec.rerank_factor}" if isinstance(index, RefinedIndex) else "")
+          + f", {index_bytes_per_vector(index):.0f} bytes/vector")
+    print(f"\n{'index':<22} {'param':>12} {'recall@' + str(k):>10} {'QPS':>10} {'ms/query':>9}")
+    print(f"{'Flat (exact)':<22} {'-':>12} {1.0:>10.4f} {len(queries) / exact_time:>10.0f} "
+          f"{exact_time / len(queries) * 1000:>9.3f}")
+
+    param_name, values = sweep_values(spec)
+    results = []
+    for value in values:
+        if param_name:
+            apply_search_params(index, {param_name: value})
+        ids, elapsed = timed_search(index, queries, k)
+        recall = recall_at_k(exact_ids, ids, k)
+        results.append((value, recall, len(queries) / elapsed))
+        label = f"{param_name}={value}" if param_name else "-"
+        print(f"{spec.factory_string():<22} {label:>12} {recall:>10.4f} {len(queries) / elapsed:>10.0f} "
+              f"{elapsed / len(queries) * 1000:>9.3f}")
+
+    if not param_name:
+        return
+
+    # Giá trị nhỏ nhất (nhanh nhất) đạt recall mục tiêu
+    chosen = next((r for r in results if r[1] >= args.target_recall), None)
+    if chosen is None:
+        print(f"\n⚠️ Không đạt recall@{k} >= {args.target_recall}, thử nlist / M lớn hơn hoặc Flat")
+        return
+    print(f"\n✅ {param_name}={chosen[0]}: recall@{k}={chosen[1]:.4f}, {chosen[2]:.0f} QPS")
+
+    if args.apply and args.index:
+        spec = replace(spec, **({"nprobe": chosen[0]} if param_name == "nprobe" else {"ef_search": chosen[0]}))
+        apply_search_params(index, spec.search_params())
+        write_index_manifest(args.index, index, spec, extra={"tuned_recall_at_k": {str(k): round(chosen[1], 4)}})
+        print(f"📋 Đã ghi {param_name}={chosen[0]} vào manifest của {args.index}")
+
+def cmd_compact(args):
+    """Xóa <doc>_faiss.index / <doc>_embeddings.pkl trong thư mục con khi index chung đã chứa đủ tài liệu"""
+    index_path = os.path.join(args.data_dir, "all_faiss.index")
+    with open(args.pickle, 'rb') as f:
+        documents_data = pickle.load(f)
+    indexed_docs = {doc['pdf_name'] for doc in documents_data}
+    total_chunks = sum(len(doc['chunks']) for doc in documents_data)
+
+    manifest = read_index_manifest(index_path)
+    ntotal = manifest["ntotal"] if manifest else faiss.read_index(index_path).ntotal
+    if ntotal != total_chunks:
+        print(f"❌ Index chung có {ntotal} vectors nhưng pickle có {total_chunks} chunks - không compact")
+        return
+
+    redundant = []
+    for root, _, files in os.walk(args.data_dir):
+        if os.path.abspath(root) == os.path.abspath(args.data_dir):
+            continue
+        for name in files:
+            for suffix in ("_faiss.index", "_embeddings.pkl"):
+                if name.endswith(suffix) and name[:-len(suffix)] in indexed_docs:
+                    redundant.append(os.path.join(root, name))
+
+    total_bytes = sum(os.path.getsize(path) for path in redundant)
+    print(f"📊 {len(indexed_docs)} tài liệu trong index chung ({ntotal} vectors)")
+    print(f"🗑️ {len(redundant)} file bản sao riêng, {total_bytes / 2**20:.1f} MiB")
+    if not args.yes:
+        for path in redundant:
+            print(f"   {path}")
+        print("ℹ️ Dry-run - thêm --yes để xóa")
+        return
+
+    for path in redundant:
+        os.remove(path)
+    for root, dirs, files in os.walk(args.data_dir, topdown=False):
+        if os.path.abspath(root) != os.path.abspath(args.data_dir) and not os.listdir(root):
+            os.rmdir(root)
+    print(f"✅ Đã xóa {len(redundant)} file, giải phóng {total_bytes / 2**20:.1f} MiB")
+
+def add_spec_arguments(parser):
+    parser.add_argument("--type", choices=INDEX_TYPES)
+    parser.add_argument("--metric", choices=["l2", "ip"])
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--pq-m", type=int)
+    parser.add_argument("--hnsw-m", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--rerank-factor", type=int, help="Index nén: số ứng viên re-rank = top_k * factor")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, tuning và compaction FAISS index")
+    parser.add_argument("--data-dir", default="data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build lại index chung từ segment store / all_embeddings.pkl")
+    add_spec_arguments(build_parser)
+    build_parser.add_argument("--output", help="Mặc định: <data-dir>/all_faiss.index")
+
+    tune_parser = subparsers.add_parser("tune", help="Sweep nprobe / efSearch: recall@k và QPS")
+    add_spec_arguments(tune_parser)
+    tune_parser.add_argument("--index", help="Tune index có sẵn (mặc định: build tạm theo --type)")
+    tune_parser.add_argument("--queries", type=int, default=500)
+    tune_parser.add_argument("--top-k", type=int, default=10)
+    tune_parser.add_argument("--noise", type=float, default=0.02)
+    tune_parser.add_argument("--seed", type=int, default=42)
+    tune_parser.add_argument("--target-recall", type=float, default=0.95)
+    tune_parser.add_argument("--apply", action="store_true", help="Ghi tham số đã chọn vào manifest của --index")
+
+    compact_parser = subparsers.add_parser("compact", help="Xóa bản sao index/pickle riêng của từng tài liệu")
+    compact_parser.add_argument("--yes", action="store_true", help="Xóa thật (mặc định chỉ liệt kê)")
+
+    args = parser.parse_args()
+    args.pickle = os.path.join(args.data_dir, "all_embeddings.pkl")
+
+    if args.command == "build":
+        args.output = args.output or os.path.join(args.data_dir, "all_faiss.index")
+        cmd_build(args)
+    elif args.command == "tune":
+        cmd_tune(args)
+    else:
+        cmd_compact(args)
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,11 @@
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from app.core.config import settings
 from app.api.api_v1.api import api_router
+from app.services.inference_executor import shutdown_inference_executor
+from app.core.metrics import get_metrics_registry
 
 # Tạo instance FastAPI
 app = FastAPI(
@@ -38,6 +40,23 @@ async def health_check():
     """Endpoint kiểm tra sức khỏe của API"""
     return {"status": "healthy"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Metrics (histogram latency từng stage, counters) theo định dạng Prometheus"""
+    return PlainTextResponse(
+        get_metrics_registry().render_prometheus(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Dừng generation scheduler và các thread pool inference khi tắt ứng dụng"""
+    from app.services.rag_service_unified import _rag_service_unified
+    
+    if _rag_service_unified and _rag_service_unified.llm_service and _rag_service_unified.llm_service.scheduler:
+        _rag_service_unified.llm_service.scheduler.shutdown()
+    shutdown_inference_executor(wait=False)
+
 @app.get("/favicon.ico")
 async def favicon():
     """Endpoint cho favicon để tránh 404 error"""
@@ -0,0 +1,7 @@
+# tests/conftest.py
+# Cho phép import package `app` khi chạy pytest từ thư mục backend1
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,39 @@
+# tests/test_answer_cache.py
+# Tầng semantic của answer cache không được trả câu trả lời của Điều / văn bản khác
+
+import numpy as np
+
+from app.services.answer_cache import AnswerCache
+
+PARAMS = AnswerCache.make_params_key(5, None, 0.0, True)
+
+def make_cache():
+    return AnswerCache(max_entries=10, ttl_seconds=60, semantic_enabled=True, semantic_threshold=0.97,
+                       semantic_max_entries=10)
+
+def near_embeddings():
+    """Hai embedding gần như trùng nhau (cosine > 0.999)"""
+    base = np.random.default_rng(0).normal(size=64).astype('float32')
+    return base, base + np.float32(0.001) * np.ones(64, dtype='float32')
+
+def test_semantic_miss_on_different_article():
+    cache = make_cache()
+    first, second = near_embeddings()
+    cache.put("Điều 5 Luật 86/2015 quy định gì?", PARAMS, {'answer': 'Điều 5'}, first)
+
+    assert cache.get_semantic("Điều 6 Luật 86/2015 quy định gì?", second, PARAMS) is None
+
+def test_semantic_miss_on_different_document():
+    cache = make_cache()
+    first, second = near_embeddings()
+    cache.put("Nghị định 13/2023/NĐ-CP quy định gì?", PARAMS, {'answer': 'NĐ 13'}, first)
+
+    assert cache.get_semantic("Thông tư 13/2023/TT-BTTTT quy định gì?", second, PARAMS) is None
+
+def test_semantic_hit_on_paraphrase_with_same_numbers():
+    cache = make_cache()
+    first, second = near_embeddings()
+    cache.put("Điều 5 Luật 86/2015 quy định gì?", PARAMS, {'answer': 'Điều 5'}, first)
+
+    cached = cache.get_semantic("Điều 5 của Luật 86/2015 quy định những gì", second, PARAMS)
+    assert cached is not None and cached['answer'] == 'Điều 5'
@@ -0,0 +1,31 @@
+# tests/test_confidence.py
+# Confidence cơ bản (adaptive bỏ enhancement) phải dùng điểm đã chuẩn hóa, không phải khoảng cách L2 thô
+
+import math
+
+import pytest
+
+from app.core.config import settings
+from app.services.rag_service_unified import RAGServiceUnified
+
+def make_result(distance, category='luat', **extra):
+    return {'score': distance, 'similarity': distance, 'category': category, **extra}
+
+def test_basic_confidence_large_l2_distance_is_low():
+    service = object.__new__(RAGServiceUnified)
+    results = [make_result(180.0), make_result(190.0), make_result(200.0)]
+
+    # Khoảng cách lớn (kém) -> confidence thấp, không bão hòa ở 1.0
+    assert service._calculate_basic_confidence(results) == pytest.approx(0.05 + 0.1)
+    assert not service._should_skip_enhancement({'confidence': service._calculate_basic_confidence(results),
+                                                 'raw_response': 'ngắn'})
+
+def test_basic_confidence_uses_rerank_sigmoid():
+    service = object.__new__(RAGServiceUnified)
+    relevant = [make_result(180.0, rerank_score=2.0), make_result(190.0, rerank_score=2.0)]
+    irrelevant = [make_result(1.0, rerank_score=-3.0), make_result(2.0, rerank_score=-3.0)]
+
+    # Đã rerank: lấy sigmoid(rerank_score), bỏ qua khoảng cách
+    assert service._calculate_basic_confidence(relevant) == pytest.approx(1 / (1 + math.exp(-2.0)) + 0.1)
+    assert service._calculate_basic_confidence(relevant) >= settings.ADAPTIVE_SKIP_CONFIDENCE
+    assert service._calculate_basic_confidence(irrelevant) < settings.ADAPTIVE_SKIP_CONFIDENCE
@@ -0,0 +1,30 @@
+# tests/test_context_packer.py
+# Tách câu cho context packer: chỉ tách ở dấu kết thúc câu, giữ nguyên tiêu đề Điều và các khoản liệt kê
+
+from app.services.context_packer import ContextPacker, split_sentences
+
+LAW_EXCERPT = """Điều 5. Nguyên tắc bảo vệ dữ liệu cá nhân
+1. Dữ liệu cá nhân được xử lý theo quy định của pháp luật. Chủ thể dữ liệu được biết về hoạt động xử lý.
+2. Bên Kiểm soát dữ liệu có trách nhiệm: a) Áp dụng biện pháp bảo vệ; b) Thông báo vi phạm trong 72 giờ.
+Điều 6: Phạm vi điều chỉnh"""
+
+def test_split_law_excerpt():
+    assert split_sentences(LAW_EXCERPT) == [
+        "Điều 5. Nguyên tắc bảo vệ dữ liệu cá nhân",
+        "1. Dữ liệu cá nhân được xử lý theo quy định của pháp luật.",
+        "Chủ thể dữ liệu được biết về hoạt động xử lý.",
+        "2. Bên Kiểm soát dữ liệu có trách nhiệm: a) Áp dụng biện pháp bảo vệ; b) Thông báo vi phạm trong 72 giờ.",
+        "Điều 6: Phạm vi điều chỉnh",
+    ]
+
+def test_heading_label_stays_with_title():
+    assert split_sentences("Điều 5. Phạm vi điều chỉnh. Nghị định này quy định về bảo vệ dữ liệu.") == [
+        "Điều 5. Phạm vi điều chỉnh.",
+        "Nghị định này quy định về bảo vệ dữ liệu.",
+    ]
+
+def test_pack_keeps_enumerated_clause_whole():
+    packed = ContextPacker().pack("Bên kiểm soát dữ liệu có trách nhiệm gì?", [LAW_EXCERPT], token_budget=40)
+
+    assert "a) Áp dụng biện pháp bảo vệ; b) Thông báo vi phạm trong 72 giờ." in packed.passages[0]
+    assert packed.token_count <= 40
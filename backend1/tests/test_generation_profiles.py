@@ -0,0 +1,109 @@
+# tests/test_generation_profiles.py
+# Kiểm tra các request với profile khác nhau chạy song song đều nhận đúng tham số generation của mình
+
+import dataclasses
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+from transformers import GenerationConfig
+
+from app.core.config import settings
+from app.services.generation_profiles import GENERATION_PROFILES, get_generation_profile, resolve_generation_profile
+from app.services.llm_service import LLMService
+
+PROFILE_NAMES = ["basic", "enhancement", "chat"]
+CHECKED_FIELDS = ["max_new_tokens", "do_sample", "temperature", "top_p", "top_k",
+                  "repetition_penalty", "no_repeat_ngram_size", "num_beams", "early_stopping"]
+
+class FakeTokenizer:
+    """Tokenizer giả: prompt 'profile:<name>' -> input_ids chứa index của profile"""
+
+    eos_token_id = 0
+    pad_token = "<pad>"
+
+    def __call__(self, prompt, **kwargs):
+        index = PROFILE_NAMES.index(prompt.split(":", 1)[1])
+        return {
+            "input_ids": torch.tensor([[100 + index]]),
+            "attention_mask": torch.tensor([[1]])
+        }
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "ok"
+
+class RecordingModel:
+    """Model giả ghi lại GenerationConfig mà mỗi request nhận được"""
+
+    device = "cpu"
+
+    def __init__(self):
+        self.generation_config = GenerationConfig()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def generate(self, input_ids, attention_mask, generation_config, **kwargs):
+        profile_name = PROFILE_NAMES[int(input_ids[0, 0]) - 100]
+        # Ngủ ngẫu nhiên để các request đan xen nhau, sau đó mới đọc config
+        time.sleep(random.uniform(0, 0.005))
+        seen = {name: getattr(generation_config, name) for name in CHECKED_FIELDS}
+        with self._lock:
+            self.records.append((profile_name, seen))
+        return torch.cat([input_ids, torch.tensor([[1, 2]])], dim=-1)
+
+@pytest.fixture
+def llm_service(monkeypatch):
+    monkeypatch.setattr(settings, "GENERATION_SCHEDULER_ENABLED", False)
+    service = LLMService("unused")
+    service.tokenizer = FakeTokenizer()
+    service.model = RecordingModel()
+    return service
+
+def test_concurrent_requests_keep_their_own_profile(llm_service):
+    requests = PROFILE_NAMES * 50
+    random.shuffle(requests)
+    base_before = llm_service.model.generation_config.to_dict()
+
+    def run(profile_name):
+        return llm_service.generate_from_prompt(
+            f"profile:{profile_name}", generation_config=get_generation_profile(profile_name)
+        )
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        answers = list(pool.map(run, requests))
+
+    assert answers == ["ok"] * len(requests)
+    assert len(llm_service.model.records) == len(requests)
+    for profile_name, seen in llm_service.model.records:
+        profile = GENERATION_PROFILES[profile_name]
+        expected = {name: getattr(profile, name) for name in CHECKED_FIELDS}
+        assert seen == expected, f"profile {profile_name} nhận sai tham số: {seen}"
+
+    # Config dùng chung của model không bị sửa
+    assert llm_service.model.generation_config.to_dict() == base_before
+
+def test_profiles_are_immutable():
+    profile = get_generation_profile("basic")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        profile.temperature = 1.0
+    with pytest.raises(TypeError):
+        GENERATION_PROFILES["basic"] = profile
+
+def test_profile_validation():
+    with pytest.raises(ValueError):
+        get_generation_profile("unknown")
+    with pytest.raises(ValueError):
+        get_generation_profile("basic", top_p=1.5)
+    with pytest.raises(ValueError):
+        get_generation_profile("basic", early_stopping=True)
+    with pytest.raises(ValueError):
+        resolve_generation_profile({"temperatur": 0.3})
+
+def test_resolve_dict_keeps_legacy_defaults():
+    profile = resolve_generation_profile({"temperature": 0.3}, max_new_tokens=128)
+    assert profile.temperature == 0.3
+    assert profile.max_new_tokens == 128
+    assert profile.top_k == GENERATION_PROFILES["default"].top_k
@@ -0,0 +1,50 @@
+# tests/test_hybrid_fusion.py
+# Reciprocal rank fusion / sắp xếp dense phải theo metric của index: L2 distance nhỏ là gần nhất
+
+from types import SimpleNamespace
+
+import faiss
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services.rag_service_unified import RAGServiceUnified
+
+def make_service(metric_type):
+    service = object.__new__(RAGServiceUnified)
+    service.faiss_index = SimpleNamespace(metric_type=metric_type)
+    return service
+
+def test_fuse_rankings_l2_distances(monkeypatch):
+    monkeypatch.setattr(settings, "HYBRID_RRF_K", 60)
+    service = make_service(faiss.METRIC_L2)
+    dense_ids = np.array([30, 10, 20], dtype='int64')
+    dense_scores = np.array([0.9, 0.1, 0.5], dtype='float32')  # Gần nhất: 10, rồi 20, xa nhất: 30
+    lexical_ids = np.array([99], dtype='int64')
+
+    ids, scores, sources = service._fuse_rankings(dense_ids, dense_scores, lexical_ids, None, top_k=3)
+
+    # Hit dense gần nhất có rank 1 (ngang hit BM25 rank 1, giữ thứ tự chèn), hit xa nhất bị cắt
+    assert ids.tolist() == [10, 99, 20]
+    assert scores.tolist() == pytest.approx([0.1, 0.0, 0.5])
+    assert sources == ['dense', 'lexical', 'dense']
+
+def test_fuse_rankings_inner_product(monkeypatch):
+    monkeypatch.setattr(settings, "HYBRID_RRF_K", 60)
+    service = make_service(faiss.METRIC_INNER_PRODUCT)
+    dense_ids = np.array([30, 10, 20], dtype='int64')
+    dense_scores = np.array([0.9, 0.1, 0.5], dtype='float32')
+
+    ids, _, _ = service._fuse_rankings(dense_ids, dense_scores, np.array([20], dtype='int64'), None, top_k=2)
+
+    # 20: dense rank 2 + BM25 rank 1 > 30: dense rank 1
+    assert ids.tolist() == [20, 30]
+
+@pytest.mark.parametrize("metric_type, expected", [
+    (faiss.METRIC_L2, [10, 20, 30]),
+    (faiss.METRIC_INNER_PRODUCT, [30, 20, 10]),
+])
+def test_dense_order(metric_type, expected):
+    ids = np.array([30, 10, 20])
+    scores = np.array([0.9, 0.1, 0.5], dtype='float32')
+    assert ids[make_service(metric_type)._dense_order(scores)].tolist() == expected
@@ -0,0 +1,87 @@
+# tests/test_ingestion_pipeline.py
+# Lỗi ở thread của pipeline (commit index chung) phải làm run() thất bại, không báo tài liệu đã embedding
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from app.services import ingestion_pipeline
+from app.services.ingestion_pipeline import IngestionPipeline
+
+class FakeModel:
+    def encode(self, texts, **kwargs):
+        return np.zeros((len(texts), 4), dtype='float32')
+
+class FakeManifest:
+    def record(self, *args, **kwargs):
+        pass
+
+class FakeService:
+    """EmbeddingService giả: ghi tài liệu vào RAM, commit có thể lỗi"""
+
+    model_path = "unused"
+    output_dir = "unused"
+    embedding_model = "fake"
+
+    def __init__(self, commit_error=None):
+        self.model = FakeModel()
+        self.ingestion_manifest = FakeManifest()
+        self.commit_error = commit_error
+        self.saved = []
+
+    def save_embeddings_to_faiss(self, chunks, embeddings, doc_path, commit=True):
+        self.saved.append(doc_path)
+        return {}
+
+    def commit(self, force=False):
+        if self.commit_error is not None:
+            raise self.commit_error
+        return {"chunks": len(self.saved), "added": len(self.saved)}
+
+def fake_extract(doc):
+    doc.pages = 1
+    doc.text = f"text of {doc.doc_path}"
+    return doc
+
+class FakeChunkTask:
+    def __init__(self, chunk_size, overlap):
+        pass
+
+    def __call__(self, doc):
+        doc.chunks = [doc.text, doc.text.upper()]
+        return doc
+
+@pytest.fixture(autouse=True)
+def thread_pools(monkeypatch):
+    """Stage extract / chunk chạy bằng thread pool, không spawn process"""
+    monkeypatch.setattr(ingestion_pipeline, "ProcessPoolExecutor",
+                        lambda workers, mp_context=None, initializer=None, initargs=(): ThreadPoolExecutor(workers))
+    monkeypatch.setattr(ingestion_pipeline, "_extract", fake_extract)
+    monkeypatch.setattr(ingestion_pipeline, "_ChunkTask", FakeChunkTask)
+
+def make_pipeline(service):
+    return IngestionPipeline(service, extract_workers=2, chunk_workers=2, queue_size=1, embed_batch_chunks=3)
+
+def test_pipeline_success():
+    service = FakeService()
+    result = make_pipeline(service).run([f"doc{i}.txt" for i in range(5)])
+
+    assert sorted(r["doc_path"] for r in result["results"]) == [f"doc{i}.txt" for i in range(5)]
+    assert all(r["status"] == "success" for r in result["results"])
+    assert result["summary"]["stages"]["write"]["documents"] == 5
+
+def test_commit_failure_is_raised():
+    service = FakeService(commit_error=RuntimeError("không ghi được index chung"))
+
+    with pytest.raises(RuntimeError, match="không ghi được index chung"):
+        make_pipeline(service).run([f"doc{i}.txt" for i in range(5)])
+    assert len(service.saved) == 5
+
+def test_embed_failure_does_not_hang(monkeypatch):
+    service = FakeService()
+    monkeypatch.setattr(IngestionPipeline, "_encode", lambda self, batch, outbox: 1 / 0)
+
+    with pytest.raises(ZeroDivisionError):
+        make_pipeline(service).run([f"doc{i}.txt" for i in range(8)])
+    assert service.saved == []
@@ -0,0 +1,47 @@
+# tests/test_query_router.py
+# Luật từ khóa của router chỉ khớp nguyên từ và không route theo từ chung của mọi câu hỏi pháp lý
+
+import numpy as np
+import pytest
+
+from app.services.query_router import QueryRouter
+from app.services.rag_service_unified import RAGServiceUnified
+
+@pytest.fixture
+def router():
+    return QueryRouter({'luat': 100, 'english': 50, 'chuyen_nganh': 30})
+
+@pytest.mark.parametrize("question", [
+    "Network isolation là gì?",
+    "Quy định về văn bản hành chính điện tử",
+    "Các văn bản quy định về an toàn thông tin",
+])
+def test_no_rule_signal(router, question):
+    assert router.rule_scores(question) == {}
+
+@pytest.mark.parametrize("question, category", [
+    ("Yêu cầu của ISO 27001 về kiểm soát truy cập", 'english'),
+    ("ISO/IEC 27002 có bao nhiêu biện pháp?", 'english'),
+    ("Điều 5 Nghị định 13/2023/NĐ-CP quy định gì?", 'luat'),
+    ("Thông tư 12/2022/TT-BTC áp dụng cho ai?", 'luat'),
+])
+def test_rule_signal(router, question, category):
+    assert router.rule_scores(question) == {category: 1.0}
+
+@pytest.mark.parametrize("pdf_name", [
+    "13_2023_ND-CP_465185.pdf", "53_2022_ND-CP_398695.pdf", "142_2016_ND-CP_329672.pdf",
+    "03_2017_TT-BTTTT_348836.pdf", "20_2021_TT-BTTTT_496457.pdf",
+])
+def test_legal_question_searches_numbered_documents(pdf_name):
+    centroids = {
+        'luat': np.array([1.0, 0.0, 0.0], dtype='float32'),
+        'english': np.array([0.0, 1.0, 0.0], dtype='float32'),
+        'vietnamese': np.array([0.0, 0.0, 1.0], dtype='float32'),
+    }
+    router = QueryRouter({'luat': 100, 'english': 50, 'vietnamese': 30}, centroids)
+
+    # Không có số hiệu -> citation lookup không bắt được, chỉ còn partition được route
+    decision = router.route("Nghị định bảo vệ dữ liệu cá nhân quy định gì?", np.array([1.0, 0.1, 0.2]))
+
+    assert decision.categories is not None
+    assert RAGServiceUnified._determine_category(pdf_name) in decision.categories
@@ -0,0 +1,194 @@
+# tests/test_segment_store.py
+# Segment store: chunk id (= id trong FAISS / BM25 / citation / chunk store) phải giữ nguyên qua gộp segment,
+# commit chỉ thêm phần đuôi chưa index, index lệch với segment store thì build lại
+
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services import embedding_service as embedding_module
+from app.services.embedding_service import EmbeddingService
+from app.services.index_factory import load_index
+from app.services.segment_store import SegmentStore
+
+DIM = 4
+# Mỗi batch: số chunk của từng tài liệu
+BATCHES = [[2, 1], [3], [1, 2], [2], [1, 1, 1]]
+
+def chunk_vectors(start: int, n: int) -> np.ndarray:
+    """Vector của chunk id i = [i, i, i, i] - đọc lại là biết chunk id"""
+    return np.repeat(np.arange(start, start + n, dtype='float32')[:, None], DIM, axis=1)
+
+def make_documents(batch, start: int, tag: str):
+    documents = []
+    for i, n in enumerate(batch):
+        documents.append({
+            'pdf_name': f"{tag}_doc{i}",
+            'doc_path': f"/docs/{tag}_doc{i}.pdf",
+            'chunks': [f"{tag} doc{i} chunk{j}" for j in range(n)],
+            'embeddings': chunk_vectors(start, n)
+        })
+        start += n
+    return documents, start
+
+def fill_store(store: SegmentStore, batches=BATCHES) -> int:
+    start = 0
+    for b, batch in enumerate(batches):
+        documents, start = make_documents(batch, start, f"b{b}")
+        store.append(documents)
+    return start
+
+def snapshot_reads(store: SegmentStore, n_total: int):
+    """read_embeddings(k) / iter_documents(k) cho mọi k"""
+    reads = {}
+    for k in range(n_total + 1):
+        documents = [(offset, doc['pdf_name'], list(doc['chunks'])) for offset, doc in store.iter_documents(k)]
+        reads[k] = (store.read_embeddings(k)[:, 0].tolist() if k < n_total else [], documents)
+    return reads
+
+def test_ids_and_offsets_unchanged_by_merge(tmp_path):
+    store = SegmentStore(str(tmp_path / "segments"))
+    n_total = fill_store(store)
+    before = snapshot_reads(store, n_total)
+
+    merged = store.merge_small_segments(min_chunks=100, merge_factor=2)
+
+    assert merged is not None
+    assert [segment["name"] for segment in store.segments] == [merged]
+    assert store.n_chunks == n_total
+    assert snapshot_reads(store, n_total) == before
+    for k in range(n_total):
+        assert before[k][0] == list(range(k, n_total))
+        assert before[k][1][0][0] <= k  # Tài liệu đầu tiên chứa chunk k
+
+    # Segment cũ đã bị gộp được xóa (không có reader)
+    files = {name.split(".")[0] for name in os.listdir(tmp_path / "segments") if name.startswith("seg_")}
+    assert files == {merged}
+
+def test_merge_keeps_old_files_while_reader_snapshot_open(tmp_path):
+    store = SegmentStore(str(tmp_path / "segments"))
+    n_total = fill_store(store)
+    old_names = [segment["name"] for segment in store.segments]
+    reader = SegmentStore(str(tmp_path / "segments"), writable=False)
+
+    with reader.snapshot():
+        merged = store.merge_small_segments(min_chunks=100, merge_factor=2)
+        # Reader vẫn đọc được theo manifest cũ
+        assert reader.read_embeddings(0)[:, 0].tolist() == list(range(n_total))
+        for name in old_names:
+            assert os.path.exists(tmp_path / "segments" / f"{name}.npy")
+
+    store.remove_orphans()
+    for name in old_names:
+        assert not os.path.exists(tmp_path / "segments" / f"{name}.npy")
+    assert os.path.exists(tmp_path / "segments" / f"{merged}.npy")
+
+def test_merge_only_adjacent_small_segments(tmp_path):
+    store = SegmentStore(str(tmp_path / "segments"))
+    n_total = fill_store(store, [[2], [1], [20], [1], [2]])
+    before = snapshot_reads(store, n_total)
+
+    store.merge_small_segments(min_chunks=10, merge_factor=2)
+
+    # Segment lớn ở giữa không gộp: chỉ một dãy nhỏ liền kề được gộp, thứ tự chunk giữ nguyên
+    assert [segment["n_chunks"] for segment in store.segments] == [3, 20, 1, 2]
+    assert snapshot_reads(store, n_total) == before
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "OCR_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", "flat")
+    monkeypatch.setattr(settings, "SEGMENT_MERGE_FACTOR", 1000)  # Không gộp nền trong test
+
+    calls = {"bm25": [], "citation": [], "build": 0}
+
+    def fake_bm25(output_dir, new_chunks, existing_chunks, n_indexed, **kwargs):
+        calls["bm25"].append((n_indexed, list(new_chunks)))
+
+    def fake_citation(output_dir, new_documents, existing_documents, n_indexed):
+        calls["citation"].append((n_indexed, [name for name, _ in new_documents]))
+
+    build_index = embedding_module.build_index
+
+    def counting_build(*args, **kwargs):
+        calls["build"] += 1
+        return build_index(*args, **kwargs)
+
+    monkeypatch.setattr(embedding_module, "update_bm25_index", fake_bm25)
+    monkeypatch.setattr(embedding_module, "update_citation_index", fake_citation)
+    monkeypatch.setattr(embedding_module, "build_index", counting_build)
+
+    service = EmbeddingService("unused-model", output_dir=str(tmp_path / "data"))
+    service.calls = calls
+    return service
+
+def add_batch(service: EmbeddingService, batch, start: int, tag: str) -> int:
+    """Ghi file gốc (manifest ingestion hash file) rồi thêm tài liệu vào batch chờ commit"""
+    documents, end = make_documents(batch, start, tag)
+    docs_dir = os.path.join(os.path.dirname(service.output_dir), "docs")
+    os.makedirs(docs_dir, exist_ok=True)
+    for doc in documents:
+        doc_path = os.path.join(docs_dir, os.path.basename(doc['doc_path']))
+        with open(doc_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(doc['chunks']))
+        service.save_embeddings_to_faiss(doc['chunks'], doc['embeddings'], doc_path, commit=False)
+    return end
+
+def index_ids(service: EmbeddingService):
+    index, _ = load_index(service.all_faiss_path)
+    return index.reconstruct_n(0, index.ntotal)[:, 0].tolist()
+
+def test_commit_adds_exactly_the_tail(service):
+    k = add_batch(service, [2, 1, 3], 0, "first")
+    assert service.commit(force=True) == {"chunks": k, "added": k}
+    assert index_ids(service) == list(range(k))
+    assert service.calls["build"] == 1
+
+    n_total = add_batch(service, [1, 2], k, "tail")
+    result = service.commit(force=True)
+
+    assert result == {"chunks": n_total, "added": n_total - k}
+    assert index_ids(service) == list(range(n_total))
+    assert service.calls["build"] == 1  # Thêm vào index có sẵn, không build lại
+    assert service.calls["bm25"][-1] == (k, ["tail doc0 chunk0", "tail doc1 chunk0", "tail doc1 chunk1"])
+    assert service.calls["citation"][-1] == (k, ["tail_doc0", "tail_doc1"])
+
+def test_commit_tail_after_merge(service):
+    k = add_batch(service, [1, 1], 0, "first")
+    service.commit(force=True)
+    n_total = add_batch(service, [2], k, "tail")
+    service.flush_segment()
+    service.segment_store.merge_small_segments(min_chunks=100, merge_factor=2)
+
+    assert service.commit(force=True) == {"chunks": n_total, "added": n_total - k}
+    assert index_ids(service) == list(range(n_total))
+
+def test_commit_deferred_below_fraction(service, monkeypatch):
+    monkeypatch.setattr(settings, "SEGMENT_INDEX_MIN_FRACTION", 0.5)
+    k = add_batch(service, [4, 4], 0, "first")
+    service.commit(force=True)
+    n_total = add_batch(service, [1], k, "tail")
+
+    # Đuôi nhỏ: chưa ghi lại index chung, RAG service thêm phần đuôi khi load
+    assert service.commit() == {"chunks": n_total, "added": 0, "deferred": n_total - k}
+    assert index_ids(service) == list(range(k))
+    assert service.commit(force=True)["added"] == n_total - k
+
+def test_misaligned_index_is_rebuilt(service):
+    n_total = add_batch(service, [2, 3], 0, "first")
+    service.commit(force=True)
+
+    # Index chung dừng giữa một tài liệu (chunk id 3 nằm trong tài liệu bắt đầu ở 2) -> lệch với segment store
+    index = faiss.IndexFlatL2(DIM)
+    index.add(chunk_vectors(0, 3))
+    faiss.write_index(index, service.all_faiss_path)
+
+    result = service.commit(force=True)
+
+    assert result == {"chunks": n_total, "added": n_total}
+    assert index_ids(service) == list(range(n_total))
+    assert service.calls["build"] == 2
+    assert service.calls["bm25"][-1][0] == 0
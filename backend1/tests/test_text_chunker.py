@@ -0,0 +1,99 @@
+# tests/test_text_chunker.py
+# Golden test: chunker dùng số token tính batch phải cho đúng các chunk như cách tokenize từng câu trước đây
+
+import random
+
+import pytest
+
+from app.services.text_chunker import chunk_sentences, count_tokens
+
+class WhitespaceTokenizer:
+    """Tokenizer giả: mỗi từ là một token, đếm số lần gọi để kiểm tra việc gọi batch"""
+
+    def __init__(self, is_fast: bool = True):
+        self.is_fast = is_fast
+        self.calls = 0
+
+    def tokenize(self, text):
+        self.calls += 1
+        return text.split()
+
+    def __call__(self, texts, add_special_tokens=True, **kwargs):
+        self.calls += 1
+        return {"input_ids": [list(range(len(text.split()))) for text in texts]}
+
+def reference_chunks(sentences, tokenizer, chunk_size, overlap):
+    """Cách chia chunk cũ của split_text_to_chunks_vi cho một section (tokenize lại từng câu khi tính overlap)"""
+    all_chunks = []
+    current_chunk = []
+    current_tokens = 0
+
+    for sentence in sentences:
+        num_tokens = len(tokenizer.tokenize(sentence))
+
+        if current_tokens + num_tokens > chunk_size:
+            if current_chunk:
+                all_chunks.append('\n'.join(current_chunk).strip())
+
+            overlap_chunk = []
+            total = 0
+            for s in reversed(current_chunk):
+                toks = len(tokenizer.tokenize(s))
+                if total + toks > overlap:
+                    break
+                overlap_chunk.insert(0, s)
+                total += toks
+
+            current_chunk = overlap_chunk + [sentence]
+            current_tokens = total + num_tokens
+        else:
+            current_chunk.append(sentence)
+            current_tokens += num_tokens
+
+    if current_chunk:
+        all_chunks.append(' '.join(current_chunk).strip())
+    return all_chunks
+
+def new_chunks(sentences, tokenizer, chunk_size, overlap):
+    return chunk_sentences(sentences, count_tokens(tokenizer, sentences), chunk_size, overlap)
+
+SENTENCES = [
+    "Điều 1. Phạm vi điều chỉnh.",
+    "Luật này quy định về giáo dục đại học.",
+    "Cơ sở giáo dục đại học có tư cách pháp nhân.",
+    "Sinh viên có quyền được tôn trọng và đối xử bình đẳng, không phân biệt nam nữ, dân tộc, tôn giáo.",
+    "Giảng viên.",
+    "Nhà nước đầu tư cho giáo dục đại học.",
+]
+
+GOLDEN = [
+    "Điều 1. Phạm vi điều chỉnh.\nLuật này quy định về giáo dục đại học.",
+    "Luật này quy định về giáo dục đại học.\nCơ sở giáo dục đại học có tư cách pháp nhân.",
+    "Sinh viên có quyền được tôn trọng và đối xử bình đẳng, không phân biệt nam nữ, dân tộc, tôn giáo.",
+    "Giảng viên. Nhà nước đầu tư cho giáo dục đại học.",
+]
+
+def test_golden_chunks():
+    tokenizer = WhitespaceTokenizer()
+    assert reference_chunks(SENTENCES, tokenizer, chunk_size=15, overlap=9) == GOLDEN
+    assert new_chunks(SENTENCES, tokenizer, chunk_size=15, overlap=9) == GOLDEN
+
+@pytest.mark.parametrize("seed", range(50))
+@pytest.mark.parametrize("is_fast", [True, False])
+def test_same_boundaries_as_reference(seed, is_fast):
+    rng = random.Random(seed)
+    words = ["luật", "giáo", "dục", "sinh", "viên", "điều", "khoản", "quy", "định"]
+    sentences = [" ".join(rng.choice(words) for _ in range(rng.choice([0, 1, 3, 8, 20, 70])))
+                 for _ in range(rng.randint(0, 60))]
+    chunk_size = rng.choice([5, 20, 64, 512])
+    overlap = rng.choice([0, 3, 10, 50])
+    tokenizer = WhitespaceTokenizer(is_fast)
+
+    assert new_chunks(sentences, tokenizer, chunk_size, overlap) == \
+        reference_chunks(sentences, WhitespaceTokenizer(), chunk_size, overlap)
+
+def test_fast_tokenizer_called_once_per_section():
+    tokenizer = WhitespaceTokenizer()
+    new_chunks(SENTENCES * 20, tokenizer, chunk_size=15, overlap=9)
+    assert tokenizer.calls == 1
+    assert count_tokens(tokenizer, []) == []
@@ -159,18 +159,16 @@ class Backend1Service {
   }
 
   // Enhanced Chat with Streaming
-  async enhancedChatStream(query, maxTokens = 512, temperature = 0.7, topK = 50, topP = 0.95) {
+  async enhancedChatStream(query, chatId = null, topK = 5) {
     const response = await fetch(this.getFullURL(API_ENDPOINTS.CHATBOT_ENHANCED_STREAM), {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
       body: JSON.stringify({
-        query,
-        max_tokens: maxTokens,
-        temperature,
-        top_k: topK,
-        top_p: topP
+        message: query,
+        chat_id: chatId,
+        top_k: topK
       })
     });
 
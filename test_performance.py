@@ -130,6 +130,7 @@ class PerformanceTester:
     def __init__(self, base_url: str = "http://localhost:8000"):
         self.base_url = base_url
         self.api_endpoint = f"{base_url}/api/v1/rag/query"
+        self.liveness_endpoint = f"{base_url}/api/v1/health/live"
         self.session = None
         self.resource_monitor = ResourceMonitor()
         
@@ -268,7 +269,8 @@ class PerformanceTester:
             "question": question,
             "top_k": 5,
             "include_sources": True,
-            "use_enhancement": True
+            "use_enhancement": True,
+            "debug": True  # Lay thoi gian thuc te tung stage (stage_breakdown)
         }
         
         # Bat dau monitor tai nguyen
@@ -287,11 +289,13 @@ class PerformanceTester:
                 # Phan tich thoi gian tung thanh phan (dua tren response data)
                 processing_time_ms = response_data.get("processing_time_ms", 0)
                 
-                # Ưoc tinh thoi gian tung thanh phan (dua tren ty le thong thuong)
-                embedding_time = processing_time_ms * 0.15  # 15% cho embedding
-                vector_search_time = processing_time_ms * 0.25  # 25% cho vector search
-                context_retrieval_time = processing_time_ms * 0.20  # 20% cho context retrieval
-                llm_generation_time = processing_time_ms * 0.40  # 40% cho LLM generation
+                # Thoi gian tung thanh phan do tai server (stage_breakdown khi debug=true)
+                breakdown = response_data.get("stage_breakdown") or {}
+                embedding_time = breakdown.get("encode_ms", 0)
+                vector_search_time = breakdown.get("search_ms", 0)
+                context_retrieval_time = max(breakdown.get("retrieval_ms", 0) - embedding_time - vector_search_time, 0)
+                llm_generation_time = (breakdown.get("stage1_ms", 0) + breakdown.get("stage2_ms", 0)
+                                       + breakdown.get("single_pass_ms", 0))
                 
                 return {
                     "question": question,
@@ -306,6 +310,8 @@ class PerformanceTester:
                     "llm_generation_time_ms": llm_generation_time,
                     "total_processing_time_ms": processing_time_ms,
                     "total_response_time_ms": total_response_time,
+                    "cache_hit": response_data.get("cache_hit"),
+                    "stage_breakdown": breakdown,
                     
                     # Thong tin response
                     "answer": response_data.get("answer", ""),  # Them cau tra loi day du
@@ -468,6 +474,131 @@ class PerformanceTester:
             "gpu_memory_peak": safe_stats(gpu_memory_max)
         }
     
+    async def _probe_liveness(self, stop_event: asyncio.Event, interval: float) -> List[float]:
+        """Goi /health/live lien tuc cho den khi stop_event duoc set, tra ve latency (ms)"""
+        latencies = []
+        while not stop_event.is_set():
+            start_time = time.time()
+            try:
+                async with self.session.get(self.liveness_endpoint) as response:
+                    await response.read()
+                    if response.status == 200:
+                        latencies.append((time.time() - start_time) * 1000)
+            except Exception as e:
+                logger.error(f"Liveness probe failed: {e}")
+            await asyncio.sleep(interval)
+        return latencies
+    
+    async def _rag_query_for_latency_test(self, question: str) -> Dict[str, Any]:
+        """Gui 1 RAG query, dung lam tai nen cho event loop latency test"""
+        payload = {
+            "question": question,
+            "top_k": 5,
+            "include_sources": True,
+            "use_enhancement": True
+        }
+        start_time = time.time()
+        try:
+            async with self.session.post(self.api_endpoint, json=payload) as response:
+                await response.json()
+                return {
+                    "question": question,
+                    "success": response.status == 200,
+                    "response_time_ms": (time.time() - start_time) * 1000
+                }
+        except Exception as e:
+            return {
+                "question": question,
+                "success": False,
+                "response_time_ms": (time.time() - start_time) * 1000,
+                "error": str(e)
+            }
+    
+    def _latency_stats(self, latencies: List[float]) -> Dict[str, Any]:
+        """Thong ke latency: count, mean, p50, p95, p99, max"""
+        if not latencies:
+            return {"count": 0}
+        return {
+            "count": len(latencies),
+            "mean": statistics.mean(latencies),
+            "p50": self.percentile(latencies, 50),
+            "p95": self.percentile(latencies, 95),
+            "p99": self.percentile(latencies, 99),
+            "max": max(latencies)
+        }
+    
+    async def event_loop_latency_test(self, concurrent_queries: int = 8,
+                                      probe_interval: float = 0.05,
+                                      baseline_seconds: float = 5.0) -> Dict[str, Any]:
+        """
+        Do p99 latency cua /health/live khi dang co N RAG query chay dong thoi.
+        Neu pipeline RAG chan event loop thi latency cua /health/live tang theo thoi gian generate.
+        """
+        logger.info(f"[TEST] Bat dau event loop latency test voi {concurrent_queries} RAG queries dong thoi...")
+        
+        # 1. Baseline: chi probe /health/live, khong co tai
+        stop_event = asyncio.Event()
+        probe_task = asyncio.create_task(self._probe_liveness(stop_event, probe_interval))
+        await asyncio.sleep(baseline_seconds)
+        stop_event.set()
+        baseline_latencies = await probe_task
+        
+        # 2. Co tai: N RAG queries dong thoi + probe /health/live
+        questions = [self.test_questions[i % len(self.test_questions)] for i in range(concurrent_queries)]
+        stop_event = asyncio.Event()
+        probe_task = asyncio.create_task(self._probe_liveness(stop_event, probe_interval))
+        
+        load_start = time.time()
+        query_results = await asyncio.gather(*[self._rag_query_for_latency_test(q) for q in questions])
+        load_duration_ms = (time.time() - load_start) * 1000
+        
+        stop_event.set()
+        loaded_latencies = await probe_task
+        
+        return {
+            "concurrent_queries": concurrent_queries,
+            "probe_interval_s": probe_interval,
+            "load_duration_ms": load_duration_ms,
+            "successful_queries": sum(1 for r in query_results if r.get("success")),
+            "query_response_time": self._latency_stats([r["response_time_ms"] for r in query_results if r.get("success")]),
+            "liveness_baseline": self._latency_stats(baseline_latencies),
+            "liveness_under_load": self._latency_stats(loaded_latencies),
+            "query_results": query_results
+        }
+    
+    def print_event_loop_latency_summary(self, results: Dict[str, Any]):
+        """In tom tat ket qua event loop latency test"""
+        print(f"\n{'='*80}")
+        print(f"⏱️ KẾT QUẢ THỬ NGHIỆM EVENT LOOP LATENCY (/health/live)")
+        print(f"{'='*80}")
+        print(f"[DATA] {results['successful_queries']}/{results['concurrent_queries']} RAG queries thanh cong "
+              f"trong {results['load_duration_ms']/1000:.2f}s")
+        
+        for label, key in [("Khong tai", "liveness_baseline"), ("Co tai", "liveness_under_load")]:
+            stats = results[key]
+            if not stats.get("count"):
+                print(f"{label:12} | Khong co du lieu")
+                continue
+            print(f"{label:12} | n={stats['count']:4d} | p50: {stats['p50']:8.2f}ms | "
+                  f"p95: {stats['p95']:8.2f}ms | p99: {stats['p99']:8.2f}ms | max: {stats['max']:8.2f}ms")
+    
+    def save_event_loop_latency_results(self, results: Dict[str, Any]):
+        """Luu ket qua event loop latency test"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"event_loop_latency_test_{timestamp}.json"
+        
+        output = {
+            "test_type": "event_loop_latency_testing",
+            "timestamp": timestamp,
+            "results": results
+        }
+        
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        
+        logger.info(f"[RESULT] Ket qua event loop latency test da duoc luu: {filename}")
+        return filename
+    
     async def load_test(self, duration_seconds: int = 60, requests_per_second: int = 5) -> List[Dict[str, Any]]:
         """Load test trong khoang thoi gian nhat dinh"""
         logger.info(f"🚀 Bat dau load test: {duration_seconds}s voi {requests_per_second} req/s...")
@@ -942,12 +1073,19 @@ async def main():
         tester.print_resource_usage_summary(resource_usage_results)
         tester.save_resource_usage_results(resource_usage_results)
         
+        # Test 3: Event loop latency khi co 8 RAG queries dong thoi
+        print("\n[TEST] Test 3: Latency /health/live khi co 8 RAG queries dong thoi")
+        event_loop_results = await tester.event_loop_latency_test(concurrent_queries=8)
+        tester.print_event_loop_latency_summary(event_loop_results)
+        tester.save_event_loop_latency_results(event_loop_results)
+        
         print(f"\n[OK] HOÀN THÀNH THỬ NGHIỆM HIỆU SUẤT")
         print("[FILE] Cac files ket qua da duoc tao:")
         print("   - JSON: response_time_test_TIMESTAMP.json")
         print("   - CSV: response_time_table_TIMESTAMP.csv")
         print("   - JSON: resource_usage_test_TIMESTAMP.json")
         print("   - CSV: resource_usage_table_TIMESTAMP.csv")
+        print("   - JSON: event_loop_latency_test_TIMESTAMP.json")
         print("="*80)
 
 if __name__ == "__main__":